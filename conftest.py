@@ -1,3 +1,16 @@
 import os
 
+import pytest
+
 os.environ.setdefault("PREFECT_LOGGING_TO_API_WHEN_MISSING_FLOW", "ignore")
+
+
+@pytest.fixture(autouse=True)
+def _clear_local_cache_tier():
+    """The local cache tier outlives each test's database rollback."""
+    yield
+    from django.core.cache import cache
+
+    clear_local = getattr(cache, "clear_local", None)
+    if clear_local is not None:
+        clear_local()
@@ -87,8 +87,20 @@ DATABASES = {
     }
 }
 
+# The default cache keeps a per-process LRU copy of values held in the shared
+# database cache; see viewer.cache.TieredCache
 CACHES = {
     'default': {
+        'BACKEND': 'viewer.cache.TieredCache',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'SHARED_CACHE': 'shared',
+            'MAX_BYTES': env.int("LOCAL_CACHE_MAX_BYTES", 128 * 1024 * 1024),
+            'LOCAL_TIMEOUT': 3600,
+            'SYNC_INTERVAL': 5,
+        }
+    },
+    'shared': {
         'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
         'LOCATION': 'django_cache_table',
         'TIMEOUT': None,
@@ -96,7 +108,7 @@ CACHES = {
             'MAX_ENTRIES': 1000,
             'CULL_FREQUENCY': 3,
         }
-    }
+    },
 }
 
 # Password validation
@@ -1,9 +1,13 @@
+import hashlib
+import os
 import requests
 import zipfile
 import re
 import xml.etree.ElementTree as ET
 
-from typing import Optional, Dict, Tuple, List
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from typing import IO, Optional, Dict, Tuple, List, Iterator
 from dataclasses import dataclass
 from pathlib import Path
 from google.cloud import bigquery
@@ -13,7 +17,12 @@ from prefect import task, flow
 from prefect.logging import get_run_logger
 from prefect.blocks.system import Secret
 
-from pipeline.utils.utils import get_bigquery_client, fetch_table_data_from_bq
+from pipeline.utils.utils import (
+    get_bigquery_client,
+    fetch_table_data_from_bq,
+    load_json_batches,
+)
+from pipeline.utils.xml_stream import XML_BATCH_SIZE, child_text, iter_record_batches
 from pipeline.setup.bq_tables import (
     DMD_SUPP_TABLE_SPEC, 
     VTM_INGREDIENTS_TABLE_SPEC, 
@@ -23,7 +32,15 @@ from pipeline.setup.bq_tables import (
 
 from pipeline.atc_ddd.import_atc_ddd.import_atc import create_atc_code_mapping
 
-TEMP_DIR = Path("temp")
+DMD_RELEASE_CACHE_DIR = Path(
+    os.environ.get(
+        "DMD_RELEASE_CACHE_DIR",
+        Path.home() / ".cache" / "openprescribing-hospitals" / "trud",
+    )
+)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+HISTORY_ENTITY_TYPES = ["VTM", "VMP", "ING", "SUPP", "FORM", "ROUTE", "UOM"]
 
 
 def normalise_bnf_code(bnf_code: Optional[str]) -> Optional[str]:
@@ -46,6 +63,8 @@ class TRUDRelease:
     release_date: str
     download_url: str
     year: int
+    release_id: Optional[str] = None
+    archive_sha256: Optional[str] = None
 
 
 class TRUDClient:
@@ -66,36 +85,11 @@ class TRUDClient:
             release_date=release_date,
             download_url=release["archiveFileUrl"],
             year=release_date_obj.isocalendar()[0],
+            release_id=release.get("id"),
+            archive_sha256=release.get("archiveFileSha256"),
         )
 
 
-@task
-def cleanup_temp_files():
-    """Clean up temporary files"""
-    logger = get_run_logger()
-    logger.info("Cleaning up temporary files")
-    
-    if TEMP_DIR.exists():
-        for file in TEMP_DIR.rglob("*"):
-            try:
-                if file.is_file():
-                    file.unlink(missing_ok=True)
-            except (PermissionError, OSError) as e:
-                logger.warning(f"Could not remove file {file}: {str(e)}")
-
-        dirs_to_remove = [d for d in TEMP_DIR.rglob("*") if d.is_dir()]
-        for dir_path in reversed(dirs_to_remove):
-            try:
-                dir_path.rmdir()
-            except (PermissionError, OSError) as e:
-                logger.warning(f"Could not remove directory {dir_path}: {str(e)}")
-
-        try:
-            TEMP_DIR.rmdir()
-        except (PermissionError, OSError) as e:
-            logger.warning(f"Could not remove temp directory {TEMP_DIR}: {str(e)}")
-
-
 @task
 def get_latest_trud_release() -> TRUDRelease:
     """Get the latest TRUD release information"""
@@ -107,65 +101,191 @@ def get_latest_trud_release() -> TRUDRelease:
     return trud_client.get_latest_release()
 
 
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cached_release_path(release: TRUDRelease, cache_dir: Path) -> Path:
+    release_id = release.release_id or f"dmd_{release.release_date}"
+    return Path(cache_dir) / f"{release_id}.zip"
+
+
+def is_cached_release_valid(zip_path: Path, release: TRUDRelease) -> bool:
+    """
+    Whether a cached release zip matches the checksum recorded when it was
+    downloaded, and the checksum published by TRUD if there is one
+    """
+    checksum_path = zip_path.with_name(f"{zip_path.name}.sha256")
+    if not zip_path.exists() or not checksum_path.exists():
+        return False
+    recorded = checksum_path.read_text().strip()
+    if release.archive_sha256 and recorded != release.archive_sha256.lower():
+        return False
+    return file_sha256(zip_path) == recorded
+
+
 @task
-def download_dmd_release(release: TRUDRelease) -> Path:
-    """Download the latest dm+d release zip file"""
+def download_dmd_release(
+    release: TRUDRelease, cache_dir: Path = DMD_RELEASE_CACHE_DIR
+) -> Path:
+    """
+    Download the dm+d release zip file into cache_dir, keyed by release id.
+
+    A cached zip whose checksum still matches is reused without downloading.
+    Other releases are removed from the cache once the download completes.
+    """
     logger = get_run_logger()
-    logger.info(f"Downloading dm+d release from {release.release_date}")
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    main_zip_path = cached_release_path(release, cache_dir)
+
+    if is_cached_release_valid(main_zip_path, release):
+        logger.info(f"Using cached dm+d release {main_zip_path.name}")
+        return main_zip_path
 
-    response = requests.get(release.download_url)
-    response.raise_for_status()
+    logger.info(f"Downloading dm+d release from {release.release_date}")
+    part_path = main_zip_path.with_name(f"{main_zip_path.name}.part")
+    digest = hashlib.sha256()
+    try:
+        with requests.get(release.download_url, stream=True) as response:
+            response.raise_for_status()
+            with open(part_path, "wb") as temp_file:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    temp_file.write(chunk)
+                    digest.update(chunk)
+
+        checksum = digest.hexdigest()
+        if release.archive_sha256 and checksum != release.archive_sha256.lower():
+            raise ValueError(
+                f"Checksum mismatch for dm+d release {main_zip_path.name}: "
+                f"expected {release.archive_sha256}, got {checksum}"
+            )
+        os.replace(part_path, main_zip_path)
+        main_zip_path.with_name(f"{main_zip_path.name}.sha256").write_text(checksum)
+    finally:
+        part_path.unlink(missing_ok=True)
 
-    main_zip_path = TEMP_DIR / "dmd_release.zip"
-    with open(main_zip_path, "wb") as temp_file:
-        temp_file.write(response.content)
+    for path in cache_dir.glob("*.zip*"):
+        if not path.name.startswith(main_zip_path.name):
+            path.unlink(missing_ok=True)
 
     return main_zip_path
 
 
+@contextmanager
+def open_zip_member(zip_path: Path, member_path: Tuple[str, ...]) -> Iterator[IO[bytes]]:
+    """
+    Open a zip member for reading without extracting it. member_path names
+    the member in each zip from the outermost in, so members of nested zips
+    are read in place.
+    """
+    with ExitStack() as stack:
+        current = stack.enter_context(zipfile.ZipFile(zip_path, "r"))
+        for name in member_path[:-1]:
+            current = stack.enter_context(
+                zipfile.ZipFile(stack.enter_context(current.open(name)), "r")
+            )
+        yield stack.enter_context(current.open(member_path[-1]))
+
+
+def find_member(names: List[str], pattern: str, description: str) -> str:
+    matches = [name for name in names if re.match(pattern, name)]
+    if not matches:
+        raise FileNotFoundError(f"No {description} found matching pattern: {pattern}")
+    return matches[0]
+
+
 @task
-def extract_supplementary_files(main_zip_path: Path, release_year: int) -> Tuple[Path, Path, Path]:
-    """Extract BNF XML file and find VTM ingredients and history files"""
+def find_supplementary_files(
+    main_zip_path: Path, release_year: int
+) -> Tuple[Tuple[str, ...], Tuple[str, ...], Tuple[str, ...]]:
+    """
+    Find the BNF XML file in the nested BNF zip, and the VTM ingredients and
+    history files, as member paths for open_zip_member
+    """
     logger = get_run_logger()
-    logger.info("Extracting supplementary files")
+    logger.info("Finding supplementary files")
 
     bnf_zip_pattern = rf"week\d\d{release_year}.*BNF\.zip"
     vtm_ing_pattern = rf"VTM_INGREDIENTS/f_vtm_ing1_\d+\.xml"
     history_pattern = rf"HISTORIC_CODES/f_history1_\d+\.xml"
 
     with zipfile.ZipFile(main_zip_path, "r") as zip_file:
-        bnf_zip_files = [f for f in zip_file.namelist() if re.match(bnf_zip_pattern, f)]
-        if not bnf_zip_files:
-            raise FileNotFoundError(f"No BNF zip file found matching pattern: {bnf_zip_pattern}")
-
-        bnf_zip_path = TEMP_DIR / bnf_zip_files[0]
-        zip_file.extract(bnf_zip_files[0], TEMP_DIR)
-
-        # Extract VTM ingredients file
-        vtm_ing_files = [f for f in zip_file.namelist() if re.match(vtm_ing_pattern, f)]
-        if not vtm_ing_files:
-            raise FileNotFoundError(f"No VTM ingredients file found matching pattern: {vtm_ing_pattern}")
-        
-        vtm_ing_path = TEMP_DIR / vtm_ing_files[0]
-        zip_file.extract(vtm_ing_files[0], TEMP_DIR)
-
-        # Extract history file
-        history_files = [f for f in zip_file.namelist() if re.match(history_pattern, f)]
-        if not history_files:
-            raise FileNotFoundError(f"No history file found matching pattern: {history_pattern}")
-        
-        history_path = TEMP_DIR / history_files[0]
-        zip_file.extract(history_files[0], TEMP_DIR)
-
-        with zipfile.ZipFile(bnf_zip_path, "r") as bnf_zip:
+        names = zip_file.namelist()
+        bnf_zip_name = find_member(names, bnf_zip_pattern, "BNF zip file")
+        vtm_ing_name = find_member(names, vtm_ing_pattern, "VTM ingredients file")
+        history_name = find_member(names, history_pattern, "history file")
+
+        with zipfile.ZipFile(zip_file.open(bnf_zip_name), "r") as bnf_zip:
             xml_files = [f for f in bnf_zip.namelist() if f.endswith(".xml")]
             if not xml_files:
-                raise FileNotFoundError(f"No XML file found in {bnf_zip_path}")
-            
-            bnf_xml_path = TEMP_DIR / xml_files[0]
-            bnf_zip.extract(xml_files[0], TEMP_DIR)
+                raise FileNotFoundError(f"No XML file found in {bnf_zip_name}")
+
+    return (bnf_zip_name, xml_files[0]), (vtm_ing_name,), (history_name,)
 
-        return bnf_xml_path, vtm_ing_path, history_path
+
+def bnf_record(vmp: ET.Element) -> Dict[str, Optional[str]]:
+    """VMP, BNF, ATC and DDD codes from a VMP element of the BNF bonus file"""
+    vmp_code = child_text(vmp, "VPID")
+    bnf_code = child_text(vmp, "BNF")
+    ddd_value = child_text(vmp, "DDD")
+    if ddd_value is not None:
+        try:
+            ddd_value = float(ddd_value)
+        except ValueError:
+            get_run_logger().warning(
+                f"Invalid DDD value for VMP {vmp_code}: {ddd_value}. Setting to None."
+            )
+            ddd_value = None
+
+    return {
+        "vmp_code": vmp_code,
+        "bnf_code": normalise_bnf_code(bnf_code),
+        "atc_code": child_text(vmp, "ATC"),
+        "ddd": ddd_value,
+        "ddd_uom": child_text(vmp, "DDD_UOMCD"),
+    }
+
+
+def vtm_ingredient_record(vtm_ing: ET.Element) -> Dict[str, Optional[str]]:
+    return {
+        "vtm_id": child_text(vtm_ing, "VTMID"),
+        "ingredient_id": child_text(vtm_ing, "ISID"),
+    }
+
+
+def history_record(entity: ET.Element) -> Dict[str, Optional[str]]:
+    return {
+        "current_id": child_text(entity, "IDCURRENT"),
+        "previous_id": child_text(entity, "IDPREVIOUS"),
+        "start_date": child_text(entity, "STARTDT"),
+        "end_date": child_text(entity, "ENDDT"),
+        "entity_type": entity.tag,
+    }
+
+
+def iter_bnf_batches(
+    xml_path: Path, batch_size: int = XML_BATCH_SIZE
+) -> Iterator[List[Dict[str, Optional[str]]]]:
+    return iter_record_batches(xml_path, {"VMP"}, bnf_record, batch_size)
+
+
+def iter_vtm_ingredient_batches(
+    xml_path: Path, batch_size: int = XML_BATCH_SIZE
+) -> Iterator[List[Dict[str, Optional[str]]]]:
+    return iter_record_batches(xml_path, {"VTM_ING"}, vtm_ingredient_record, batch_size)
+
+
+def iter_history_batches(
+    xml_path: Path, batch_size: int = XML_BATCH_SIZE
+) -> Iterator[List[Dict[str, Optional[str]]]]:
+    return iter_record_batches(
+        xml_path, set(HISTORY_ENTITY_TYPES), history_record, batch_size
+    )
 
 
 @task
@@ -174,42 +294,7 @@ def parse_xml_data(xml_path: Path) -> List[Dict[str, Optional[str]]]:
     logger = get_run_logger()
     logger.info(f"Parsing XML data from {xml_path}")
 
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
-
-    data = []
-    for vmp in root.findall(".//VMP"):
-        vmp_code = vmp.find("VPID").text
-        bnf_code = vmp.find("BNF")
-        atc_code = vmp.find("ATC")
-        ddd = vmp.find("DDD")
-        ddd_uom = vmp.find("DDD_UOMCD")
-
-        ddd_value = ddd.text if ddd is not None else None
-        if ddd_value is not None:
-            try:
-                ddd_value = float(ddd_value)
-            except ValueError:
-                logger.warning(
-                    f"Invalid DDD value for VMP {vmp_code}: {ddd_value}. Setting to None."
-                )
-                ddd_value = None
-
-        data.append(
-            {
-                "vmp_code": str(vmp_code) if vmp_code is not None else None,
-                "bnf_code": normalise_bnf_code(str(bnf_code.text))
-                if bnf_code is not None and bnf_code.text is not None
-                else None,
-                "atc_code": str(atc_code.text)
-                if atc_code is not None and atc_code.text is not None
-                else None,
-                "ddd": ddd_value,
-                "ddd_uom": str(ddd_uom.text)
-                if ddd_uom is not None and ddd_uom.text is not None
-                else None,
-            }
-        )
+    data = [record for batch in iter_bnf_batches(xml_path) for record in batch]
 
     logger.info(f"Extracted {len(data)} records from XML")
     return data
@@ -221,18 +306,9 @@ def parse_vtm_ingredients_xml(xml_path: Path) -> List[Dict[str, Optional[str]]]:
     logger = get_run_logger()
     logger.info(f"Parsing VTM ingredients XML data from {xml_path}")
 
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
-
-    data = []
-    for vtm_ing in root.findall(".//VTM_ING"):
-        vtm_id = vtm_ing.find("VTMID").text
-        ingredient_id = vtm_ing.find("ISID").text
-        
-        data.append({
-            "vtm_id": str(vtm_id) if vtm_id is not None else None,
-            "ingredient_id": str(ingredient_id) if ingredient_id is not None else None,
-        })
+    data = [
+        record for batch in iter_vtm_ingredient_batches(xml_path) for record in batch
+    ]
 
     logger.info(f"Extracted {len(data)} VTM ingredient mappings")
     return data
@@ -244,97 +320,86 @@ def parse_dmd_history_xml(xml_path: Path) -> List[Dict[str, Optional[str]]]:
     logger = get_run_logger()
     logger.info(f"Parsing dm+d history XML data from {xml_path}")
 
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
-
-    data = []
-
-    def process_entities(entities, entity_type):
-        results = []
-        for entity in entities:
-            current_id = entity.find("IDCURRENT").text
-            previous_id = entity.find("IDPREVIOUS").text
-            start_date = entity.find("STARTDT").text
-            end_date = entity.find("ENDDT").text if entity.find("ENDDT") is not None else None
-            
-            results.append({
-                "current_id": str(current_id) if current_id is not None else None,
-                "previous_id": str(previous_id) if previous_id is not None else None,
-                "start_date": start_date,
-                "end_date": end_date,
-                "entity_type": entity_type
-            })
-        return results
-
-    entity_mappings = [
-        (".//VTM", "VTM"),
-        (".//VMP", "VMP"),
-        (".//ING", "ING"),
-        (".//SUPP", "SUPP"),
-        (".//FORM", "FORM"),
-        (".//ROUTE", "ROUTE"),
-        (".//UOM", "UOM"),
-    ]
-
-    for xpath, entity_type in entity_mappings:
-        entities = root.findall(xpath)
-        entity_data = process_entities(entities, entity_type)
-        data.extend(entity_data)
-        logger.info(f"Extracted {len(entity_data)} {entity_type} history records")
+    data = [record for batch in iter_history_batches(xml_path) for record in batch]
+    counts = Counter(record["entity_type"] for record in data)
+    for entity_type in HISTORY_ENTITY_TYPES:
+        logger.info(f"Extracted {counts[entity_type]} {entity_type} history records")
 
     logger.info(f"Extracted {len(data)} total dm+d history records")
     return data
 
 
-@task
-def update_atc_codes(
+def apply_atc_code_updates(
     data: List[Dict[str, Optional[str]]],
     atc_mapping: Dict[str, Dict[str, str]],
     deleted_atc_codes: Dict[str, str]
-    ) -> List[Dict[str, Optional[str]]]:
-    """Update ATC codes in dm+d data using the mapping"""
-    logger = get_run_logger()
-
-    updated_data = data.copy()
-    
-    deletions_made = 0
+    ) -> Tuple[List[Dict[str, Optional[str]]], int, int]:
+    """
+    Drop records with deleted ATC codes and map the rest to their new codes.
+    Returns the updated records and the number of deletions and changes made.
+    """
     updated_data = [
-        record for record in updated_data
+        record for record in data
         if not (record.get('atc_code') and record['atc_code'] in deleted_atc_codes)
     ]
     deletions_made = len(data) - len(updated_data)
-    
-    if deletions_made > 0:
-        logger.info(f"Removed {deletions_made} records with deleted ATC codes")
-    else:
-        logger.info("No records removed for deleted ATC codes")
-    
+
     changes_made = 0
     for record in updated_data:
         atc_code = record.get('atc_code')
         if atc_code and atc_code in atc_mapping:
-            old_code = atc_code
-            mapping = atc_mapping[atc_code]
-            record['atc_code'] = mapping['new_code']
+            record['atc_code'] = atc_mapping[atc_code]['new_code']
             changes_made += 1
-            logger.debug(f"Updated ATC code {old_code} to {mapping['new_code']} for VMP {record.get('vmp_code')}")
-    
+
+    return updated_data, deletions_made, changes_made
+
+
+def log_atc_code_updates(deletions_made: int, changes_made: int, total: int) -> None:
+    logger = get_run_logger()
+
+    if deletions_made > 0:
+        logger.info(f"Removed {deletions_made} records with deleted ATC codes")
+    else:
+        logger.info("No records removed for deleted ATC codes")
+
     if changes_made > 0:
         logger.info(f"Updated {changes_made} ATC codes using mapping")
     else:
         logger.info("No ATC codes were updated")
-    
-    
-    logger.info(f"ATC code update completed. Total records: {len(updated_data)}")
-    return updated_data
 
+    logger.info(f"ATC code update completed. Total records: {total}")
+
+
+@task
+def update_atc_codes(
+    data: List[Dict[str, Optional[str]]],
+    atc_mapping: Dict[str, Dict[str, str]],
+    deleted_atc_codes: Dict[str, str]
+    ) -> List[Dict[str, Optional[str]]]:
+    """Update ATC codes in dm+d data using the mapping"""
+    updated_data, deletions_made, changes_made = apply_atc_code_updates(
+        [record.copy() for record in data], atc_mapping, deleted_atc_codes
+    )
+    log_atc_code_updates(deletions_made, changes_made, len(updated_data))
+    return updated_data
 
 
 @task
-def upload_to_bigquery(data: list[dict]):
-    """Upload the extracted data to BigQuery"""
+def load_bnf_data(
+    zip_path: Path,
+    member_path: Tuple[str, ...],
+    atc_mapping: Dict[str, Dict[str, str]],
+    deleted_atc_codes: Dict[str, str],
+    batch_size: int = XML_BATCH_SIZE,
+) -> int:
+    """
+    Stream the BNF XML file into BigQuery in batches, updating ATC codes
+    with the mapping as each batch is parsed
+    """
     logger = get_run_logger()
-    logger.info(f"Uploading {len(data)} records to {DMD_SUPP_TABLE_SPEC.full_table_id}")
+    logger.info(
+        f"Loading BNF data from {'/'.join(member_path)} into {DMD_SUPP_TABLE_SPEC.full_table_id}"
+    )
 
     client = get_bigquery_client()
 
@@ -348,62 +413,60 @@ def upload_to_bigquery(data: list[dict]):
             f"Table {DMD_SUPP_TABLE_SPEC.full_table_id} does not exist. Please run setup_bq_tables.py first"
         )
 
-    job_config = bigquery.LoadJobConfig(
-        schema=DMD_SUPP_TABLE_SPEC.schema,
-        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
-    )
+    totals = Counter()
 
-    job = client.load_table_from_json(
-        data, DMD_SUPP_TABLE_SPEC.full_table_id, job_config=job_config
-    )
-    job.result()
+    def updated_batches(xml_file):
+        for batch in iter_bnf_batches(xml_file, batch_size):
+            updated, deletions_made, changes_made = apply_atc_code_updates(
+                batch, atc_mapping, deleted_atc_codes
+            )
+            totals.update(
+                deletions=deletions_made, changes=changes_made, records=len(updated)
+            )
+            yield updated
 
-    logger.info(
-        f"Loaded {job.output_rows} rows into {DMD_SUPP_TABLE_SPEC.full_table_id}"
-    )
-    return job.output_rows
+    with open_zip_member(zip_path, member_path) as xml_file:
+        rows = load_json_batches(updated_batches(xml_file), DMD_SUPP_TABLE_SPEC)
+    log_atc_code_updates(totals["deletions"], totals["changes"], totals["records"])
+
+    logger.info(f"Loaded {rows} rows into {DMD_SUPP_TABLE_SPEC.full_table_id}")
+    return rows
 
 
 @task
-def upload_vtm_ingredients_to_bigquery(data: list[dict]):
-    """Upload VTM ingredients data to BigQuery"""
+def load_vtm_ingredients(
+    zip_path: Path, member_path: Tuple[str, ...], batch_size: int = XML_BATCH_SIZE
+) -> int:
+    """Stream the VTM ingredients XML file into BigQuery in batches"""
     logger = get_run_logger()
-    logger.info(f"Uploading {len(data)} VTM ingredient records")
-
-    client = get_bigquery_client()
     table_id = VTM_INGREDIENTS_TABLE_SPEC.full_table_id
+    logger.info(f"Loading VTM ingredients from {'/'.join(member_path)} into {table_id}")
 
-    job_config = bigquery.LoadJobConfig(
-        schema=VTM_INGREDIENTS_TABLE_SPEC.schema,
-        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
-    )
-
-    job = client.load_table_from_json(data, table_id, job_config=job_config)
-    job.result()
+    with open_zip_member(zip_path, member_path) as xml_file:
+        rows = load_json_batches(
+            iter_vtm_ingredient_batches(xml_file, batch_size), VTM_INGREDIENTS_TABLE_SPEC
+        )
 
-    logger.info(f"Loaded {job.output_rows} rows into {table_id}")
-    return job.output_rows
+    logger.info(f"Loaded {rows} rows into {table_id}")
+    return rows
 
 
 @task
-def upload_dmd_history_to_bigquery(data: list[dict]):
-    """Upload dm+d history data to BigQuery"""
+def load_dmd_history(
+    zip_path: Path, member_path: Tuple[str, ...], batch_size: int = XML_BATCH_SIZE
+) -> int:
+    """Stream the dm+d history XML file into BigQuery in batches"""
     logger = get_run_logger()
-    logger.info(f"Uploading {len(data)} dm+d history records")
-
-    client = get_bigquery_client()
     table_id = DMD_HISTORY_TABLE_SPEC.full_table_id
+    logger.info(f"Loading dm+d history from {'/'.join(member_path)} into {table_id}")
 
-    job_config = bigquery.LoadJobConfig(
-        schema=DMD_HISTORY_TABLE_SPEC.schema,
-        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
-    )
-
-    job = client.load_table_from_json(data, table_id, job_config=job_config)
-    job.result()
+    with open_zip_member(zip_path, member_path) as xml_file:
+        rows = load_json_batches(
+            iter_history_batches(xml_file, batch_size), DMD_HISTORY_TABLE_SPEC
+        )
 
-    logger.info(f"Loaded {job.output_rows} rows into {table_id}")
-    return job.output_rows
+    logger.info(f"Loaded {rows} rows into {table_id}")
+    return rows
 
 
 @flow(name="Import dm+d Supplementary Data")
@@ -413,39 +476,27 @@ def import_dmd_supp():
     logger.info("Starting dm+d supplementary data import flow")
 
     try:
-        TEMP_DIR.mkdir(exist_ok=True)
-
         release = get_latest_trud_release()
         logger.info(f"Processing release from {release.release_date}")
 
         main_zip_path = download_dmd_release(release)
-        bnf_xml_path, vtm_ing_path, history_path = extract_supplementary_files(main_zip_path, release.year)
-        
-        bnf_data = parse_xml_data(bnf_xml_path)
-        vtm_ing_data = parse_vtm_ingredients_xml(vtm_ing_path)
-        dmd_history_data = parse_dmd_history_xml(history_path)
+        bnf_member, vtm_ing_member, history_member = find_supplementary_files(
+            main_zip_path, release.year
+        )
 
         atc_alterations = fetch_table_data_from_bq(WHO_ATC_ALTERATIONS_TABLE_SPEC)
         atc_mapping, new_atc_codes, deleted_atc_codes = create_atc_code_mapping(atc_alterations)
-        
-        updated_data = update_atc_codes(bnf_data, atc_mapping, deleted_atc_codes)
 
-        bnf_rows = 0
-        if updated_data and len(updated_data) > 0:
-            bnf_rows = upload_to_bigquery(updated_data)
-        else:
+        bnf_rows = load_bnf_data(main_zip_path, bnf_member, atc_mapping, deleted_atc_codes)
+        if not bnf_rows:
             logger.warning("No BNF data found to upload")
 
-        vtm_ing_rows = 0
-        if vtm_ing_data and len(vtm_ing_data) > 0:
-            vtm_ing_rows = upload_vtm_ingredients_to_bigquery(vtm_ing_data)
-        else:
+        vtm_ing_rows = load_vtm_ingredients(main_zip_path, vtm_ing_member)
+        if not vtm_ing_rows:
             logger.warning("No VTM ingredient data found to upload")
 
-        dmd_history_rows = 0
-        if dmd_history_data and len(dmd_history_data) > 0:
-            dmd_history_rows = upload_dmd_history_to_bigquery(dmd_history_data)
-        else:
+        dmd_history_rows = load_dmd_history(main_zip_path, history_member)
+        if not dmd_history_rows:
             logger.warning("No dm+d history data found to upload")
 
         logger.info(
@@ -458,9 +509,5 @@ def import_dmd_supp():
         logger.error(f"Error in dm+d supplementary data import flow: {str(e)}")
         raise
 
-    finally:
-        cleanup_temp_files()
-
-
 if __name__ == "__main__":
     import_dmd_supp()
@@ -7,6 +7,7 @@ from pipeline.setup.bq_tables import WHO_ATC_TABLE_SPEC
 
 setup_django_environment()
 from viewer.models import ATC
+from viewer.atc_closure import rebuild_atc_closure
 
 
 @task()
@@ -95,6 +96,17 @@ def load_atc_codes(data: List[Dict]) -> Dict:
     }
 
 
+@task
+def load_atc_closure() -> int:
+    """Rebuild the ATC ancestor closure over the VMP ATC links"""
+    logger = get_run_logger()
+
+    created = rebuild_atc_closure()
+
+    logger.info(f"Created {created} ATC ancestor closure records")
+    return created
+
+
 @flow
 def load_atc():
     """Main flow to import ATC code data from BigQuery to Django"""
@@ -104,6 +116,7 @@ def load_atc():
     atc_data = extract_atc_codes()
     transformed_data = transform_atc_codes(atc_data)
     result = load_atc_codes(transformed_data)
+    load_atc_closure()
 
     logger.info(
         f"ATC code import complete. Deleted: {result['deleted']}, Created: {result['created']}"
@@ -15,6 +15,7 @@ from pipeline.load_data.load_dose_data import load_dose_data
 from pipeline.load_data.load_ingredient_quantity import load_ingredient_quantity
 from pipeline.load_data.load_ddd_quantity import load_ddd_quantity
 from pipeline.load_data.load_trust_admissions import load_trust_admissions
+from pipeline.load_data.load_vmp_quantity_summary import load_vmp_quantity_summary
 
 
 @flow(name="Load Data")
@@ -33,6 +34,7 @@ def load_data():
     load_dose_data()
     load_ingredient_quantity()
     load_ddd_quantity()
+    load_vmp_quantity_summary()
 
     logger.info("Load flows completed")
 
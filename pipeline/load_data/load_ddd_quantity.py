@@ -4,14 +4,16 @@ import pandas as pd
 from google.cloud import bigquery
 from prefect import get_run_logger, task, flow
 from django.db import transaction
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 from pipeline.setup.bq_tables import DDD_QUANTITY_TABLE_SPEC, DDD_CALCULATION_LOGIC_TABLE_SPEC
 from pipeline.utils.utils import (
     setup_django_environment,
     get_bigquery_client,
     get_quantity_months,
-    sparse_to_dense,
+    pivot_to_dense,
 )
+from pipeline.utils.bq_stream import EXTRACT_MODES, extract_vmp_chunks
+from pipeline.utils.upsert import QuantityUpsert, rows_touched_report
 
 
 setup_django_environment()
@@ -84,6 +86,29 @@ def get_unique_vmps_with_ddd_data() -> List[str]:
     return vmp_codes
 
 
+def ddd_data_query(vmp_codes: Optional[List[str]] = None) -> str:
+    """Extraction query ordered by VMP, limited to vmp_codes if given"""
+    vmp_filter = ""
+    if vmp_codes is not None:
+        vmp_list_str = "', '".join(vmp_codes)
+        vmp_filter = f"AND vmp_code IN ('{vmp_list_str}')"
+
+    return f"""
+    SELECT 
+        vmp_code,
+        year_month,
+        ods_code,
+        ddd_quantity,
+        ddd_value,
+        ddd_unit,
+        ingredient_code
+    FROM `{DDD_QUANTITY_TABLE_SPEC.full_table_id}`
+    WHERE ddd_quantity IS NOT NULL
+    {vmp_filter}
+    ORDER BY vmp_code, ods_code, year_month
+    """
+
+
 @task
 def extract_ddd_data_by_vmps(
     vmp_codes: List[str], chunk_num: int, total_chunks: int
@@ -101,22 +126,7 @@ def extract_ddd_data_by_vmps(
 
     client = get_bigquery_client()
 
-    vmp_list_str = "', '".join(vmp_codes)
-
-    query = f"""
-    SELECT 
-        vmp_code,
-        year_month,
-        ods_code,
-        ddd_quantity,
-        ddd_value,
-        ddd_unit,
-        ingredient_code
-    FROM `{DDD_QUANTITY_TABLE_SPEC.full_table_id}`
-    WHERE ddd_quantity IS NOT NULL
-    AND vmp_code IN ('{vmp_list_str}')
-    ORDER BY vmp_code, ods_code, year_month
-    """
+    query = ddd_data_query(vmp_codes)
 
     df = fetch_bigquery_data(query, client)
 
@@ -164,6 +174,19 @@ def clear_existing_ddd_data() -> Tuple[int, int]:
     return total_deleted, total_logic_deleted
 
 
+@task
+def clear_ddd_calculation_logic() -> int:
+    """Clear DDD calculation logic, which is reloaded in full on every run"""
+    logger = get_run_logger()
+    deleted_count = CalculationLogic.objects.filter(logic_type='ddd').delete()[0]
+    logger.info(f"Deleted {deleted_count:,} existing DDD calculation logic records")
+    return deleted_count
+
+
+def ddd_quantity_writer() -> QuantityUpsert:
+    return QuantityUpsert(DDDQuantity, key_fields=["vmp", "organisation"])
+
+
 @task
 def cache_foreign_keys() -> Dict:
     """Cache all VMP and Organisation foreign keys"""
@@ -232,8 +255,9 @@ def transform_and_load_ddd_quantity_chunk(
     foreign_key_cache: Dict,
     chunk_num: int,
     total_chunks: int,
+    writer: QuantityUpsert = None,
 ) -> Dict:
-    """Transform and load a chunk of DDD quantity data"""
+    """Transform and upsert a chunk of DDD quantity data"""
     logger = get_run_logger()
 
     logger.info(
@@ -242,7 +266,7 @@ def transform_and_load_ddd_quantity_chunk(
 
     if len(chunk_df) == 0:
         logger.info(f"Chunk {chunk_num}/{total_chunks}: No DDD quantity data to process")
-        return {"created": 0, "skipped": 0}
+        return {"created": 0, "updated": 0, "unchanged": 0, "skipped": 0}
 
     valid_mask = (
         chunk_df["vmp_code"].notna()
@@ -261,7 +285,7 @@ def transform_and_load_ddd_quantity_chunk(
 
     if len(df_valid) == 0:
         logger.info(f"Chunk {chunk_num}/{total_chunks}: No valid DDD quantity data to process after filtering")
-        return {"created": 0, "skipped": skipped_count}
+        return {"created": 0, "updated": 0, "unchanged": 0, "skipped": skipped_count}
 
     df_valid["year_month"] = pd.to_datetime(df_valid["year_month"]).dt.strftime("%Y-%m-%d")
 
@@ -272,13 +296,8 @@ def transform_and_load_ddd_quantity_chunk(
         )
 
     grouped_data = {}
-    for (vmp_code, ods_code), group in df_valid.groupby(["vmp_code", "ods_code"]):
-        sparse = [
-            [row.year_month, float(row.ddd_quantity)]
-            for row in group.itertuples(index=False)
-        ]
-        dense = sparse_to_dense(sparse, months)
-
+    dense_by_key = pivot_to_dense(df_valid, ["vmp_code", "ods_code"], "ddd_quantity", months)
+    for (vmp_code, ods_code), dense in dense_by_key.items():
         if (vmp_code in foreign_key_cache["vmps"] and 
             ods_code in foreign_key_cache["organisations"]):
             key = (
@@ -301,45 +320,47 @@ def transform_and_load_ddd_quantity_chunk(
         f"Chunk {chunk_num}/{total_chunks}: Loading {len(ddd_objects):,} objects to database..."
     )
 
-    SUB_BATCH_SIZE = 500
-    total_created = 0
-    total_skipped = skipped_count
-
-    for i in range(0, len(ddd_objects), SUB_BATCH_SIZE):
-        sub_batch = ddd_objects[i : i + SUB_BATCH_SIZE]
-
-        try:
-            with transaction.atomic():
-                DDDQuantity.objects.bulk_create(
-                    sub_batch,
-                    batch_size=SUB_BATCH_SIZE,
-                    unique_fields=["vmp", "organisation"],
-                )
-                total_created += len(sub_batch)
-
-        except Exception as e:
-            logger.error(
-                f"Chunk {chunk_num}/{total_chunks}: Error in sub-batch {i//SUB_BATCH_SIZE + 1}: {str(e)}"
-            )
-            total_skipped += len(sub_batch)
+    writer = writer or ddd_quantity_writer()
+    counts = writer.write(
+        ddd_objects,
+        on_error=lambda e, batch: logger.error(
+            f"Chunk {chunk_num}/{total_chunks}: Error in sub-batch {batch}: {str(e)}"
+        ),
+    )
+    total_skipped = skipped_count + counts["failed"]
 
     logger.info(
-        f"Chunk {chunk_num}/{total_chunks}: Load complete. Created: {total_created:,}, Skipped: {total_skipped:,}"
+        f"Chunk {chunk_num}/{total_chunks}: Load complete. Created: {counts['inserted']:,}, "
+        f"Updated: {counts['updated']:,}, Unchanged: {counts['unchanged']:,}, Skipped: {total_skipped:,}"
     )
 
     return {
-        "created": total_created,
+        "created": counts["inserted"],
+        "updated": counts["updated"],
+        "unchanged": counts["unchanged"],
         "skipped": total_skipped,
     }
 
 
 @flow
-def load_ddd_quantity(vmp_chunk_size: int = 500):
+def load_ddd_quantity(
+    vmp_chunk_size: int = 500,
+    replace: bool = False,
+    bq_prefetch: int = 2,
+    extract_mode: str = "query",
+):
     """
     Main flow to import DDD quantity data from BigQuery
 
+    Rows are upserted and only new or changed arrays are written; rows that are
+    no longer in BigQuery are deleted at the end.
+
     Args:
         vmp_chunk_size: Number of VMPs to process in each chunk (default: 500)
+        replace: Delete all existing rows first instead of upserting (default: False)
+        bq_prefetch: Number of BigQuery chunks to fetch ahead while a chunk is loaded (default: 2)
+        extract_mode: "query" to run one BigQuery query per chunk, or "storage" to read the
+            whole table once through the Storage Read API (default: "query")
     """
     logger = get_run_logger()
     start_time = time.time()
@@ -356,11 +377,17 @@ def load_ddd_quantity(vmp_chunk_size: int = 500):
         f"Found {len(all_logic_vmps):,} VMPs with DDD logic and {len(quantity_vmps):,} VMPs with DDD quantity data"
     )
 
-    deleted_count, logic_deleted_count = clear_existing_ddd_data()
+    if replace:
+        deleted_count, logic_deleted_count = clear_existing_ddd_data()
+    else:
+        deleted_count, logic_deleted_count = 0, clear_ddd_calculation_logic()
     foreign_key_cache = cache_foreign_keys()
+    writer = ddd_quantity_writer()
 
     total_stats = {
         "total_created": 0,
+        "total_updated": 0,
+        "total_unchanged": 0,
         "total_skipped": 0,
         "total_logic_created": 0,
         "total_logic_missing": 0,
@@ -401,20 +428,26 @@ def load_ddd_quantity(vmp_chunk_size: int = 500):
         f"Will process DDD quantity data for {len(quantity_vmps):,} VMPs in {quantity_total_chunks} chunks of {vmp_chunk_size} VMPs each"
     )
 
-    for chunk_num in range(1, quantity_total_chunks + 1):
+    for chunk_num, _, chunk_vmps, chunk_df in extract_vmp_chunks(
+        quantity_vmps,
+        vmp_chunk_size,
+        extract_ddd_data_by_vmps,
+        ddd_data_query(),
+        extract_mode=extract_mode,
+        prefetch=bq_prefetch,
+    ):
         chunk_start_time = time.time()
 
         start_idx = (chunk_num - 1) * vmp_chunk_size
-        end_idx = min(start_idx + vmp_chunk_size, len(quantity_vmps))
-        chunk_vmps = quantity_vmps[start_idx:end_idx]
-
-        chunk_df = extract_ddd_data_by_vmps(chunk_vmps, chunk_num, quantity_total_chunks)
+        end_idx = start_idx + len(chunk_vmps)
 
         chunk_result = transform_and_load_ddd_quantity_chunk(
-            chunk_df, foreign_key_cache, chunk_num, quantity_total_chunks
+            chunk_df, foreign_key_cache, chunk_num, quantity_total_chunks, writer
         )
 
         total_stats["total_created"] += chunk_result["created"]
+        total_stats["total_updated"] += chunk_result["updated"]
+        total_stats["total_unchanged"] += chunk_result["unchanged"]
         total_stats["total_skipped"] += chunk_result["skipped"]
         total_stats["total_processed_chunks"] += 1
 
@@ -425,18 +458,26 @@ def load_ddd_quantity(vmp_chunk_size: int = 500):
             f"Quantity chunk {chunk_num}/{quantity_total_chunks} complete in {chunk_duration:.1f}s ({progress_pct:.1f}% done). "
             f"Processed VMPs {start_idx+1}-{end_idx}. "
             f"Running totals - Quantity created: {total_stats['total_created']:,}, "
+            f"Quantity updated: {total_stats['total_updated']:,}, "
+            f"Quantity unchanged: {total_stats['total_unchanged']:,}, "
             f"Quantity skipped: {total_stats['total_skipped']:,}. "
         )
 
+    if not replace:
+        deleted_count = writer.delete_orphans()
+
     total_time = time.time() - start_time
 
+    logger.info(writer.summary())
     logger.info(
         f"DDD quantity data import completed in {total_time/60:.1f} minutes. "
         f"Deleted: {deleted_count:,}, Created: {total_stats['total_created']:,}, "
+        f"Updated: {total_stats['total_updated']:,}, Unchanged: {total_stats['total_unchanged']:,}, "
         f"Logic deleted: {logic_deleted_count:,}, Logic created: {total_stats['total_logic_created']:,}, "
         f"Logic missing: {total_stats['total_logic_missing']:,}, "
         f"Skipped: {total_stats['total_skipped']:,}, Chunks processed: {total_stats['total_processed_chunks']}. "
     )
+    return rows_touched_report([writer])
 
 
 
@@ -450,7 +491,29 @@ if __name__ == "__main__":
         default=500,
         help="Number of VMPs per chunk (default: 500)",
     )
+    parser.add_argument(
+        "--replace",
+        action="store_true",
+        help="Delete all existing rows before loading instead of upserting",
+    )
+    parser.add_argument(
+        "--bq-prefetch",
+        type=int,
+        default=2,
+        help="Number of BigQuery chunks to fetch ahead while a chunk is loaded (default: 2)",
+    )
+    parser.add_argument(
+        "--extract-mode",
+        choices=EXTRACT_MODES,
+        default="query",
+        help="Query BigQuery per chunk, or read each table once with the Storage Read API (default: query)",
+    )
 
     args = parser.parse_args()
 
-    load_ddd_quantity(vmp_chunk_size=args.vmp_chunk_size)
+    load_ddd_quantity(
+        vmp_chunk_size=args.vmp_chunk_size,
+        replace=args.replace,
+        bq_prefetch=args.bq_prefetch,
+        extract_mode=args.extract_mode,
+    )
@@ -4,14 +4,16 @@ import pandas as pd
 from google.cloud import bigquery
 from prefect import get_run_logger, task, flow
 from django.db import transaction
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 from pipeline.setup.bq_tables import DOSE_TABLE_SPEC, DOSE_CALCULATION_LOGIC_TABLE_SPEC
 from pipeline.utils.utils import (
     setup_django_environment,
     get_bigquery_client,
     get_quantity_months,
-    sparse_to_dense,
+    pivot_to_dense,
 )
+from pipeline.utils.bq_stream import EXTRACT_MODES, extract_vmp_chunks
+from pipeline.utils.upsert import QuantityUpsert, rows_touched_report
 
 
 setup_django_environment()
@@ -67,22 +69,14 @@ def get_dose_calculation_logic() -> Dict[str, str]:
     return logic_dict
 
 
-@task
-def extract_dose_data_by_vmps(
-    vmp_codes: List[str], chunk_num: int, total_chunks: int
-) -> pd.DataFrame:
-    """Extract dose and SCMD data for a specific set of VMP codes"""
-    logger = get_run_logger()
+def dose_data_query(vmp_codes: Optional[List[str]] = None) -> str:
+    """Extraction query ordered by VMP, limited to vmp_codes if given"""
+    vmp_filter = ""
+    if vmp_codes is not None:
+        vmp_list_str = "', '".join(vmp_codes)
+        vmp_filter = f"AND vmp_code IN ('{vmp_list_str}')"
 
-    logger.info(
-        f"Chunk {chunk_num}/{total_chunks}: Extracting data for {len(vmp_codes):,} VMPs"
-    )
-
-    client = get_bigquery_client()
-
-    vmp_list_str = "', '".join(vmp_codes)
-
-    query = f"""
+    return f"""
     SELECT 
         year_month, 
         vmp_code, 
@@ -94,10 +88,26 @@ def extract_dose_data_by_vmps(
     FROM `{DOSE_TABLE_SPEC.full_table_id}`
     WHERE ((dose_quantity IS NOT NULL AND dose_unit IS NOT NULL)
            OR (scmd_quantity IS NOT NULL AND scmd_basis_unit_name IS NOT NULL))
-    AND vmp_code IN ('{vmp_list_str}')
+    {vmp_filter}
     ORDER BY vmp_code, ods_code, year_month
     """
 
+
+@task
+def extract_dose_data_by_vmps(
+    vmp_codes: List[str], chunk_num: int, total_chunks: int
+) -> pd.DataFrame:
+    """Extract dose and SCMD data for a specific set of VMP codes"""
+    logger = get_run_logger()
+
+    logger.info(
+        f"Chunk {chunk_num}/{total_chunks}: Extracting data for {len(vmp_codes):,} VMPs"
+    )
+
+    client = get_bigquery_client()
+
+    query = dose_data_query(vmp_codes)
+
     df = fetch_bigquery_data(query, client)
 
     logger.info(
@@ -163,6 +173,46 @@ def clear_existing_dose_data() -> Tuple[int, int, int]:
     return total_dose_deleted, total_scmd_deleted, total_logic_deleted
 
 
+@task
+def clear_dose_calculation_logic() -> int:
+    """Clear dose calculation logic, which is reloaded in full on every run"""
+    logger = get_run_logger()
+    deleted_count = CalculationLogic.objects.filter(logic_type='dose').delete()[0]
+    logger.info(f"Deleted {deleted_count:,} existing dose calculation logic records")
+    return deleted_count
+
+
+@task
+def delete_unused_quantity_units() -> int:
+    """Delete dose and SCMD units no longer referenced by any quantity row"""
+    return VMPQuantityUnit.objects.filter(
+        doses__isnull=True, scmd_quantities__isnull=True
+    ).delete()[0]
+
+
+def dose_writer() -> QuantityUpsert:
+    return QuantityUpsert(
+        Dose, key_fields=["vmp", "organisation"], value_fields=["quantity_unit", "data"]
+    )
+
+
+def scmd_quantity_writer() -> QuantityUpsert:
+    return QuantityUpsert(
+        SCMDQuantity, key_fields=["vmp", "organisation"], value_fields=["quantity_unit", "data"]
+    )
+
+
+def get_vmp_quantity_unit(quantity_type: str, vmp_id: int, unit: str) -> VMPQuantityUnit:
+    """Get or create the unit for a VMP, updating it if the unit has changed"""
+    quantity_unit, created = VMPQuantityUnit.objects.get_or_create(
+        quantity_type=quantity_type, vmp_id=vmp_id, defaults={"unit": unit}
+    )
+    if not created and quantity_unit.unit != unit:
+        quantity_unit.unit = unit
+        quantity_unit.save(update_fields=["unit"])
+    return quantity_unit
+
+
 @task
 def cache_foreign_keys() -> Dict:
     """Cache all VMP and Organisation foreign keys"""
@@ -223,15 +273,27 @@ def load_dose_logic(
     return {"logic_created": logic_created, "logic_conflicts": logic_conflicts}
 
 
+def dense_with_units(
+    df: pd.DataFrame, value_column: str, unit_column: str, months: List[str]
+) -> Dict[Tuple[str, str], Tuple[List[float], str]]:
+    """(vmp_code, ods_code) -> (dense array, unit of the group's first row)"""
+    keys = ["vmp_code", "ods_code"]
+    dense = pivot_to_dense(df, keys, value_column, months)
+    units = df.groupby(keys, sort=False)[unit_column].first().astype(str).to_dict()
+    return {key: (data, units[key]) for key, data in dense.items()}
+
+
 @task
 def transform_and_load_chunk(
     chunk_df: pd.DataFrame, 
     foreign_key_cache: Dict, 
     dose_logic_dict: Dict[str, str],
     chunk_num: int, 
-    total_chunks: int
+    total_chunks: int,
+    dose_upsert: QuantityUpsert = None,
+    scmd_upsert: QuantityUpsert = None,
 ) -> Dict:
-    """Transform and load a chunk"""
+    """Transform and upsert a chunk"""
     logger = get_run_logger()
 
     logger.info(
@@ -240,7 +302,11 @@ def transform_and_load_chunk(
 
     if len(chunk_df) == 0:
         logger.info(f"Chunk {chunk_num}/{total_chunks}: No data to process")
-        return {"dose_created": 0, "scmd_created": 0, "skipped": 0, "logic_created": 0, "logic_conflicts": 0}
+        return {
+            "dose_created": 0, "dose_updated": 0, "dose_unchanged": 0,
+            "scmd_created": 0, "scmd_updated": 0, "scmd_unchanged": 0,
+            "skipped": 0, "logic_created": 0, "logic_conflicts": 0,
+        }
 
     logic_result = load_dose_logic(chunk_df, foreign_key_cache, dose_logic_dict, chunk_num, total_chunks)
 
@@ -263,7 +329,11 @@ def transform_and_load_chunk(
         logger.info(
             f"Chunk {chunk_num}/{total_chunks}: No valid records after filtering"
         )
-        return {"dose_created": 0, "scmd_created": 0, "skipped": skipped_count, **logic_result}
+        return {
+            "dose_created": 0, "dose_updated": 0, "dose_unchanged": 0,
+            "scmd_created": 0, "scmd_updated": 0, "scmd_unchanged": 0,
+            "skipped": skipped_count, **logic_result,
+        }
 
     logger.info(f"Chunk {chunk_num}/{total_chunks}: Converting data types...")
     df_valid["year_month"] = pd.to_datetime(df_valid["year_month"]).dt.strftime(
@@ -278,24 +348,18 @@ def transform_and_load_chunk(
             f"Chunk {chunk_num}/{total_chunks}: DataStatus has no months - cannot build dense arrays"
         )
 
-    dose_data = {}
-    scmd_data = {}
-    for (vmp_code, ods_code), group in df_valid.groupby(["vmp_code", "ods_code"]):
-        dose_group = group[
-            (group["dose_quantity"].notna()) & (group["dose_unit"].notna())
-        ]
-        if len(dose_group) > 0:
-            dose_unit = str(dose_group.iloc[0].dose_unit)
-            sparse = [[row.year_month, float(row.dose_quantity)] for row in dose_group.itertuples(index=False)]
-            dose_data[(vmp_code, ods_code)] = (sparse_to_dense(sparse, months), dose_unit)
-
-        scmd_group = group[
-            (group["scmd_quantity"].notna()) & (group["scmd_basis_unit_name"].notna())
-        ]
-        if len(scmd_group) > 0:
-            scmd_unit = str(scmd_group.iloc[0].scmd_basis_unit_name)
-            sparse = [[row.year_month, float(row.scmd_quantity)] for row in scmd_group.itertuples(index=False)]
-            scmd_data[(vmp_code, ods_code)] = (sparse_to_dense(sparse, months), scmd_unit)
+    dose_data = dense_with_units(
+        df_valid[df_valid["dose_quantity"].notna() & df_valid["dose_unit"].notna()],
+        "dose_quantity",
+        "dose_unit",
+        months,
+    )
+    scmd_data = dense_with_units(
+        df_valid[df_valid["scmd_quantity"].notna() & df_valid["scmd_basis_unit_name"].notna()],
+        "scmd_quantity",
+        "scmd_basis_unit_name",
+        months,
+    )
 
     logger.info(
         f"Chunk {chunk_num}/{total_chunks}: Created {len(dose_data):,} dose combinations and {len(scmd_data):,} SCMD combinations"
@@ -313,9 +377,7 @@ def transform_and_load_chunk(
             vmp_id = vmps[vmp_code]
             cache_key = (vmp_id, unit)
             if cache_key not in dose_unit_cache:
-                dose_unit_cache[cache_key], _ = VMPQuantityUnit.objects.get_or_create(
-                    quantity_type="dose", vmp_id=vmp_id, defaults={"unit": unit}
-                )
+                dose_unit_cache[cache_key] = get_vmp_quantity_unit("dose", vmp_id, unit)
             dose_objects.append(
                 Dose(
                     vmp_id=vmp_id,
@@ -336,9 +398,7 @@ def transform_and_load_chunk(
             vmp_id = vmps[vmp_code]
             cache_key = (vmp_id, unit)
             if cache_key not in scmd_unit_cache:
-                scmd_unit_cache[cache_key], _ = VMPQuantityUnit.objects.get_or_create(
-                    quantity_type="scmd", vmp_id=vmp_id, defaults={"unit": unit}
-                )
+                scmd_unit_cache[cache_key] = get_vmp_quantity_unit("scmd", vmp_id, unit)
             scmd_objects.append(
                 SCMDQuantity(
                     vmp_id=vmp_id,
@@ -354,66 +414,64 @@ def transform_and_load_chunk(
         f"Chunk {chunk_num}/{total_chunks}: Loading {len(dose_objects):,} dose objects and {len(scmd_objects):,} SCMD objects to database..."
     )
 
-    SUB_BATCH_SIZE = 500
-    dose_created = 0
-    scmd_created = 0
-    total_skipped = skipped_count + dose_skipped + scmd_skipped
-
-    for i in range(0, len(dose_objects), SUB_BATCH_SIZE):
-        sub_batch = dose_objects[i:i + SUB_BATCH_SIZE]
-
-        try:
-            with transaction.atomic():
-                Dose.objects.bulk_create(
-                    sub_batch,
-                    batch_size=SUB_BATCH_SIZE,
-                    unique_fields=["vmp", "organisation"],
-                )
-                dose_created += len(sub_batch)
-
-        except Exception as e:
-            logger.error(
-                f"Chunk {chunk_num}/{total_chunks}: Error in dose sub-batch {i//SUB_BATCH_SIZE + 1}: {str(e)}"
-            )
-            total_skipped += len(sub_batch)
-
-    for i in range(0, len(scmd_objects), SUB_BATCH_SIZE):
-        sub_batch = scmd_objects[i:i + SUB_BATCH_SIZE]
-
-        try:
-            with transaction.atomic():
-                SCMDQuantity.objects.bulk_create(
-                    sub_batch,
-                    batch_size=SUB_BATCH_SIZE,
-                    unique_fields=["vmp", "organisation"],
-                )
-                scmd_created += len(sub_batch)
-
-        except Exception as e:
-            logger.error(
-                f"Chunk {chunk_num}/{total_chunks}: Error in SCMD sub-batch {i//SUB_BATCH_SIZE + 1}: {str(e)}"
-            )
-            total_skipped += len(sub_batch)
+    dose_upsert = dose_upsert or dose_writer()
+    scmd_upsert = scmd_upsert or scmd_quantity_writer()
+    dose_counts = dose_upsert.write(
+        dose_objects,
+        on_error=lambda e, batch: logger.error(
+            f"Chunk {chunk_num}/{total_chunks}: Error in dose sub-batch {batch}: {str(e)}"
+        ),
+    )
+    scmd_counts = scmd_upsert.write(
+        scmd_objects,
+        on_error=lambda e, batch: logger.error(
+            f"Chunk {chunk_num}/{total_chunks}: Error in SCMD sub-batch {batch}: {str(e)}"
+        ),
+    )
+    total_skipped = (
+        skipped_count + dose_skipped + scmd_skipped
+        + dose_counts["failed"] + scmd_counts["failed"]
+    )
 
     logger.info(
-        f"Chunk {chunk_num}/{total_chunks}: Load complete. Dose created: {dose_created:,}, SCMD created: {scmd_created:,}, Skipped: {total_skipped:,}"
+        f"Chunk {chunk_num}/{total_chunks}: Load complete. "
+        f"Dose created: {dose_counts['inserted']:,}, updated: {dose_counts['updated']:,}, "
+        f"unchanged: {dose_counts['unchanged']:,}. "
+        f"SCMD created: {scmd_counts['inserted']:,}, updated: {scmd_counts['updated']:,}, "
+        f"unchanged: {scmd_counts['unchanged']:,}. Skipped: {total_skipped:,}"
     )
 
     return {
-        "dose_created": dose_created,
-        "scmd_created": scmd_created,
+        "dose_created": dose_counts["inserted"],
+        "dose_updated": dose_counts["updated"],
+        "dose_unchanged": dose_counts["unchanged"],
+        "scmd_created": scmd_counts["inserted"],
+        "scmd_updated": scmd_counts["updated"],
+        "scmd_unchanged": scmd_counts["unchanged"],
         "skipped": total_skipped,
         **logic_result
     }
 
 
 @flow
-def load_dose_data(vmp_chunk_size: int = 500):
+def load_dose_data(
+    vmp_chunk_size: int = 500,
+    replace: bool = False,
+    bq_prefetch: int = 2,
+    extract_mode: str = "query",
+):
     """
     Main flow to import dose and SCMD quantity data using VMP-based chunking
 
+    Rows are upserted and only new or changed arrays are written; rows that are
+    no longer in BigQuery are deleted at the end.
+
     Args:
         vmp_chunk_size: Number of VMPs to process in each chunk (default: 500)
+        replace: Delete all existing rows first instead of upserting (default: False)
+        bq_prefetch: Number of BigQuery chunks to fetch ahead while a chunk is loaded (default: 2)
+        extract_mode: "query" to run one BigQuery query per chunk, or "storage" to read the
+            whole table once through the Storage Read API (default: "query")
     """
     logger = get_run_logger()
     start_time = time.time()
@@ -428,24 +486,38 @@ def load_dose_data(vmp_chunk_size: int = 500):
         f"Will process {len(all_vmps):,} VMPs in {total_chunks} chunks of {vmp_chunk_size} VMPs each"
     )
 
-    dose_deleted, scmd_deleted, logic_deleted = clear_existing_dose_data()
+    if replace:
+        dose_deleted, scmd_deleted, logic_deleted = clear_existing_dose_data()
+    else:
+        dose_deleted, scmd_deleted, logic_deleted = 0, 0, clear_dose_calculation_logic()
     foreign_key_cache = cache_foreign_keys()
+    dose_upsert = dose_writer()
+    scmd_upsert = scmd_quantity_writer()
 
     total_stats = {
         "total_dose_created": 0,
+        "total_dose_updated": 0,
+        "total_dose_unchanged": 0,
         "total_scmd_created": 0,
+        "total_scmd_updated": 0,
+        "total_scmd_unchanged": 0,
         "total_skipped": 0,
         "total_logic_created": 0,
         "total_logic_conflicts": 0,
         "total_processed_chunks": 0,
     }
 
-    for chunk_num in range(1, total_chunks + 1):
+    for chunk_num, total_chunks, chunk_vmps, chunk_df in extract_vmp_chunks(
+        all_vmps,
+        vmp_chunk_size,
+        extract_dose_data_by_vmps,
+        dose_data_query(),
+        extract_mode=extract_mode,
+        prefetch=bq_prefetch,
+    ):
         chunk_start_time = time.time()
         start_idx = (chunk_num - 1) * vmp_chunk_size
-        end_idx = min(start_idx + vmp_chunk_size, len(all_vmps))
-        chunk_vmps = all_vmps[start_idx:end_idx]
-        chunk_df = extract_dose_data_by_vmps(chunk_vmps, chunk_num, total_chunks)
+        end_idx = start_idx + len(chunk_vmps)
 
         if len(chunk_df) == 0:
             logger.info(
@@ -454,11 +526,13 @@ def load_dose_data(vmp_chunk_size: int = 500):
             continue
 
         chunk_result = transform_and_load_chunk(
-            chunk_df, foreign_key_cache, dose_logic_dict, chunk_num, total_chunks
+            chunk_df, foreign_key_cache, dose_logic_dict, chunk_num, total_chunks,
+            dose_upsert, scmd_upsert,
         )
 
-        total_stats["total_dose_created"] += chunk_result["dose_created"]
-        total_stats["total_scmd_created"] += chunk_result["scmd_created"]
+        for key in ("dose_created", "dose_updated", "dose_unchanged",
+                    "scmd_created", "scmd_updated", "scmd_unchanged"):
+            total_stats[f"total_{key}"] += chunk_result[key]
         total_stats["total_skipped"] += chunk_result["skipped"]
         total_stats["total_logic_created"] += chunk_result["logic_created"]
         total_stats["total_logic_conflicts"] += chunk_result["logic_conflicts"]
@@ -472,20 +546,33 @@ def load_dose_data(vmp_chunk_size: int = 500):
             f"Chunk {chunk_num}/{total_chunks} complete in {chunk_duration:.1f}s ({progress_pct:.1f}% done). "
             f"Processed VMPs {start_idx+1}-{end_idx}. "
             f"Running totals - Dose created: {total_stats['total_dose_created']:,}, "
-            f"SCMD created: {total_stats['total_scmd_created']:,}, Logic created: {total_stats['total_logic_created']:,}, "
+            f"Dose updated: {total_stats['total_dose_updated']:,}, "
+            f"SCMD created: {total_stats['total_scmd_created']:,}, "
+            f"SCMD updated: {total_stats['total_scmd_updated']:,}, Logic created: {total_stats['total_logic_created']:,}, "
             f"Logic conflicts: {total_stats['total_logic_conflicts']:,}, Skipped: {total_stats['total_skipped']:,}. "
         )
 
+    if not replace:
+        dose_deleted = dose_upsert.delete_orphans()
+        scmd_deleted = scmd_upsert.delete_orphans()
+        units_deleted = delete_unused_quantity_units()
+        logger.info(f"Deleted {units_deleted:,} unused dose and SCMD quantity units")
+
     total_time = time.time() - start_time
 
+    logger.info(dose_upsert.summary())
+    logger.info(scmd_upsert.summary())
     logger.info(
         f"Dose data import completed in {total_time/60:.1f} minutes. "
         f"Dose deleted: {dose_deleted:,}, Dose created: {total_stats['total_dose_created']:,}, "
+        f"Dose updated: {total_stats['total_dose_updated']:,}, Dose unchanged: {total_stats['total_dose_unchanged']:,}, "
         f"SCMD deleted: {scmd_deleted:,}, SCMD created: {total_stats['total_scmd_created']:,}, "
+        f"SCMD updated: {total_stats['total_scmd_updated']:,}, SCMD unchanged: {total_stats['total_scmd_unchanged']:,}, "
         f"Logic deleted: {logic_deleted:,}, Logic created: {total_stats['total_logic_created']:,}, "
         f"Logic conflicts: {total_stats['total_logic_conflicts']:,}, "
         f"Skipped: {total_stats['total_skipped']:,}, Chunks processed: {total_stats['total_processed_chunks']}. "
     )
+    return rows_touched_report([dose_upsert, scmd_upsert])
 
 
 
@@ -499,7 +586,29 @@ if __name__ == "__main__":
         default=500,
         help="Number of VMPs per chunk (default: 500)",
     )
+    parser.add_argument(
+        "--replace",
+        action="store_true",
+        help="Delete all existing rows before loading instead of upserting",
+    )
+    parser.add_argument(
+        "--bq-prefetch",
+        type=int,
+        default=2,
+        help="Number of BigQuery chunks to fetch ahead while a chunk is loaded (default: 2)",
+    )
+    parser.add_argument(
+        "--extract-mode",
+        choices=EXTRACT_MODES,
+        default="query",
+        help="Query BigQuery per chunk, or read each table once with the Storage Read API (default: query)",
+    )
 
     args = parser.parse_args()
 
-    load_dose_data(vmp_chunk_size=args.vmp_chunk_size)
+    load_dose_data(
+        vmp_chunk_size=args.vmp_chunk_size,
+        replace=args.replace,
+        bq_prefetch=args.bq_prefetch,
+        extract_mode=args.extract_mode,
+    )
@@ -3,14 +3,16 @@ import argparse
 import pandas as pd
 from prefect import get_run_logger, task, flow
 from django.db import transaction
-from typing import Dict, List
+from typing import Dict, List, Optional
 from pipeline.setup.bq_tables import SCMD_PROCESSED_TABLE_SPEC
 from pipeline.utils.utils import (
     setup_django_environment,
     get_bigquery_client,
     get_quantity_months,
-    sparse_to_dense,
+    pivot_to_dense,
 )
+from pipeline.utils.bq_stream import EXTRACT_MODES, extract_vmp_chunks
+from pipeline.utils.upsert import QuantityUpsert, rows_touched_report
 from google.cloud import bigquery
 
 
@@ -46,6 +48,26 @@ def get_unique_vmps() -> List[str]:
     return vmp_codes
 
 
+def indicative_cost_query(vmp_codes: Optional[List[str]] = None) -> str:
+    """Extraction query ordered by VMP, limited to vmp_codes if given"""
+    vmp_filter = ""
+    if vmp_codes is not None:
+        vmp_list_str = "', '".join(vmp_codes)
+        vmp_filter = f"AND vmp_code IN ('{vmp_list_str}')"
+
+    return f"""
+    SELECT 
+        year_month, 
+        vmp_code, 
+        ods_code, 
+        indicative_cost
+    FROM `{SCMD_PROCESSED_TABLE_SPEC.full_table_id}`
+    WHERE indicative_cost IS NOT NULL
+    {vmp_filter}
+    ORDER BY vmp_code, ods_code, year_month
+    """
+
+
 @task
 def extract_indicative_cost_by_vmps(
     vmp_codes: List[str], chunk_num: int, total_chunks: int
@@ -59,19 +81,7 @@ def extract_indicative_cost_by_vmps(
 
     client = get_bigquery_client()
 
-    vmp_list_str = "', '".join(vmp_codes)
-
-    query = f"""
-    SELECT 
-        year_month, 
-        vmp_code, 
-        ods_code, 
-        indicative_cost
-    FROM `{SCMD_PROCESSED_TABLE_SPEC.full_table_id}`
-    WHERE indicative_cost IS NOT NULL
-    AND vmp_code IN ('{vmp_list_str}')
-    ORDER BY vmp_code, ods_code, year_month
-    """
+    query = indicative_cost_query(vmp_codes)
 
     df = fetch_bigquery_data(query, client)
 
@@ -106,6 +116,10 @@ def clear_existing_data() -> int:
     return total_deleted
 
 
+def indicative_cost_writer() -> QuantityUpsert:
+    return QuantityUpsert(IndicativeCost, key_fields=["vmp", "organisation"])
+
+
 @task
 def cache_foreign_keys() -> Dict:
     """Cache all VMP and Organisation foreign keys"""
@@ -121,9 +135,13 @@ def cache_foreign_keys() -> Dict:
 
 @task
 def transform_and_load_chunk(
-    chunk_df: pd.DataFrame, foreign_key_cache: Dict, chunk_num: int, total_chunks: int
+    chunk_df: pd.DataFrame,
+    foreign_key_cache: Dict,
+    chunk_num: int,
+    total_chunks: int,
+    writer: QuantityUpsert = None,
 ) -> Dict:
-    """Transform and load a chunk"""
+    """Transform and upsert a chunk"""
     logger = get_run_logger()
 
     logger.info(
@@ -132,7 +150,7 @@ def transform_and_load_chunk(
 
     if len(chunk_df) == 0:
         logger.info(f"Chunk {chunk_num}/{total_chunks}: No data to process")
-        return {"created": 0, "updated": 0, "skipped": 0}
+        return {"created": 0, "updated": 0, "unchanged": 0, "skipped": 0}
 
     logger.info(f"Chunk {chunk_num}/{total_chunks}: Filtering for valid records...")
     valid_mask = (
@@ -154,7 +172,7 @@ def transform_and_load_chunk(
         logger.info(
             f"Chunk {chunk_num}/{total_chunks}: No valid records after filtering"
         )
-        return {"created": 0, "updated": 0, "skipped": skipped_count}
+        return {"created": 0, "updated": 0, "unchanged": 0, "skipped": skipped_count}
 
     df_valid["year_month"] = pd.to_datetime(df_valid["year_month"]).dt.strftime(
         "%Y-%m-%d"
@@ -167,14 +185,9 @@ def transform_and_load_chunk(
         )
 
     logger.info(f"Chunk {chunk_num}/{total_chunks}: Grouping data...")
-    grouped_data = {}
-    for (vmp_code, ods_code), group in df_valid.groupby(["vmp_code", "ods_code"]):
-        sparse = [
-            [row.year_month, float(row.indicative_cost)]
-            for row in group.itertuples(index=False)
-        ]
-        dense = sparse_to_dense(sparse, months)
-        grouped_data[(vmp_code, ods_code)] = dense
+    grouped_data = pivot_to_dense(
+        df_valid, ["vmp_code", "ods_code"], "indicative_cost", months
+    )
 
     logger.info(
         f"Chunk {chunk_num}/{total_chunks}: Created {len(grouped_data):,} VMP-Organisation combinations"
@@ -202,42 +215,48 @@ def transform_and_load_chunk(
         f"Chunk {chunk_num}/{total_chunks}: Loading {len(ic_objects):,} objects to database..."
     )
 
-    SUB_BATCH_SIZE = 500
-    total_created = 0
-    total_updated = 0
-    total_skipped = skipped_count + skipped_due_to_missing_fk
-
-    for i in range(0, len(ic_objects), SUB_BATCH_SIZE):
-        sub_batch = ic_objects[i : i + SUB_BATCH_SIZE]
-
-        try:
-            with transaction.atomic():
-                IndicativeCost.objects.bulk_create(
-                    sub_batch,
-                    batch_size=SUB_BATCH_SIZE,
-                    unique_fields=["vmp", "organisation"],
-                )
-                total_created += len(sub_batch)
-
-        except Exception as e:
-            logger.error(
-                f"Chunk {chunk_num}/{total_chunks}: Error in sub-batch {i//SUB_BATCH_SIZE + 1}: {str(e)}"
-            )
-            total_skipped += len(sub_batch)
+    writer = writer or indicative_cost_writer()
+    counts = writer.write(
+        ic_objects,
+        on_error=lambda e, batch: logger.error(
+            f"Chunk {chunk_num}/{total_chunks}: Error in sub-batch {batch}: {str(e)}"
+        ),
+    )
+    total_skipped = skipped_count + skipped_due_to_missing_fk + counts["failed"]
 
     logger.info(
-        f"Chunk {chunk_num}/{total_chunks}: Load complete. Created: {total_created:,}, Skipped: {total_skipped:,}"
+        f"Chunk {chunk_num}/{total_chunks}: Load complete. Created: {counts['inserted']:,}, "
+        f"Updated: {counts['updated']:,}, Unchanged: {counts['unchanged']:,}, Skipped: {total_skipped:,}"
     )
 
     return {
-        "created": total_created,
-        "updated": total_updated,
+        "created": counts["inserted"],
+        "updated": counts["updated"],
+        "unchanged": counts["unchanged"],
         "skipped": total_skipped,
     }
 
 
 @flow
-def load_indicative_costs(vmp_chunk_size: int = 500):
+def load_indicative_costs(
+    vmp_chunk_size: int = 500,
+    replace: bool = False,
+    bq_prefetch: int = 2,
+    extract_mode: str = "query",
+):
+    """
+    Main flow to import indicative costs using VMP-based chunking
+
+    Rows are upserted and only new or changed arrays are written; rows that are
+    no longer in BigQuery are deleted at the end.
+
+    Args:
+        vmp_chunk_size: Number of VMPs to process in each chunk (default: 500)
+        replace: Delete all existing rows first instead of upserting (default: False)
+        bq_prefetch: Number of BigQuery chunks to fetch ahead while a chunk is loaded (default: 2)
+        extract_mode: "query" to run one BigQuery query per chunk, or "storage" to read the
+            whole table once through the Storage Read API (default: "query")
+    """
     logger = get_run_logger()
     start_time = time.time()
 
@@ -249,24 +268,30 @@ def load_indicative_costs(vmp_chunk_size: int = 500):
         f"Will process {len(all_vmps):,} VMPs in {total_chunks} chunks of {vmp_chunk_size} VMPs each"
     )
 
-    deleted_count = clear_existing_data()
+    deleted_count = clear_existing_data() if replace else 0
     foreign_key_cache = cache_foreign_keys()
+    writer = indicative_cost_writer()
 
     total_stats = {
         "total_created": 0,
         "total_updated": 0,
+        "total_unchanged": 0,
         "total_skipped": 0,
         "total_processed_chunks": 0,
     }
 
-    for chunk_num in range(1, total_chunks + 1):
+    for chunk_num, total_chunks, chunk_vmps, chunk_df in extract_vmp_chunks(
+        all_vmps,
+        vmp_chunk_size,
+        extract_indicative_cost_by_vmps,
+        indicative_cost_query(),
+        extract_mode=extract_mode,
+        prefetch=bq_prefetch,
+    ):
         chunk_start_time = time.time()
 
         start_idx = (chunk_num - 1) * vmp_chunk_size
-        end_idx = min(start_idx + vmp_chunk_size, len(all_vmps))
-        chunk_vmps = all_vmps[start_idx:end_idx]
-
-        chunk_df = extract_indicative_cost_by_vmps(chunk_vmps, chunk_num, total_chunks)
+        end_idx = start_idx + len(chunk_vmps)
 
         if len(chunk_df) == 0:
             logger.info(
@@ -275,11 +300,12 @@ def load_indicative_costs(vmp_chunk_size: int = 500):
             continue
 
         chunk_result = transform_and_load_chunk(
-            chunk_df, foreign_key_cache, chunk_num, total_chunks
+            chunk_df, foreign_key_cache, chunk_num, total_chunks, writer
         )
 
         total_stats["total_created"] += chunk_result["created"]
         total_stats["total_updated"] += chunk_result["updated"]
+        total_stats["total_unchanged"] += chunk_result["unchanged"]
         total_stats["total_skipped"] += chunk_result["skipped"]
         total_stats["total_processed_chunks"] += 1
 
@@ -289,16 +315,24 @@ def load_indicative_costs(vmp_chunk_size: int = 500):
         logger.info(
             f"Chunk {chunk_num}/{total_chunks} complete in {chunk_duration:.1f}s ({progress_pct:.1f}% done). "
             f"Processed VMPs {start_idx+1}-{end_idx}. "
-            f"Running totals - Created: {total_stats['total_created']:,}, Skipped: {total_stats['total_skipped']:,}. "
+            f"Running totals - Created: {total_stats['total_created']:,}, "
+            f"Updated: {total_stats['total_updated']:,}, Unchanged: {total_stats['total_unchanged']:,}, "
+            f"Skipped: {total_stats['total_skipped']:,}. "
         )
 
+    if not replace:
+        deleted_count = writer.delete_orphans()
+
     total_time = time.time() - start_time
 
+    logger.info(writer.summary())
     logger.info(
         f"Indicative cost data import completed in {total_time/60:.1f} minutes. "
         f"Deleted: {deleted_count:,}, Created: {total_stats['total_created']:,}, "
+        f"Updated: {total_stats['total_updated']:,}, Unchanged: {total_stats['total_unchanged']:,}, "
         f"Skipped: {total_stats['total_skipped']:,}, Chunks processed: {total_stats['total_processed_chunks']}. "
     )
+    return rows_touched_report([writer])
 
 
 
@@ -312,7 +346,29 @@ if __name__ == "__main__":
         default=500,
         help="Number of VMPs per chunk (default: 500)",
     )
+    parser.add_argument(
+        "--replace",
+        action="store_true",
+        help="Delete all existing rows before loading instead of upserting",
+    )
+    parser.add_argument(
+        "--bq-prefetch",
+        type=int,
+        default=2,
+        help="Number of BigQuery chunks to fetch ahead while a chunk is loaded (default: 2)",
+    )
+    parser.add_argument(
+        "--extract-mode",
+        choices=EXTRACT_MODES,
+        default="query",
+        help="Query BigQuery per chunk, or read each table once with the Storage Read API (default: query)",
+    )
 
     args = parser.parse_args()
 
-    load_indicative_costs(vmp_chunk_size=args.vmp_chunk_size)
+    load_indicative_costs(
+        vmp_chunk_size=args.vmp_chunk_size,
+        replace=args.replace,
+        bq_prefetch=args.bq_prefetch,
+        extract_mode=args.extract_mode,
+    )
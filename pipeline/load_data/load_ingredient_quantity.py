@@ -5,15 +5,17 @@ import argparse
 from google.cloud import bigquery
 from prefect import get_run_logger, task, flow
 from django.db import transaction
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 from pipeline.setup.bq_tables import INGREDIENT_QUANTITY_TABLE_SPEC, INGREDIENT_CALCULATION_LOGIC_TABLE_SPEC
 from pipeline.utils.utils import (
     setup_django_environment,
     get_bigquery_client,
     execute_bigquery_query,
     get_quantity_months,
-    sparse_to_dense,
+    pivot_to_dense,
 )
+from pipeline.utils.bq_stream import EXTRACT_MODES, extract_vmp_chunks
+from pipeline.utils.upsert import QuantityUpsert, rows_touched_report
 
 
 setup_django_environment()
@@ -104,6 +106,30 @@ def fetch_bigquery_data(query: str, client) -> pd.DataFrame:
     return df.copy()
 
 
+def ingredient_data_query(vmp_codes: Optional[List[str]] = None) -> str:
+    """Extraction query ordered by VMP, limited to vmp_codes if given"""
+    vmp_filter = ""
+    if vmp_codes is not None:
+        vmp_list_str = "', '".join(vmp_codes)
+        vmp_filter = f"AND vmp_code IN ('{vmp_list_str}')"
+
+    return f"""
+    SELECT 
+        vmp_code,
+        year_month,
+        ods_code,
+        ingredients
+    FROM `{INGREDIENT_QUANTITY_TABLE_SPEC.full_table_id}`
+    WHERE EXISTS (
+      SELECT 1 
+      FROM UNNEST(ingredients) as ing 
+      WHERE ing.ingredient_quantity IS NOT NULL
+    )
+    {vmp_filter}
+    ORDER BY vmp_code, ods_code, year_month
+    """
+
+
 @task
 def extract_ingredient_data_by_vmps(
     vmp_codes: List[str], chunk_num: int, total_chunks: int
@@ -121,23 +147,7 @@ def extract_ingredient_data_by_vmps(
 
     client = get_bigquery_client()
 
-    vmp_list_str = "', '".join(vmp_codes)
-
-    query = f"""
-    SELECT 
-        vmp_code,
-        year_month,
-        ods_code,
-        ingredients
-    FROM `{INGREDIENT_QUANTITY_TABLE_SPEC.full_table_id}`
-    WHERE EXISTS (
-      SELECT 1 
-      FROM UNNEST(ingredients) as ing 
-      WHERE ing.ingredient_quantity IS NOT NULL
-    )
-    AND vmp_code IN ('{vmp_list_str}')
-    ORDER BY vmp_code, ods_code, year_month
-    """
+    query = ingredient_data_query(vmp_codes)
 
     df = fetch_bigquery_data(query, client)
 
@@ -199,6 +209,40 @@ def clear_existing_ingredient_data() -> Tuple[int, int]:
     return total_deleted, total_logic_deleted
 
 
+@task
+def clear_ingredient_calculation_logic() -> int:
+    """Clear ingredient calculation logic, which is reloaded in full on every run"""
+    logger = get_run_logger()
+    deleted_count = CalculationLogic.objects.filter(logic_type='ingredient').delete()[0]
+    logger.info(f"Deleted {deleted_count:,} existing ingredient calculation logic records")
+    return deleted_count
+
+
+@task
+def delete_unused_ingredient_quantity_units() -> int:
+    """Delete units no longer referenced by any ingredient quantity row"""
+    return IngredientQuantityUnit.objects.filter(ingredient_quantities__isnull=True).delete()[0]
+
+
+def ingredient_quantity_writer() -> QuantityUpsert:
+    return QuantityUpsert(
+        IngredientQuantity,
+        key_fields=["ingredient", "vmp", "organisation"],
+        value_fields=["quantity_unit", "data"],
+    )
+
+
+def get_ingredient_quantity_unit(ingredient_id: int, vmp_id: int, unit: str) -> IngredientQuantityUnit:
+    """Get or create the unit for an ingredient-VMP, updating it if the unit has changed"""
+    quantity_unit, created = IngredientQuantityUnit.objects.get_or_create(
+        ingredient_id=ingredient_id, vmp_id=vmp_id, defaults={"unit": unit}
+    )
+    if not created and quantity_unit.unit != unit:
+        quantity_unit.unit = unit
+        quantity_unit.save(update_fields=["unit"])
+    return quantity_unit
+
+
 @task
 def cache_foreign_keys() -> Dict:
     """Cache all Ingredient, VMP and Organisation foreign keys"""
@@ -280,14 +324,37 @@ def load_ingredient_logic_for_combinations(
     return {"logic_created": logic_created, "logic_missing": logic_missing}
 
 
+def explode_ingredients(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    One row per usable ingredient struct, with ingredient_code,
+    ingredient_quantity_basis and ingredient_basis_unit alongside the
+    vmp_code, ods_code and year_month of its source row
+    """
+    exploded = df[["vmp_code", "ods_code", "year_month", "ingredients"]].explode("ingredients")
+    exploded = exploded[exploded["ingredients"].map(lambda i: isinstance(i, dict))]
+    structs = pd.DataFrame(
+        exploded["ingredients"].tolist(),
+        index=exploded.index,
+        columns=["ingredient_code", "ingredient_quantity_basis", "ingredient_basis_unit"],
+    )
+    rows = pd.concat([exploded.drop(columns="ingredients"), structs], axis=1)
+    usable = (
+        rows["ingredient_code"].fillna("").astype(bool)
+        & rows["ingredient_quantity_basis"].notna()
+        & rows["ingredient_basis_unit"].fillna("").astype(bool)
+    )
+    return rows[usable].reset_index(drop=True)
+
+
 @task
 def transform_and_load_ingredient_quantity_chunk(
     chunk_df: pd.DataFrame, 
     foreign_key_cache: Dict, 
     chunk_num: int, 
-    total_chunks: int
+    total_chunks: int,
+    writer: QuantityUpsert = None,
 ) -> Dict:
-    """Transform and load a chunk of ingredient quantity data"""
+    """Transform and upsert a chunk of ingredient quantity data"""
     logger = get_run_logger()
 
     logger.info(
@@ -296,7 +363,7 @@ def transform_and_load_ingredient_quantity_chunk(
 
     if len(chunk_df) == 0:
         logger.info(f"Chunk {chunk_num}/{total_chunks}: No ingredient quantity data to process")
-        return {"created": 0, "skipped": 0}
+        return {"created": 0, "updated": 0, "unchanged": 0, "skipped": 0}
 
     logger.info(f"Chunk {chunk_num}/{total_chunks}: Filtering for valid records...")
     valid_mask = (
@@ -318,7 +385,7 @@ def transform_and_load_ingredient_quantity_chunk(
         logger.info(
             f"Chunk {chunk_num}/{total_chunks}: No valid ingredient quantity records after filtering"
         )
-        return {"created": 0, "skipped": skipped_count}
+        return {"created": 0, "updated": 0, "unchanged": 0, "skipped": skipped_count}
 
     df_valid["year_month"] = pd.to_datetime(df_valid["year_month"].astype(str)).dt.strftime(
         "%Y-%m-%d"
@@ -330,51 +397,21 @@ def transform_and_load_ingredient_quantity_chunk(
             f"Chunk {chunk_num}/{total_chunks}: DataStatus has no months - cannot build dense arrays"
         )
 
-    df_valid = df_valid.copy()
-    df_valid['ingredients'] = df_valid['ingredients'].apply(
-        lambda x: x.tolist() if hasattr(x, 'tolist') else (x if isinstance(x, list) else [])
-    )
-
-    ingredient_sparse_data = {}
-    units_by_ingredient_vmp = {}
-
     logger.info(f"Chunk {chunk_num}/{total_chunks}: Processing ingredient data...")
 
-    for row in df_valid.itertuples(index=False):
-        try:
-            vmp_code = row.vmp_code
-            ods_code = row.ods_code
-            year_month = row.year_month
-            ingredients = row.ingredients
-
-            for ingredient in ingredients:
-                ingredient_code = ingredient.get("ingredient_code")
-                ingredient_quantity_basis = ingredient.get("ingredient_quantity_basis")
-                ingredient_basis_unit = ingredient.get("ingredient_basis_unit")
-
-                if (
-                    not ingredient_code
-                    or ingredient_quantity_basis is None
-                    or not ingredient_basis_unit
-                ):
-                    continue
-
-                key = (ingredient_code, vmp_code, ods_code)
-                unit_key = (ingredient_code, vmp_code)
-                if unit_key not in units_by_ingredient_vmp:
-                    units_by_ingredient_vmp[unit_key] = ingredient_basis_unit
-
-                if key not in ingredient_sparse_data:
-                    ingredient_sparse_data[key] = []
-                ingredient_sparse_data[key].append([year_month, float(ingredient_quantity_basis)])
-        except Exception as e:
-            logger.error(f"Error processing row: {str(e)}")
-            continue
-
-    ingredient_data = {
-        key: sparse_to_dense(sparse_values, months, accumulate=True)
-        for key, sparse_values in ingredient_sparse_data.items()
-    }
+    ingredient_rows = explode_ingredients(df_valid)
+    ingredient_data = pivot_to_dense(
+        ingredient_rows,
+        ["ingredient_code", "vmp_code", "ods_code"],
+        "ingredient_quantity_basis",
+        months,
+        accumulate=True,
+    )
+    units_by_ingredient_vmp = (
+        ingredient_rows.groupby(["ingredient_code", "vmp_code"], sort=False)["ingredient_basis_unit"]
+        .first()
+        .to_dict()
+    )
 
     logger.info(
         f"Chunk {chunk_num}/{total_chunks}: Created {len(ingredient_data):,} ingredient-VMP-organisation combinations"
@@ -399,8 +436,8 @@ def transform_and_load_ingredient_quantity_chunk(
             unit = units_by_ingredient_vmp[(ingredient_code, vmp_code)]
             cache_key = (ingredient_id, vmp_id)
             if cache_key not in iq_unit_cache:
-                iq_unit_cache[cache_key], _ = IngredientQuantityUnit.objects.get_or_create(
-                    ingredient_id=ingredient_id, vmp_id=vmp_id, defaults={"unit": unit}
+                iq_unit_cache[cache_key] = get_ingredient_quantity_unit(
+                    ingredient_id, vmp_id, unit
                 )
             iq_objects.append(
                 IngredientQuantity(
@@ -418,41 +455,44 @@ def transform_and_load_ingredient_quantity_chunk(
         f"Chunk {chunk_num}/{total_chunks}: Loading {len(iq_objects):,} objects to database..."
     )
 
-    SUB_BATCH_SIZE = 500
-    total_created = 0
-    total_skipped = skipped_count + skipped_due_to_missing_fk
-
-    for i in range(0, len(iq_objects), SUB_BATCH_SIZE):
-        sub_batch = iq_objects[i : i + SUB_BATCH_SIZE]
-        
-        try:
-            with transaction.atomic():
-                IngredientQuantity.objects.bulk_create(
-                    sub_batch,
-                    batch_size=SUB_BATCH_SIZE,
-                    unique_fields=["ingredient", "vmp", "organisation"],
-                )
-                total_created += len(sub_batch)
-        except Exception as e:
-            logger.error(
-                f"Chunk {chunk_num}/{total_chunks}: Error in sub-batch {i//SUB_BATCH_SIZE + 1}: {str(e)}"
-            )
-            total_skipped += len(sub_batch)
+    writer = writer or ingredient_quantity_writer()
+    counts = writer.write(
+        iq_objects,
+        on_error=lambda e, batch: logger.error(
+            f"Chunk {chunk_num}/{total_chunks}: Error in sub-batch {batch}: {str(e)}"
+        ),
+    )
+    total_skipped = skipped_count + skipped_due_to_missing_fk + counts["failed"]
 
     return {
-        "created": total_created,
+        "created": counts["inserted"],
+        "updated": counts["updated"],
+        "unchanged": counts["unchanged"],
         "skipped": total_skipped,
     }
 
 
 @flow
-def load_ingredient_quantity(combination_chunk_size: int = 1000, vmp_chunk_size: int = 500):
+def load_ingredient_quantity(
+    combination_chunk_size: int = 1000,
+    vmp_chunk_size: int = 500,
+    replace: bool = False,
+    bq_prefetch: int = 2,
+    extract_mode: str = "query",
+):
     """
     Main flow to import ingredient quantity data from BigQuery
 
+    Rows are upserted and only new or changed arrays are written; rows that are
+    no longer in BigQuery are deleted at the end.
+
     Args:
         combination_chunk_size: Number of VMP-ingredient combinations to process in each logic chunk (default: 1000)
         vmp_chunk_size: Number of VMPs to process in each quantity chunk (default: 500)
+        replace: Delete all existing rows first instead of upserting (default: False)
+        bq_prefetch: Number of BigQuery chunks to fetch ahead while a chunk is loaded (default: 2)
+        extract_mode: "query" to run one BigQuery query per chunk, or "storage" to read the
+            whole table once through the Storage Read API (default: "query")
     """
     logger = get_run_logger()
     start_time = time.time()
@@ -469,11 +509,17 @@ def load_ingredient_quantity(combination_chunk_size: int = 1000, vmp_chunk_size:
         f"Found {len(all_logic_combinations):,} VMP-ingredient combinations with logic and {len(quantity_vmps):,} VMPs with ingredient quantity data"
     )
 
-    deleted_count, logic_deleted_count = clear_existing_ingredient_data()
+    if replace:
+        deleted_count, logic_deleted_count = clear_existing_ingredient_data()
+    else:
+        deleted_count, logic_deleted_count = 0, clear_ingredient_calculation_logic()
     foreign_key_cache = cache_foreign_keys()
+    writer = ingredient_quantity_writer()
 
     total_stats = {
         "total_created": 0,
+        "total_updated": 0,
+        "total_unchanged": 0,
         "total_skipped": 0,
         "total_logic_created": 0,
         "total_logic_missing": 0,
@@ -514,14 +560,18 @@ def load_ingredient_quantity(combination_chunk_size: int = 1000, vmp_chunk_size:
         f"Will process ingredient quantity data for {len(quantity_vmps):,} VMPs in {quantity_total_chunks} chunks of {vmp_chunk_size} VMPs each"
     )
 
-    for chunk_num in range(1, quantity_total_chunks + 1):
+    for chunk_num, _, chunk_vmps, chunk_df in extract_vmp_chunks(
+        quantity_vmps,
+        vmp_chunk_size,
+        extract_ingredient_data_by_vmps,
+        ingredient_data_query(),
+        extract_mode=extract_mode,
+        prefetch=bq_prefetch,
+    ):
         chunk_start_time = time.time()
 
         start_idx = (chunk_num - 1) * vmp_chunk_size
-        end_idx = min(start_idx + vmp_chunk_size, len(quantity_vmps))
-        chunk_vmps = quantity_vmps[start_idx:end_idx]
-
-        chunk_df = extract_ingredient_data_by_vmps(chunk_vmps, chunk_num, quantity_total_chunks)
+        end_idx = start_idx + len(chunk_vmps)
 
         if len(chunk_df) == 0:
             logger.info(
@@ -530,10 +580,12 @@ def load_ingredient_quantity(combination_chunk_size: int = 1000, vmp_chunk_size:
             continue
 
         chunk_result = transform_and_load_ingredient_quantity_chunk(
-            chunk_df, foreign_key_cache, chunk_num, quantity_total_chunks
+            chunk_df, foreign_key_cache, chunk_num, quantity_total_chunks, writer
         )
 
         total_stats["total_created"] += chunk_result["created"]
+        total_stats["total_updated"] += chunk_result["updated"]
+        total_stats["total_unchanged"] += chunk_result["unchanged"]
         total_stats["total_skipped"] += chunk_result["skipped"]
         total_stats["total_processed_chunks"] += 1
 
@@ -544,18 +596,28 @@ def load_ingredient_quantity(combination_chunk_size: int = 1000, vmp_chunk_size:
             f"Quantity chunk {chunk_num}/{quantity_total_chunks} complete in {chunk_duration:.1f}s ({progress_pct:.1f}% done). "
             f"Processed VMPs {start_idx+1}-{end_idx}. "
             f"Running totals - Quantity created: {total_stats['total_created']:,}, "
+            f"Quantity updated: {total_stats['total_updated']:,}, "
+            f"Quantity unchanged: {total_stats['total_unchanged']:,}, "
             f"Quantity skipped: {total_stats['total_skipped']:,}. "
         )
 
+    if not replace:
+        deleted_count = writer.delete_orphans()
+        units_deleted = delete_unused_ingredient_quantity_units()
+        logger.info(f"Deleted {units_deleted:,} unused ingredient quantity units")
+
     total_time = time.time() - start_time
 
+    logger.info(writer.summary())
     logger.info(
         f"Ingredient quantity data import completed in {total_time/60:.1f} minutes. "
         f"Deleted: {deleted_count:,}, Created: {total_stats['total_created']:,}, "
+        f"Updated: {total_stats['total_updated']:,}, Unchanged: {total_stats['total_unchanged']:,}, "
         f"Logic deleted: {logic_deleted_count:,}, Logic created: {total_stats['total_logic_created']:,}, "
         f"Logic missing: {total_stats['total_logic_missing']:,}, "
         f"Skipped: {total_stats['total_skipped']:,}, Chunks processed: {total_stats['total_processed_chunks']}. "
     )
+    return rows_touched_report([writer])
 
 
 
@@ -576,10 +638,30 @@ if __name__ == "__main__":
         default=500,
         help="Number of VMPs per quantity chunk (default: 500)",
     )
+    parser.add_argument(
+        "--replace",
+        action="store_true",
+        help="Delete all existing rows before loading instead of upserting",
+    )
+    parser.add_argument(
+        "--bq-prefetch",
+        type=int,
+        default=2,
+        help="Number of BigQuery chunks to fetch ahead while a chunk is loaded (default: 2)",
+    )
+    parser.add_argument(
+        "--extract-mode",
+        choices=EXTRACT_MODES,
+        default="query",
+        help="Query BigQuery per chunk, or read each table once with the Storage Read API (default: query)",
+    )
 
     args = parser.parse_args()
 
     load_ingredient_quantity(
         combination_chunk_size=args.combination_chunk_size,
-        vmp_chunk_size=args.vmp_chunk_size
+        vmp_chunk_size=args.vmp_chunk_size,
+        replace=args.replace,
+        bq_prefetch=args.bq_prefetch,
+        extract_mode=args.extract_mode,
     )
@@ -19,12 +19,6 @@ from viewer.models import (
     TrustType,
     Region,
     ICB,
-    SCMDQuantity, 
-    Dose, 
-    IngredientQuantity, 
-    DDDQuantity, 
-    IndicativeCost, 
-    PrecomputedMeasure, 
     OrgSubmissionCache
 )
 
@@ -164,59 +158,17 @@ def create_trust_types(data: List[Dict]) -> Dict:
 
 @task
 def load_organisation_data(data: List[Dict], trust_type_lookup: Dict) -> Dict:
+    """
+    Upsert regions, ICBs, cancer alliances and organisations by code.
+
+    Existing organisations keep their ids, so quantity and measure rows that
+    reference them are left in place; organisations (and regions, ICBs and
+    cancer alliances) that are no longer in the data are deleted.
+    """
     logger = get_run_logger()
     logger.info(f"Loading {len(data)} organisation records")
 
     with transaction.atomic():
-        logger.info("Deleting SCMDQuantity records...")
-        scmd_deleted_total = 0
-        while SCMDQuantity.objects.exists():
-            ids = SCMDQuantity.objects.values_list('id', flat=True)[:10000]
-            batch_count = SCMDQuantity.objects.filter(id__in=ids).delete()[0]
-            scmd_deleted_total += batch_count
-            logger.info(f"Deleted {batch_count} SCMDQuantity records (total: {scmd_deleted_total})")
-        logger.info(f"Finished deleting SCMDQuantity records. Total deleted: {scmd_deleted_total}")
-        
-        logger.info("Deleting Dose records...")
-        dose_deleted_total = 0
-        while Dose.objects.exists():
-            ids = Dose.objects.values_list('id', flat=True)[:10000]
-            batch_count = Dose.objects.filter(id__in=ids).delete()[0]
-            dose_deleted_total += batch_count
-        logger.info(f"Finished deleting Dose records. Total deleted: {dose_deleted_total}")
-        
-        logger.info("Deleting IngredientQuantity records...")
-        ingredient_deleted_total = 0
-        while IngredientQuantity.objects.exists():
-            ids = IngredientQuantity.objects.values_list('id', flat=True)[:10000]
-            batch_count = IngredientQuantity.objects.filter(id__in=ids).delete()[0]
-            ingredient_deleted_total += batch_count
-        logger.info(f"Finished deleting IngredientQuantity records. Total deleted: {ingredient_deleted_total}")
-
-        logger.info("Deleting DDDQuantity records...")
-        ddd_deleted_total = 0
-        while DDDQuantity.objects.exists():
-            ids = DDDQuantity.objects.values_list('id', flat=True)[:10000]
-            batch_count = DDDQuantity.objects.filter(id__in=ids).delete()[0]
-            ddd_deleted_total += batch_count
-        logger.info(f"Finished deleting DDDQuantity records. Total deleted: {ddd_deleted_total}")
-        
-        logger.info("Deleting IndicativeCost records...")
-        cost_deleted_total = 0
-        while IndicativeCost.objects.exists():
-            ids = IndicativeCost.objects.values_list('id', flat=True)[:10000]
-            batch_count = IndicativeCost.objects.filter(id__in=ids).delete()[0]
-            cost_deleted_total += batch_count
-        logger.info(f"Finished deleting IndicativeCost records. Total deleted: {cost_deleted_total}")
-        
-        logger.info("Deleting PrecomputedMeasure records...")
-        measure_deleted_total = 0
-        while PrecomputedMeasure.objects.exists():
-            ids = PrecomputedMeasure.objects.values_list('id', flat=True)[:10000]
-            batch_count = PrecomputedMeasure.objects.filter(id__in=ids).delete()[0]
-            measure_deleted_total += batch_count
-        logger.info(f"Finished deleting PrecomputedMeasure records. Total deleted: {measure_deleted_total}")
-        
         logger.info("Deleting OrgSubmissionCache records...")
         cache_deleted_total = 0
         while OrgSubmissionCache.objects.exists():
@@ -225,29 +177,8 @@ def load_organisation_data(data: List[Dict], trust_type_lookup: Dict) -> Dict:
             cache_deleted_total += batch_count
         logger.info(f"Finished deleting OrgSubmissionCache records. Total deleted: {cache_deleted_total}")
 
-        logger.info("Deleting Organisation records...")
-        deleted_count = Organisation.objects.all().delete()[0]
-        logger.info(f"Deleted {deleted_count} Organisation records")
-
-        logger.info("Deleting ICB records...")
-        icb_deleted_count = ICB.objects.all().delete()[0]
-        logger.info(f"Deleted {icb_deleted_count} ICB records")
-
-        logger.info("Deleting Region records...")
-        region_deleted_count = Region.objects.all().delete()[0]
-        logger.info(f"Deleted {region_deleted_count} Region records")
-
-        logger.info("Deleting CancerAlliance records...")
-        cancer_alliance_deleted_count = CancerAlliance.objects.all().delete()[0]
-        logger.info(f"Deleted {cancer_alliance_deleted_count} CancerAlliance records")
-
-        total_related_deleted = (scmd_deleted_total + dose_deleted_total + ingredient_deleted_total + 
-                               ddd_deleted_total + cost_deleted_total + measure_deleted_total + cache_deleted_total)
-        logger.info(f"Deletion summary - Related records: {total_related_deleted}, Organisations: {deleted_count}, ICBs: {icb_deleted_count}, Regions: {region_deleted_count}")
-        logger.info("Deletion phase complete")
-     
     with transaction.atomic():
-        logger.info("Starting creation phase...")
+        logger.info("Starting upsert phase...")
 
         unique_regions = {}
         for row in data:
@@ -256,12 +187,14 @@ def load_organisation_data(data: List[Dict], trust_type_lookup: Dict) -> Dict:
             if region_code and region_name and region_code not in unique_regions:
                 unique_regions[region_code] = region_name
 
-        region_objects = [
-            Region(code=code, name=name) 
-            for code, name in unique_regions.items()
-        ]
-        created_regions = Region.objects.bulk_create(region_objects, batch_size=1000)
-        logger.info(f"Created {len(created_regions)} region records")
+        Region.objects.bulk_create(
+            [Region(code=code, name=name) for code, name in unique_regions.items()],
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["code"],
+            update_fields=["name"],
+        )
+        logger.info(f"Upserted {len(unique_regions)} region records")
 
         unique_icbs = {}
         for row in data:
@@ -275,7 +208,7 @@ def load_organisation_data(data: List[Dict], trust_type_lookup: Dict) -> Dict:
                 }
 
         region_lookup = {region.code: region for region in Region.objects.all()}
-        
+
         icb_objects = []
         for icb_code, icb_data in unique_icbs.items():
             region = region_lookup.get(icb_data['region_code'])
@@ -286,8 +219,14 @@ def load_organisation_data(data: List[Dict], trust_type_lookup: Dict) -> Dict:
                     region=region
                 ))
 
-        created_icbs = ICB.objects.bulk_create(icb_objects, batch_size=1000)
-        logger.info(f"Created {len(created_icbs)} ICB records")
+        ICB.objects.bulk_create(
+            icb_objects,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["code"],
+            update_fields=["name", "region"],
+        )
+        logger.info(f"Upserted {len(icb_objects)} ICB records")
 
         unique_cancer_alliances = {}
         for row in data:
@@ -296,15 +235,18 @@ def load_organisation_data(data: List[Dict], trust_type_lookup: Dict) -> Dict:
             if ca_code and ca_name and ca_code not in unique_cancer_alliances:
                 unique_cancer_alliances[ca_code] = ca_name
 
-        cancer_alliance_objects = [
-            CancerAlliance(code=code, name=name)
-            for code, name in unique_cancer_alliances.items()
-        ]
-        CancerAlliance.objects.bulk_create(cancer_alliance_objects, batch_size=1000)
-        logger.info(f"Created {len(cancer_alliance_objects)} CancerAlliance records")
+        CancerAlliance.objects.bulk_create(
+            [CancerAlliance(code=code, name=name) for code, name in unique_cancer_alliances.items()],
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["code"],
+            update_fields=["name"],
+        )
+        logger.info(f"Upserted {len(unique_cancer_alliances)} CancerAlliance records")
 
         cancer_alliance_lookup = {ca.code: ca for ca in CancerAlliance.objects.all()}
         icb_lookup = {icb.code: icb for icb in ICB.objects.all()}
+        existing_codes = set(Organisation.objects.values_list('ods_code', flat=True))
 
         organisation_objects = []
         for row in data:
@@ -323,45 +265,75 @@ def load_organisation_data(data: List[Dict], trust_type_lookup: Dict) -> Dict:
                     in_shelford_group=row.get("in_shelford_group", False),
                 ))
 
-        created_objects = Organisation.objects.bulk_create(
-            organisation_objects, batch_size=1000
+        Organisation.objects.bulk_create(
+            organisation_objects,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["ods_code"],
+            update_fields=[
+                "ods_name", "region", "icb", "trust_type", "cancer_alliance", "in_shelford_group",
+            ],
         )
 
-        total_created = len(created_objects)
-        logger.info(f"Created {total_created} organisation records")
-    
+        loaded_codes = {org.ods_code for org in organisation_objects}
+        total_created = len(loaded_codes - existing_codes)
+        total_updated = len(loaded_codes & existing_codes)
+        logger.info(f"Created {total_created} and updated {total_updated} organisation records")
+
+        # Deleting an organisation cascades to its quantity, measure and admission rows
+        deleted_count = Organisation.objects.exclude(ods_code__in=loaded_codes).delete()[1].get(
+            Organisation._meta.label, 0
+        )
+        icb_deleted_count = ICB.objects.exclude(code__in=unique_icbs).delete()[0]
+        region_deleted_count = Region.objects.exclude(code__in=unique_regions).delete()[0]
+        cancer_alliance_deleted_count = CancerAlliance.objects.exclude(
+            code__in=unique_cancer_alliances
+        ).delete()[0]
+        logger.info(
+            f"Deleted {deleted_count} organisations, {icb_deleted_count} ICBs, "
+            f"{region_deleted_count} regions and {cancer_alliance_deleted_count} cancer alliances "
+            f"no longer in the data"
+        )
 
     with transaction.atomic():
         logger.info("Starting successor updates...")
         successor_updates = 0
 
         org_lookup = {org.ods_code: org for org in Organisation.objects.all()}
+        successor_codes = {
+            row["ods_code"]: row.get("successor_code")
+            for row in data
+            if row["ods_code"] in org_lookup
+        }
 
         orgs_to_update = []
-        for row in data:
-            if row.get("successor_code") and row["successor_code"] in org_lookup:
-                org = org_lookup[row["ods_code"]]
-                successor = org_lookup[row["successor_code"]]
+        for ods_code, org in org_lookup.items():
+            successor = org_lookup.get(successor_codes.get(ods_code))
+            if successor is not None:
+                successor_updates += 1
+            if org.successor_id != (successor.id if successor else None):
                 org.successor = successor
                 orgs_to_update.append(org)
-                successor_updates += 1
 
         if orgs_to_update:
             Organisation.objects.bulk_update(
                 orgs_to_update, ["successor"], batch_size=1000
             )
-            logger.info(f"Updated {successor_updates} successor relationships")
+        logger.info(
+            f"{successor_updates} successor relationships, {len(orgs_to_update)} changed"
+        )
         logger.info("Successor updates complete")
 
     logger.info(
-        f"Organisation data load complete. Related deleted: {total_related_deleted}, "
+        f"Organisation data load complete. Related deleted: {cache_deleted_total}, "
         f"Organisations deleted: {deleted_count}, Created: {total_created}, "
-        f"Updated successors: {successor_updates}"
+        f"Updated: {total_updated}, Successors: {successor_updates}"
     )
     return {
-        "related_records_deleted": total_related_deleted,
+        "related_records_deleted": cache_deleted_total,
         "deleted": deleted_count,
         "created": total_created,
+        "updated": total_updated,
         "updated_successors": successor_updates,
         "total_records": len(data),
     }
@@ -381,7 +353,7 @@ def load_organisations():
     logger.info(
         f"Organisation import complete. Related deleted: {result['related_records_deleted']}, "
         f"Organisations deleted: {result['deleted']}, Created: {result['created']}, "
-        f"Updated successors: {result['updated_successors']}"
+        f"Updated: {result['updated']}, Successors: {result['updated_successors']}"
     )
 
 
@@ -0,0 +1,25 @@
+import logging
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("prefect.client").setLevel(logging.WARNING)
+
+from prefect import flow, get_run_logger
+from pipeline.utils.utils import setup_django_environment
+
+setup_django_environment()
+from viewer.quantity_summary import update_vmp_quantity_summary
+
+
+@flow(name="Load VMP Quantity Summary")
+def load_vmp_quantity_summary():
+    """Rebuild the per-VMP quantity availability summary once the quantity tables are loaded"""
+    logger = get_run_logger()
+    logger.info("Updating VMP quantity summary")
+
+    rows = update_vmp_quantity_summary()
+
+    logger.info(f"Wrote {rows} VMP quantity summary rows")
+    return {"rows": rows}
+
+
+if __name__ == "__main__":
+    load_vmp_quantity_summary()
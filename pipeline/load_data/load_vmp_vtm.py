@@ -10,6 +10,7 @@ from pipeline.setup.bq_tables import (
     WHO_ROUTES_OF_ADMINISTRATION_TABLE_SPEC,
     ADM_ROUTE_MAPPING_TABLE_SPEC,
 )
+from pipeline.load_data.load_atc import load_atc_closure
 
 setup_django_environment()
 from viewer.models import VMP, VTM, Ingredient, WHORoute, ATC, OntFormRoute, VMPIngredientStrength, AMP
@@ -575,6 +576,7 @@ def vacuum_tables() -> None:
         "viewer_vmp_who_routes",
         "viewer_vmp_atcs",
         "viewer_vmp_amps",
+        "viewer_vmpatcancestor",
     ]
 
     cascaded_tables = [
@@ -583,7 +585,7 @@ def vacuum_tables() -> None:
         "viewer_ingredientquantity",
         "viewer_dddquantity",
         "viewer_indicativecost",
-        "viewer_precomputedmeasure",
+        "viewer_precomputedmeasureseries",
     ]
 
     all_affected_tables = vmp_vtm_tables + m2m_tables + cascaded_tables
@@ -618,6 +620,8 @@ def load_vmp_vtm_data():
         vmp_data, vtm_mapping, ingredient_mapping, atc_mapping, ont_form_route_mapping, amp_mapping
     )
     
+    load_atc_closure()
+    
     load_vmp_ingredient_strengths(vmp_data, ingredient_mapping)
 
     vacuum_tables()
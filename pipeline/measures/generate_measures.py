@@ -1,4 +1,5 @@
 import logging
+import os
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("prefect.client").setLevel(logging.WARNING)
 
@@ -11,6 +12,8 @@ from viewer.management.commands.get_measure_vmps import Command as GetMeasureVMP
 from viewer.management.commands.compute_measures import Command as ComputeMeasuresCommand
 from viewer.models import Measure
 
+MEASURE_COMPUTE_WORKERS = min(4, os.cpu_count() or 1)
+
 @flow(name="Generate Measures")
 def generate_measures():
     logger = get_run_logger()
@@ -38,9 +41,7 @@ def generate_measures():
 
         logger.info("Computing measures")
         compute_measures = ComputeMeasuresCommand()
-        for measure in Measure.objects.all():
-            logger.info(f"Computing measure: {measure.slug}")
-            compute_measures.handle(measure=measure.slug)
+        compute_measures.handle(all=True, workers=MEASURE_COMPUTE_WORKERS, incremental=True)
         logger.info("Successfully computed measures")
 
     except Exception as e:
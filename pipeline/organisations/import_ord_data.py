@@ -1,31 +1,35 @@
 import requests
 import pandas as pd
-import time
 from google.cloud import bigquery
-from typing import Dict, List, Any
+from pathlib import Path
+from typing import Dict, List, Any, Optional
 from prefect import task, flow, get_run_logger
 
 from pipeline.setup.config import PROJECT_ID, DATASET_ID, ORGANISATION_TABLE_ID
 from pipeline.utils.utils import get_bigquery_client
 from pipeline.setup.bq_tables import ORGANISATION_TABLE_SPEC
+from pipeline.organisations.ord_client import ORDClient, ORD_BASE_URL, ORD_CACHE_DIR
 
 
 @task()
-def fetch_all_trusts_from_ord() -> List[str]:
-    """Fetch all organisation ODS codes for given roles."""
+def fetch_all_trusts_from_ord() -> Dict[str, str]:
+    """
+    Fetch all organisation ODS codes for given roles, with the LastChangeDate
+    of each organisation.
+    """
     logger = get_run_logger()
     roles = ["RO197", "RO24"]
     urls = [
         f"https://directory.spineservices.nhs.uk/ORD/2-0-0/organisations?Roles={role}&Limit=1000"
         for role in roles
     ]
-    all_orgs = []
+    all_orgs = {}
     for url in urls:
         try:
             response = requests.get(url)
             response.raise_for_status()
             data = response.json()["Organisations"]
-            all_orgs.extend([org["OrgId"] for org in data])
+            all_orgs.update({org["OrgId"]: org.get("LastChangeDate") for org in data})
         except requests.RequestException as e:
             logger.error(f"Failed to fetch organisations: {str(e)}")
             raise e
@@ -33,36 +37,42 @@ def fetch_all_trusts_from_ord() -> List[str]:
 
 
 @task()
-def fetch_org_details(orgs: List[str]) -> Dict[str, Any]:
+def fetch_org_details(
+    orgs: List[str],
+    last_change_dates: Optional[Dict[str, str]] = None,
+    cache_dir: Optional[Path] = ORD_CACHE_DIR,
+    base_url: str = ORD_BASE_URL,
+) -> Dict[str, Any]:
     """
     Get details for a list of organisations.
 
     Args:
         orgs (List[str]): The ODS codes of the organisations to get details for.
+        last_change_dates (Dict[str, str], optional): The current LastChangeDate of
+            each organisation. Organisations cached at that date are not refetched.
+        cache_dir (Path, optional): Directory of cached ORD responses, or None to
+            disable the cache.
+        base_url (str): The ORD API base URL.
 
     Returns:
         Dict[str, Any]: A dictionary with the ODS codes as keys and the details as values.
     """
     logger = get_run_logger()
-    all_orgs_details = {}
     total = len(orgs)
     logger.info(f"Fetching details for {total} organisations")
 
-    for i, org in enumerate(orgs, 1):
-        url = f"https://directory.spineservices.nhs.uk/ORD/2-0-0/organisations/{org}"
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            all_orgs_details[org] = response.json()
-            if i % 50 == 0 or i == total:
-                logger.info(
-                    f"Progress: {i}/{total} organisations processed ({(i/total)*100:.1f}%)"
-                )
-        except requests.RequestException as e:
-            logger.error(f"Failed to fetch organisation details for {org}: {str(e)}")
-            raise e
-        time.sleep(0.2)
-    return all_orgs_details
+    def log_progress(done: int, total: int) -> None:
+        if done % 50 == 0 or done == total:
+            logger.info(
+                f"Progress: {done}/{total} organisations processed ({(done/total)*100:.1f}%)"
+            )
+
+    try:
+        with ORDClient(base_url=base_url, cache_dir=cache_dir) as client:
+            return client.organisations(orgs, last_change_dates, progress=log_progress)
+    except requests.RequestException as e:
+        logger.error(f"Failed to fetch organisation details: {str(e)}")
+        raise e
 
 
 @task
@@ -314,7 +324,7 @@ def import_ord_data():
     table_id = f"{PROJECT_ID}.{DATASET_ID}.{ORGANISATION_TABLE_ID}"
 
     all_orgs = fetch_all_trusts_from_ord()
-    all_orgs_details = fetch_org_details(all_orgs)
+    all_orgs_details = fetch_org_details(list(all_orgs), last_change_dates=all_orgs)
     icbs, successors, predecessors, filtered_org_details = process_org_details(all_orgs_details)
 
     icbs_list = list(set(icbs.values()))
@@ -1,8 +1,14 @@
+import argparse
+import json
+import os
 import requests
 import re
 import io
 import pandas as pd
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
 from urllib.parse import urljoin
 from prefect import task, flow, get_run_logger
 from google.cloud import bigquery
@@ -11,12 +17,17 @@ from pipeline.utils.utils import get_bigquery_client
 from pipeline.setup.bq_tables import ORG_AE_STATUS_TABLE_SPEC
 
 
-@task()
-def fetch_ae_data() -> pd.DataFrame:
-    """Fetch A&E attendance data from NHS England website."""
-    logger = get_run_logger()
-    base_url = "https://www.england.nhs.uk/statistics/statistical-work-areas/ae-waiting-times-and-activity/"
+AE_INDEX_URL = "https://www.england.nhs.uk/statistics/statistical-work-areas/ae-waiting-times-and-activity/"
+AE_MANIFEST_PATH = Path(
+    os.environ.get(
+        "AE_MANIFEST_PATH",
+        Path.home() / ".cache" / "openprescribing-hospitals" / "ae_status_manifest.json",
+    )
+)
+
 
+def find_ae_csv_links(base_url: str = AE_INDEX_URL, max_workers: int = 4) -> List[str]:
+    """Monthly A&E CSV URLs from every year page linked from the index, in page order"""
     response = requests.get(base_url)
     soup = BeautifulSoup(response.content, "html.parser")
 
@@ -24,72 +35,148 @@ def fetch_ae_data() -> pd.DataFrame:
         "a",
         href=lambda href: href and "ae-attendances-and-emergency-admissions" in href,
     )
-    all_data = []
+    year_urls = [urljoin(base_url, link["href"]) for link in links]
 
-    total_links = len(links)
-    logger.info(f"Found {total_links} links of data to process")
-
-    for year_index, link in enumerate(links, 1):
-        year_url = link["href"]
+    def csv_links(year_url: str) -> List[str]:
         year_response = requests.get(year_url)
         year_soup = BeautifulSoup(year_response.content, "html.parser")
+        return [
+            urljoin(year_url, csv_link["href"])
+            for csv_link in year_soup.find_all(
+                "a",
+                href=lambda href: href and href.endswith(".csv") and "Monthly-AE" in href,
+            )
+        ]
 
-        csv_links = year_soup.find_all(
-            "a",
-            href=lambda href: href and href.endswith(".csv") and "Monthly-AE" in href,
-        )
-        total_csvs = len(csv_links)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        return [url for urls in executor.map(csv_links, year_urls) for url in urls]
 
-        for csv_index, csv_link in enumerate(csv_links, 1):
-            file_url = urljoin(year_url, csv_link["href"])
-            file_response = requests.get(file_url)
 
-            match = re.search(
-                r"Monthly-AE-([A-Za-z]+)-(?:(\d{4})|(\d{2})-CSV(?:-revised)?)",
-                file_url,
-                re.IGNORECASE,
-            )
-            month_name = match.group(1)
-            year = match.group(2) or f"20{match.group(3)}"
+def parse_ae_period(file_url: str) -> pd.Timestamp:
+    """The month a Monthly-AE CSV covers, from its file name"""
+    match = re.search(
+        r"Monthly-AE-([A-Za-z]+)-(?:(\d{4})|(\d{2})-CSV(?:-revised)?)",
+        file_url,
+        re.IGNORECASE,
+    )
+    month_name = match.group(1)
+    year = match.group(2) or f"20{match.group(3)}"
 
-            year_month = pd.to_datetime(f"{month_name}-{year}")
+    return pd.to_datetime(f"{month_name}-{year}")
 
-            columns = (
-                ["Org Code", "A&E attendances Type 1"]
-                if year_month >= pd.to_datetime("2020-09")
-                else ["Org Code", "Number of A&E attendances Type 1"]
-            )
 
-            if year_month == pd.to_datetime("2020-08"):
-                df = pd.read_csv(
-                    io.StringIO(file_response.text),
-                    usecols=[0, 1, 4],
-                    names=columns,
-                )
-            else:
-                df = pd.read_csv(
-                    io.StringIO(file_response.text),
-                    usecols=columns,
-                )
-                df = df.drop(df.index[-1])
-
-            df["Period"] = year_month
-            all_data.append(df)
-
-            if csv_index == 1 or csv_index % 6 == 0 or csv_index == total_csvs:
-                logger.info(
-                    f"Year {year_index}/{total_links}: Processed {csv_index}/{total_csvs} months"
-                )
-
-    combined_data = pd.concat(all_data, ignore_index=True)
-    combined_data["has_ae"] = combined_data["A&E attendances Type 1"] > 0
-    combined_data = combined_data[["Period", "Org Code", "has_ae"]]
-    combined_data = combined_data.rename(
-        columns={"Org Code": "ods_code", "Period": "period"}
+def select_ae_files(csv_urls: List[str]) -> Dict[pd.Timestamp, str]:
+    """One CSV per month, preferring a revised file over the original"""
+    files = {}
+    for file_url in csv_urls:
+        period = parse_ae_period(file_url)
+        if period not in files or "revised" in file_url.lower():
+            files[period] = file_url
+    return files
+
+
+def parse_ae_csv(text: str, year_month: pd.Timestamp) -> pd.DataFrame:
+    """period, ods_code and has_ae for each organisation in one monthly CSV"""
+    columns = (
+        ["Org Code", "A&E attendances Type 1"]
+        if year_month >= pd.to_datetime("2020-09")
+        else ["Org Code", "Number of A&E attendances Type 1"]
+    )
+
+    if year_month == pd.to_datetime("2020-08"):
+        df = pd.read_csv(
+            io.StringIO(text),
+            usecols=[0, 1, 4],
+            names=columns,
+        )
+    else:
+        df = pd.read_csv(
+            io.StringIO(text),
+            usecols=columns,
+        )
+        df = df.drop(df.index[-1])
+
+    return pd.DataFrame(
+        {
+            "period": year_month,
+            "ods_code": df["Org Code"],
+            "has_ae": df[columns[1]] > 0,
+        }
     )
 
-    logger.info(f"Completed processing with {len(combined_data)} total records")
-    return combined_data
+
+def fetch_ae_file(
+    file_url: str, period: pd.Timestamp, manifest_entry: Optional[Dict] = None
+) -> Optional[Dict]:
+    """
+    Download and parse one monthly CSV. With the ETag and Last-Modified from
+    manifest_entry the request is conditional, and None is returned if the
+    file has not changed.
+    """
+    headers = {}
+    if manifest_entry:
+        if manifest_entry.get("etag"):
+            headers["If-None-Match"] = manifest_entry["etag"]
+        if manifest_entry.get("last_modified"):
+            headers["If-Modified-Since"] = manifest_entry["last_modified"]
+
+    file_response = requests.get(file_url, headers=headers)
+    if file_response.status_code == 304:
+        return None
+    file_response.raise_for_status()
+
+    return {
+        "url": file_url,
+        "period": period,
+        "etag": file_response.headers.get("ETag"),
+        "last_modified": file_response.headers.get("Last-Modified"),
+        "data": parse_ae_csv(file_response.text, period),
+    }
+
+
+def load_manifest(path: Path) -> Dict[str, Dict]:
+    """The manifest of ingested CSVs, keyed by URL, or an empty one"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest: Dict[str, Dict], path: Path) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+@task()
+def fetch_changed_ae_files(
+    manifest: Dict[str, Dict], base_url: str = AE_INDEX_URL, max_workers: int = 4
+) -> List[Dict]:
+    """
+    Fetch the monthly CSVs that are new, or have changed since they were
+    recorded in the manifest, with conditional requests on a bounded pool.
+    Returns one {url, period, etag, last_modified, data} per changed file.
+    """
+    logger = get_run_logger()
+
+    files = select_ae_files(find_ae_csv_links(base_url, max_workers))
+    logger.info(f"Found {len(files)} months of data, checking for changes")
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        results = list(
+            executor.map(
+                lambda item: fetch_ae_file(item[1], item[0], manifest.get(item[1])),
+                files.items(),
+            )
+        )
+
+    changed = [result for result in results if result is not None]
+    logger.info(f"{len(changed)} new or changed months, {len(files) - len(changed)} unchanged")
+    return changed
 
 
 @task
@@ -125,13 +212,77 @@ def upload_to_bigquery(df: pd.DataFrame) -> None:
     )
 
 
+@task
+def upload_partition_to_bigquery(df: pd.DataFrame, period: pd.Timestamp) -> None:
+    """Replace one month's partition of the A&E status table with df."""
+    logger = get_run_logger()
+    client = get_bigquery_client()
+
+    job_config = bigquery.LoadJobConfig(
+        schema=ORG_AE_STATUS_TABLE_SPEC.schema,
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+    )
+
+    target_table = f"{ORG_AE_STATUS_TABLE_SPEC.full_table_id}${period:%Y%m%d}"
+    job = client.load_table_from_dataframe(df, target_table, job_config=job_config)
+    job.result()
+
+    logger.info(f"Loaded {job.output_rows} rows into {target_table}")
+
+
 @flow(name="Import AE Status")
-def import_org_ae_status():
-    """Main flow to import A&E status data."""
-    df = fetch_ae_data()
-    df = prepare_dataframe(df)
-    upload_to_bigquery(df)
+def import_org_ae_status(
+    max_workers: int = 4,
+    full_refresh: bool = False,
+    manifest_path: Path = AE_MANIFEST_PATH,
+    base_url: str = AE_INDEX_URL,
+):
+    """
+    Main flow to import A&E status data.
+
+    Only months whose CSV is new or has changed since the last run, according
+    to the manifest at manifest_path, are downloaded, and each replaces its
+    own partition. full_refresh reloads the whole table.
+    """
+    logger = get_run_logger()
+
+    manifest = {} if full_refresh else load_manifest(manifest_path)
+    changed = sorted(
+        fetch_changed_ae_files(manifest, base_url, max_workers),
+        key=lambda result: result["period"],
+    )
+    if not changed:
+        logger.info("No new or changed A&E months to import")
+        return
+
+    if full_refresh:
+        df = pd.concat([result["data"] for result in changed], ignore_index=True)
+        upload_to_bigquery(prepare_dataframe(df))
+
+    for result in changed:
+        if not full_refresh:
+            upload_partition_to_bigquery(prepare_dataframe(result["data"]), result["period"])
+        manifest[result["url"]] = {
+            "period": f"{result['period']:%Y-%m-%d}",
+            "etag": result["etag"],
+            "last_modified": result["last_modified"],
+        }
+        save_manifest(manifest, manifest_path)
 
 
 if __name__ == "__main__":
-    import_org_ae_status()
+    parser = argparse.ArgumentParser(description="Import A&E status data")
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=4,
+        help="Pages and CSVs fetched at once (default: 4)",
+    )
+    parser.add_argument(
+        "--full-refresh",
+        action="store_true",
+        help="Download every month and replace the whole table",
+    )
+    args = parser.parse_args()
+
+    import_org_ae_status(max_workers=args.max_workers, full_refresh=args.full_refresh)
@@ -0,0 +1,217 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+ORD_BASE_URL = "https://directory.spineservices.nhs.uk/ORD/2-0-0"
+ORD_CACHE_DIR = Path(
+    os.environ.get(
+        "ORD_CACHE_DIR",
+        Path.home() / ".cache" / "openprescribing-hospitals" / "ord",
+    )
+)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket allowing rate requests per second on average,
+    with bursts of up to capacity requests.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until a token is available and take it"""
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+class ORDResponseCache:
+    """
+    On-disk cache of ORD organisation responses, one JSON file per ODS code.
+
+    An entry is only returned for the LastChangeDate it was fetched at, so an
+    organisation that has changed since is fetched again.
+    """
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, ods_code: str) -> Path:
+        return self.cache_dir / f"{ods_code}.json"
+
+    def get(self, ods_code: str, last_change_date: Optional[str]) -> Optional[dict]:
+        if not last_change_date:
+            return None
+        try:
+            with open(self._path(ods_code)) as f:
+                details = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if details.get("Organisation", {}).get("LastChangeDate") != last_change_date:
+            return None
+        return details
+
+    def set(self, ods_code: str, details: dict) -> None:
+        path = self._path(ods_code)
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(details, f)
+        os.replace(tmp_path, path)
+
+
+class ORDClient:
+    """
+    Client for the ORD API that fetches organisations on a thread pool over
+    one keep-alive session.
+
+    Requests share a token bucket limiting them to requests_per_second, and
+    connection errors and retryable statuses are retried with exponential
+    backoff and full jitter, honouring Retry-After. Organisation responses are
+    cached in cache_dir when given.
+    """
+
+    def __init__(
+        self,
+        base_url: str = ORD_BASE_URL,
+        max_workers: int = 8,
+        requests_per_second: float = 10.0,
+        max_retries: int = 5,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        timeout: float = 30.0,
+        cache_dir: Optional[Path] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.max_workers = max(1, max_workers)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.rate_limiter = TokenBucket(requests_per_second)
+        self.cache = ORDResponseCache(cache_dir) if cache_dir is not None else None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        self.session.close()
+
+    def _retry_delay(self, attempt: int, response=None) -> float:
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(self.max_backoff, float(retry_after)))
+        return delay
+
+    def get_json(self, path: str, params: Optional[dict] = None) -> dict:
+        """GET base_url/path, rate limited and retried, and return the JSON body"""
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._retry_delay(attempt))
+                continue
+
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                time.sleep(self._retry_delay(attempt, response))
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    def organisation(self, ods_code: str, last_change_date: Optional[str] = None) -> dict:
+        """
+        Details for one organisation, from the cache if it holds a response
+        with the given LastChangeDate.
+        """
+        if self.cache is not None:
+            cached = self.cache.get(ods_code, last_change_date)
+            if cached is not None:
+                return cached
+
+        details = self.get_json(f"organisations/{ods_code}")
+        if self.cache is not None:
+            self.cache.set(ods_code, details)
+        return details
+
+    def organisations(
+        self,
+        ods_codes: Iterable[str],
+        last_change_dates: Optional[Dict[str, str]] = None,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> Dict[str, dict]:
+        """
+        Details for each organisation, keyed by ODS code in the order given.
+
+        progress(done, total) is called from the calling thread as each
+        organisation completes. The first failure is raised once the requests
+        already running have finished.
+        """
+        ods_codes = list(dict.fromkeys(ods_codes))
+        last_change_dates = last_change_dates or {}
+        results = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(
+                    self.organisation, ods_code, last_change_dates.get(ods_code)
+                ): ods_code
+                for ods_code in ods_codes
+            }
+            try:
+                for done, future in enumerate(as_completed(futures), 1):
+                    results[futures[future]] = future.result()
+                    if progress:
+                        progress(done, len(ods_codes))
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        return {ods_code: results[ods_code] for ods_code in ods_codes}
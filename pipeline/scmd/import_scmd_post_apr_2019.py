@@ -1,9 +1,19 @@
 from prefect import flow, task, get_run_logger
 
+import argparse
+import contextvars
 import re
 import requests
+import tempfile
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 import io
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from google.cloud import bigquery
 from typing import Dict, List, Iterator
 from dataclasses import dataclass
@@ -15,6 +25,34 @@ from pipeline.setup.bq_tables import (
 )
 
 
+COLUMN_MAPPING = {
+    "YEAR_MONTH": "year_month",
+    "ODS_CODE": "ods_code",
+    "VMP_SNOMED_CODE": "vmp_snomed_code",
+    "VMP_PRODUCT_NAME": "vmp_product_name",
+    "UNIT_OF_MEASURE_IDENTIFIER": "unit_of_measure_identifier",
+    "UNIT_OF_MEASURE_NAME": "unit_of_measure_name",
+    "INDICATIVE_COST": "indicative_cost",
+    # The published CSVs have a typo in the quantity column name
+    "TOTAL_QUANITY_IN_VMP_UNIT": "total_quantity_in_vmp_unit",
+    "TOTAL_QUANTITY_IN_VMP_UNIT": "total_quantity_in_vmp_unit",
+}
+
+CSV_COLUMN_TYPES = {
+    "YEAR_MONTH": pa.string(),
+    "ODS_CODE": pa.string(),
+    "VMP_SNOMED_CODE": pa.string(),
+    "VMP_PRODUCT_NAME": pa.string(),
+    "UNIT_OF_MEASURE_IDENTIFIER": pa.string(),
+    "UNIT_OF_MEASURE_NAME": pa.string(),
+    "TOTAL_QUANITY_IN_VMP_UNIT": pa.float64(),
+    "TOTAL_QUANTITY_IN_VMP_UNIT": pa.float64(),
+    "INDICATIVE_COST": pa.float64(),
+}
+
+CSV_BLOCK_SIZE = 8 * 1024 * 1024
+
+
 @dataclass
 class DatasetURL:
     month: str
@@ -125,6 +163,66 @@ def process_month_data(
         raise
 
 
+def _map_batch(batch: pa.RecordBatch, month_date: np.datetime64) -> pa.RecordBatch:
+    """
+    map_columns for one Arrow batch: renamed columns, year_month set to the
+    month being imported and lower case unit names. Unknown columns are dropped.
+    """
+    names = ["year_month"]
+    columns = [pa.array(np.full(batch.num_rows, month_date))]
+    for name, column in zip(batch.schema.names, batch.columns):
+        mapped = COLUMN_MAPPING.get(name)
+        if mapped is None or mapped == "year_month":
+            continue
+        if mapped == "unit_of_measure_name":
+            column = pc.utf8_lower(column)
+        names.append(mapped)
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, names=names)
+
+
+@task
+def stream_month_to_parquet(
+    month: str,
+    url: str,
+    path: Path,
+    block_size: int = CSV_BLOCK_SIZE,
+) -> int:
+    """
+    Stream a month's CSV into a Parquet file at path, one block of the HTTP
+    body at a time, with the column mapping applied as each batch is read.
+    Returns the number of rows written.
+    """
+    logger = get_run_logger()
+    logger.info(f"Streaming data for month: {month}")
+    month_date = np.datetime64(month, "D")
+    rows = 0
+    try:
+        with requests.get(url, stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+
+            reader = pa_csv.open_csv(
+                response.raw,
+                read_options=pa_csv.ReadOptions(block_size=block_size),
+                convert_options=pa_csv.ConvertOptions(column_types=CSV_COLUMN_TYPES),
+            )
+            schema = _map_batch(
+                pa.RecordBatch.from_pylist([], schema=reader.schema), month_date
+            ).schema
+
+            with pq.ParquetWriter(path, schema) as writer:
+                for batch in reader:
+                    writer.write_batch(_map_batch(batch, month_date))
+                    rows += batch.num_rows
+
+        logger.info(f"Successfully streamed {rows} rows for {month}")
+        return rows
+    except (requests.RequestException, pa.ArrowInvalid) as e:
+        logger.error(f"Failed to stream data for {month}: {str(e)}")
+        raise
+
+
 @task
 def get_existing_dates(table_spec) -> set:
     """
@@ -177,6 +275,81 @@ def load_partition(df: pd.DataFrame, partition_date: str, table_spec) -> Dict:
     job.result()
 
 
+@task
+def load_partition_file(path: Path, partition_date: str, table_spec) -> None:
+    """Loads a Parquet file written by stream_month_to_parquet into the BigQuery table."""
+    client = get_bigquery_client()
+
+    partition_date = partition_date.replace("-", "")
+    job_config = bigquery.LoadJobConfig(
+        schema=table_spec.schema,
+        source_format=bigquery.SourceFormat.PARQUET,
+        write_disposition="WRITE_TRUNCATE",
+    )
+
+    target_table = f"{table_spec.full_table_id}${partition_date}"
+    with open(path, "rb") as f:
+        job = client.load_table_from_file(f, target_table, job_config=job_config)
+    job.result()
+
+
+def import_month(
+    month: str, url: str, file_type: str, table_spec, work_dir: Path
+) -> Dict:
+    """Stream one month to Parquet, load it into its partition and remove the file"""
+    path = Path(work_dir) / f"scmd_{file_type}_{month}.parquet"
+    try:
+        rows = stream_month_to_parquet(month=month, url=url, path=path)
+        load_partition_file(path=path, partition_date=month, table_spec=table_spec)
+    finally:
+        path.unlink(missing_ok=True)
+    return {"month": month, "file_type": file_type, "rows": rows}
+
+
+@task
+def import_months(
+    jobs: List[Dict], max_concurrent_months: int = 4, work_dir: Path = None
+) -> List[Dict]:
+    """
+    Run import_month for each job ({month, url, file_type, table_spec}) with at
+    most max_concurrent_months months downloading or loading at once.
+
+    Results are returned in job order. The first failure cancels the months
+    that have not started and is raised.
+    """
+    logger = get_run_logger()
+    if not jobs:
+        return []
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrent_months)) as executor:
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run,
+                    import_month,
+                    job["month"],
+                    job["url"],
+                    job["file_type"],
+                    job["table_spec"],
+                    Path(tmp_dir),
+                )
+                for job in jobs
+            ]
+            results = []
+            try:
+                for i, future in enumerate(futures, 1):
+                    result = future.result()
+                    results.append(result)
+                    logger.info(
+                        f"Completed {result['file_type']} month "
+                        f"{i}/{len(jobs)}: {result['month']}"
+                    )
+            finally:
+                for future in futures:
+                    future.cancel()
+    return results
+
+
 
 @task
 def get_months_to_update(
@@ -205,24 +378,8 @@ def get_months_to_update(
 def map_columns(df: pd.DataFrame) -> pd.DataFrame:
     """Map the columns to the correct names"""
     column_mapping = {
-        "YEAR_MONTH": "year_month",
-        "ODS_CODE": "ods_code",
-        "VMP_SNOMED_CODE": "vmp_snomed_code",
-        "VMP_PRODUCT_NAME": "vmp_product_name",
-        "UNIT_OF_MEASURE_IDENTIFIER": "unit_of_measure_identifier",
-        "UNIT_OF_MEASURE_NAME": "unit_of_measure_name",
-        "INDICATIVE_COST": "indicative_cost",
+        column: COLUMN_MAPPING[column] for column in df.columns if column in COLUMN_MAPPING
     }
-    
-    # Handle the typo in the quantity column name
-    if "TOTAL_QUANITY_IN_VMP_UNIT" in df.columns:
-        column_mapping[
-            "TOTAL_QUANITY_IN_VMP_UNIT"
-        ] = "total_quantity_in_vmp_unit"
-    elif "TOTAL_QUANTITY_IN_VMP_UNIT" in df.columns:
-        column_mapping[
-            "TOTAL_QUANTITY_IN_VMP_UNIT"
-        ] = "total_quantity_in_vmp_unit"
 
     df.rename(columns=column_mapping, inplace=True)
 
@@ -233,7 +390,7 @@ def map_columns(df: pd.DataFrame) -> pd.DataFrame:
 
 
 @flow(name="SCMD Import Post April 2019")
-def import_scmd_post_apr_2019():
+def import_scmd_post_apr_2019(max_concurrent_months: int = 4):
     """Main flow for importing SCMD data"""
     logger = get_run_logger()
 
@@ -256,75 +413,41 @@ def import_scmd_post_apr_2019():
         finalised_urls, existing_finalised_dates
     )
 
-    processed_months = []
-
-
-    if provisional_months_to_update:
-        logger.info(
-            f"Processing {len(provisional_months_to_update)} "
-            f"months of provisional data"
-        )
-        for i, month in enumerate(provisional_months_to_update, 1):
-            url_data = provisional_urls[month]
-            processed_data = process_month_data(month=month, url=url_data["url"])
-            processed_data = map_columns(processed_data)
-
-            load_partition(
-                df=processed_data,
-                partition_date=month,
-                table_spec=SCMD_RAW_PROVISIONAL_TABLE_SPEC,
-            )
-
-            processed_months.append(
-                {
-                    "month": month,
-                    "file_type": "provisional",
-                    "rows": len(processed_data),
-                }
-            )
-
-            logger.info(
-                f"Completed provisional month "
-                f"{i}/{len(provisional_months_to_update)}: {month}"
-            )
-    else:
-        logger.info("No new provisional months to import")
-
-    if finalised_months_to_update:
-        logger.info(
-            f"Processing {len(finalised_months_to_update)} "
-            f"months of finalised data"
+    jobs = []
+    for file_type, months, urls, table_spec in (
+        ("provisional", provisional_months_to_update, provisional_urls, SCMD_RAW_PROVISIONAL_TABLE_SPEC),
+        ("finalised", finalised_months_to_update, finalised_urls, SCMD_RAW_FINALISED_TABLE_SPEC),
+    ):
+        if months:
+            logger.info(f"Processing {len(months)} months of {file_type} data")
+        else:
+            logger.info(f"No new {file_type} months to import")
+        jobs.extend(
+            {
+                "month": month,
+                "url": urls[month]["url"],
+                "file_type": file_type,
+                "table_spec": table_spec,
+            }
+            for month in months
         )
-        for i, month in enumerate(finalised_months_to_update, 1):
-            url_data = finalised_urls[month]
-            processed_data = process_month_data(month=month, url=url_data["url"])
-            processed_data = map_columns(processed_data)
-
-            load_partition(
-                df=processed_data,
-                partition_date=month,
-                table_spec=SCMD_RAW_FINALISED_TABLE_SPEC,
-            )
 
-            processed_months.append(
-                {
-                    "month": month,
-                    "file_type": "finalised",
-                    "rows": len(processed_data),
-                }
-            )
-
-            logger.info(
-                f"Completed finalised month "
-                f"{i}/{len(finalised_months_to_update)}: {month}"
-            )
-    else:
-        logger.info("No new finalised months to import")
+    processed_months = import_months(jobs, max_concurrent_months)
 
     if not processed_months:
         logger.info("No months to update")
 
+    return processed_months
 
 
 if __name__ == "__main__":
-    import_scmd_post_apr_2019()
+    parser = argparse.ArgumentParser(description="Import SCMD data from April 2019")
+    parser.add_argument(
+        "--max-concurrent-months",
+        type=int,
+        default=4,
+        help="Months downloaded and loaded at once (default: 4)",
+    )
+    args = parser.parse_args()
+
+    import_scmd_post_apr_2019(max_concurrent_months=args.max_concurrent_months)
@@ -1,7 +1,17 @@
+import hashlib
+import io
+import zipfile
+
 import pytest
+from unittest.mock import patch
 
 from pipeline.dmd.import_dmd_supp import (
+    TRUDRelease,
+    download_dmd_release,
+    find_supplementary_files,
+    load_vtm_ingredients,
     normalise_bnf_code,
+    open_zip_member,
     parse_xml_data,
     parse_vtm_ingredients_xml,
     parse_dmd_history_xml,
@@ -275,3 +285,135 @@ class TestATCCodeUpdates:
         assert none_atc_record['atc_code'] is None
         assert none_atc_record in result  # Should still be present
 
+
+
+@pytest.fixture
+def release_zip(tmp_path, sample_xml_content, sample_vtm_ingredients_xml_content, sample_history_xml_content):
+    """A TRUD release zip with the BNF XML inside a nested zip"""
+    bnf_zip = io.BytesIO()
+    with zipfile.ZipFile(bnf_zip, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr("f_bnf1_0020124.xml", sample_xml_content)
+
+    zip_path = tmp_path / "release.zip"
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr("week022024-r2_3-BNF.zip", bnf_zip.getvalue())
+        zip_file.writestr("VTM_INGREDIENTS/f_vtm_ing1_3020124.xml", sample_vtm_ingredients_xml_content)
+        zip_file.writestr("HISTORIC_CODES/f_history1_0020124.xml", sample_history_xml_content)
+    return zip_path
+
+
+class TestZipMembers:
+    def test_find_supplementary_files(self, release_zip):
+        bnf_member, vtm_ing_member, history_member = find_supplementary_files(release_zip, 2024)
+
+        assert bnf_member == ("week022024-r2_3-BNF.zip", "f_bnf1_0020124.xml")
+        assert vtm_ing_member == ("VTM_INGREDIENTS/f_vtm_ing1_3020124.xml",)
+        assert history_member == ("HISTORIC_CODES/f_history1_0020124.xml",)
+
+    def test_find_supplementary_files_missing_bnf_zip(self, release_zip):
+        with pytest.raises(FileNotFoundError):
+            find_supplementary_files(release_zip, 2023)
+
+    def test_parses_members_in_place(self, release_zip, tmp_path):
+        bnf_member, vtm_ing_member, _ = find_supplementary_files(release_zip, 2024)
+
+        with open_zip_member(release_zip, bnf_member) as xml_file:
+            bnf_data = parse_xml_data(xml_file)
+        with open_zip_member(release_zip, vtm_ing_member) as xml_file:
+            vtm_ing_data = parse_vtm_ingredients_xml(xml_file)
+
+        assert [record["vmp_code"] for record in bnf_data] == [
+            "12345", "67890", "11111", "39732411000001106"
+        ]
+        assert vtm_ing_data[1] == {"vtm_id": "54321", "ingredient_id": "98765"}
+        # Nothing is extracted next to the release
+        assert [p.name for p in tmp_path.iterdir()] == ["release.zip"]
+
+    def test_load_vtm_ingredients_from_zip(self, release_zip):
+        loaded = []
+
+        def load_json_batches(batches, table_spec):
+            loaded.extend(batches)
+            return sum(len(batch) for batch in loaded)
+
+        with patch("pipeline.dmd.import_dmd_supp.load_json_batches", side_effect=load_json_batches):
+            rows = load_vtm_ingredients(
+                release_zip, ("VTM_INGREDIENTS/f_vtm_ing1_3020124.xml",), batch_size=1
+            )
+
+        assert rows == 2
+        assert loaded == [
+            [{"vtm_id": "12345", "ingredient_id": "67890"}],
+            [{"vtm_id": "54321", "ingredient_id": "98765"}],
+        ]
+
+
+class FakeDownload:
+    def __init__(self, content):
+        self.content = content
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), 4):
+            yield self.content[i : i + 4]
+
+
+class TestReleaseCache:
+    CONTENT = b"dm+d release zip bytes"
+
+    def release(self, release_id="nhsbsa_dmd_1.0.0_20240101000001", archive_sha256=None):
+        return TRUDRelease(
+            release_date="2024-01-01",
+            download_url="https://example.com/release.zip",
+            year=2024,
+            release_id=release_id,
+            archive_sha256=archive_sha256,
+        )
+
+    def test_downloads_once_per_release(self, tmp_path):
+        release = self.release(archive_sha256=hashlib.sha256(self.CONTENT).hexdigest())
+
+        with patch("requests.get", return_value=FakeDownload(self.CONTENT)) as mock_get:
+            first = download_dmd_release(release, cache_dir=tmp_path)
+            second = download_dmd_release(release, cache_dir=tmp_path)
+
+        assert mock_get.call_count == 1
+        assert first == second == tmp_path / "nhsbsa_dmd_1.0.0_20240101000001.zip"
+        assert first.read_bytes() == self.CONTENT
+
+    def test_redownloads_corrupted_cache(self, tmp_path):
+        release = self.release()
+
+        with patch("requests.get", return_value=FakeDownload(self.CONTENT)) as mock_get:
+            path = download_dmd_release(release, cache_dir=tmp_path)
+            path.write_bytes(b"truncated")
+            download_dmd_release(release, cache_dir=tmp_path)
+
+        assert mock_get.call_count == 2
+        assert path.read_bytes() == self.CONTENT
+
+    def test_checksum_mismatch_is_not_cached(self, tmp_path):
+        release = self.release(archive_sha256="0" * 64)
+
+        with patch("requests.get", return_value=FakeDownload(self.CONTENT)):
+            with pytest.raises(ValueError, match="Checksum mismatch"):
+                download_dmd_release(release, cache_dir=tmp_path)
+
+        assert list(tmp_path.iterdir()) == []
+
+    def test_new_release_replaces_cached_release(self, tmp_path):
+        with patch("requests.get", return_value=FakeDownload(self.CONTENT)):
+            download_dmd_release(self.release("old_release"), cache_dir=tmp_path)
+            download_dmd_release(self.release("new_release"), cache_dir=tmp_path)
+
+        assert sorted(p.name for p in tmp_path.iterdir()) == [
+            "new_release.zip", "new_release.zip.sha256"
+        ]
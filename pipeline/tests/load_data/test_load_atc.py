@@ -5,8 +5,9 @@ from pipeline.load_data.load_atc import (
     extract_atc_codes,
     transform_atc_codes,
     load_atc_codes,
+    load_atc_closure,
 )
-from viewer.models import ATC
+from viewer.models import ATC, VMP, VMPATCAncestor
 
 
 @pytest.fixture
@@ -191,3 +192,19 @@ class TestLoadATC:
         for atc in atcs_list:
             assert atc.code.startswith("A")
             assert len(atc.code) in [1, 3, 4, 5, 7]
+
+    @pytest.mark.django_db
+    def test_load_atc_closure(self, sample_transformed_data):
+        load_atc_codes(sample_transformed_data)
+        vmp = VMP.objects.create(code="VMP1", name="Magnesium carbonate tablets")
+        vmp.atcs.add(ATC.objects.get(code="A02AA01"))
+        VMPATCAncestor.objects.create(atc=ATC.objects.get(code="A02"), vmp=VMP.objects.create(
+            code="STALE", name="Stale link"
+        ))
+
+        assert load_atc_closure() == 5
+
+        closure = VMPATCAncestor.objects.values_list("atc__code", "vmp__code")
+        assert sorted(closure) == [
+            ("A", "VMP1"), ("A02", "VMP1"), ("A02A", "VMP1"), ("A02AA", "VMP1"), ("A02AA01", "VMP1")
+        ]
@@ -11,6 +11,7 @@ from pipeline.load_data.load_ddd_quantity import (
     cache_foreign_keys,
     transform_and_load_ddd_quantity_chunk,
     load_ddd_logic_for_vmps,
+    ddd_quantity_writer,
 )
 from viewer.models import (
     DDDQuantity,
@@ -330,3 +331,30 @@ class TestLoadDDDQuantity:
             assert result["skipped"] == 2 
             assert DDDQuantity.objects.count() == 1
 
+
+    @pytest.mark.django_db
+    def test_reload_upserts_changed_rows_and_deletes_orphans(
+        self, sample_ddd_data, sample_foreign_keys
+    ):
+        transform_and_load_ddd_quantity_chunk(sample_ddd_data, sample_foreign_keys, 1, 1)
+        unchanged = DDDQuantity.objects.get(vmp__code="67890", organisation__ods_code="ORG1")
+
+        reloaded = sample_ddd_data.copy()
+        reloaded.loc[0, "ddd_quantity"] = 9.0
+        reloaded = reloaded[reloaded["ods_code"] == "ORG1"]
+
+        writer = ddd_quantity_writer()
+        result = transform_and_load_ddd_quantity_chunk(
+            reloaded, sample_foreign_keys, 1, 1, writer
+        )
+        deleted = writer.delete_orphans()
+
+        assert (result["created"], result["updated"], result["unchanged"]) == (0, 1, 1)
+        assert deleted == 1
+        assert writer.rows_touched == 2
+        assert DDDQuantity.objects.count() == 2
+        assert DDDQuantity.objects.get(
+            vmp__code="12345", organisation__ods_code="ORG1"
+        ).data == [9.0, 0.0]
+        # Unchanged rows are not rewritten
+        assert DDDQuantity.objects.get(pk=unchanged.pk).content_hash == unchanged.content_hash
@@ -8,7 +8,15 @@ from pipeline.load_data.load_organisations import (
     create_trust_types,
     load_organisation_data,
 )
-from viewer.models import Organisation, TrustType, Region, ICB, CancerAlliance
+from viewer.models import (
+    CancerAlliance,
+    DDDQuantity,
+    ICB,
+    Organisation,
+    Region,
+    TrustType,
+    VMP,
+)
 
 
 @pytest.fixture
@@ -214,6 +222,31 @@ class TestLoadOrganisations:
         assert orgs_list[1].successor is None  # DEF456 should have no successor
         assert orgs_list[2].successor is None  # GHI789 should have no successor
 
+    @pytest.mark.django_db
+    def test_reload_keeps_organisation_ids_and_quantities(self, sample_transformed_data):
+        trust_type_lookup = create_trust_types(sample_transformed_data)
+        load_organisation_data(sample_transformed_data, trust_type_lookup)
+        ids = dict(Organisation.objects.values_list("ods_code", "id"))
+        vmp = VMP.objects.create(code="12345", name="Test Drug")
+        DDDQuantity.objects.create(vmp=vmp, organisation_id=ids["ABC123"], data=[1.0])
+        DDDQuantity.objects.create(vmp=vmp, organisation_id=ids["GHI789"], data=[2.0])
+
+        reloaded = [dict(row) for row in sample_transformed_data if row["ods_code"] != "GHI789"]
+        reloaded[0]["ods_name"] = "Renamed Hospital 1"
+        reloaded[0]["successor_code"] = None
+        result = load_organisation_data(reloaded, trust_type_lookup)
+
+        assert (result["created"], result["updated"], result["deleted"]) == (0, 2, 1)
+        assert dict(Organisation.objects.values_list("ods_code", "id")) == {
+            "ABC123": ids["ABC123"],
+            "DEF456": ids["DEF456"],
+        }
+        renamed = Organisation.objects.get(ods_code="ABC123")
+        assert renamed.ods_name == "Renamed Hospital 1"
+        assert renamed.successor is None
+        assert list(DDDQuantity.objects.values_list("organisation__ods_code", flat=True)) == ["ABC123"]
+        assert not Region.objects.filter(code="REG003").exists()
+
 
 class TestResolveUltimateSuccessors:
     def test_multiple_ultimate_without_override(self):
@@ -357,11 +357,11 @@ class TestFetchOrganisations:
         mock_get.assert_any_call("https://directory.spineservices.nhs.uk/ORD/2-0-0/organisations?Roles=RO197&Limit=1000")
         mock_get.assert_any_call("https://directory.spineservices.nhs.uk/ORD/2-0-0/organisations?Roles=RO24&Limit=1000")
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_fetch_org_details(self, mock_get, sample_org_details):
         """Test fetching organisation details"""
         mock_get.return_value.json.return_value = sample_org_details["ABC1"]
-        result = fetch_org_details(["ABC1"])
+        result = fetch_org_details(["ABC1"], cache_dir=None)
         
         assert "ABC1" in result
         assert result["ABC1"]["Organisation"]["Name"] == "SAMPLE HOSPITAL NHS FOUNDATION TRUST"
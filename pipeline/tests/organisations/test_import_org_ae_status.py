@@ -1,10 +1,19 @@
+import json
+import os
+import threading
+import time
 import pytest
 import pandas as pd
 from datetime import date
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import Mock, patch
 from pipeline.organisations.import_org_ae_status import (
-    fetch_ae_data,
-    prepare_dataframe
+    fetch_ae_file,
+    fetch_changed_ae_files,
+    import_org_ae_status,
+    prepare_dataframe,
+    select_ae_files,
 )
 
 @pytest.fixture
@@ -48,7 +57,13 @@ def mock_requests_get():
     with patch("requests.get") as mock_get:
         yield mock_get
 
-def test_fetch_ae_data(mock_requests_get, sample_html_index, sample_html_year_page, sample_new_csv_content):
+def fetch_all_ae_data():
+    """Every month's data, as fetched with an empty manifest"""
+    return pd.concat(
+        [result["data"] for result in fetch_changed_ae_files({})], ignore_index=True
+    )
+
+def test_fetch_changed_ae_files_without_manifest(mock_requests_get, sample_html_index, sample_html_year_page, sample_new_csv_content):
     mock_responses = [
         Mock(content=sample_html_index.encode()),
         Mock(content=sample_html_year_page.encode()),
@@ -56,7 +71,7 @@ def test_fetch_ae_data(mock_requests_get, sample_html_index, sample_html_year_pa
     ]
     mock_requests_get.side_effect = mock_responses
 
-    result = fetch_ae_data()
+    result = fetch_all_ae_data()
 
     assert isinstance(result, pd.DataFrame)
     assert list(result.columns) == ["period", "ods_code", "has_ae"]
@@ -65,7 +80,7 @@ def test_fetch_ae_data(mock_requests_get, sample_html_index, sample_html_year_pa
     assert all(result["has_ae"])
 
 
-def test_fetch_ae_data_supports_revised_filename_format(mock_requests_get, sample_html_index, sample_new_csv_content):
+def test_fetch_changed_ae_files_supports_revised_filename_format(mock_requests_get, sample_html_index, sample_new_csv_content):
     year_page_with_revised_csv = """
     <html>
         <body>
@@ -81,7 +96,7 @@ def test_fetch_ae_data_supports_revised_filename_format(mock_requests_get, sampl
     ]
     mock_requests_get.side_effect = mock_responses
 
-    result = fetch_ae_data()
+    result = fetch_all_ae_data()
     assert len(result) == 2
     assert set(result["period"].astype(str).unique()) == {"2025-11-01"}
 
@@ -99,3 +114,117 @@ def test_prepare_dataframe():
     assert isinstance(result["period"].iloc[0], date)
     assert isinstance(result["ods_code"].iloc[0], str)
     assert bool(result["has_ae"].iloc[0]) is True
+
+
+def test_select_ae_files_prefers_revised_files():
+    files = select_ae_files([
+        "https://example.com/Monthly-AE-November-2025.csv",
+        "https://example.com/Monthly-AE-Nov-25-CSV-revised.csv",
+        "https://example.com/Monthly-AE-October-2025.csv",
+    ])
+
+    assert files == {
+        pd.Timestamp("2025-11-01"): "https://example.com/Monthly-AE-Nov-25-CSV-revised.csv",
+        pd.Timestamp("2025-10-01"): "https://example.com/Monthly-AE-October-2025.csv",
+    }
+
+
+def test_fetch_ae_file_sends_conditional_headers(mock_requests_get):
+    mock_requests_get.return_value = Mock(status_code=304)
+
+    result = fetch_ae_file(
+        "https://example.com/Monthly-AE-March-2024.csv",
+        pd.Timestamp("2024-03-01"),
+        {"etag": '"abc"', "last_modified": "Mon, 01 Apr 2024 00:00:00 GMT"},
+    )
+
+    assert result is None
+    mock_requests_get.assert_called_once_with(
+        "https://example.com/Monthly-AE-March-2024.csv",
+        headers={
+            "If-None-Match": '"abc"',
+            "If-Modified-Since": "Mon, 01 Apr 2024 00:00:00 GMT",
+        },
+    )
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def ae_site(tmp_path, sample_new_csv_content):
+    """A static copy of the A&E statistics pages served from a local server"""
+    site = tmp_path / "site"
+    year_dir = site / "ae-attendances-and-emergency-admissions-2023-24"
+    year_dir.mkdir(parents=True)
+    (site / "index.html").write_text(
+        '<a href="ae-attendances-and-emergency-admissions-2023-24/">2023-24</a>'
+    )
+    (year_dir / "index.html").write_text(
+        '<a href="Monthly-AE-February-2024.csv">February 2024</a>'
+        '<a href="Monthly-AE-March-2024.csv">March 2024</a>'
+    )
+    for name in ["Monthly-AE-February-2024.csv", "Monthly-AE-March-2024.csv"]:
+        (year_dir / name).write_text(sample_new_csv_content)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=str(site)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield year_dir, f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+
+def run_import(base_url, manifest_path, **kwargs):
+    loaded = []
+
+    def upload_partition(df, period):
+        loaded.append((period.strftime("%Y-%m-%d"), df["ods_code"].tolist()))
+
+    with patch(
+        "pipeline.organisations.import_org_ae_status.upload_partition_to_bigquery",
+        side_effect=upload_partition,
+    ):
+        import_org_ae_status(manifest_path=manifest_path, base_url=base_url, **kwargs)
+    return loaded
+
+
+def test_import_only_loads_new_or_changed_months(ae_site, tmp_path):
+    year_dir, base_url = ae_site
+    manifest_path = tmp_path / "manifest.json"
+
+    first = run_import(base_url, manifest_path, max_workers=2)
+    second = run_import(base_url, manifest_path, max_workers=2)
+
+    march = year_dir / "Monthly-AE-March-2024.csv"
+    march.write_text(march.read_text().replace("RXH", "RYJ"))
+    later = time.time() + 60
+    os.utime(march, (later, later))
+    third = run_import(base_url, manifest_path, max_workers=2)
+
+    assert first == [
+        ("2024-02-01", ["RR8", "RXH"]),
+        ("2024-03-01", ["RR8", "RXH"]),
+    ]
+    assert second == []
+    assert third == [("2024-03-01", ["RR8", "RYJ"])]
+
+    manifest = json.loads(manifest_path.read_text())
+    assert sorted(entry["period"] for entry in manifest.values()) == ["2024-02-01", "2024-03-01"]
+    assert all(entry["last_modified"] for entry in manifest.values())
+
+
+def test_full_refresh_replaces_the_table(ae_site, tmp_path):
+    _, base_url = ae_site
+    manifest_path = tmp_path / "manifest.json"
+    run_import(base_url, manifest_path)
+
+    with patch("pipeline.organisations.import_org_ae_status.upload_to_bigquery") as mock_upload:
+        partitions = run_import(base_url, manifest_path, full_refresh=True)
+
+    assert partitions == []
+    df = mock_upload.call_args.args[0]
+    assert len(df) == 4
+    assert sorted(set(df["period"])) == [date(2024, 2, 1), date(2024, 3, 1)]
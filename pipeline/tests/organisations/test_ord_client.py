@@ -0,0 +1,175 @@
+import json
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from pipeline.organisations.import_ord_data import fetch_org_details
+from pipeline.organisations.ord_client import ORDClient, ORDResponseCache, TokenBucket
+
+
+def org_details(ods_code, last_change_date="2024-01-01"):
+    return {
+        "Organisation": {
+            "Name": f"TRUST {ods_code}",
+            "OrgId": {"extension": ods_code},
+            "LastChangeDate": last_change_date,
+        }
+    }
+
+
+class MockORDHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        ods_code = self.path.rsplit("/", 1)[-1]
+        with server.lock:
+            server.requests[ods_code] += 1
+            failures = server.failures.get(ods_code, 0)
+            if failures:
+                server.failures[ods_code] = failures - 1
+
+        if failures:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if ods_code not in server.orgs:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = json.dumps(server.orgs[ods_code]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def ord_server():
+    """A local stand-in for the ORD organisations endpoint"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockORDHandler)
+    server.lock = threading.Lock()
+    server.requests = Counter()
+    server.failures = {}
+    server.orgs = {code: org_details(code) for code in ["AAA", "BBB", "CCC", "DDD"]}
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/ORD/2-0-0"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(server, **kwargs):
+    kwargs = {"backoff": 0, "requests_per_second": 1000, **kwargs}
+    return ORDClient(base_url=server.base_url, **kwargs)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket_allows_burst_then_limits_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=3, clock=clock, sleep=clock.sleep)
+
+    for _ in range(5):
+        bucket.acquire()
+
+    assert clock.sleeps == [0.5, 0.5]
+    assert clock.now == 1.0
+
+
+def test_fetches_organisations_concurrently(ord_server):
+    with make_client(ord_server, max_workers=4) as client:
+        progress = []
+        result = client.organisations(
+            ["DDD", "AAA", "CCC", "BBB", "AAA"], progress=lambda done, total: progress.append((done, total))
+        )
+
+    assert list(result) == ["DDD", "AAA", "CCC", "BBB"]
+    assert result["CCC"] == org_details("CCC")
+    assert progress == [(1, 4), (2, 4), (3, 4), (4, 4)]
+    assert ord_server.requests == {"AAA": 1, "BBB": 1, "CCC": 1, "DDD": 1}
+
+
+def test_retries_unavailable_responses(ord_server):
+    ord_server.failures = {"AAA": 2}
+
+    with make_client(ord_server, max_retries=2) as client:
+        assert client.organisation("AAA") == org_details("AAA")
+
+    assert ord_server.requests["AAA"] == 3
+
+
+def test_raises_when_retries_are_exhausted(ord_server):
+    ord_server.failures = {"AAA": 3}
+
+    with make_client(ord_server, max_retries=2) as client:
+        with pytest.raises(requests.HTTPError):
+            client.organisations(["BBB", "AAA"])
+
+
+def test_does_not_retry_missing_organisation(ord_server):
+    with make_client(ord_server) as client:
+        with pytest.raises(requests.HTTPError):
+            client.organisation("ZZZ")
+
+    assert ord_server.requests["ZZZ"] == 1
+
+
+def test_cache_skips_unchanged_organisations(ord_server, tmp_path):
+    dates = {code: "2024-01-01" for code in ["AAA", "BBB"]}
+    with make_client(ord_server, cache_dir=tmp_path) as client:
+        client.organisations(["AAA", "BBB"], dates)
+
+    ord_server.orgs["BBB"] = org_details("BBB", "2024-06-01")
+    with make_client(ord_server, cache_dir=tmp_path) as client:
+        result = client.organisations(["AAA", "BBB"], {**dates, "BBB": "2024-06-01"})
+
+    assert ord_server.requests == {"AAA": 1, "BBB": 2}
+    assert result["BBB"]["Organisation"]["LastChangeDate"] == "2024-06-01"
+    assert ORDResponseCache(tmp_path).get("BBB", "2024-06-01") == result["BBB"]
+
+
+def test_cache_is_not_used_without_a_last_change_date(ord_server, tmp_path):
+    for _ in range(2):
+        with make_client(ord_server, cache_dir=tmp_path) as client:
+            client.organisation("AAA")
+
+    assert ord_server.requests["AAA"] == 2
+
+
+def test_fetch_org_details_against_mock_server(ord_server, tmp_path):
+    result = fetch_org_details(
+        ["AAA", "BBB"],
+        last_change_dates={"AAA": "2024-01-01", "BBB": "2024-01-01"},
+        cache_dir=tmp_path,
+        base_url=ord_server.base_url,
+    )
+    result_again = fetch_org_details(
+        ["AAA", "BBB"],
+        last_change_dates={"AAA": "2024-01-01", "BBB": "2024-01-01"},
+        cache_dir=tmp_path,
+        base_url=ord_server.base_url,
+    )
+
+    assert result == result_again == {"AAA": org_details("AAA"), "BBB": org_details("BBB")}
+    assert ord_server.requests == {"AAA": 1, "BBB": 1}
@@ -1,6 +1,11 @@
+import threading
 import pytest
 import pandas as pd
+import pyarrow.parquet as pq
+import requests
 from datetime import date
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import patch, Mock
 
 from pipeline.scmd.import_scmd_post_apr_2019 import (
@@ -8,6 +13,8 @@ from pipeline.scmd.import_scmd_post_apr_2019 import (
     process_month_data,
     get_months_to_update,
     map_columns,
+    stream_month_to_parquet,
+    import_months,
 )
 
 @pytest.fixture
@@ -16,6 +23,26 @@ def sample_csv_content():
 202401,ABC123,12345678,Test Product,001,milligram,100.0,50.0
 202401,XYZ789,87654321,Another Product,002,millilitre,200.0,75.0"""
 
+
+@pytest.fixture
+def csv_server(tmp_path):
+    """A local HTTP server serving the files in tmp_path / "csv" """
+    csv_dir = tmp_path / "csv"
+    csv_dir.mkdir()
+    handler = partial(QuietHandler, directory=str(csv_dir))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield csv_dir, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
 class TestDatasetURLFetching:
     @pytest.fixture
     def mock_provisional_api_response(self):
@@ -192,3 +219,116 @@ class TestGetMonthsToUpdate:
         assert isinstance(result, list)
         assert len(result) == 2
         assert sorted(result) == sorted(expected_months)
+
+
+class TestStreamingIngestion:
+    def test_stream_month_to_parquet(self, csv_server, tmp_path, sample_csv_content):
+        csv_dir, base_url = csv_server
+        (csv_dir / "scmd_provisional_202401.csv").write_text(sample_csv_content)
+        path = tmp_path / "out.parquet"
+
+        rows = stream_month_to_parquet(
+            "2024-01-01", f"{base_url}/scmd_provisional_202401.csv", path, block_size=256
+        )
+
+        table = pq.read_table(path)
+        assert rows == 2
+        assert table.column_names == [
+            "year_month", "ods_code", "vmp_snomed_code", "vmp_product_name",
+            "unit_of_measure_identifier", "unit_of_measure_name",
+            "total_quantity_in_vmp_unit", "indicative_cost"
+        ]
+        assert table.to_pylist()[1] == {
+            "year_month": date(2024, 1, 1),
+            "ods_code": "XYZ789",
+            "vmp_snomed_code": "87654321",
+            "vmp_product_name": "Another Product",
+            "unit_of_measure_identifier": "002",
+            "unit_of_measure_name": "millilitre",
+            "total_quantity_in_vmp_unit": 200.0,
+            "indicative_cost": 75.0,
+        }
+
+    def test_stream_month_to_parquet_matches_map_columns(self, csv_server, tmp_path):
+        csv_dir, base_url = csv_server
+        lines = ["YEAR_MONTH,ODS_CODE,VMP_SNOMED_CODE,VMP_PRODUCT_NAME,UNIT_OF_MEASURE_IDENTIFIER,UNIT_OF_MEASURE_NAME,TOTAL_QUANTITY_IN_VMP_UNIT,INDICATIVE_COST"]
+        lines += [
+            f"202402,ORG{i % 7},{1000 + i},Product {i},00{i % 3},MilliGram,{i}.5,"
+            for i in range(500)
+        ]
+        (csv_dir / "scmd_final_202402.csv").write_text("\n".join(lines))
+        path = tmp_path / "out.parquet"
+
+        # A small block size spreads the CSV over many batches
+        rows = stream_month_to_parquet(
+            "2024-02-01", f"{base_url}/scmd_final_202402.csv", path, block_size=1024
+        )
+
+        with patch("requests.get") as mock_get:
+            mock_get.return_value = Mock(text="\n".join(lines))
+            expected = map_columns(
+                process_month_data("2024-02-01", "https://example.com/test.csv")
+            )
+        result = pq.read_table(path).to_pandas()
+        assert rows == 500
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+    def test_stream_month_to_parquet_missing_file(self, csv_server, tmp_path):
+        _, base_url = csv_server
+
+        with pytest.raises(requests.HTTPError):
+            stream_month_to_parquet(
+                "2024-01-01", f"{base_url}/missing.csv", tmp_path / "out.parquet"
+            )
+
+    def test_import_months_loads_each_month(self, csv_server, tmp_path, sample_csv_content):
+        csv_dir, base_url = csv_server
+        months = ["2024-01-01", "2024-02-01", "2024-03-01"]
+        for month in months:
+            (csv_dir / f"{month}.csv").write_text(sample_csv_content)
+        loaded = {}
+        lock = threading.Lock()
+
+        def load_partition_file(path, partition_date, table_spec):
+            with lock:
+                loaded[partition_date] = (table_spec, pq.read_table(path).num_rows)
+
+        jobs = [
+            {
+                "month": month,
+                "url": f"{base_url}/{month}.csv",
+                "file_type": "provisional" if i else "finalised",
+                "table_spec": f"table_{i}",
+            }
+            for i, month in enumerate(months)
+        ]
+        with patch(
+            "pipeline.scmd.import_scmd_post_apr_2019.load_partition_file",
+            side_effect=load_partition_file,
+        ):
+            results = import_months(jobs, max_concurrent_months=2, work_dir=tmp_path)
+
+        assert results == [
+            {"month": "2024-01-01", "file_type": "finalised", "rows": 2},
+            {"month": "2024-02-01", "file_type": "provisional", "rows": 2},
+            {"month": "2024-03-01", "file_type": "provisional", "rows": 2},
+        ]
+        assert loaded == {
+            "2024-01-01": ("table_0", 2),
+            "2024-02-01": ("table_1", 2),
+            "2024-03-01": ("table_2", 2),
+        }
+        # Temporary Parquet files are removed once loaded
+        assert [p.name for p in tmp_path.iterdir()] == ["csv"]
+
+    def test_import_months_raises_failed_month(self, csv_server, tmp_path, sample_csv_content):
+        csv_dir, base_url = csv_server
+        (csv_dir / "2024-01-01.csv").write_text(sample_csv_content)
+        jobs = [
+            {"month": month, "url": f"{base_url}/{month}.csv", "file_type": "provisional", "table_spec": None}
+            for month in ["2024-01-01", "2024-02-01"]
+        ]
+
+        with patch("pipeline.scmd.import_scmd_post_apr_2019.load_partition_file"):
+            with pytest.raises(requests.HTTPError):
+                import_months(jobs, max_concurrent_months=2, work_dir=tmp_path)
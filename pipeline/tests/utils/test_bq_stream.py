@@ -0,0 +1,103 @@
+import pyarrow as pa
+import pytest
+
+from pipeline.load_data.load_ddd_quantity import ddd_data_query
+from pipeline.utils.bq_stream import (
+    chunk_record_batches,
+    extract_vmp_chunks,
+    stream_vmp_chunks,
+)
+
+
+def _batch(vmp_codes, values):
+    return pa.RecordBatch.from_pydict({"vmp_code": vmp_codes, "ddd_quantity": values})
+
+
+@pytest.fixture
+def sorted_batches():
+    # VMP 222 spans the first two batches and 333 spans the last three
+    return [
+        _batch(["111", "111", "222"], [1.0, 2.0, 3.0]),
+        _batch(["222", "333"], [4.0, 5.0]),
+        _batch([], []),
+        _batch(["333", "333"], [6.0, 7.0]),
+        _batch(["333", "444", "555"], [8.0, 9.0, 10.0]),
+    ]
+
+
+class FakeRowIterator:
+    def __init__(self, batches):
+        self.batches = batches
+        self.bqstorage_client = None
+
+    def to_arrow_iterable(self, bqstorage_client=None):
+        self.bqstorage_client = bqstorage_client
+        return iter(self.batches)
+
+
+class FakeQueryJob:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def result(self):
+        return self.rows
+
+
+class FakeBigQueryClient:
+    def __init__(self, batches):
+        self.queries = []
+        self.rows = FakeRowIterator(batches)
+
+    def query(self, query, job_config=None):
+        self.queries.append(query)
+        return FakeQueryJob(self.rows)
+
+
+@pytest.mark.parametrize(
+    "chunk_size, expected",
+    [
+        (1, [["111"], ["222"], ["333"], ["444"], ["555"]]),
+        (2, [["111", "222"], ["333", "444"], ["555"]]),
+        (3, [["111", "222", "333"], ["444", "555"]]),
+        (10, [["111", "222", "333", "444", "555"]]),
+    ],
+)
+def test_chunk_record_batches_keeps_each_vmp_in_one_chunk(
+    sorted_batches, chunk_size, expected
+):
+    tables = list(chunk_record_batches(sorted_batches, "vmp_code", chunk_size))
+
+    assert [sorted(set(t.column("vmp_code").to_pylist())) for t in tables] == expected
+    assert [v for t in tables for v in t.column("ddd_quantity").to_pylist()] == [
+        1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 9.0, 10.0
+    ]
+
+
+def test_chunk_record_batches_with_no_rows():
+    assert list(chunk_record_batches([_batch([], [])], "vmp_code", 2)) == []
+
+
+def test_stream_vmp_chunks_reads_the_table_once(sorted_batches):
+    client = FakeBigQueryClient(sorted_batches)
+    bqstorage_client = object()
+
+    chunks = list(
+        stream_vmp_chunks(
+            ddd_data_query(), 2, total_chunks=3, client=client, bqstorage_client=bqstorage_client
+        )
+    )
+
+    assert [(num, total, vmps) for num, total, vmps, _ in chunks] == [
+        (1, 3, ["111", "222"]),
+        (2, 3, ["333", "444"]),
+        (3, 3, ["555"]),
+    ]
+    assert chunks[1][3]["ddd_quantity"].tolist() == [5.0, 6.0, 7.0, 8.0, 9.0]
+    assert len(client.queries) == 1
+    assert "vmp_code IN" not in client.queries[0]
+    assert client.rows.bqstorage_client is bqstorage_client
+
+
+def test_extract_vmp_chunks_rejects_unknown_mode():
+    with pytest.raises(ValueError):
+        extract_vmp_chunks(["111"], 1, lambda *args: None, ddd_data_query(), extract_mode="csv")
@@ -0,0 +1,82 @@
+import pandas as pd
+import pytest
+
+from pipeline.utils.benchmark_pivot import run_benchmark
+from pipeline.utils.utils import pivot_to_dense, sparse_to_dense
+
+
+MONTHS = ["2024-01-01", "2024-02-01", "2024-03-01"]
+
+
+@pytest.fixture
+def long_rows():
+    return pd.DataFrame(
+        {
+            "vmp_code": ["222", "111", "111", "222", "111", "111"],
+            "ods_code": ["ORG1", "ORG1", "ORG1", "ORG2", "ORG1", "ORG2"],
+            "year_month": [
+                "2024-01-01", "2024-03-01", "2024-01-01", "2024-02-01", "2024-03-01", "2023-12-01"
+            ],
+            "quantity": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+        }
+    )
+
+
+def test_pivot_to_dense_overwrites_by_default(long_rows):
+    dense = pivot_to_dense(long_rows, ["vmp_code", "ods_code"], "quantity", MONTHS)
+
+    assert dense == {
+        ("222", "ORG1"): [1.0, 0.0, 0.0],
+        ("111", "ORG1"): [3.0, 0.0, 5.0],
+        ("222", "ORG2"): [0.0, 4.0, 0.0],
+        # Only row is outside the months
+        ("111", "ORG2"): [0.0, 0.0, 0.0],
+    }
+
+
+def test_pivot_to_dense_accumulates(long_rows):
+    dense = pivot_to_dense(
+        long_rows, ["vmp_code", "ods_code"], "quantity", MONTHS, accumulate=True
+    )
+
+    assert dense[("111", "ORG1")] == [3.0, 0.0, 7.0]
+
+
+def test_pivot_to_dense_ignores_non_numeric_values():
+    df = pd.DataFrame(
+        {
+            "vmp_code": ["111", "111", "111"],
+            "year_month": MONTHS,
+            "quantity": ["1.5", None, "n/a"],
+        }
+    )
+
+    assert pivot_to_dense(df, ["vmp_code"], "quantity", MONTHS) == {
+        ("111",): [1.5, 0.0, 0.0]
+    }
+
+
+def test_pivot_to_dense_empty():
+    df = pd.DataFrame(columns=["vmp_code", "ods_code", "year_month", "quantity"])
+
+    assert pivot_to_dense(df, ["vmp_code", "ods_code"], "quantity", MONTHS) == {}
+
+
+@pytest.mark.parametrize("accumulate", [True, False])
+def test_pivot_to_dense_matches_sparse_to_dense(long_rows, accumulate):
+    dense = pivot_to_dense(
+        long_rows, ["vmp_code", "ods_code"], "quantity", MONTHS, accumulate=accumulate
+    )
+
+    for key, group in long_rows.groupby(["vmp_code", "ods_code"]):
+        sparse = [[row.year_month, row.quantity] for row in group.itertuples(index=False)]
+        assert dense[key] == sparse_to_dense(sparse, MONTHS, accumulate=accumulate)
+
+
+def test_benchmark_pivot():
+    result = run_benchmark(rows=5_000, groups=200, n_months=12, repeat=1)
+
+    assert result["matches"]
+    assert result["groups"] <= 200
+    assert result["per_group_seconds"] > 0
+    assert result["vectorised_seconds"] > 0
@@ -0,0 +1,134 @@
+import re
+import threading
+
+import pandas as pd
+import pytest
+from unittest.mock import patch
+
+from pipeline.load_data.load_ddd_quantity import extract_ddd_data_by_vmps
+from pipeline.utils.prefetch import chunked, prefetch_chunks
+
+
+class FakeQueryJob:
+    def __init__(self, df):
+        self.df = df
+
+    def to_dataframe(self, create_bqstorage_client=False):
+        return self.df
+
+
+class FakeBigQueryClient:
+    """Answers DDD quantity queries with one row per VMP code in the IN list"""
+
+    def __init__(self):
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def query(self, query, job_config=None):
+        with self.lock:
+            self.queries.append(query)
+        vmp_codes = re.search(r"vmp_code IN \(([^)]*)\)", query).group(1)
+        vmp_codes = [code.strip(" '") for code in vmp_codes.split(",")]
+        return FakeQueryJob(
+            pd.DataFrame(
+                {
+                    "vmp_code": vmp_codes,
+                    "year_month": ["2024-01-01"] * len(vmp_codes),
+                    "ods_code": ["ORG1"] * len(vmp_codes),
+                    "ddd_quantity": [1.0] * len(vmp_codes),
+                    "ddd_value": [2.0] * len(vmp_codes),
+                    "ddd_unit": ["g"] * len(vmp_codes),
+                    "ingredient_code": [None] * len(vmp_codes),
+                }
+            )
+        )
+
+
+def test_chunked():
+    assert chunked([1, 2, 3, 4, 5], 2) == [[1, 2], [3, 4], [5]]
+    assert chunked([], 2) == []
+
+
+@pytest.mark.parametrize("prefetch", [0, 1, 3])
+def test_yields_chunks_in_order(prefetch):
+    results = list(
+        prefetch_chunks(
+            list(range(7)),
+            3,
+            lambda chunk, chunk_num, total: [x * 10 for x in chunk],
+            prefetch=prefetch,
+        )
+    )
+
+    assert results == [
+        (1, 3, [0, 1, 2], [0, 10, 20]),
+        (2, 3, [3, 4, 5], [30, 40, 50]),
+        (3, 3, [6], [60]),
+    ]
+
+
+def test_empty_items_yield_nothing():
+    assert list(prefetch_chunks([], 10, lambda *args: pytest.fail("fetched"))) == []
+
+
+def test_next_chunk_is_fetched_while_current_chunk_is_processed():
+    second_chunk_fetched = threading.Event()
+
+    def fetch(chunk, chunk_num, total):
+        if chunk_num == 2:
+            second_chunk_fetched.set()
+        return chunk
+
+    chunks = prefetch_chunks([1, 2, 3], 1, fetch, prefetch=1)
+    next(chunks)
+
+    assert second_chunk_fetched.wait(timeout=5)
+    chunks.close()
+
+
+@pytest.mark.parametrize("prefetch", [1, 2])
+def test_fetches_ahead_are_bounded(prefetch):
+    started = []
+    lock = threading.Lock()
+
+    def fetch(chunk, chunk_num, total):
+        with lock:
+            started.append(chunk_num)
+        return chunk
+
+    for chunk_num, _, _, _ in prefetch_chunks(list(range(10)), 1, fetch, prefetch=prefetch):
+        with lock:
+            assert max(started) <= chunk_num + prefetch
+
+
+def test_fetch_error_is_raised_at_its_chunk():
+    def fetch(chunk, chunk_num, total):
+        if chunk_num == 2:
+            raise RuntimeError("query failed")
+        return chunk
+
+    chunks = prefetch_chunks([1, 2, 3], 1, fetch, prefetch=2)
+
+    assert next(chunks)[0] == 1
+    with pytest.raises(RuntimeError, match="query failed"):
+        next(chunks)
+
+
+def test_prefetches_bigquery_extracts_with_fake_client():
+    fake_client = FakeBigQueryClient()
+    vmp_codes = [f"{code:05d}" for code in range(5)]
+
+    with patch(
+        "pipeline.load_data.load_ddd_quantity.get_bigquery_client",
+        return_value=fake_client,
+    ):
+        results = list(
+            prefetch_chunks(vmp_codes, 2, extract_ddd_data_by_vmps, prefetch=2)
+        )
+
+    assert [(chunk_num, total) for chunk_num, total, _, _ in results] == [
+        (1, 3), (2, 3), (3, 3)
+    ]
+    for _, _, chunk, df in results:
+        assert df["vmp_code"].tolist() == list(chunk)
+    assert len(fake_client.queries) == 3
@@ -0,0 +1,138 @@
+import io
+
+import pytest
+from unittest.mock import Mock, patch
+
+from pipeline.dmd.import_dmd_supp import iter_history_batches
+from pipeline.utils.benchmark_xml import run_benchmark
+from pipeline.utils.utils import load_json_batches
+from pipeline.utils.xml_stream import child_text, iter_elements, iter_record_batches
+
+
+SAMPLE_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<DMDXML>
+    <VMPS>
+        <VMP><VPID>1</VPID><BNF>0403030E0</BNF></VMP>
+        <VMP><VPID>2</VPID></VMP>
+        <VMP><VPID>3</VPID><BNF>0501013</BNF></VMP>
+    </VMPS>
+    <AMPS>
+        <AMP><APID>99</APID></AMP>
+    </AMPS>
+</DMDXML>"""
+
+
+def vmp_record(elem):
+    return {"vmp_code": child_text(elem, "VPID"), "bnf_code": child_text(elem, "BNF")}
+
+
+def test_iter_elements_yields_matching_elements_with_children():
+    codes = [
+        (child_text(elem, "VPID"), child_text(elem, "BNF"))
+        for elem in iter_elements(io.BytesIO(SAMPLE_XML), {"VMP"})
+    ]
+
+    assert codes == [("1", "0403030E0"), ("2", None), ("3", "0501013")]
+
+
+def test_iter_elements_clears_elements_once_consumed():
+    elements = list(iter_elements(io.BytesIO(SAMPLE_XML), {"VMP"}))
+
+    assert len(elements) == 3
+    assert all(len(elem) == 0 for elem in elements)
+
+
+def test_iter_elements_with_namespaced_tags():
+    xml = b"""<dataroot xmlns:z="#RowsetSchema">
+        <z:row ATCCode="A" Name="ONE"/>
+        <z:row ATCCode="B" Name="TWO"/>
+    </dataroot>"""
+
+    rows = [
+        dict(elem.attrib)
+        for elem in iter_elements(io.BytesIO(xml), {"{#RowsetSchema}row"})
+    ]
+
+    assert rows == [{"ATCCode": "A", "Name": "ONE"}, {"ATCCode": "B", "Name": "TWO"}]
+
+
+@pytest.mark.parametrize(
+    "batch_size, expected_sizes", [(1, [1, 1, 1]), (2, [2, 1]), (3, [3]), (10, [3])]
+)
+def test_iter_record_batches(batch_size, expected_sizes):
+    batches = list(
+        iter_record_batches(io.BytesIO(SAMPLE_XML), {"VMP"}, vmp_record, batch_size)
+    )
+
+    assert [len(batch) for batch in batches] == expected_sizes
+    assert [record["vmp_code"] for batch in batches for record in batch] == ["1", "2", "3"]
+
+
+def test_iter_record_batches_skips_none_records():
+    def with_bnf(elem):
+        record = vmp_record(elem)
+        return record if record["bnf_code"] else None
+
+    batches = list(iter_record_batches(io.BytesIO(SAMPLE_XML), {"VMP"}, with_bnf))
+
+    assert batches == [
+        [
+            {"vmp_code": "1", "bnf_code": "0403030E0"},
+            {"vmp_code": "3", "bnf_code": "0501013"},
+        ]
+    ]
+
+
+def test_iter_history_batches(tmp_path):
+    xml_file = tmp_path / "history.xml"
+    xml_file.write_text(
+        """<HISTORY>
+            <VTM><IDCURRENT>1</IDCURRENT><IDPREVIOUS>2</IDPREVIOUS><STARTDT>2023-01-01</STARTDT></VTM>
+            <UOM><IDCURRENT>3</IDCURRENT><IDPREVIOUS>4</IDPREVIOUS><STARTDT>2023-02-01</STARTDT><ENDDT>2023-03-01</ENDDT></UOM>
+            <ROUTE><IDCURRENT>5</IDCURRENT><IDPREVIOUS>6</IDPREVIOUS><STARTDT>2023-04-01</STARTDT></ROUTE>
+        </HISTORY>"""
+    )
+
+    batches = list(iter_history_batches(xml_file, batch_size=2))
+
+    assert [len(batch) for batch in batches] == [2, 1]
+    assert batches[0][1] == {
+        "current_id": "3",
+        "previous_id": "4",
+        "start_date": "2023-02-01",
+        "end_date": "2023-03-01",
+        "entity_type": "UOM",
+    }
+    assert batches[1][0]["entity_type"] == "ROUTE"
+
+
+@patch("pipeline.utils.utils.get_bigquery_client")
+def test_load_json_batches_truncates_then_appends(mock_get_client):
+    client = mock_get_client.return_value
+    client.load_table_from_json.side_effect = lambda batch, table_id, job_config: Mock(
+        output_rows=len(batch)
+    )
+    table_spec = Mock(schema=[], full_table_id="project.dataset.table")
+
+    rows = load_json_batches(iter([[{"a": 1}, {"a": 2}], [], [{"a": 3}]]), table_spec)
+
+    assert rows == 3
+    calls = client.load_table_from_json.call_args_list
+    assert [call.args[0] for call in calls] == [[{"a": 1}, {"a": 2}], [{"a": 3}]]
+    assert [call.kwargs["job_config"].write_disposition for call in calls] == [
+        "WRITE_TRUNCATE",
+        "WRITE_APPEND",
+    ]
+
+
+@patch("pipeline.utils.utils.get_bigquery_client")
+def test_load_json_batches_leaves_table_when_empty(mock_get_client):
+    assert load_json_batches(iter([]), Mock()) == 0
+    mock_get_client.return_value.load_table_from_json.assert_not_called()
+
+
+def test_benchmark_xml():
+    result = run_benchmark(records=2_000, batch_size=100)
+
+    assert result["matches"]
+    assert result["streamed_peak_bytes"] < result["whole_tree_peak_bytes"]
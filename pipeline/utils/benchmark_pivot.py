@@ -0,0 +1,88 @@
+import argparse
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from pipeline.utils.utils import pivot_to_dense, sparse_to_dense
+
+
+def synthetic_chunk(
+    rows: int, groups: int, n_months: int, seed: int = 0
+) -> Tuple[pd.DataFrame, List[str]]:
+    """A loader-shaped chunk of rows spread over groups (VMP, org) pairs and n_months months"""
+    months = [str(m.date()) for m in pd.date_range("2019-01-01", periods=n_months, freq="MS")]
+    rng = np.random.default_rng(seed)
+    group_ids = rng.integers(0, groups, rows)
+    df = pd.DataFrame(
+        {
+            "vmp_code": (group_ids // 100).astype(str),
+            "ods_code": (group_ids % 100).astype(str),
+            "year_month": np.asarray(months)[rng.integers(0, n_months, rows)],
+            "quantity": rng.random(rows) * 100,
+        }
+    )
+    return df, months
+
+
+def per_group_pivot(df: pd.DataFrame, months: List[str]) -> Dict:
+    """The loaders' previous approach: groupby, itertuples and sparse_to_dense per group"""
+    dense = {}
+    for key, group in df.groupby(["vmp_code", "ods_code"]):
+        sparse = [[row.year_month, float(row.quantity)] for row in group.itertuples(index=False)]
+        dense[key] = sparse_to_dense(sparse, months, accumulate=True)
+    return dense
+
+
+def _best_time(func, repeat: int) -> Tuple[float, Dict]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def run_benchmark(
+    rows: int = 1_000_000, groups: int = 20_000, n_months: int = 60, repeat: int = 3
+) -> Dict:
+    """Best-of-repeat timings of both pivots on one synthetic chunk, and whether they agree"""
+    df, months = synthetic_chunk(rows, groups, n_months)
+    per_group_time, per_group = _best_time(lambda: per_group_pivot(df, months), repeat)
+    vectorised_time, vectorised = _best_time(
+        lambda: pivot_to_dense(df, ["vmp_code", "ods_code"], "quantity", months, accumulate=True),
+        repeat,
+    )
+    matches = per_group.keys() == vectorised.keys() and all(
+        np.allclose(per_group[key], vectorised[key]) for key in per_group
+    )
+    return {
+        "rows": rows,
+        "groups": len(vectorised),
+        "months": n_months,
+        "per_group_seconds": per_group_time,
+        "vectorised_seconds": vectorised_time,
+        "matches": matches,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare per-group sparse_to_dense with pivot_to_dense on a synthetic chunk"
+    )
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Rows in the chunk (default: 1,000,000)")
+    parser.add_argument("--groups", type=int, default=20_000, help="Distinct (VMP, org) pairs (default: 20,000)")
+    parser.add_argument("--months", type=int, default=60, help="Months in the dense arrays (default: 60)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per approach; the fastest is reported (default: 3)")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.rows, args.groups, args.months, max(1, args.repeat))
+    print(
+        f"{result['rows']:,} rows, {result['groups']:,} groups, {result['months']} months\n"
+        f"Per-group sparse_to_dense: {result['per_group_seconds']:.3f}s\n"
+        f"pivot_to_dense:            {result['vectorised_seconds']:.3f}s"
+    )
+    if result["vectorised_seconds"] > 0:
+        print(f"Speed-up: {result['per_group_seconds'] / result['vectorised_seconds']:.1f}x")
+    print("Results match" if result["matches"] else "Results differ")
@@ -0,0 +1,99 @@
+import argparse
+import tempfile
+import tracemalloc
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Callable, Dict, Tuple
+
+from pipeline.utils.xml_stream import child_text, iter_record_batches
+
+
+ENTITY_TYPES = ["VTM", "VMP", "ING", "SUPP", "FORM", "ROUTE", "UOM"]
+FIELDS = ["IDCURRENT", "IDPREVIOUS", "STARTDT", "ENDDT"]
+
+
+def write_synthetic_history(path: Path, records: int) -> None:
+    """A dm+d history-shaped file with records entities spread over the entity types"""
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<HISTORY>\n')
+        for i in range(records):
+            tag = ENTITY_TYPES[i % len(ENTITY_TYPES)]
+            f.write(
+                f"<{tag}><IDCURRENT>{10_000_000 + i}</IDCURRENT>"
+                f"<IDPREVIOUS>{20_000_000 + i}</IDPREVIOUS>"
+                f"<STARTDT>2020-01-01</STARTDT><ENDDT>2024-12-31</ENDDT></{tag}>\n"
+            )
+        f.write("</HISTORY>\n")
+
+
+def _record(entity: ET.Element) -> Dict:
+    return {field: child_text(entity, field) for field in FIELDS} | {
+        "entity_type": entity.tag
+    }
+
+
+def parse_whole_tree(path: Path) -> int:
+    """The previous approach: ET.parse and findall into one list of records"""
+    root = ET.parse(path).getroot()
+    data = []
+    for entity_type in ENTITY_TYPES:
+        data.extend(_record(entity) for entity in root.findall(f".//{entity_type}"))
+    return len(data)
+
+
+def parse_streamed(path: Path, batch_size: int) -> int:
+    """iter_record_batches, handing each batch on before reading the next"""
+    return sum(
+        len(batch)
+        for batch in iter_record_batches(path, set(ENTITY_TYPES), _record, batch_size)
+    )
+
+
+def _peak_memory(func: Callable[[], int]) -> Tuple[int, int]:
+    tracemalloc.start()
+    try:
+        records = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, records
+
+
+def run_benchmark(records: int = 500_000, batch_size: int = 50_000) -> Dict:
+    """Peak traced memory of both parsers over one synthetic file, and whether they agree"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "history.xml"
+        write_synthetic_history(path, records)
+        whole_tree_peak, whole_tree_records = _peak_memory(lambda: parse_whole_tree(path))
+        streamed_peak, streamed_records = _peak_memory(
+            lambda: parse_streamed(path, batch_size)
+        )
+        file_size = path.stat().st_size
+
+    return {
+        "records": records,
+        "batch_size": batch_size,
+        "file_bytes": file_size,
+        "whole_tree_peak_bytes": whole_tree_peak,
+        "streamed_peak_bytes": streamed_peak,
+        "matches": whole_tree_records == streamed_records == records,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare peak memory of whole-tree and streaming XML parsing on a synthetic dm+d history file"
+    )
+    parser.add_argument("--records", type=int, default=500_000, help="Entities in the file (default: 500,000)")
+    parser.add_argument("--batch-size", type=int, default=50_000, help="Records per streamed batch (default: 50,000)")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.records, max(1, args.batch_size))
+    mb = 1024 * 1024
+    print(
+        f"{result['records']:,} records, {result['file_bytes'] / mb:.1f} MB file, "
+        f"batches of {result['batch_size']:,}\n"
+        f"ET.parse + findall peak: {result['whole_tree_peak_bytes'] / mb:.1f} MB\n"
+        f"iterparse batches peak:  {result['streamed_peak_bytes'] / mb:.1f} MB"
+    )
+    print("Record counts match" if result["matches"] else "Record counts differ")
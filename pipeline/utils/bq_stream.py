@@ -0,0 +1,108 @@
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from google.cloud import bigquery
+
+from pipeline.utils.prefetch import prefetch_chunks
+from pipeline.utils.utils import get_bigquery_client, get_bigquery_storage_client
+
+
+EXTRACT_MODES = ("query", "storage")
+
+
+def iter_query_record_batches(
+    query: str, client=None, bqstorage_client=None
+) -> Iterator[pa.RecordBatch]:
+    """
+    Run query once and stream its result as Arrow record batches over the
+    BigQuery Storage Read API.
+
+    The result of a query with an ORDER BY is read through a single stream,
+    so batches arrive in query order.
+    """
+    client = client or get_bigquery_client()
+    bqstorage_client = bqstorage_client or get_bigquery_storage_client()
+    job_config = bigquery.QueryJobConfig(use_query_cache=False, allow_large_results=True)
+    rows = client.query(query, job_config=job_config).result()
+    yield from rows.to_arrow_iterable(bqstorage_client=bqstorage_client)
+
+
+def chunk_record_batches(
+    batches: Iterable[pa.RecordBatch], key: str, chunk_size: int
+) -> Iterator[pa.Table]:
+    """
+    Regroup record batches sorted by key into tables of chunk_size distinct
+    keys each, without splitting a key across tables.
+
+    Batches are sliced rather than copied; key boundaries are found with one
+    vectorised comparison per batch.
+    """
+    pending: List[pa.RecordBatch] = []
+    keys_in_chunk = 0
+    last_key = None
+
+    for batch in batches:
+        if batch.num_rows == 0:
+            continue
+        keys = batch.column(key).to_numpy(zero_copy_only=False)
+        starts = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        if keys[0] != last_key:
+            starts = np.concatenate(([0], starts))
+        last_key = keys[-1]
+
+        offset = 0
+        for start in starts:
+            if keys_in_chunk == chunk_size:
+                if start > offset:
+                    pending.append(batch.slice(offset, start - offset))
+                yield pa.Table.from_batches(pending)
+                pending, keys_in_chunk, offset = [], 0, start
+            keys_in_chunk += 1
+        pending.append(batch.slice(offset))
+
+    if pending:
+        yield pa.Table.from_batches(pending)
+
+
+def stream_vmp_chunks(
+    query: str,
+    vmp_chunk_size: int,
+    total_chunks: Optional[int] = None,
+    client=None,
+    bqstorage_client=None,
+) -> Iterator[Tuple[int, Optional[int], List[str], pd.DataFrame]]:
+    """
+    Yield (chunk_num, total_chunks, vmp_codes, df) for a query ordered by
+    vmp_code, read in a single pass with vmp_chunk_size VMPs per chunk.
+    """
+    batches = iter_query_record_batches(query, client, bqstorage_client)
+    for chunk_num, table in enumerate(
+        chunk_record_batches(batches, "vmp_code", vmp_chunk_size), start=1
+    ):
+        df = table.to_pandas()
+        yield chunk_num, total_chunks, df["vmp_code"].unique().tolist(), df
+
+
+def extract_vmp_chunks(
+    vmp_codes: Sequence[str],
+    vmp_chunk_size: int,
+    extract_chunk: Callable[[Sequence[str], int, int], pd.DataFrame],
+    query: str,
+    extract_mode: str = "query",
+    prefetch: int = 2,
+) -> Iterator[Tuple[int, Optional[int], Sequence[str], pd.DataFrame]]:
+    """
+    (chunk_num, total_chunks, vmp_codes, df) for each VMP chunk of a quantity loader.
+
+    "query" runs extract_chunk once per chunk with prefetch_chunks; "storage"
+    runs query, the loader's whole-table query ordered by vmp_code, once and
+    splits the Arrow stream into chunks.
+    """
+    if extract_mode not in EXTRACT_MODES:
+        raise ValueError(f"Invalid extract mode: {extract_mode}")
+    if extract_mode == "storage":
+        total_chunks = (len(vmp_codes) + vmp_chunk_size - 1) // vmp_chunk_size
+        return stream_vmp_chunks(query, vmp_chunk_size, total_chunks)
+    return prefetch_chunks(vmp_codes, vmp_chunk_size, extract_chunk, prefetch=prefetch)
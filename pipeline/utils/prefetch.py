@@ -0,0 +1,62 @@
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterator, List, Sequence, Tuple
+
+
+def chunked(items: Sequence, chunk_size: int) -> List[Sequence]:
+    """Split items into consecutive chunks of at most chunk_size"""
+    return [items[i : i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+
+def prefetch_chunks(
+    items: Sequence,
+    chunk_size: int,
+    fetch: Callable[[Sequence, int, int], Any],
+    prefetch: int = 2,
+) -> Iterator[Tuple[int, int, Sequence, Any]]:
+    """
+    Yield (chunk_num, total_chunks, chunk, fetch(chunk, chunk_num, total_chunks))
+    in chunk order, fetching up to prefetch chunks ahead on a thread pool.
+
+    While the caller transforms and writes one chunk, the BigQuery queries for
+    the next chunks run in the background. At most prefetch fetches are in
+    flight or waiting to be consumed, so memory is bounded by prefetch + 1
+    chunk results. prefetch=0 fetches each chunk only when it is needed.
+
+    Each fetch runs in a copy of the caller's context, so Prefect tasks and
+    loggers called from fetch see the flow run. An exception from fetch is
+    raised when its chunk is reached; fetches not yet started are cancelled.
+    """
+    chunks = chunked(items, chunk_size)
+    total_chunks = len(chunks)
+    if not chunks:
+        return
+
+    pending = deque()
+    next_chunk = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, prefetch)) as executor:
+
+        def submit_up_to(limit):
+            nonlocal next_chunk
+            while next_chunk < total_chunks and len(pending) < limit:
+                chunk_num = next_chunk + 1
+                chunk = chunks[next_chunk]
+                context = contextvars.copy_context()
+                pending.append(
+                    (chunk_num, chunk, executor.submit(context.run, fetch, chunk, chunk_num, total_chunks))
+                )
+                next_chunk += 1
+
+        try:
+            while next_chunk < total_chunks or pending:
+                submit_up_to(max(1, prefetch))
+                chunk_num, chunk, future = pending.popleft()
+                result = future.result()
+                # Start the following fetch before handing this chunk over
+                submit_up_to(prefetch)
+                yield chunk_num, total_chunks, chunk, result
+        finally:
+            for _, _, future in pending:
+                future.cancel()
@@ -0,0 +1,136 @@
+import hashlib
+from array import array
+from collections import Counter
+from typing import Callable, Iterable, List, Optional, Sequence
+
+from django.db import connection, transaction
+
+
+def content_hash(*values) -> str:
+    """Stable hash of a row's loaded values (e.g. quantity unit id and data array)"""
+    return hashlib.md5(repr(values).encode()).hexdigest()
+
+
+class QuantityUpsert:
+    """
+    Diff-and-upsert writer for one dense quantity table over a whole load.
+
+    Each written row gets a content_hash of its value fields. Rows whose hash
+    matches the stored one are skipped, new and changed rows are written with
+    INSERT ... ON CONFLICT DO UPDATE, and the key of every row seen is kept so
+    rows that were not part of the load can be deleted in one statement at the
+    end. stats counts inserted, updated, unchanged, failed and deleted rows.
+    """
+
+    def __init__(
+        self,
+        model,
+        key_fields: Sequence[str],
+        value_fields: Sequence[str] = ("data",),
+        batch_size: int = 500,
+    ):
+        self.model = model
+        self.key_fields = list(key_fields)
+        self.value_fields = list(value_fields)
+        self.batch_size = batch_size
+        self.key_columns = [model._meta.get_field(f).column for f in self.key_fields]
+        self.value_attnames = [model._meta.get_field(f).attname for f in self.value_fields]
+        self.seen_keys = {column: array("q") for column in self.key_columns}
+        self.stats = Counter()
+
+    def _key(self, obj) -> tuple:
+        return tuple(getattr(obj, column) for column in self.key_columns)
+
+    def _stored_hashes(self, objs) -> dict:
+        vmp_ids = {obj.vmp_id for obj in objs}
+        rows = self.model.objects.filter(vmp_id__in=vmp_ids).values_list(
+            *self.key_columns, "content_hash"
+        )
+        return {tuple(row[:-1]): row[-1] for row in rows}
+
+    def write(
+        self,
+        objs: Iterable,
+        on_error: Optional[Callable[[Exception, int], None]] = None,
+    ) -> Counter:
+        """Upsert new and changed rows; returns the counts for this call"""
+        objs = list(objs)
+        counts = Counter()
+        if not objs:
+            return counts
+
+        stored = self._stored_hashes(objs)
+        pending = []
+        for obj in objs:
+            obj.content_hash = content_hash(*(getattr(obj, a) for a in self.value_attnames))
+            key = self._key(obj)
+            for column, value in zip(self.key_columns, key):
+                self.seen_keys[column].append(value)
+            if key not in stored:
+                pending.append((obj, "inserted"))
+            elif stored[key] != obj.content_hash:
+                pending.append((obj, "updated"))
+            else:
+                counts["unchanged"] += 1
+
+        for i in range(0, len(pending), self.batch_size):
+            sub_batch = pending[i : i + self.batch_size]
+            try:
+                with transaction.atomic():
+                    self.model.objects.bulk_create(
+                        [obj for obj, _ in sub_batch],
+                        batch_size=self.batch_size,
+                        update_conflicts=True,
+                        unique_fields=self.key_fields,
+                        update_fields=[*self.value_fields, "content_hash"],
+                    )
+                counts.update(outcome for _, outcome in sub_batch)
+            except Exception as e:
+                if on_error is None:
+                    raise
+                on_error(e, i // self.batch_size + 1)
+                counts["failed"] += len(sub_batch)
+
+        self.stats.update(counts)
+        return counts
+
+    def delete_orphans(self) -> int:
+        """Delete every row whose key was not written during this load"""
+        table = self.model._meta.db_table
+        key_list = ", ".join(self.key_columns)
+        unnest = ", ".join(["%s::bigint[]"] * len(self.key_columns))
+        matches = " AND ".join(f"k.{c} = t.{c}" for c in self.key_columns)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                DELETE FROM {table} t
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM unnest({unnest}) AS k({key_list})
+                    WHERE {matches}
+                )
+                """,
+                [list(self.seen_keys[c]) for c in self.key_columns],
+            )
+            deleted = cursor.rowcount
+        self.stats["deleted"] += deleted
+        return deleted
+
+    @property
+    def rows_touched(self) -> int:
+        return self.stats["inserted"] + self.stats["updated"] + self.stats["deleted"]
+
+    def summary(self) -> str:
+        return (
+            f"{self.model.__name__}: {self.rows_touched:,} rows touched "
+            f"({self.stats['inserted']:,} inserted, {self.stats['updated']:,} updated, "
+            f"{self.stats['deleted']:,} deleted), {self.stats['unchanged']:,} unchanged, "
+            f"{self.stats['failed']:,} failed"
+        )
+
+
+def rows_touched_report(writers: List[QuantityUpsert]) -> dict:
+    """Per-table counts for the flow result"""
+    return {
+        writer.model._meta.db_table: {**writer.stats, "rows_touched": writer.rows_touched}
+        for writer in writers
+    }
@@ -2,17 +2,18 @@ import os
 import sys
 import django
 
+import numpy as np
 import pandas as pd
-import xml.etree.ElementTree as ET
 
 from pathlib import Path
-from google.cloud import bigquery
+from google.cloud import bigquery, bigquery_storage
 from prefect import get_run_logger, task
 from prefect.blocks.system import Secret
 from prefect_gcp import GcpCredentials
 from jinja2 import Template
 from environs import Env
 from pipeline.setup import config
+from pipeline.utils.xml_stream import iter_record_batches
 from pathlib import Path
 from google.cloud import storage
 from django.conf import settings
@@ -29,6 +30,13 @@ def get_bigquery_client() -> bigquery.Client:
     )
 
 
+def get_bigquery_storage_client() -> bigquery_storage.BigQueryReadClient:
+    """Create and return a BigQuery Storage Read API client"""
+    credentials = GcpCredentials.load("bq")
+    google_credentials = credentials.get_credentials_from_service_account()
+    return bigquery_storage.BigQueryReadClient(credentials=google_credentials)
+
+
 def execute_bigquery_query_from_sql_file(sql_file: str):
     """Execute a BigQuery query from a SQL file with Jinja templating support.
     
@@ -128,16 +136,17 @@ def parse_xml(file_path: Path) -> pd.DataFrame:
     logger = get_run_logger()
     logger.info(f"Parsing {file_path}")
 
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-
-    data = []
-    for row in root.findall(".//z:row", namespaces={"z": "#RowsetSchema"}):
-        row_data = {
+    def parse_row(row):
+        return {
             k: v.strip() if isinstance(v, str) else v
             for k, v in row.attrib.items()
         }
-        data.append(row_data)
+
+    data = [
+        row_data
+        for batch in iter_record_batches(file_path, {"{#RowsetSchema}row"}, parse_row)
+        for row_data in batch
+    ]
 
     return pd.DataFrame(data)
 
@@ -162,6 +171,34 @@ def load_to_bigquery(df: pd.DataFrame, table_spec) -> None:
     logger.info(f"Loaded {len(df)} rows to {table_spec.full_table_id}")
 
 
+def load_json_batches(batches, table_spec) -> int:
+    """
+    Load batches of JSON records into a BigQuery table, replacing its contents
+    with the first batch and appending the rest. Returns the rows loaded.
+
+    Nothing is loaded, and the table is left as it was, when there are no batches.
+    """
+    client = get_bigquery_client()
+    rows = 0
+    write_disposition = bigquery.WriteDisposition.WRITE_TRUNCATE
+
+    for batch in batches:
+        if not batch:
+            continue
+        job_config = bigquery.LoadJobConfig(
+            schema=table_spec.schema,
+            write_disposition=write_disposition,
+        )
+        job = client.load_table_from_json(
+            batch, table_spec.full_table_id, job_config=job_config
+        )
+        job.result()
+        rows += job.output_rows
+        write_disposition = bigquery.WriteDisposition.WRITE_APPEND
+
+    return rows
+
+
 @task
 def cleanup_temp_files(temp_dir: Path) -> None:
     """Clean up temporary files"""
@@ -216,6 +253,52 @@ def sparse_to_dense(sparse_array, months, accumulate=False):
                     dense[idx] = value
     return dense
 
+
+def pivot_to_dense(df, key_columns, value_column, months, accumulate=False):
+    """
+    Pivot long rows into one dense array per key, aligned to months.
+
+    Equivalent to calling sparse_to_dense on the (year_month, value) rows of
+    each group of key_columns, but done in one pass: year_month is mapped to a
+    month index with categorical codes, keys to group codes with factorize,
+    and values are scattered into an (n_groups, n_months) array. Rows for
+    months outside months or with non-numeric values are ignored. With
+    accumulate, values for the same group and month are summed; otherwise the
+    last wins.
+
+    Returns {key tuple: [qty0, qty1, ...]} in order of first appearance.
+    """
+    if len(df) == 0 or not months:
+        return {}
+
+    month_idx = pd.Categorical(df["year_month"].astype(str), categories=months).codes
+    values = pd.to_numeric(df[value_column], errors="coerce").to_numpy(dtype=float)
+    valid = (month_idx >= 0) & ~np.isnan(values)
+
+    # Factorizing each key column and combining the codes is much faster
+    # than factorizing tuples of keys
+    combined = np.zeros(len(df), dtype=np.int64)
+    column_uniques = []
+    for column in key_columns:
+        column_codes, uniques = pd.factorize(df[column], use_na_sentinel=False)
+        combined = combined * len(uniques) + column_codes
+        column_uniques.append(uniques)
+    codes, combined_uniques = pd.factorize(combined)
+
+    key_parts = []
+    for uniques in reversed(column_uniques):
+        key_parts.append(uniques.take(combined_uniques % len(uniques)))
+        combined_uniques = combined_uniques // len(uniques)
+    keys = list(zip(*reversed(key_parts)))
+
+    dense = np.zeros((len(keys), len(months)))
+    if accumulate:
+        np.add.at(dense, (codes[valid], month_idx[valid]), values[valid])
+    else:
+        dense[codes[valid], month_idx[valid]] = values[valid]
+    return dict(zip(keys, dense.tolist()))
+
+
 def execute_bigquery_query(query: str, timeout=600) -> list:
     """Execute a BigQuery query and return all results"""
     logger = get_run_logger()
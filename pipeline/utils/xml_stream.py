@@ -0,0 +1,69 @@
+import xml.etree.ElementTree as ET
+from typing import Callable, Collection, Iterator, List, Optional
+
+
+XML_BATCH_SIZE = 50_000
+
+
+def iter_elements(source, tags: Collection[str]) -> Iterator[ET.Element]:
+    """
+    Yield each complete element whose tag is in tags, streaming the XML with
+    iterparse.
+
+    Namespaced tags are given as "{namespace}name". Each element is cleared
+    and detached once the consumer moves on, as is anything outside a
+    matching element, so memory stays flat however large the file is.
+    Elements must be read before asking for the next one.
+    """
+    tags = set(tags)
+    stack: List[ET.Element] = []
+    open_matches = 0
+
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            stack.append(elem)
+            if elem.tag in tags:
+                open_matches += 1
+            continue
+
+        stack.pop()
+        if elem.tag in tags:
+            open_matches -= 1
+            yield elem
+        elif open_matches:
+            # Part of a matching element that is still being read
+            continue
+
+        elem.clear()
+        if stack:
+            stack[-1].remove(elem)
+
+
+def iter_record_batches(
+    source,
+    tags: Collection[str],
+    parse_record: Callable[[ET.Element], Optional[dict]],
+    batch_size: int = XML_BATCH_SIZE,
+) -> Iterator[List[dict]]:
+    """
+    Yield lists of up to batch_size records, one per element in tags as parsed
+    by parse_record. Elements for which parse_record returns None are skipped.
+    """
+    batch = []
+    for elem in iter_elements(source, tags):
+        record = parse_record(elem)
+        if record is None:
+            continue
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def child_text(elem: ET.Element, tag: str) -> Optional[str]:
+    """Text of elem's first tag child, or None if it is missing or empty"""
+    child = elem.find(tag)
+    return child.text if child is not None else None
+
@@ -97,6 +97,7 @@ export async function executeAnalysisFetch({
     quantityType,
     selectedScope,
     odsCodes,
+    format = 'ndjson',
 } = {}) {
     const response = await fetchImpl(endpoint, {
         method: 'POST',
@@ -104,14 +105,15 @@ export async function executeAnalysisFetch({
             'Content-Type': 'application/json',
             'X-CSRFToken': csrftoken,
         },
-        body: JSON.stringify(
-            buildAnalysisRequestPayload({
+        body: JSON.stringify({
+            ...buildAnalysisRequestPayload({
                 selectedProducts: resolvedProducts,
                 quantityType,
                 scope: selectedScope,
                 odsCodes,
-            })
-        ),
+            }),
+            format,
+        }),
     });
 
     if (!response.ok) {
@@ -119,8 +121,130 @@ export async function executeAnalysisFetch({
         throw new Error(data.error || `HTTP error! status: ${response.status}`);
     }
 
-    const data = await response.json();
-    return { months: data.months ?? [], items: data.items ?? [] };
+    return format === 'binary'
+        ? readQuantityBinary(response)
+        : readQuantityNdjson(response);
+}
+
+async function* readLines(response) {
+    if (!response.body?.getReader) {
+        yield* (await response.text()).split('\n');
+        return;
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        yield* lines;
+    }
+    yield buffer + decoder.decode();
+}
+
+/**
+ * Reads a get-quantity-data NDJSON response into { months, items }.
+ *
+ * The first line holds the months and the VMP metadata list, {"org": ...}
+ * lines add to the organisation list, and rows refer to both by index.
+ * Rows are expanded into the same items the JSON response returns.
+ *
+ * The server sends {"end": true, "rows": n} after the last row, or
+ * {"error": ...} if it failed part way; a stream that stops without the
+ * end line, or with a different number of rows, is rejected as incomplete.
+ */
+export async function readQuantityNdjson(response) {
+    let months = [];
+    let vmps = [];
+    const orgs = [];
+    const items = [];
+    let end = null;
+
+    for await (const line of readLines(response)) {
+        if (!line.trim()) continue;
+        if (end) {
+            throw new Error('Unexpected data after the end of the quantity data');
+        }
+        const record = JSON.parse(line);
+        if (record.error) {
+            throw new Error(record.error);
+        }
+        if (record.end) {
+            end = record;
+        } else if ('months' in record) {
+            months = record.months;
+            vmps = record.vmps ?? [];
+        } else if (record.vmp === undefined) {
+            orgs.push(record.org);
+        } else {
+            const org = record.org === null ? null : orgs[record.org];
+            const item = {
+                ...vmps[record.vmp],
+                organisation__ods_code: org?.ods_code ?? null,
+                organisation__ods_name: org?.ods_name ?? null,
+                organisation__region: org?.region ?? null,
+                organisation__icb: org?.icb ?? null,
+                data: record.data,
+            };
+            if ('unit' in record) {
+                item.unit = record.unit;
+            }
+            items.push(item);
+        }
+    }
+
+    if (!end || end.rows !== items.length) {
+        throw new Error('Incomplete quantity data response');
+    }
+
+    return { months, items };
+}
+
+/**
+ * Reads a binary get-quantity-data response into { months, items }.
+ *
+ * The body is a big-endian uint32 header length, the JSON header, then the
+ * values of every row as one little-endian Float64 matrix starting on an
+ * 8-byte boundary. Header rows index into the vmps, orgs and units lists and
+ * give each row's length; the first `placeholders` rows carry no unit.
+ * A body whose values do not match the row lengths is rejected.
+ */
+export async function readQuantityBinary(response) {
+    const buffer = await response.arrayBuffer();
+    const headerLength = new DataView(buffer).getUint32(0);
+    const header = JSON.parse(
+        new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength))
+    );
+    const { vmp, org: orgRefs, unit, length } = header.rows;
+    const valuesLength = buffer.byteLength - 4 - headerLength;
+    if (valuesLength !== length.reduce((total, n) => total + n, 0) * 8) {
+        throw new Error('Incomplete quantity data response');
+    }
+    const values = new Float64Array(buffer, 4 + headerLength);
+    const items = [];
+
+    let offset = 0;
+    for (let i = 0; i < vmp.length; i++) {
+        const org = orgRefs[i] === null ? null : header.orgs[orgRefs[i]];
+        const item = {
+            ...header.vmps[vmp[i]],
+            organisation__ods_code: org?.ods_code ?? null,
+            organisation__ods_name: org?.ods_name ?? null,
+            organisation__region: org?.region ?? null,
+            organisation__icb: org?.icb ?? null,
+            data: Array.from(values.subarray(offset, offset + length[i])),
+        };
+        if (i >= header.placeholders) {
+            item.unit = unit[i] === null ? null : header.units[unit[i]];
+        }
+        items.push(item);
+        offset += length[i];
+    }
+
+    return { months: header.months, items };
 }
 
 export function completeAnalysisRun({
@@ -0,0 +1,77 @@
+import { describe, it, expect } from 'vitest';
+import { readQuantityBinary } from '../../components/analyse/lib/runAnalysis.js';
+
+const VMP = { vmp__code: '123', vmp__name: 'Test VMP' };
+const ORG = { ods_code: 'R1', ods_name: 'Trust A', region: 'Region 1', icb: 'ICB 1' };
+
+/**
+ * A body laid out as build_quantity_binary writes it: a big-endian uint32
+ * header length, the JSON header padded with spaces so the values start on an
+ * 8-byte boundary, then the values as little-endian float64.
+ */
+function binaryBody(header, values) {
+    let headerText = JSON.stringify(header);
+    headerText += ' '.repeat((8 - ((4 + headerText.length) % 8)) % 8);
+    const headerBytes = new TextEncoder().encode(headerText);
+    const buffer = new ArrayBuffer(4 + headerBytes.length + values.length * 8);
+    const view = new DataView(buffer);
+    view.setUint32(0, headerBytes.length);
+    new Uint8Array(buffer, 4).set(headerBytes);
+    values.forEach((value, i) => view.setFloat64(4 + headerBytes.length + i * 8, value, true));
+    return buffer;
+}
+
+const HEADER = {
+    months: ['2024-01-01', '2024-02-01'],
+    vmps: [VMP],
+    orgs: [ORG],
+    units: ['DDD'],
+    placeholders: 1,
+    rows: { vmp: [0, 0, 0], org: [null, 0, null], unit: [null, 0, null], length: [0, 2, 1] },
+};
+
+describe('readQuantityBinary', () => {
+    it('expands the packed rows into the JSON response items', async () => {
+        const result = await readQuantityBinary(new Response(binaryBody(HEADER, [1.5, 0.1, 7])));
+
+        expect(result).toEqual({
+            months: ['2024-01-01', '2024-02-01'],
+            items: [
+                {
+                    ...VMP,
+                    organisation__ods_code: null,
+                    organisation__ods_name: null,
+                    organisation__region: null,
+                    organisation__icb: null,
+                    data: [],
+                },
+                {
+                    ...VMP,
+                    organisation__ods_code: 'R1',
+                    organisation__ods_name: 'Trust A',
+                    organisation__region: 'Region 1',
+                    organisation__icb: 'ICB 1',
+                    data: [1.5, 0.1],
+                    unit: 'DDD',
+                },
+                {
+                    ...VMP,
+                    organisation__ods_code: null,
+                    organisation__ods_name: null,
+                    organisation__region: null,
+                    organisation__icb: null,
+                    data: [7],
+                    unit: null,
+                },
+            ],
+        });
+    });
+
+    it('rejects a body with fewer values than the rows need', async () => {
+        const body = binaryBody(HEADER, [1.5, 0.1]);
+
+        await expect(readQuantityBinary(new Response(body))).rejects.toThrow(
+            'Incomplete quantity data response'
+        );
+    });
+});
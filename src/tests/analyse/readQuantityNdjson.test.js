@@ -0,0 +1,93 @@
+import { describe, it, expect } from 'vitest';
+import { readQuantityNdjson } from '../../components/analyse/lib/runAnalysis.js';
+
+const VMP = { vmp__code: '123', vmp__name: 'Test VMP' };
+const ORG = { ods_code: 'R1', ods_name: 'Trust A', region: 'Region 1', icb: 'ICB 1' };
+
+function ndjson(...records) {
+    return records.map((record) => JSON.stringify(record)).join('\n') + '\n';
+}
+
+function streamedResponse(text, chunkSize) {
+    const bytes = new TextEncoder().encode(text);
+    const stream = new ReadableStream({
+        start(controller) {
+            for (let i = 0; i < bytes.length; i += chunkSize) {
+                controller.enqueue(bytes.slice(i, i + chunkSize));
+            }
+            controller.close();
+        },
+    });
+    return new Response(stream);
+}
+
+const COMPLETE_BODY = ndjson(
+    { months: ['2024-01-01', '2024-02-01'], vmps: [VMP] },
+    { vmp: 0, org: null, data: [] },
+    { org: ORG },
+    { vmp: 0, org: 0, unit: 'DDD', data: [1.5, 2] },
+    { end: true, rows: 2 },
+);
+
+describe('readQuantityNdjson', () => {
+    it('expands rows into the JSON response items', async () => {
+        const result = await readQuantityNdjson(new Response(COMPLETE_BODY));
+
+        expect(result).toEqual({
+            months: ['2024-01-01', '2024-02-01'],
+            items: [
+                {
+                    ...VMP,
+                    organisation__ods_code: null,
+                    organisation__ods_name: null,
+                    organisation__region: null,
+                    organisation__icb: null,
+                    data: [],
+                },
+                {
+                    ...VMP,
+                    organisation__ods_code: 'R1',
+                    organisation__ods_name: 'Trust A',
+                    organisation__region: 'Region 1',
+                    organisation__icb: 'ICB 1',
+                    data: [1.5, 2],
+                    unit: 'DDD',
+                },
+            ],
+        });
+    });
+
+    it('reads lines split across stream chunks', async () => {
+        const expected = await readQuantityNdjson(new Response(COMPLETE_BODY));
+
+        await expect(readQuantityNdjson(streamedResponse(COMPLETE_BODY, 7))).resolves.toEqual(expected);
+    });
+
+    it('rejects a stream that stops before the end line', async () => {
+        const truncated = COMPLETE_BODY.slice(0, COMPLETE_BODY.indexOf('{"end"'));
+
+        await expect(readQuantityNdjson(new Response(truncated))).rejects.toThrow(
+            'Incomplete quantity data response'
+        );
+    });
+
+    it('rejects a stream whose end line counts a different number of rows', async () => {
+        const body = COMPLETE_BODY.replace('"rows":2', '"rows":3');
+
+        await expect(readQuantityNdjson(new Response(body))).rejects.toThrow(
+            'Incomplete quantity data response'
+        );
+    });
+
+    it('rejects a stream that ends with an error line', async () => {
+        const body = ndjson(
+            { months: ['2024-01-01'], vmps: [VMP] },
+            { vmp: 0, org: null, data: [] },
+            { error: 'An error occurred while processing the request' },
+        );
+
+        await expect(readQuantityNdjson(new Response(body))).rejects.toThrow(
+            'An error occurred while processing the request'
+        );
+    });
+});
@@ -385,13 +385,16 @@ class ContentCacheAdmin(admin.ModelAdmin):
             level=messages.INFO
         )
         
+        from django.core.cache import cache
         from django.template.response import TemplateResponse
+        metrics = getattr(cache, 'metrics', None)
         context = {
             'opts': self.model._meta,
             'app_label': self.model._meta.app_label,
             'title': 'Content Cache',
             'refresh_url': 'refresh-content-cache/',
             'clear_url': 'clear-content-cache/',
+            'cache_metrics': metrics() if metrics else None,
             **self.admin_site.each_context(request),
             **(extra_context or {}),
         }
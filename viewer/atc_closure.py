@@ -0,0 +1,29 @@
+"""
+Maintenance of VMPATCAncestor, the closure of the ATC hierarchy over VMPs.
+
+A VMP tagged with N02BE01 gets a row for N02BE01 and for each of its ancestors
+in the ATC table (N02BE, N02B, N02 and N), so the VMPs under any ATC level are
+found with an equality lookup on the ATC instead of a prefix match.
+"""
+from django.db import connection, transaction
+
+from .models import ATC, VMP, VMPATCAncestor
+
+
+def _rebuild_sql():
+    return f"""
+    INSERT INTO {VMPATCAncestor._meta.db_table} (atc_id, vmp_id)
+    SELECT DISTINCT ancestor.id, va.vmp_id
+    FROM {VMP.atcs.through._meta.db_table} va
+    JOIN {ATC._meta.db_table} a ON a.id = va.atc_id
+    CROSS JOIN LATERAL generate_series(1, length(a.code)) AS prefix(length)
+    JOIN {ATC._meta.db_table} ancestor ON ancestor.code = left(a.code, prefix.length)
+    """
+
+
+def rebuild_atc_closure():
+    """Rebuild VMPATCAncestor from the VMP ATC links; returns the number of rows written."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {VMPATCAncestor._meta.db_table}")
+        cursor.execute(_rebuild_sql())
+        return cursor.rowcount
@@ -0,0 +1,256 @@
+import pickle
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, defaultdict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.functional import cached_property
+
+
+GENERATION_KEY = 'tiered_cache:generation'
+
+_MISSING = object()
+
+
+class TieredCache(BaseCache):
+    """
+    Per-process LRU cache in front of a shared cache backend.
+
+    Values are pickled into the local tier, which is bounded by MAX_BYTES and
+    evicts least recently used entries. Reads fall through to the shared cache
+    (SHARED_CACHE, another CACHES alias) and are kept locally for at most
+    LOCAL_TIMEOUT seconds.
+
+    Every key has a version token in the shared cache, written with the value
+    by set and replaced by incr, by add and by a delete that removed the key.
+    Local entries remember the token they were read with. Every process
+    fetches the tokens of the keys it holds at most once per SYNC_INTERVAL
+    seconds, in one get_many, and drops the entries whose token changed, so a
+    change made elsewhere (e.g. the measures list chart version bump in
+    compute_measures) reaches all web processes within that interval without
+    dropping unrelated entries. clear() replaces a global token that drops
+    every local entry.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options.get('SHARED_CACHE', 'shared')
+        self._max_bytes = options.get('MAX_BYTES', 64 * 1024 * 1024)
+        self._max_entry_bytes = options.get('MAX_ENTRY_BYTES', self._max_bytes // 4)
+        self._local_timeout = options.get('LOCAL_TIMEOUT', 300)
+        self._sync_interval = options.get('SYNC_INTERVAL', 5)
+
+        # local key -> (expiry, pickled value, key, version, token)
+        self._local = OrderedDict()
+        self._local_bytes = 0
+        self._lock = threading.RLock()
+        self._generation = _MISSING
+        self._synced_at = None
+        self._stats = Counter()
+
+    @cached_property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    @staticmethod
+    def _token_key(key):
+        return f'{GENERATION_KEY}:{key}'
+
+    def _new_token(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        """Store a new version token for key, invalidating other processes' copies."""
+        token = uuid.uuid4().hex
+        self.shared.set(self._token_key(key), token, timeout=timeout, version=version)
+        return token
+
+    def _tombstone_timeout(self):
+        # Local copies live at most LOCAL_TIMEOUT, so the token only has to
+        # outlast them
+        if self._local_timeout is None:
+            return None
+        return self._local_timeout + self._sync_interval
+
+    def _local_expiry(self, timeout=DEFAULT_TIMEOUT):
+        expiry = self.get_backend_timeout(timeout)
+        if self._local_timeout is None:
+            return expiry
+        local_expiry = time.time() + self._local_timeout
+        return local_expiry if expiry is None else min(expiry, local_expiry)
+
+    def _sync(self):
+        now = time.monotonic()
+        if self._synced_at is not None and now - self._synced_at < self._sync_interval:
+            return
+
+        keys_by_version = defaultdict(list, {None: []})
+        with self._lock:
+            for _, _, key, version, _ in self._local.values():
+                keys_by_version[version].append(key)
+        tokens = {}
+        for version, keys in keys_by_version.items():
+            names = [self._token_key(key) for key in keys]
+            if version is None:
+                names.append(GENERATION_KEY)
+            tokens.update(
+                ((name, version), token)
+                for name, token in self.shared.get_many(names, version=version).items()
+            )
+
+        with self._lock:
+            generation = tokens.get((GENERATION_KEY, None))
+            if generation != self._generation:
+                self._clear_local()
+                self._generation = generation
+            else:
+                stale = [
+                    local_key
+                    for local_key, (_, _, key, version, token) in self._local.items()
+                    if tokens.get((self._token_key(key), version)) != token
+                ]
+                for local_key in stale:
+                    self._discard_local(local_key)
+                self._stats['invalidations'] += len(stale)
+            self._synced_at = now
+
+    def _clear_local(self):
+        with self._lock:
+            self._local.clear()
+            self._local_bytes = 0
+
+    def _discard_local(self, local_key):
+        with self._lock:
+            entry = self._local.pop(local_key, None)
+            if entry is not None:
+                self._local_bytes -= len(entry[1])
+
+    def _store_local(self, local_key, value, expiry, key, version, token):
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._discard_local(local_key)
+            if len(pickled) > self._max_entry_bytes:
+                self._stats['oversized'] += 1
+                return
+            self._local[local_key] = (expiry, pickled, key, version, token)
+            self._local_bytes += len(pickled)
+            while self._local_bytes > self._max_bytes:
+                _, (_, evicted, *_) = self._local.popitem(last=False)
+                self._local_bytes -= len(evicted)
+                self._stats['evictions'] += 1
+
+    def _get_local(self, local_key):
+        with self._lock:
+            entry = self._local.get(local_key)
+            if entry is None:
+                return _MISSING
+            expiry, pickled = entry[:2]
+            if expiry is not None and expiry <= time.time():
+                self._discard_local(local_key)
+                return _MISSING
+            self._local.move_to_end(local_key)
+        return pickle.loads(pickled)
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        self._sync()
+        value = self._get_local(local_key)
+        if value is not _MISSING:
+            self._count('local_hits')
+            return value
+
+        token_key = self._token_key(key)
+        found = self.shared.get_many([key, token_key], version=version)
+        if key not in found:
+            self._count('misses')
+            return default
+        self._count('shared_hits')
+        value = found[key]
+        self._store_local(
+            local_key, value, self._local_expiry(), key, version, found.get(token_key)
+        )
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        self._sync()
+        token = uuid.uuid4().hex
+        self.shared.set_many(
+            {key: value, self._token_key(key): token}, timeout=timeout, version=version
+        )
+        self._store_local(local_key, value, self._local_expiry(timeout), key, version, token)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        self._sync()
+        added = self.shared.add(key, value, timeout=timeout, version=version)
+        if added:
+            token = self._new_token(key, timeout=timeout, version=version)
+            self._store_local(
+                local_key, value, self._local_expiry(timeout), key, version, token
+            )
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout=timeout, version=version)
+
+    def has_key(self, key, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        self._sync()
+        if self._get_local(local_key) is not _MISSING:
+            return True
+        return self.shared.has_key(key, version=version)
+
+    def delete(self, key, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        deleted = self.shared.delete(key, version=version)
+        self._discard_local(local_key)
+        if deleted:
+            self._new_token(key, timeout=self._tombstone_timeout(), version=version)
+        return deleted
+
+    def incr(self, key, delta=1, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        value = self.shared.incr(key, delta, version=version)
+        self._discard_local(local_key)
+        self._new_token(key, version=version)
+        return value
+
+    def clear(self):
+        self.shared.clear()
+        generation = uuid.uuid4().hex
+        self.shared.set(GENERATION_KEY, generation, timeout=None)
+        with self._lock:
+            self._clear_local()
+            self._generation = generation
+
+    def clear_local(self):
+        """Drop this process's local tier, e.g. between tests."""
+        with self._lock:
+            self._clear_local()
+            self._generation = _MISSING
+            self._synced_at = None
+
+    def metrics(self):
+        """Hit/miss counters and local tier size for this process."""
+        with self._lock:
+            stats = dict(self._stats)
+            entries = len(self._local)
+            local_bytes = self._local_bytes
+        lookups = sum(stats.get(name, 0) for name in ('local_hits', 'shared_hits', 'misses'))
+        return {
+            'local_hits': stats.get('local_hits', 0),
+            'shared_hits': stats.get('shared_hits', 0),
+            'misses': stats.get('misses', 0),
+            'local_hit_rate': stats.get('local_hits', 0) / lookups if lookups else None,
+            'evictions': stats.get('evictions', 0),
+            'oversized': stats.get('oversized', 0),
+            'invalidations': stats.get('invalidations', 0),
+            'local_entries': entries,
+            'local_bytes': local_bytes,
+            'max_bytes': self._max_bytes,
+        }
@@ -0,0 +1,287 @@
+import json
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+
+from viewer.models import (
+    Measure,
+    PrecomputedMeasureAggregatedSeries,
+    PrecomputedMeasureSeries,
+    PrecomputedPercentileSeries,
+)
+from viewer.views.measures import build_measure_item_payload
+
+
+SERIES_TABLES = tuple(
+    model._meta.db_table
+    for model in (
+        PrecomputedMeasureSeries,
+        PrecomputedMeasureAggregatedSeries,
+        PrecomputedPercentileSeries,
+    )
+)
+ROW_TABLES = (
+    'benchmark_precomputedmeasure',
+    'benchmark_precomputedmeasureaggregated',
+    'benchmark_precomputedpercentile',
+)
+
+
+# The per-month tables the series replaced, with the same columns, constraints
+# and indexes, filled from the series (one row per month with a value)
+CREATE_ROWS_SQL = (
+    """
+    CREATE TEMPORARY TABLE benchmark_precomputedmeasure (
+        id bigserial PRIMARY KEY,
+        measure_id bigint NOT NULL,
+        organisation_id bigint NOT NULL,
+        month date NOT NULL,
+        quantity double precision,
+        numerator double precision,
+        denominator double precision,
+        UNIQUE (measure_id, organisation_id, month)
+    );
+    CREATE INDEX ON benchmark_precomputedmeasure (measure_id, organisation_id, month);
+    CREATE INDEX ON benchmark_precomputedmeasure (measure_id);
+    CREATE INDEX ON benchmark_precomputedmeasure (organisation_id);
+    INSERT INTO benchmark_precomputedmeasure
+        (measure_id, organisation_id, month, quantity, numerator, denominator)
+    SELECT
+        s.measure_id, s.organisation_id,
+        (s.start_month + (v.i - 1) * interval '1 month')::date,
+        v.quantity, v.numerator, v.denominator
+    FROM viewer_precomputedmeasureseries s
+    CROSS JOIN LATERAL unnest(s.quantity, s.numerator, s.denominator)
+        WITH ORDINALITY AS v(quantity, numerator, denominator, i)
+    WHERE v.quantity IS NOT NULL
+    """,
+    """
+    CREATE TEMPORARY TABLE benchmark_precomputedmeasureaggregated (
+        id bigserial PRIMARY KEY,
+        measure_id bigint NOT NULL,
+        label varchar(255),
+        month date NOT NULL,
+        quantity double precision,
+        numerator double precision,
+        denominator double precision,
+        category varchar(20) NOT NULL,
+        UNIQUE (measure_id, category, label, month)
+    );
+    CREATE INDEX ON benchmark_precomputedmeasureaggregated (measure_id, category, label, month);
+    CREATE INDEX ON benchmark_precomputedmeasureaggregated (measure_id);
+    INSERT INTO benchmark_precomputedmeasureaggregated
+        (measure_id, category, label, month, quantity, numerator, denominator)
+    SELECT
+        s.measure_id, s.category, s.label,
+        (s.start_month + (v.i - 1) * interval '1 month')::date,
+        v.quantity, v.numerator, v.denominator
+    FROM viewer_precomputedmeasureaggregatedseries s
+    CROSS JOIN LATERAL unnest(s.quantity, s.numerator, s.denominator)
+        WITH ORDINALITY AS v(quantity, numerator, denominator, i)
+    WHERE v.quantity IS NOT NULL
+    """,
+    """
+    CREATE TEMPORARY TABLE benchmark_precomputedpercentile (
+        id bigserial PRIMARY KEY,
+        measure_id bigint NOT NULL,
+        month date NOT NULL,
+        percentile integer NOT NULL,
+        quantity double precision,
+        UNIQUE (measure_id, month, percentile)
+    );
+    CREATE INDEX ON benchmark_precomputedpercentile (measure_id, month, percentile);
+    CREATE INDEX ON benchmark_precomputedpercentile (measure_id);
+    INSERT INTO benchmark_precomputedpercentile (measure_id, percentile, month, quantity)
+    SELECT
+        s.measure_id, s.percentile,
+        (s.start_month + (v.i - 1) * interval '1 month')::date,
+        v.quantity
+    FROM viewer_precomputedpercentileseries s
+    CROSS JOIN LATERAL unnest(s.quantity) WITH ORDINALITY AS v(quantity, i)
+    WHERE v.quantity IS NOT NULL
+    """,
+)
+
+ORG_ROWS_SQL = """
+    SELECT o.ods_code, r.month, r.quantity, r.numerator, r.denominator
+    FROM benchmark_precomputedmeasure r
+    JOIN viewer_organisation o ON o.id = r.organisation_id
+    WHERE r.measure_id = %s
+    ORDER BY o.ods_name, r.organisation_id, r.month
+"""
+
+AGGREGATED_ROWS_SQL = """
+    SELECT category, label, month, quantity, numerator, denominator
+    FROM benchmark_precomputedmeasureaggregated
+    WHERE measure_id = %s
+    ORDER BY category, label, month
+"""
+
+PERCENTILE_ROWS_SQL = """
+    SELECT month, percentile, quantity
+    FROM benchmark_precomputedpercentile
+    WHERE measure_id = %s
+    ORDER BY month, percentile
+"""
+
+
+def build_rows_payload(measure_id):
+    """The measure item payload built from the per-month rows, grouped by month as it used to be."""
+    with connection.cursor() as cursor:
+        cursor.execute(ORG_ROWS_SQL, [measure_id])
+        org_data = defaultdict(list)
+        for ods_code, month, quantity, numerator, denominator in cursor.fetchall():
+            org_data[ods_code].append({
+                'month': month, 'quantity': quantity,
+                'numerator': numerator, 'denominator': denominator,
+            })
+
+        cursor.execute(AGGREGATED_ROWS_SQL, [measure_id])
+        aggregated = {'region': {}, 'icb': {}, 'national': {}}
+        for category, label, month, quantity, numerator, denominator in cursor.fetchall():
+            aggregated[category].setdefault(label, []).append({
+                'month': month, 'quantity': quantity,
+                'numerator': numerator, 'denominator': denominator,
+            })
+
+        cursor.execute(PERCENTILE_ROWS_SQL, [measure_id])
+        percentiles = [
+            {'measure_id': measure_id, 'month': month, 'percentile': percentile, 'quantity': quantity}
+            for month, percentile, quantity in cursor.fetchall()
+        ]
+
+    def series_list(category):
+        return [{'name': label, 'data': data} for label, data in aggregated[category].items()]
+
+    national = next(iter(aggregated['national'].values()), [])
+    return {
+        'org_data': json.dumps(dict(org_data), cls=DjangoJSONEncoder),
+        'region_data': json.dumps(series_list('region'), cls=DjangoJSONEncoder),
+        'icb_data': json.dumps(series_list('icb'), cls=DjangoJSONEncoder),
+        'national_data': json.dumps({'name': 'National', 'data': national}, cls=DjangoJSONEncoder),
+        'percentile_data': json.dumps(percentiles, cls=DjangoJSONEncoder),
+    }
+
+
+def _format_bytes(size):
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def _table_stats(table):
+    """(row count, total size, index size) of a table."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT COUNT(*), pg_total_relation_size(%s), pg_indexes_size(%s) FROM {table}",
+            [table, table],
+        )
+        return cursor.fetchone()
+
+
+def _time_page_builds(build, measure_ids, repeat):
+    """Best-of-repeat total time to build every measure item page payload."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for measure_id in measure_ids:
+            build(measure_id)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the columnar series tables with the per-month layout they '
+        'replaced, rebuilt from the series in temporary tables: row counts, '
+        'table and index sizes, and measure item page build time'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--measures',
+            type=int,
+            default=10,
+            help='Number of measures to build pages for (those with the most rows are used)',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Number of runs per layout; the fastest run is reported',
+        )
+
+    def handle(self, *args, **options):
+        repeat = max(1, options['repeat'])
+
+        # The temporary tables are dropped with the rolled-back transaction
+        with transaction.atomic():
+            self.compare(options['measures'], repeat)
+            transaction.set_rollback(True)
+
+    def compare(self, measure_count, repeat):
+        with connection.cursor() as cursor:
+            for sql in CREATE_ROWS_SQL:
+                cursor.execute(sql)
+
+        self.stdout.write(f"{'Table':<40} {'Rows':>10} {'Total size':>12} {'Index size':>12}")
+        totals = {}
+        for layout, tables in (('rows', ROW_TABLES), ('series', SERIES_TABLES)):
+            layout_rows = layout_size = layout_index_size = 0
+            for table in tables:
+                rows, total_size, index_size = _table_stats(table)
+                self.stdout.write(
+                    f"{table:<40} {rows:>10} "
+                    f"{_format_bytes(total_size):>12} {_format_bytes(index_size):>12}"
+                )
+                layout_rows += rows
+                layout_size += total_size
+                layout_index_size += index_size
+            totals[layout] = (layout_rows, layout_size, layout_index_size)
+            self.stdout.write(
+                f"{'All ' + layout + ' tables':<40} {layout_rows:>10} "
+                f"{_format_bytes(layout_size):>12} {_format_bytes(layout_index_size):>12}"
+            )
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT measure_id FROM benchmark_precomputedmeasure
+                GROUP BY measure_id ORDER BY COUNT(*) DESC, measure_id LIMIT %s
+                """,
+                [measure_count],
+            )
+            measure_ids = [measure_id for (measure_id,) in cursor.fetchall()]
+        if not measure_ids:
+            self.stdout.write(self.style.ERROR(
+                'No measures have series; run compute_measures first'
+            ))
+            return
+
+        names = dict(Measure.objects.filter(id__in=measure_ids).values_list('id', 'short_name'))
+        self.stdout.write(
+            f"Building item pages for {len(measure_ids)} measures (best of {repeat}): "
+            + ', '.join(names.get(m) or str(m) for m in measure_ids)
+        )
+
+        rows_time = _time_page_builds(build_rows_payload, measure_ids, repeat)
+        series_time = _time_page_builds(build_measure_item_payload, measure_ids, repeat)
+
+        self.stdout.write(f"Per-month rows: {rows_time:.3f}s")
+        self.stdout.write(f"Series:         {series_time:.3f}s")
+        if series_time > 0:
+            self.stdout.write(f"Speed-up: {rows_time / series_time:.1f}x")
+        rows_count, series_count = totals['rows'][0], totals['series'][0]
+        if series_count:
+            self.stdout.write(f"Row count reduction: {rows_count / series_count:.1f}x")
+
+        rows_data = [build_rows_payload(m) for m in measure_ids]
+        series_data = [build_measure_item_payload(m) for m in measure_ids]
+        if rows_data == series_data:
+            self.stdout.write(self.style.SUCCESS('Page data matches'))
+        else:
+            self.stdout.write(self.style.ERROR('Page data differs between layouts'))
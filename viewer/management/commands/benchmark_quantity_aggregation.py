@@ -0,0 +1,116 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from viewer.quantity_aggregation import (
+    QUANTITY_MODELS,
+    aggregate_quantities,
+    aggregate_quantities_python,
+)
+from viewer.search import MAX_ANALYSIS_VMP_COUNT
+
+
+QUANTITY_TYPE_CODES = {
+    'scmd': "SCMD Quantity",
+    'dose': "Unit Dose Quantity",
+    'ingredient': "Ingredient Quantity",
+    'ddd': "Defined Daily Dose Quantity",
+}
+
+
+def _time_call(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+
+def _results_match(expected, actual, tolerance=1e-6):
+    if expected.keys() != actual.keys():
+        return False
+    for key, group in expected.items():
+        other = actual[key]
+        if group['organisation'] != other['organisation']:
+            return False
+        if len(group['data']) != len(other['data']):
+            return False
+        if any(abs(a - b) > tolerance for a, b in zip(group['data'], other['data'])):
+            return False
+    return True
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks in-database quantity aggregation against the Python '
+        'element-wise aggregation used previously by get_quantity_data'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--quantity-type',
+            choices=sorted(QUANTITY_TYPE_CODES),
+            default='scmd',
+            help='Quantity table to aggregate',
+        )
+        parser.add_argument(
+            '--scope',
+            choices=['trust', 'national'],
+            default='national',
+            help='Group by (VMP, successor org) for trust, or by VMP for national',
+        )
+        parser.add_argument(
+            '--vmp-count',
+            type=int,
+            default=MAX_ANALYSIS_VMP_COUNT,
+            help='Number of VMPs to aggregate (those with the most rows are used)',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Number of runs per engine; the fastest run is reported',
+        )
+
+    def handle(self, *args, **options):
+        model = QUANTITY_MODELS[QUANTITY_TYPE_CODES[options['quantity_type']]]
+        national = options['scope'] == 'national'
+        repeat = max(1, options['repeat'])
+
+        vmp_ids = list(
+            model.objects.values('vmp_id')
+            .annotate(row_count=Count('id'))
+            .order_by('-row_count')
+            .values_list('vmp_id', flat=True)[:options['vmp_count']]
+        )
+        if not vmp_ids:
+            self.stdout.write(self.style.ERROR(f'No {model.__name__} rows found'))
+            return
+
+        row_count = model.objects.filter(vmp_id__in=vmp_ids).count()
+        self.stdout.write(
+            f"Aggregating {row_count} {model.__name__} rows for {len(vmp_ids)} VMPs "
+            f"({options['scope']} scope, best of {repeat})"
+        )
+
+        python_result, python_time = _time_call(
+            lambda: aggregate_quantities_python(model, vmp_ids, national=national),
+            repeat,
+        )
+        sql_result, sql_time = _time_call(
+            lambda: aggregate_quantities(model, vmp_ids, national=national),
+            repeat,
+        )
+
+        self.stdout.write(f"Python aggregation: {python_time:.3f}s ({len(python_result)} groups)")
+        self.stdout.write(f"SQL aggregation:    {sql_time:.3f}s ({len(sql_result)} groups)")
+        if sql_time > 0:
+            self.stdout.write(f"Speed-up: {python_time / sql_time:.1f}x")
+
+        if _results_match(python_result, sql_result):
+            self.stdout.write(self.style.SUCCESS('Results match'))
+        else:
+            self.stdout.write(self.style.ERROR('Results differ between engines'))
@@ -1,17 +1,23 @@
-import math
+import hashlib
 import time
-from django.db.models import F
-from django.db.models import Case, When, IntegerField, CharField
-from django.core.management.base import BaseCommand
-from django.db import transaction
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
 
 from viewer.models import (
     Measure,
-    MeasureVMP, 
-    PrecomputedMeasure, 
-    PrecomputedMeasureAggregated, 
-    PrecomputedPercentile,
+    MeasureComputation,
+    MeasureVMP,
+    PrecomputedMeasureAggregatedSeries,
+    PrecomputedMeasureSeries,
+    PrecomputedPercentileSeries,
     Dose,
     IngredientQuantity,
     DDDQuantity,
@@ -21,45 +27,262 @@ from viewer.models import (
     DataStatus
 )
 from viewer.views.measures import (
+    PERCENTILE_LEVELS,
     invalidate_measures_list_chart_cache,
     invalidate_measure_item_cache,
+    save_measure_item_payload,
 )
 from viewer.utils import get_ddd_unit_map
+from viewer.measure_computation import (
+    ABSOLUTE_MEASURE,
+    EXTERNAL_DENOMINATOR_MEASURE,
+    PRODUCT_RATIO_MEASURE,
+    MeasureInputs,
+    QuantityScan,
+    compute_measure,
+    month_fingerprints,
+    sum_by_org,
+)
+from viewer.measure_series import month_offset
 from viewer.measure_denominators import (
-    compute_rate_from_totals,
     get_external_denominator,
-    get_external_denominator_values_by_org_month,
+    get_rate_scale,
 )
 
 
+MODEL_MAPPING = {
+    'scmd': SCMDQuantity,
+    'dose': Dose,
+    'ingredient': IngredientQuantity,
+    'ddd': DDDQuantity,
+    'indicative_cost': IndicativeCost,
+}
+
+BATCH_SIZE = 1000
+
+MEASURES_DIR = Path(__file__).parent.parent.parent / 'measures'
+
+
+def organisations_fingerprint():
+    """Hash of the successor and geography mapping used to group organisations."""
+    digest = hashlib.sha256()
+    for row in Organisation.objects.order_by('id').values_list(
+        'id', 'successor_id', 'icb__name', 'region__name'
+    ):
+        digest.update(repr(row).encode())
+    return digest.hexdigest()
+
+
+def measure_fingerprint(measure, measurevmps, organisations=''):
+    """
+    Hash of everything that decides which rows a measure produces: its
+    definition.yaml, the vmps.sql output stored as MeasureVMPs, the measure
+    fields compute_measures reads and the organisations fingerprint.
+    """
+    digest = hashlib.sha256(organisations.encode())
+    definition = MEASURES_DIR / measure.slug / 'definition.yaml'
+    if definition.exists():
+        digest.update(definition.read_bytes())
+    digest.update(f"{measure.quantity_type}|{measure.denominator_type}".encode())
+    for vmp_id, vmp_type in sorted((mv.vmp_id, mv.type) for mv in measurevmps):
+        digest.update(f"|{vmp_id}:{vmp_type}".encode())
+    return digest.hexdigest()
+
+
+def external_denominator_values_for(measure, loaded):
+    """The measure's external denominator values, loaded once per denominator into loaded."""
+    external_denominator = get_external_denominator(measure)
+    if external_denominator is None:
+        return None
+    if external_denominator.key not in loaded:
+        loaded[external_denominator.key] = external_denominator.get_values_by_org_month()
+    return loaded[external_denominator.key]
+
+
+def rebuild_reason(all_months, computation, fingerprint):
+    """Why a measure needs a full rebuild rather than an update of changed months, or None."""
+    if computation is None or computation.fingerprint != fingerprint:
+        return 'no previous run with the current definition and VMPs'
+    if not computation.month_fingerprints:
+        return 'no month fingerprints from the previous run'
+    current = {month.isoformat() for month in all_months}
+    if any(month not in current for month in computation.data_status):
+        return 'months were removed'
+    if min(computation.data_status) != all_months[0].isoformat():
+        return 'the first month changed'
+    return None
+
+
+def changed_months(all_months, fingerprints, computation):
+    """Indices of months whose fingerprint differs from the previous run, including new months."""
+    return [
+        i for i, month in enumerate(all_months)
+        if computation.month_fingerprints.get(month.isoformat()) != fingerprints[i]
+    ]
+
+
+def update_series_month(model, key_columns, measure_id, offset, values_by_key):
+    """
+    Set element offset of the quantity, numerator and denominator arrays of
+    the measure's series rows from values_by_key, {key: (quantity, numerator,
+    denominator)}, keyed by the key_columns ((column, SQL type) pairs) values.
+    Arrays shorter than offset are extended with nulls.
+    """
+    if not values_by_key:
+        return
+    keys = list(values_by_key)
+    columns = [name for name, _ in key_columns] + ['quantity', 'numerator', 'denominator']
+    types = [sql_type for _, sql_type in key_columns] + ['float8'] * 3
+    params = [
+        [key[i] for key in keys] for i in range(len(key_columns))
+    ] + [
+        [values_by_key[key][i] for key in keys] for i in range(3)
+    ]
+    element = offset + 1
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {model._meta.db_table}
+            SET quantity[{element}] = v.quantity,
+                numerator[{element}] = v.numerator,
+                denominator[{element}] = v.denominator
+            FROM unnest({', '.join(f'%s::{t}[]' for t in types)}) AS v({', '.join(columns)})
+            WHERE measure_id = %s
+            AND {' AND '.join(f'{model._meta.db_table}.{name} = v.{name}' for name, _ in key_columns)}
+            """,
+            params + [measure_id],
+        )
+
+
+def delete_empty_series(model, measure_id):
+    """Delete the measure's series rows that no longer have a value in any month."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            DELETE FROM {model._meta.db_table}
+            WHERE measure_id = %s AND cardinality(array_remove(quantity, NULL)) = 0
+            """,
+            [measure_id],
+        )
+
+
+def series_values(results, all_months):
+    """
+    The results' org and aggregate values as {month offset: {key: (quantity,
+    numerator, denominator)}}, keyed by (org_id,) and (category, label), and
+    the percentile series. Offsets count months from the first DataStatus month.
+    """
+    start_month = all_months[0]
+    offsets = [month_offset(start_month, month) for month in all_months]
+    n_months = offsets[-1] + 1
+
+    org_values = defaultdict(dict)
+    for org_id, i, numerator, denominator, quantity in results.org_rows:
+        org_values[offsets[i]][(org_id,)] = (quantity, numerator, denominator)
+
+    aggregated_values = defaultdict(dict)
+    for category, label, i, numerator, denominator, quantity in results.aggregated_rows:
+        aggregated_values[offsets[i]][(category, label)] = (quantity, numerator, denominator)
+
+    percentile_series = {}
+    for i, percentile, quantity in results.percentile_rows:
+        percentile_series.setdefault(percentile, [None] * n_months)[offsets[i]] = quantity
+
+    return org_values, aggregated_values, percentile_series, n_months
+
+
+def series_arrays(values_by_offset, n_months):
+    """{key: (quantity, numerator, denominator) arrays} from series_values' per-month values."""
+    series = {}
+    for offset, values in values_by_offset.items():
+        for key, value in values.items():
+            arrays = series.setdefault(key, tuple([None] * n_months for _ in range(3)))
+            for array, element in zip(arrays, value):
+                array[offset] = element
+    return series
+
+
+def scan_quantity_table(model, vmp_ids, n_months):
+    """
+    Read a quantity table once for a set of VMPs.
+
+    Returns (QuantityScan, {vmp_id: unit}). Rows carry the successor-normalised
+    organisation id so predecessors are summed into their successor.
+    """
+    has_unit = model in (SCMDQuantity, Dose, IngredientQuantity)
+    fields = ['vmp_id', 'normalised_org_id', 'data']
+    if has_unit:
+        fields.append('quantity_unit__unit')
+
+    rows = (
+        model.objects.filter(vmp_id__in=vmp_ids)
+        .annotate(
+            normalised_org_id=Coalesce(
+                F('organisation__successor_id'), F('organisation_id')
+            )
+        )
+        .values_list(*fields)
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+
+    scan_rows = []
+    vmp_units = {}
+    for row in rows:
+        if has_unit and row[3] and row[0] not in vmp_units:
+            vmp_units[row[0]] = row[3]
+        scan_rows.append(row[:3])
+    return QuantityScan.from_rows(scan_rows, n_months), vmp_units
+
+
 class Command(BaseCommand):
-    help = 'Populates MeasureVMP instances for a given measure based on SQL file'
+    help = 'Computes precomputed org, percentile and aggregated values for measures'
 
     def add_arguments(self, parser):
-        parser.add_argument('measure', type=str, help='slug of the measure')
+        parser.add_argument('measure', type=str, nargs='?', help='slug of the measure')
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Compute every measure, scanning each quantity table once',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of processes used to compute measures in parallel',
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help=(
+                'Only rewrite the months whose inputs changed since the last incremental '
+                'run, and fully rebuild measures whose definition or VMPs changed'
+            ),
+        )
 
     def handle(self, *args, **kwargs):
         measure_slug = kwargs.get('measure')
-        
-        try:
-            measure = Measure.objects.get(slug=measure_slug)
-        except Measure.DoesNotExist:
-            self.stdout.write(
-                self.style.ERROR(f'Measure with slug "{measure_slug}" does not exist')
-            )
+        compute_all = kwargs.get('all', False)
+        workers = kwargs.get('workers') or 1
+        incremental = kwargs.get('incremental', False)
+
+        if compute_all:
+            measures = list(Measure.objects.all())
+        elif measure_slug:
+            try:
+                measures = [Measure.objects.get(slug=measure_slug)]
+            except Measure.DoesNotExist:
+                self.stdout.write(
+                    self.style.ERROR(f'Measure with slug "{measure_slug}" does not exist')
+                )
+                return
+        else:
+            self.stdout.write(self.style.ERROR('Provide a measure slug or --all'))
             return
 
-        def delete_existing_precomputed_data(measure):
-            PrecomputedMeasure.objects.filter(measure=measure).delete()
-            PrecomputedMeasureAggregated.objects.filter(measure=measure).delete()
-            PrecomputedPercentile.objects.filter(measure=measure).delete()
-            self.stdout.write(f"Deleted existing precomputed data for measure: {measure.slug}")
-
-        delete_existing_precomputed_data(measure)
-
-        all_months = list(
-            DataStatus.objects.order_by('year_month').values_list('year_month', flat=True)
+        file_types = dict(
+            DataStatus.objects.order_by('year_month').values_list('year_month', 'file_type')
         )
+        all_months = list(file_types)
 
         if not all_months:
             self.stdout.write(
@@ -71,346 +294,402 @@ class Command(BaseCommand):
             f"Processing data for {len(all_months)} months from {all_months[0]} to {all_months[-1]}"
         )
 
-        model_mapping = {
-            'scmd': SCMDQuantity,
-            'dose': Dose,
-            'ingredient': IngredientQuantity,
-            'ddd': DDDQuantity,
-            'indicative_cost': IndicativeCost,
+        measure_vmps = defaultdict(list)
+        for measurevmp in MeasureVMP.objects.filter(measure__in=measures).select_related('vmp'):
+            measure_vmps[measurevmp.measure_id].append(measurevmp)
+
+        computations = {
+            c.measure_id: c
+            for c in MeasureComputation.objects.filter(measure__in=measures)
+        } if incremental else {}
+
+        organisations = organisations_fingerprint()
+        external_denominator_values = {}
+        fingerprints = {}
+        measures_by_quantity_type = defaultdict(list)
+        for measure in measures:
+            if measure.quantity_type not in MODEL_MAPPING:
+                self.stdout.write(
+                    self.style.ERROR(f'Invalid quantity_type: {measure.quantity_type}')
+                )
+                continue
+            fingerprints[measure.id] = measure_fingerprint(
+                measure, measure_vmps[measure.id], organisations
+            )
+            external_denominator_values_for(measure, external_denominator_values)
+            measures_by_quantity_type[measure.quantity_type].append(measure)
+
+        org_geography = {
+            org['id']: (org['icb__name'], org['region__name'])
+            for org in Organisation.objects.values('id', 'icb__name', 'region__name')
         }
 
-        model = model_mapping.get(measure.quantity_type)
-        if not model:
+        # Per measure: (fingerprint, month fingerprints, month indices to rewrite
+        # or None for a full rebuild)
+        plans = {}
+        inputs = []
+        for quantity_type, type_measures in measures_by_quantity_type.items():
+            vmp_ids = {
+                mv.vmp_id for m in type_measures for mv in measure_vmps[m.id]
+            }
+            start_time = time.time()
+            scan, vmp_units = scan_quantity_table(
+                MODEL_MAPPING[quantity_type], vmp_ids, len(all_months)
+            )
             self.stdout.write(
-                self.style.ERROR(f'Invalid quantity_type: {measure.quantity_type}')
+                f"Scanned {quantity_type} data for {len(vmp_ids)} VMPs "
+                f"({len(type_measures)} measures) in {time.time() - start_time:.2f}s"
             )
-            return
 
-        org_lookup = {org.id: org for org in Organisation.objects.all()}
-
-        subset = model.objects.filter(vmp__in=measure.vmps.all())
-        subset = subset.annotate(icb=F('organisation__icb__name'), region=F('organisation__region__name'))
-        
-        subset = subset.annotate(
-            normalised_org_id=Case(
-                When(organisation__successor_id__isnull=True, then=F('organisation_id')),
-                default=F('organisation__successor_id'),
-                output_field=IntegerField(),
-            ),
-            # normalised icb is the icb of the successor if it has one, otherwise the icb of the org
-            normalised_icb_id=Case(
-                When(organisation__successor__icb__isnull=True, then=F('organisation__icb__name')),
-                default=F('organisation__successor__icb__name'),
-                output_field=CharField(),
-            ),
-            # normalised region is the region of the successor if it has one, otherwise the region of the org
-            normalised_region_id=Case(
-                When(organisation__successor__region__isnull=True, then=F('organisation__region__name')),
-                default=F('organisation__successor__region__name'),
-                output_field=CharField(),
+            self.update_measure_vmp_units(
+                quantity_type, type_measures, measure_vmps, vmp_units
             )
-        )
 
-        measure_orgs = subset.values_list('normalised_org_id', flat=True).distinct()
+            for measure in type_measures:
+                measure_inputs = self.build_measure_inputs(
+                    measure,
+                    measure_vmps[measure.id],
+                    scan,
+                    all_months,
+                    external_denominator_values,
+                )
+                plan = self.plan_measure(
+                    measure,
+                    measure_inputs,
+                    fingerprints[measure.id],
+                    all_months,
+                    computations.get(measure.id),
+                    incremental,
+                )
+                if plan is not None:
+                    plans[measure.id] = plan
+                    inputs.append(measure_inputs)
+
+        if workers > 1 and len(inputs) > 1:
+            # Worker processes must not inherit open database connections
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(
+                        compute_measure,
+                        measure_inputs,
+                        org_geography,
+                        PERCENTILE_LEVELS,
+                        plans[measure_inputs.measure_id][2],
+                    )
+                    for measure_inputs in inputs
+                ]
+                for future in as_completed(futures):
+                    results = future.result()
+                    self.save_measure_results(
+                        results, all_months, file_types, *plans[results.measure_id]
+                    )
+        else:
+            for measure_inputs in inputs:
+                plan = plans[measure_inputs.measure_id]
+                results = compute_measure(
+                    measure_inputs, org_geography, PERCENTILE_LEVELS, plan[2]
+                )
+                self.save_measure_results(results, all_months, file_types, *plan)
 
-        measurevmps = MeasureVMP.objects.filter(measure=measure)
-        ddd_unit_map = get_ddd_unit_map(measure.vmps.values_list('id', flat=True))
+        invalidate_measures_list_chart_cache()
+        for measure_inputs in inputs:
+            invalidate_measure_item_cache(measure_inputs.slug)
+        self.stdout.write(self.style.SUCCESS('Invalidated measures list and item chart cache'))
 
-        for measurevmp in measurevmps:
-            vmp_records = subset.filter(vmp=measurevmp.vmp)
-            
-            if measure.quantity_type == 'indicative_cost':
-                unit = 'Indicative cost (£)'
-            elif measure.quantity_type == 'ddd':
-                unit = ddd_unit_map.get(measurevmp.vmp_id, 'No DDD')
-            else:
-                unit = vmp_records.values_list('quantity_unit__unit', flat=True).first()
-            if unit:
-                measurevmp.unit = unit
-                measurevmp.save()
-            elif measure.quantity_type not in ('indicative_cost', 'ddd'):
-                self.stdout.write(
-                    self.style.WARNING(f'No unit found for VMP: {measurevmp.vmp.name}')
-                )
+    def plan_measure(
+        self, measure, measure_inputs, fingerprint, all_months, computation, incremental
+    ):
+        """
+        (fingerprint, month fingerprints, month indices to rewrite or None for a
+        full rebuild) for a measure, or None if it is unchanged. Month
+        fingerprints are only computed in incremental mode.
+        """
+        if not incremental:
+            return fingerprint, {}, None
+
+        month_hashes = month_fingerprints(measure_inputs)
+        by_month = {
+            month.isoformat(): month_hash for month, month_hash in zip(all_months, month_hashes)
+        }
+        reason = rebuild_reason(all_months, computation, fingerprint)
+        if reason is not None:
+            self.stdout.write(f"{measure.slug}: {reason}, rebuilding")
+            return fingerprint, by_month, None
+
+        refresh_months = changed_months(all_months, month_hashes, computation)
+        if not refresh_months:
+            self.stdout.write(f"{measure.slug}: unchanged, skipping")
+            return None
+        if len(refresh_months) == len(all_months):
+            self.stdout.write(f"{measure.slug}: every month changed, rebuilding")
+            return fingerprint, by_month, None
+        return fingerprint, by_month, refresh_months
+
+    def update_measure_vmp_units(self, quantity_type, measures, measure_vmps, vmp_units):
+        ddd_unit_map = (
+            get_ddd_unit_map({mv.vmp_id for m in measures for mv in measure_vmps[m.id]})
+            if quantity_type == 'ddd'
+            else {}
+        )
+        updated = []
+        for measure in measures:
+            for measurevmp in measure_vmps[measure.id]:
+                if quantity_type == 'indicative_cost':
+                    unit = 'Indicative cost (£)'
+                elif quantity_type == 'ddd':
+                    unit = ddd_unit_map.get(measurevmp.vmp_id, 'No DDD')
+                else:
+                    unit = vmp_units.get(measurevmp.vmp_id)
+                if unit:
+                    measurevmp.unit = unit
+                    updated.append(measurevmp)
+                else:
+                    self.stdout.write(
+                        self.style.WARNING(f'No unit found for VMP: {measurevmp.vmp.name}')
+                    )
+        MeasureVMP.objects.bulk_update(updated, ['unit'], batch_size=BATCH_SIZE)
 
-        numerator_vmps = measurevmps.filter(
-            type='numerator'
-        ).values_list('vmp', flat=True)
-        denominator_vmps = measurevmps.filter(
-            type='denominator'
-        ).values_list('vmp', flat=True)
-        all_vmps = list(numerator_vmps) + list(denominator_vmps)
+    def build_measure_inputs(
+        self, measure, measurevmps, scan, all_months, external_denominator_values
+    ):
+        numerator_vmps = {mv.vmp_id for mv in measurevmps if mv.type == 'numerator'}
+        denominator_vmps = {mv.vmp_id for mv in measurevmps if mv.type == 'denominator'}
         external_denominator = get_external_denominator(measure)
-        is_external_denominator_measure = external_denominator is not None
-        is_product_ratio_measure = denominator_vmps.exists()
-        is_rate_measure = (
-            is_product_ratio_measure or is_external_denominator_measure
-        )
 
-        if is_external_denominator_measure:
+        org_index = np.unique(scan.org_ids[scan.rows_for(numerator_vmps | denominator_vmps)])
+        numerators = sum_by_org(scan, scan.rows_for(numerator_vmps), org_index)
+
+        if external_denominator is not None:
+            kind = EXTERNAL_DENOMINATOR_MEASURE
+            values_by_org = external_denominator_values[external_denominator.key]
+            denominators = np.array(
+                [
+                    [
+                        float(values_by_org.get(org_id, {}).get(month, 0))
+                        for month in all_months
+                    ]
+                    for org_id in org_index.tolist()
+                ],
+                dtype=float,
+            ).reshape(numerators.shape)
             self.stdout.write(
-                f"Processing {external_denominator.label.lower()} measure: "
+                f"Processing {external_denominator.label.lower()} measure {measure.slug}: "
                 f"{len(numerator_vmps)} numerator VMPs"
             )
-        elif is_product_ratio_measure:
+        elif denominator_vmps:
+            kind = PRODUCT_RATIO_MEASURE
+            # Denominators include the numerator products
+            denominators = sum_by_org(
+                scan, scan.rows_for(numerator_vmps | denominator_vmps), org_index
+            )
             self.stdout.write(
-                f"Processing ratio measure: {len(numerator_vmps)} numerator VMPs "
+                f"Processing ratio measure {measure.slug}: {len(numerator_vmps)} numerator VMPs "
                 f"and {len(denominator_vmps)} denominator VMPs"
             )
         else:
+            kind = ABSOLUTE_MEASURE
+            denominators = np.zeros_like(numerators)
             self.stdout.write(
-                f"Processing absolute measure: {len(numerator_vmps)} numerator VMPs "
+                f"Processing absolute measure {measure.slug}: {len(numerator_vmps)} numerator VMPs "
                 f"(no denominators)"
             )
 
-        external_denominator_by_org = (
-            get_external_denominator_values_by_org_month(measure)
-            if is_external_denominator_measure
-            else {}
+        return MeasureInputs(
+            measure_id=measure.id,
+            slug=measure.slug,
+            kind=kind,
+            scale=get_rate_scale(measure),
+            org_ids=org_index.tolist(),
+            numerators=numerators,
+            denominators=denominators,
         )
 
-        org_monthly_data = defaultdict(
-            lambda: defaultdict(lambda: {'numerator': 0, 'denominator': 0})
-        )
-
-        for org_id in measure_orgs:
-            for month in all_months:
-                org_monthly_data[org_id][month] = {'numerator': 0, 'denominator': 0}
+    def save_measure_results(
+        self, results, all_months, file_types, fingerprint, month_hashes, refresh_months=None,
+    ):
+        """
+        Write a measure's results as series. With refresh_months (month indices)
+        only those elements of the org and aggregate series are rewritten;
+        otherwise the series are replaced.
+        """
+        measure_id = results.measure_id
 
-        numerator_records = subset.filter(vmp__in=numerator_vmps)
+        with transaction.atomic():
+            if refresh_months is None:
+                org_count, category_counts, percentile_count = self.save_measure_series(
+                    results, all_months
+                )
+            else:
+                org_count, category_counts, percentile_count = self.update_measure_series(
+                    results, all_months, refresh_months
+                )
 
-        if is_product_ratio_measure:
-            denominator_records = subset.filter(vmp__in=all_vmps)
-            denominator_data = (
-                denominator_records
-                .values('normalised_org_id', 'data')
-                .iterator(chunk_size=1000)
+            MeasureComputation.objects.update_or_create(
+                measure_id=measure_id,
+                defaults={
+                    'fingerprint': fingerprint,
+                    'month_fingerprints': month_hashes,
+                    'data_status': {
+                        month.isoformat(): file_type for month, file_type in file_types.items()
+                    },
+                },
             )
-        else:
-            denominator_data = None
 
-        numerator_data = (
-            numerator_records
-            .values('normalised_org_id', 'data')
-            .iterator(chunk_size=1000)
-        )
-
-        def add_data_to_org_monthly(records_iter, key):
-            for record in records_iter:
-                org_id = record['normalised_org_id']
-                data = record.get('data') or []
-                for i, month in enumerate(all_months):
-                    if i < len(data):
-                        org_monthly_data[org_id][month][key] += float(data[i] or 0)
-
-        add_data_to_org_monthly(numerator_data, 'numerator')
-        if is_product_ratio_measure and denominator_data:
-            add_data_to_org_monthly(denominator_data, 'denominator')
-
-        if is_external_denominator_measure:
-            for org_id, monthly_data in org_monthly_data.items():
-                org_denominators = external_denominator_by_org.get(org_id, {})
-                for month in all_months:
-                    monthly_data[month]['denominator'] = float(
-                        org_denominators.get(month, 0)
-                    )
+        save_measure_item_payload(measure_id)
 
-        precomputed_measures = []
-        for org_id, monthly_data in org_monthly_data.items():
-            org = org_lookup[org_id]
-            for month, values in monthly_data.items():
-                numerator = values['numerator']
-                denominator = values['denominator']
-
-                if is_external_denominator_measure and denominator <= 0:
-                    continue
-
-                if is_rate_measure:
-                    quantity = compute_rate_from_totals(numerator, denominator, measure)
-                else:
-                    quantity = numerator
-                    denominator = None
-
-                precomputed_measures.append(
-                    PrecomputedMeasure(
-                        measure=measure,
-                        organisation=org,
-                        month=month,
-                        numerator=numerator,
-                        denominator=denominator,
-                        quantity=quantity,
-                    )
-                )
-
-        batch_size = 1000
-        with transaction.atomic():
-            for i in range(0, len(precomputed_measures), batch_size):
-                batch = precomputed_measures[i:i + batch_size]
-                PrecomputedMeasure.objects.bulk_create(batch, batch_size=batch_size)
-
-        self.stdout.write(
-            self.style.SUCCESS(f'Successfully created {len(precomputed_measures)} precomputed measures')
+        action = 'created' if refresh_months is None else (
+            f'updated {len(refresh_months)} changed months of'
         )
-
-        precomputed_percentiles = []
-        
-        for org_id, monthly_data in org_monthly_data.items():
-            for month, data in monthly_data.items():
-                if is_rate_measure:
-                    if is_external_denominator_measure and data['denominator'] <= 0:
-                        data['value'] = None
-                    else:
-                        data['value'] = compute_rate_from_totals(
-                            data['numerator'], data['denominator'], measure
-                        )
-                else:
-                    data['value'] = data['numerator']
-        
-        self.stdout.write(f"Total organisations in monthly data: {len(org_monthly_data)} (normalised - predecessors merged into successors)")
-        
-        actual_org_count = len(set(
-            record['organisation_id'] 
-            for record in subset.values('organisation_id').distinct()
-        ))
-        self.stdout.write(f"Actual organisation records in data: {actual_org_count} (including separate predecessor records)")
-        
-        # Remove trusts with 0 quantity for selected products across all months
-        orgs_with_data = set()
-        for org_id, monthly_data in org_monthly_data.items():
-            if is_external_denominator_measure:
-                if any(data['denominator'] > 0 for data in monthly_data.values()):
-                    orgs_with_data.add(org_id)
-            elif is_product_ratio_measure:
-                if any(data['denominator'] > 0 for data in monthly_data.values()):
-                    orgs_with_data.add(org_id)
-            else:
-                if any(data['numerator'] > 0 for data in monthly_data.values()):
-                    orgs_with_data.add(org_id)
-        
-        self.stdout.write(f"Organisations with data for percentile calculations: {len(orgs_with_data)} (including predecessors)")
-        
-        for month in all_months:
-            month_values = [
-                org_monthly_data[org_id][month]['value']
-                for org_id in orgs_with_data
-                if org_monthly_data[org_id][month]['value'] is not None
-            ]
-            
-            month_values.sort()
-            n = len(month_values)
-            
-            if n > 0:
-                for percentile in [5, 15, 25, 35, 45, 50, 55, 65, 75, 85, 95]:
-                    # Calculate index for this percentile
-                    k = (n - 1) * (percentile / 100)
-                    f = math.floor(k)
-                    c = math.ceil(k)
-                    
-                    if f == c:
-                        value = month_values[int(k)]
-                    else:
-                        # Interpolate when k is not an integer
-                        d0 = month_values[int(f)] * (c - k)
-                        d1 = month_values[int(c)] * (k - f)
-                        value = d0 + d1
-                    
-                    precomputed_percentiles.append(
-                        PrecomputedPercentile(
-                            measure=measure,
-                            month=month,
-                            percentile=percentile,
-                            quantity=value
-                        )
-                    )
-        
-        PrecomputedPercentile.objects.bulk_create(precomputed_percentiles)
         self.stdout.write(
-            self.style.SUCCESS(f'Successfully created {len(precomputed_percentiles)} percentile records')
+            self.style.SUCCESS(
+                f"{results.slug}: {action} series for {org_count} organisations "
+                f"({results.orgs_with_data} with data), {percentile_count} percentiles, "
+                f"{category_counts['icb']} ICBs, {category_counts['region']} regions and "
+                f"{category_counts['national']} national"
+            )
         )
 
-
-        self.stdout.write("Starting aggregations using existing org data...")
-        start_time = time.time()
-
-        icb_values = defaultdict(lambda: defaultdict(lambda: {'numerator': 0, 'denominator': 0}))
-        region_values = defaultdict(lambda: defaultdict(lambda: {'numerator': 0, 'denominator': 0}))
-        national_values = defaultdict(lambda: {'numerator': 0, 'denominator': 0})
-
-        for org_id, monthly_data in org_monthly_data.items():
-            org = org_lookup[org_id]
-            
-            icb_id = org.icb.name if org.icb else None
-            region_id = org.region.name if org.region else None
-            
-            for month, values in monthly_data.items():
-                if is_external_denominator_measure and values['denominator'] <= 0:
-                    continue
-                if icb_id:
-                    icb_values[icb_id][month]['numerator'] += values['numerator']
-                    icb_values[icb_id][month]['denominator'] += values['denominator']
-
-                if region_id:
-                    region_values[region_id][month]['numerator'] += values['numerator']
-                    region_values[region_id][month]['denominator'] += values['denominator']
-
-                national_values[month]['numerator'] += values['numerator']
-                national_values[month]['denominator'] += values['denominator']
-
-        def set_aggregated_values(monthly_data):
-            for month, values in monthly_data.items():
-                if is_rate_measure:
-                    values['value'] = compute_rate_from_totals(
-                        values['numerator'], values['denominator'], measure
-                    )
-                else:
-                    values['value'] = values['numerator']
-
-        for icb_id, monthly_data in icb_values.items():
-            set_aggregated_values(monthly_data)
-
-        for region_id, monthly_data in region_values.items():
-            set_aggregated_values(monthly_data)
-
-        set_aggregated_values(national_values)
-        
-        aggregation_time = time.time() - start_time
-        self.stdout.write(f"All aggregations completed in: {aggregation_time:.2f}s (no additional queries!)")
-        
-        self.stdout.write(f"Found {len(icb_values)} ICBs, {len(region_values)} regions")
-
-
-        def bulk_create_aggregated_measures(data_dict, category):
-            aggregated_measures = []
-            for label, monthly_data in data_dict.items():
-                for month, values in monthly_data.items():
-                    aggregated_measures.append(
-                        PrecomputedMeasureAggregated(
-                            measure=measure,
-                            label=label,
-                            month=month,
-                            numerator=values["numerator"],
-                            denominator=values["denominator"],
-                            quantity=values["value"],
-                            category=category
-                        )
+    def save_measure_series(self, results, all_months):
+        """
+        Replace the measure's series. Arrays hold consecutive months from the
+        first DataStatus month. Returns the number of org series, aggregate
+        series by category and percentile series written.
+        """
+        measure_id = results.measure_id
+        start_month = all_months[0]
+        org_values, aggregated_values, percentile_series, n_months = series_values(
+            results, all_months
+        )
+        org_series = series_arrays(org_values, n_months)
+        aggregated_series = series_arrays(aggregated_values, n_months)
+
+        for model in (
+            PrecomputedMeasureSeries,
+            PrecomputedMeasureAggregatedSeries,
+            PrecomputedPercentileSeries,
+        ):
+            model.objects.filter(measure_id=measure_id).delete()
+
+        PrecomputedMeasureSeries.objects.bulk_create(
+            [
+                PrecomputedMeasureSeries(
+                    measure_id=measure_id,
+                    organisation_id=org_id,
+                    start_month=start_month,
+                    quantity=quantity,
+                    numerator=numerator,
+                    denominator=denominator,
+                )
+                for (org_id,), (quantity, numerator, denominator) in org_series.items()
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        PrecomputedMeasureAggregatedSeries.objects.bulk_create(
+            [
+                PrecomputedMeasureAggregatedSeries(
+                    measure_id=measure_id,
+                    category=category,
+                    label=label,
+                    start_month=start_month,
+                    quantity=quantity,
+                    numerator=numerator,
+                    denominator=denominator,
+                )
+                for (category, label), (quantity, numerator, denominator) in aggregated_series.items()
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        self.save_percentile_series(measure_id, start_month, percentile_series)
+
+        category_counts = defaultdict(int)
+        for category, _ in aggregated_series:
+            category_counts[category] += 1
+        return len(org_series), category_counts, len(percentile_series)
+
+    def update_measure_series(self, results, all_months, refresh_months):
+        """
+        Rewrite the refresh_months elements of the measure's org and aggregate
+        series in place, one UPDATE per month and table. Series for keys that
+        first have a value in those months are created, and series left with no
+        value in any month are deleted. Percentiles depend on which
+        organisations have data in any month, so they are always rewritten;
+        there are only a few of them. Returns the same counts as
+        save_measure_series, for the series with values in refresh_months.
+        """
+        measure_id = results.measure_id
+        start_month = all_months[0]
+        org_values, aggregated_values, percentile_series, n_months = series_values(
+            results, all_months
+        )
+        refresh_offsets = [month_offset(start_month, all_months[i]) for i in refresh_months]
+
+        for model, key_columns, values in (
+            (PrecomputedMeasureSeries, (('organisation_id', 'bigint'),), org_values),
+            (
+                PrecomputedMeasureAggregatedSeries,
+                (('category', 'text'), ('label', 'text')),
+                aggregated_values,
+            ),
+        ):
+            key_fields = [name for name, _ in key_columns]
+            existing = set(
+                model.objects.filter(measure_id=measure_id).values_list(*key_fields)
+            )
+            new_series = series_arrays(
+                {
+                    offset: {
+                        key: value for key, value in values[offset].items()
+                        if key not in existing
+                    }
+                    for offset in refresh_offsets
+                },
+                n_months,
+            )
+            model.objects.bulk_create(
+                [
+                    model(
+                        measure_id=measure_id,
+                        start_month=start_month,
+                        quantity=quantity,
+                        numerator=numerator,
+                        denominator=denominator,
+                        **dict(zip(key_fields, key)),
                     )
-            
-            with transaction.atomic():
-                for i in range(0, len(aggregated_measures), batch_size):
-                    batch = aggregated_measures[i:i + batch_size]
-                    PrecomputedMeasureAggregated.objects.bulk_create(batch, batch_size=batch_size)
-            
-            return len(aggregated_measures)
-
-        icb_count = bulk_create_aggregated_measures(icb_values, 'icb')
-        region_count = bulk_create_aggregated_measures(region_values, 'region')
-        national_count = bulk_create_aggregated_measures({'National': national_values}, 'national')
-
-        self.stdout.write(
-            self.style.SUCCESS(f'Successfully created {icb_count} ICB, {region_count} region, and {national_count} national aggregated measures')
+                    for key, (quantity, numerator, denominator) in new_series.items()
+                ],
+                batch_size=BATCH_SIZE,
+            )
+            for offset in refresh_offsets:
+                update_series_month(
+                    model,
+                    key_columns,
+                    measure_id,
+                    offset,
+                    {key: values[offset].get(key, (None, None, None)) for key in existing},
+                )
+            delete_empty_series(model, measure_id)
+
+        self.save_percentile_series(measure_id, start_month, percentile_series)
+
+        org_keys = {key for offset in refresh_offsets for key in org_values[offset]}
+        category_counts = defaultdict(int)
+        for category, _ in {key for offset in refresh_offsets for key in aggregated_values[offset]}:
+            category_counts[category] += 1
+        return len(org_keys), category_counts, len(percentile_series)
+
+    def save_percentile_series(self, measure_id, start_month, percentile_series):
+        PrecomputedPercentileSeries.objects.filter(measure_id=measure_id).delete()
+        PrecomputedPercentileSeries.objects.bulk_create(
+            [
+                PrecomputedPercentileSeries(
+                    measure_id=measure_id,
+                    percentile=percentile,
+                    start_month=start_month,
+                    quantity=quantity,
+                )
+                for percentile, quantity in percentile_series.items()
+            ],
+            batch_size=BATCH_SIZE,
         )
 
-        invalidate_measures_list_chart_cache()
-        invalidate_measure_item_cache(measure_slug)
-        self.stdout.write(self.style.SUCCESS('Invalidated measures list and item chart cache'))
-
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from viewer.quantity_summary import update_vmp_quantity_summary
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-VMP quantity availability summary from the quantity tables'
+
+    def handle(self, *args, **options):
+        rows = update_vmp_quantity_summary()
+        self.stdout.write(self.style.SUCCESS(f'Wrote {rows} VMP quantity summary rows'))
@@ -89,9 +89,16 @@ def measure_has_rate_denominator(measure) -> bool:
     return measure_has_product_denominator(measure) or measure_uses_external_denominator(measure)
 
 
-def compute_rate_from_totals(numerator: float, denominator: float, measure) -> float:
+def get_rate_scale(measure) -> float:
+    external_denominator = get_external_denominator(measure)
+    return external_denominator.scale if external_denominator is not None else 100
+
+
+def compute_rate(numerator: float, denominator: float, scale: float) -> float:
     if denominator <= 0:
         return 0.0
-    external_denominator = get_external_denominator(measure)
-    scale = external_denominator.scale if external_denominator is not None else 100
     return (numerator / denominator) * scale
+
+
+def compute_rate_from_totals(numerator: float, denominator: float, measure) -> float:
+    return compute_rate(numerator, denominator, get_rate_scale(measure))
@@ -0,0 +1,114 @@
+"""
+Reads of precomputed measure data from the columnar series tables.
+
+compute_measures writes each measure as series rows holding arrays of
+consecutive months from the row's start_month, with None where there is no
+value. Months are placed from start_month rather than by position in
+DataStatus, so series stay correct when DataStatus changes after they were
+written. The readers return one dict per series with its arrays and a months
+tuple of the same length, for callers to zip against; series of the same
+length and start share the months tuple.
+"""
+from datetime import date
+from functools import lru_cache
+
+from django.db.models import Count
+
+from .models import (
+    PrecomputedMeasureAggregatedSeries,
+    PrecomputedMeasureSeries,
+    PrecomputedPercentileSeries,
+)
+
+
+def add_months(month, n):
+    """The first of the month n months after month."""
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_offset(start_month, month):
+    """Number of months from start_month to month."""
+    return (month.year - start_month.year) * 12 + month.month - start_month.month
+
+
+@lru_cache(maxsize=256)
+def series_months(start_month, length):
+    """The months of a series of length elements starting at start_month."""
+    return tuple(add_months(start_month, i) for i in range(length))
+
+
+def _with_months(series):
+    series = list(series)
+    for s in series:
+        s['months'] = series_months(s.pop('start_month'), len(s['quantity']))
+    return series
+
+
+def series_points(series):
+    """A series' months with a value as [{month, quantity, numerator, denominator}, ...]."""
+    return [
+        {'month': month, 'quantity': quantity, 'numerator': numerator, 'denominator': denominator}
+        for month, quantity, numerator, denominator in zip(
+            series['months'], series['quantity'], series['numerator'], series['denominator']
+        )
+        if quantity is not None
+    ]
+
+
+def org_series(measure_ids, trust_codes=None):
+    """
+    Org series as dicts with measure_id, organisation__ods_code,
+    organisation__ods_name, months, quantity, numerator and denominator,
+    ordered by measure and organisation name.
+    """
+    series = PrecomputedMeasureSeries.objects.filter(measure_id__in=measure_ids)
+    if trust_codes:
+        series = series.filter(organisation__ods_code__in=trust_codes)
+    return _with_months(
+        series.values(
+            'measure_id', 'organisation__ods_code', 'organisation__ods_name',
+            'start_month', 'quantity', 'numerator', 'denominator',
+        ).order_by('measure_id', 'organisation__ods_name', 'organisation_id')
+    )
+
+
+def aggregated_series(measure_ids, categories=None):
+    """
+    ICB, region and national series as dicts with measure_id, category, label,
+    months, quantity, numerator and denominator, ordered by measure, category
+    and label.
+    """
+    series = PrecomputedMeasureAggregatedSeries.objects.filter(measure_id__in=measure_ids)
+    if categories:
+        series = series.filter(category__in=categories)
+    return _with_months(
+        series.values(
+            'measure_id', 'category', 'label',
+            'start_month', 'quantity', 'numerator', 'denominator',
+        ).order_by('measure_id', 'category', 'label')
+    )
+
+
+def percentile_series(measure_ids, percentiles=None):
+    """
+    Percentile series as dicts with measure_id, percentile, months and
+    quantity, ordered by measure and percentile.
+    """
+    series = PrecomputedPercentileSeries.objects.filter(measure_id__in=measure_ids)
+    if percentiles is not None:
+        series = series.filter(percentile__in=percentiles)
+    return _with_months(
+        series.values('measure_id', 'percentile', 'start_month', 'quantity')
+        .order_by('measure_id', 'percentile')
+    )
+
+
+def organisation_counts(measure_ids):
+    """Number of organisations with values, by measure id (measures with none are omitted)."""
+    return dict(
+        PrecomputedMeasureSeries.objects.filter(measure_id__in=measure_ids)
+        .values('measure_id')
+        .annotate(count=Count('organisation_id'))
+        .values_list('measure_id', 'count')
+    )
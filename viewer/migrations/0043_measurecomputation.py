@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewer', '0042_rename_viewer_icb_code_idx_viewer_icb_code_3782ec_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeasureComputation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(help_text='Hash of the measure definition and MeasureVMP set the precomputed rows were built from', max_length=64)),
+                ('data_status', models.JSONField(default=dict, help_text='DataStatus file type by month (ISO date) when the precomputed rows were built')),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('measure', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='computation', to='viewer.measure')),
+            ],
+        ),
+    ]
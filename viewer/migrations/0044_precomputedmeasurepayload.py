@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewer', '0043_measurecomputation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrecomputedMeasurePayload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('org_data', models.BinaryField()),
+                ('region_data', models.BinaryField()),
+                ('icb_data', models.BinaryField()),
+                ('national_data', models.BinaryField()),
+                ('percentile_data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now=True)),
+                ('measure', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='payload', to='viewer.measure')),
+            ],
+        ),
+    ]
@@ -0,0 +1,122 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:58
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Backfill the series tables from the existing per-month rows so measure pages
+# keep working before compute_measures next runs. Months are aligned to
+# DataStatus; cells without a row are NULL.
+BACKFILL_SERIES_SQL = """
+WITH months AS (
+    SELECT year_month, row_number() OVER (ORDER BY year_month) AS idx
+    FROM viewer_datastatus
+)
+INSERT INTO viewer_precomputedmeasureseries
+    (measure_id, organisation_id, quantity, numerator, denominator)
+SELECT
+    k.measure_id,
+    k.organisation_id,
+    array_agg(p.quantity ORDER BY m.idx),
+    array_agg(p.numerator ORDER BY m.idx),
+    array_agg(p.denominator ORDER BY m.idx)
+FROM (SELECT DISTINCT measure_id, organisation_id FROM viewer_precomputedmeasure) k
+CROSS JOIN months m
+LEFT JOIN viewer_precomputedmeasure p
+    ON p.measure_id = k.measure_id
+    AND p.organisation_id = k.organisation_id
+    AND p.month = m.year_month
+GROUP BY k.measure_id, k.organisation_id;
+
+WITH months AS (
+    SELECT year_month, row_number() OVER (ORDER BY year_month) AS idx
+    FROM viewer_datastatus
+)
+INSERT INTO viewer_precomputedmeasureaggregatedseries
+    (measure_id, category, label, quantity, numerator, denominator)
+SELECT
+    k.measure_id,
+    k.category,
+    k.label,
+    array_agg(p.quantity ORDER BY m.idx),
+    array_agg(p.numerator ORDER BY m.idx),
+    array_agg(p.denominator ORDER BY m.idx)
+FROM (SELECT DISTINCT measure_id, category, label FROM viewer_precomputedmeasureaggregated) k
+CROSS JOIN months m
+LEFT JOIN viewer_precomputedmeasureaggregated p
+    ON p.measure_id = k.measure_id
+    AND p.category = k.category
+    AND p.label IS NOT DISTINCT FROM k.label
+    AND p.month = m.year_month
+GROUP BY k.measure_id, k.category, k.label;
+
+WITH months AS (
+    SELECT year_month, row_number() OVER (ORDER BY year_month) AS idx
+    FROM viewer_datastatus
+)
+INSERT INTO viewer_precomputedpercentileseries (measure_id, percentile, quantity)
+SELECT
+    k.measure_id,
+    k.percentile,
+    array_agg(p.quantity ORDER BY m.idx)
+FROM (SELECT DISTINCT measure_id, percentile FROM viewer_precomputedpercentile) k
+CROSS JOIN months m
+LEFT JOIN viewer_precomputedpercentile p
+    ON p.measure_id = k.measure_id
+    AND p.percentile = k.percentile
+    AND p.month = m.year_month
+GROUP BY k.measure_id, k.percentile;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewer', '0044_precomputedmeasurepayload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrecomputedMeasureAggregatedSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(choices=[('region', 'Region'), ('icb', 'ICB'), ('national', 'National')], max_length=20)),
+                ('label', models.CharField(max_length=255, null=True)),
+                ('quantity', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(null=True), size=None)),
+                ('numerator', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(null=True), size=None)),
+                ('denominator', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(null=True), size=None)),
+                ('measure', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='precomputed_aggregated_series', to='viewer.measure')),
+            ],
+            options={
+                'unique_together': {('measure', 'category', 'label')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PrecomputedMeasureSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(null=True), size=None)),
+                ('numerator', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(null=True), size=None)),
+                ('denominator', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(null=True), size=None)),
+                ('measure', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='precomputed_series', to='viewer.measure')),
+                ('organisation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='precomputed_measure_series', to='viewer.organisation')),
+            ],
+            options={
+                'unique_together': {('measure', 'organisation')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PrecomputedPercentileSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('percentile', models.IntegerField()),
+                ('quantity', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(null=True), size=None)),
+                ('measure', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='precomputed_percentile_series', to='viewer.measure')),
+            ],
+            options={
+                'unique_together': {('measure', 'percentile')},
+            },
+        ),
+        migrations.RunSQL(BACKFILL_SERIES_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewer', '0045_precomputed_series'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dddquantity',
+            name='content_hash',
+            field=models.CharField(help_text='Hash of the loaded values, used by the loaders to skip unchanged rows', max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='dose',
+            name='content_hash',
+            field=models.CharField(help_text='Hash of the loaded values, used by the loaders to skip unchanged rows', max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='indicativecost',
+            name='content_hash',
+            field=models.CharField(help_text='Hash of the loaded values, used by the loaders to skip unchanged rows', max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='ingredientquantity',
+            name='content_hash',
+            field=models.CharField(help_text='Hash of the loaded values, used by the loaders to skip unchanged rows', max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='scmdquantity',
+            name='content_hash',
+            field=models.CharField(help_text='Hash of the loaded values, used by the loaders to skip unchanged rows', max_length=32, null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:15
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewer', '0046_quantity_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VMPQuantitySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity_type', models.CharField(choices=[('scmd', 'SCMD'), ('dose', 'Dose'), ('ingredient', 'Ingredient'), ('ddd', 'DDD')], max_length=20)),
+                ('units', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), default=list, size=None)),
+                ('first_month', models.DateField(help_text='First DataStatus month with a non-zero value', null=True)),
+                ('last_month', models.DateField(help_text='Last DataStatus month with a non-zero value', null=True)),
+                ('org_count', models.IntegerField(help_text='Organisations with at least one non-zero value')),
+                ('total_quantity', models.FloatField()),
+                ('vmp', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='quantity_summaries', to='viewer.vmp')),
+            ],
+            options={
+                'unique_together': {('vmp', 'quantity_type')},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+BACKFILL_CLOSURE_SQL = """
+INSERT INTO viewer_vmpatcancestor (atc_id, vmp_id)
+SELECT DISTINCT ancestor.id, va.vmp_id
+FROM viewer_vmp_atcs va
+JOIN viewer_atc a ON a.id = va.atc_id
+CROSS JOIN LATERAL generate_series(1, length(a.code)) AS prefix(length)
+JOIN viewer_atc ancestor ON ancestor.code = left(a.code, prefix.length)
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewer', '0047_vmp_quantity_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VMPATCAncestor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('atc', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_vmp_links', to='viewer.atc')),
+                ('vmp', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='atc_ancestors', to='viewer.vmp')),
+            ],
+            options={
+                'unique_together': {('atc', 'vmp')},
+            },
+        ),
+        migrations.RunSQL(BACKFILL_CLOSURE_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewer', '0048_atc_ancestor_closure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='measurecomputation',
+            name='data_fingerprint',
+            field=models.CharField(blank=True, default='', help_text='Hash of the quantity rows and external denominator values the precomputed rows were built from', max_length=64),
+        ),
+    ]
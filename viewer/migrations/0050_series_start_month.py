@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:10
+
+from django.db import migrations, models
+
+
+SERIES_TABLES = (
+    'viewer_precomputedmeasureseries',
+    'viewer_precomputedmeasureaggregatedseries',
+    'viewer_precomputedpercentileseries',
+)
+
+# Existing series were written aligned to the DataStatus months, so they start
+# at the first of them. Series that cannot be placed are removed and rewritten
+# by the next compute_measures run.
+BACKFILL_START_MONTH_SQL = ''.join(
+    f"""
+UPDATE {table} SET start_month = (SELECT MIN(year_month) FROM viewer_datastatus)
+WHERE start_month IS NULL;
+DELETE FROM {table} WHERE start_month IS NULL;
+"""
+    for table in SERIES_TABLES
+)
+
+START_MONTH_HELP_TEXT = 'Month of the first array element; element i is i months later'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewer', '0049_measurecomputation_data_fingerprint'),
+    ]
+
+    operations = [
+        *(
+            migrations.AddField(
+                model_name=model_name,
+                name='start_month',
+                field=models.DateField(help_text=START_MONTH_HELP_TEXT, null=True),
+            )
+            for model_name in (
+                'precomputedmeasureseries',
+                'precomputedmeasureaggregatedseries',
+                'precomputedpercentileseries',
+            )
+        ),
+        migrations.RunSQL(BACKFILL_START_MONTH_SQL, migrations.RunSQL.noop),
+        *(
+            migrations.AlterField(
+                model_name=model_name,
+                name='start_month',
+                field=models.DateField(help_text=START_MONTH_HELP_TEXT),
+            )
+            for model_name in (
+                'precomputedmeasureseries',
+                'precomputedmeasureaggregatedseries',
+                'precomputedpercentileseries',
+            )
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewer', '0050_series_start_month'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='measurecomputation',
+            name='data_fingerprint',
+        ),
+        migrations.AddField(
+            model_name='measurecomputation',
+            name='month_fingerprints',
+            field=models.JSONField(blank=True, default=dict, help_text="Hash of each month's numerator and denominator inputs (ISO date keys) at the last incremental run"),
+        ),
+    ]
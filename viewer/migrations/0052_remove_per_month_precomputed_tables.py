@@ -0,0 +1,111 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:40
+
+from django.db import migrations
+
+
+# Measures not recomputed since the series tables were added still only have
+# per-month rows. Their rows are written as series starting at the table's
+# first month before the per-month tables are dropped.
+BACKFILL_SERIES_SQL = """
+WITH months AS (
+    SELECT month::date AS month, row_number() OVER (ORDER BY month) AS i
+    FROM generate_series(
+        (SELECT MIN(month) FROM viewer_precomputedmeasure),
+        (SELECT MAX(month) FROM viewer_precomputedmeasure),
+        interval '1 month'
+    ) AS month
+),
+series AS (
+    SELECT DISTINCT measure_id, organisation_id
+    FROM viewer_precomputedmeasure
+    WHERE measure_id NOT IN (SELECT measure_id FROM viewer_precomputedmeasureseries)
+)
+INSERT INTO viewer_precomputedmeasureseries
+    (measure_id, organisation_id, start_month, quantity, numerator, denominator)
+SELECT
+    s.measure_id, s.organisation_id, (SELECT MIN(month) FROM months),
+    array_agg(r.quantity ORDER BY m.i),
+    array_agg(r.numerator ORDER BY m.i),
+    array_agg(r.denominator ORDER BY m.i)
+FROM series s
+CROSS JOIN months m
+LEFT JOIN viewer_precomputedmeasure r
+    ON r.measure_id = s.measure_id
+    AND r.organisation_id = s.organisation_id
+    AND r.month = m.month
+GROUP BY s.measure_id, s.organisation_id;
+
+WITH months AS (
+    SELECT month::date AS month, row_number() OVER (ORDER BY month) AS i
+    FROM generate_series(
+        (SELECT MIN(month) FROM viewer_precomputedmeasureaggregated),
+        (SELECT MAX(month) FROM viewer_precomputedmeasureaggregated),
+        interval '1 month'
+    ) AS month
+),
+series AS (
+    SELECT DISTINCT measure_id, category, label
+    FROM viewer_precomputedmeasureaggregated
+    WHERE measure_id NOT IN (SELECT measure_id FROM viewer_precomputedmeasureaggregatedseries)
+)
+INSERT INTO viewer_precomputedmeasureaggregatedseries
+    (measure_id, category, label, start_month, quantity, numerator, denominator)
+SELECT
+    s.measure_id, s.category, s.label, (SELECT MIN(month) FROM months),
+    array_agg(r.quantity ORDER BY m.i),
+    array_agg(r.numerator ORDER BY m.i),
+    array_agg(r.denominator ORDER BY m.i)
+FROM series s
+CROSS JOIN months m
+LEFT JOIN viewer_precomputedmeasureaggregated r
+    ON r.measure_id = s.measure_id
+    AND r.category = s.category
+    AND r.label IS NOT DISTINCT FROM s.label
+    AND r.month = m.month
+GROUP BY s.measure_id, s.category, s.label;
+
+WITH months AS (
+    SELECT month::date AS month, row_number() OVER (ORDER BY month) AS i
+    FROM generate_series(
+        (SELECT MIN(month) FROM viewer_precomputedpercentile),
+        (SELECT MAX(month) FROM viewer_precomputedpercentile),
+        interval '1 month'
+    ) AS month
+),
+series AS (
+    SELECT DISTINCT measure_id, percentile
+    FROM viewer_precomputedpercentile
+    WHERE measure_id NOT IN (SELECT measure_id FROM viewer_precomputedpercentileseries)
+)
+INSERT INTO viewer_precomputedpercentileseries (measure_id, percentile, start_month, quantity)
+SELECT
+    s.measure_id, s.percentile, (SELECT MIN(month) FROM months),
+    array_agg(r.quantity ORDER BY m.i)
+FROM series s
+CROSS JOIN months m
+LEFT JOIN viewer_precomputedpercentile r
+    ON r.measure_id = s.measure_id
+    AND r.percentile = s.percentile
+    AND r.month = m.month
+GROUP BY s.measure_id, s.percentile;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewer', '0051_measurecomputation_month_fingerprints'),
+    ]
+
+    operations = [
+        migrations.RunSQL(BACKFILL_SERIES_SQL, migrations.RunSQL.noop),
+        migrations.DeleteModel(
+            name='PrecomputedMeasure',
+        ),
+        migrations.DeleteModel(
+            name='PrecomputedMeasureAggregated',
+        ),
+        migrations.DeleteModel(
+            name='PrecomputedPercentile',
+        ),
+    ]
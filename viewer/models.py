@@ -128,7 +128,22 @@ class ATC(models.Model):
         For example, if this is ATC code 'A10', it will return VMPs with ATC codes
         that start with 'A10'.
         """
-        return VMP.objects.filter(atcs__code__startswith=self.code).distinct()
+        return VMP.objects.filter(atc_ancestors__atc=self)
+
+class VMPATCAncestor(models.Model):
+    """
+    Closure of the ATC hierarchy over VMPs: one row for each ATC a VMP is
+    tagged with and for each ancestor of that ATC. Rebuilt by the ATC and VMP
+    load flows.
+    """
+    atc = models.ForeignKey(ATC, on_delete=models.CASCADE, related_name="descendant_vmp_links")
+    vmp = models.ForeignKey("VMP", on_delete=models.CASCADE, related_name="atc_ancestors")
+
+    class Meta:
+        unique_together = ('atc', 'vmp')
+
+    def __str__(self):
+        return f"{self.atc.code} - {self.vmp.name}"
 
 class OntFormRoute(models.Model):
     name = models.CharField(max_length=255)
@@ -323,6 +338,11 @@ class SCMDQuantity(models.Model):
         null=True,
         help_text="Dense array [qty0, qty1, ...] aligned to DataStatus months (0 = no data)"
     )
+    content_hash = models.CharField(
+        max_length=32,
+        null=True,
+        help_text="Hash of the loaded values, used by the loaders to skip unchanged rows"
+    )
     
     class Meta:
         unique_together = ('vmp', 'organisation')
@@ -357,6 +377,11 @@ class Dose(models.Model):
         null=True,
         help_text="Dense array [qty0, qty1, ...] aligned to DataStatus months (0 = no data)"
     )
+    content_hash = models.CharField(
+        max_length=32,
+        null=True,
+        help_text="Hash of the loaded values, used by the loaders to skip unchanged rows"
+    )
 
     @property
     def unit(self):
@@ -394,6 +419,11 @@ class IngredientQuantity(models.Model):
         null=True,
         help_text="Dense array [qty0, qty1, ...] aligned to DataStatus months (0 = no data)"
     )
+    content_hash = models.CharField(
+        max_length=32,
+        null=True,
+        help_text="Hash of the loaded values, used by the loaders to skip unchanged rows"
+    )
 
     @property
     def unit(self):
@@ -424,6 +454,11 @@ class DDDQuantity(models.Model):
         null=True,
         help_text="Dense array [qty0, qty1, ...] aligned to DataStatus months (0 = no data)"
     )
+    content_hash = models.CharField(
+        max_length=32,
+        null=True,
+        help_text="Hash of the loaded values, used by the loaders to skip unchanged rows"
+    )
 
     def __str__(self):
         return (
@@ -445,6 +480,11 @@ class IndicativeCost(models.Model):
         null=True,
         help_text="Dense array [qty0, qty1, ...] aligned to DataStatus months (0 = no data)"
     )
+    content_hash = models.CharField(
+        max_length=32,
+        null=True,
+        help_text="Hash of the loaded values, used by the loaders to skip unchanged rows"
+    )
 
     class Meta:
         unique_together = ('vmp', 'organisation')
@@ -456,6 +496,24 @@ class IndicativeCost(models.Model):
         return f"{self.vmp.name} - {self.organisation.ods_name}"
 
 
+class VMPQuantitySummary(models.Model):
+    """Which quantity types a VMP has non-zero data for, rebuilt after the quantity tables are loaded"""
+    QUANTITY_TYPES = [('scmd', 'SCMD'), ('dose', 'Dose'), ('ingredient', 'Ingredient'), ('ddd', 'DDD')]
+    vmp = models.ForeignKey(VMP, on_delete=models.CASCADE, related_name="quantity_summaries")
+    quantity_type = models.CharField(max_length=20, choices=QUANTITY_TYPES)
+    units = ArrayField(models.CharField(max_length=255), default=list)
+    first_month = models.DateField(null=True, help_text="First DataStatus month with a non-zero value")
+    last_month = models.DateField(null=True, help_text="Last DataStatus month with a non-zero value")
+    org_count = models.IntegerField(help_text="Organisations with at least one non-zero value")
+    total_quantity = models.FloatField()
+
+    class Meta:
+        unique_together = ('vmp', 'quantity_type')
+
+    def __str__(self):
+        return f"{self.vmp.name} ({self.get_quantity_type_display()})"
+
+
 class TrustAdmission(models.Model):
     """Monthly finished discharge episodes per trust."""
 
@@ -588,24 +646,6 @@ class Measure(models.Model):
     def __str__(self):
         return self.name
 
-class PrecomputedMeasure(models.Model):
-    measure = models.ForeignKey(Measure, on_delete=models.CASCADE, related_name="precomputed_measures")
-    organisation = models.ForeignKey(Organisation, on_delete=models.CASCADE, related_name="precomputed_measures")
-    month = models.DateField()
-    quantity = models.FloatField(null=True)
-    numerator = models.FloatField(null=True)
-    denominator = models.FloatField(null=True)
-
-    class Meta:
-        unique_together = ('measure', 'organisation', 'month')
-        indexes = [
-            models.Index(fields=['measure', 'organisation', 'month']),
-        ]
-
-    def __str__(self):
-        return f"{self.measure.name} - {self.organisation.ods_name} - {self.month}"
-
-
 class OrgSubmissionCache(models.Model):
     organisation = models.ForeignKey(Organisation, on_delete=models.CASCADE)
     successor = models.ForeignKey(Organisation, on_delete=models.CASCADE, related_name='successors', null=True, blank=True)
@@ -617,39 +657,92 @@ class OrgSubmissionCache(models.Model):
     class Meta:
         unique_together = ('organisation', 'month')
 
-class PrecomputedMeasureAggregated(models.Model):
-    measure = models.ForeignKey(Measure, on_delete=models.CASCADE, related_name="precomputed_measures_aggregated")
-    label = models.CharField(max_length=255, null=True)
-    month = models.DateField()
-    quantity = models.FloatField(null=True)
-    numerator = models.FloatField(null=True)
-    denominator = models.FloatField(null=True)
+class PrecomputedMeasureSeries(models.Model):
+    """Precomputed measure values for one organisation, as arrays of consecutive months."""
+    measure = models.ForeignKey(Measure, on_delete=models.CASCADE, related_name="precomputed_series")
+    organisation = models.ForeignKey(Organisation, on_delete=models.CASCADE, related_name="precomputed_measure_series")
+    start_month = models.DateField(help_text="Month of the first array element; element i is i months later")
+    quantity = ArrayField(models.FloatField(null=True))
+    numerator = ArrayField(models.FloatField(null=True))
+    denominator = ArrayField(models.FloatField(null=True))
+
+    class Meta:
+        unique_together = ('measure', 'organisation')
+
+    def __str__(self):
+        return f"{self.measure.name} - {self.organisation.ods_name}"
+
+
+class PrecomputedMeasureAggregatedSeries(models.Model):
+    """Precomputed ICB, region or national measure values, as arrays of consecutive months."""
+    measure = models.ForeignKey(Measure, on_delete=models.CASCADE, related_name="precomputed_aggregated_series")
     category = models.CharField(max_length=20, choices=[('region', 'Region'), ('icb', 'ICB'), ('national', 'National')])
+    label = models.CharField(max_length=255, null=True)
+    start_month = models.DateField(help_text="Month of the first array element; element i is i months later")
+    quantity = ArrayField(models.FloatField(null=True))
+    numerator = ArrayField(models.FloatField(null=True))
+    denominator = ArrayField(models.FloatField(null=True))
 
     class Meta:
-        unique_together = ('measure', 'category', 'label', 'month')
-        indexes = [
-            models.Index(fields=['measure', 'category', 'label', 'month']),
-        ]
+        unique_together = ('measure', 'category', 'label')
 
     def __str__(self):
-        return f"{self.measure.name} - {self.category} - {self.label} - {self.month}"
+        return f"{self.measure.name} - {self.category} - {self.label}"
 
 
-class PrecomputedPercentile(models.Model):
-    measure = models.ForeignKey(Measure, on_delete=models.CASCADE, related_name="precomputed_percentiles")
-    month = models.DateField()
+class PrecomputedPercentileSeries(models.Model):
+    """Precomputed values of one percentile across organisations, as an array of consecutive months."""
+    measure = models.ForeignKey(Measure, on_delete=models.CASCADE, related_name="precomputed_percentile_series")
     percentile = models.IntegerField()
-    quantity = models.FloatField(null=True)
+    start_month = models.DateField(help_text="Month of the first array element; element i is i months later")
+    quantity = ArrayField(models.FloatField(null=True))
 
     class Meta:
-        unique_together = ('measure', 'month', 'percentile')
-        indexes = [
-            models.Index(fields=['measure', 'month', 'percentile']),
-        ]
+        unique_together = ('measure', 'percentile')
+
+    def __str__(self):
+        return f"{self.measure.name} - {self.percentile}th percentile"
+
+
+class PrecomputedMeasurePayload(models.Model):
+    """
+    A measure's own measure item page data, written by compute_measures as
+    zlib-compressed JSON. Organisation details are added when it is served.
+    """
+    JSON_FIELDS = ('org_data', 'region_data', 'icb_data', 'national_data', 'percentile_data')
+
+    measure = models.OneToOneField(Measure, on_delete=models.CASCADE, related_name="payload")
+    org_data = models.BinaryField()
+    region_data = models.BinaryField()
+    icb_data = models.BinaryField()
+    national_data = models.BinaryField()
+    percentile_data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.measure.name} - payload"
+
+
+class MeasureComputation(models.Model):
+    """State of the last compute_measures run for a measure, used for incremental refreshes."""
+    measure = models.OneToOneField(Measure, on_delete=models.CASCADE, related_name="computation")
+    fingerprint = models.CharField(
+        max_length=64,
+        help_text="Hash of the measure definition and MeasureVMP set the precomputed rows were built from",
+    )
+    month_fingerprints = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Hash of each month's numerator and denominator inputs (ISO date keys) at the last incremental run",
+    )
+    data_status = models.JSONField(
+        default=dict,
+        help_text="DataStatus file type by month (ISO date) when the precomputed rows were built",
+    )
+    computed_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return f"{self.measure.name} - {self.month} - {self.percentile}th percentile"
+        return f"{self.measure.name} - computed {self.computed_at}"
 
 class DataStatus(models.Model):
     year_month = models.DateField(unique=True)
@@ -0,0 +1,383 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connection
+from django.db.models import Q
+
+from .models import (
+    ICB,
+    VMP,
+    CancerAlliance,
+    DDDQuantity,
+    Dose,
+    Ingredient,
+    IngredientQuantity,
+    Organisation,
+    Region,
+    SCMDQuantity,
+    TrustType,
+)
+from .quantity_summary import DEFAULT_DDD_UNIT
+
+
+QUANTITY_MODELS = {
+    "SCMD Quantity": SCMDQuantity,
+    "Unit Dose Quantity": Dose,
+    "Ingredient Quantity": IngredientQuantity,
+    "Defined Daily Dose Quantity": DDDQuantity,
+}
+
+
+# group_by -> (key expression, name expression, joins) for rollup_quantities.
+# eo is the effective organisation (the successor if there is one).
+ROLLUP_GROUPS = {
+    'region': (
+        "r.code", "r.name",
+        [f"JOIN {Region._meta.db_table} r ON r.id = eo.region_id"],
+    ),
+    'icb': (
+        "i.code", "i.name",
+        [f"JOIN {ICB._meta.db_table} i ON i.id = eo.icb_id"],
+    ),
+    'cancer_alliance': (
+        "ca.code", "ca.name",
+        [f"JOIN {CancerAlliance._meta.db_table} ca ON ca.id = eo.cancer_alliance_id"],
+    ),
+    'trust_type': (
+        "tt.name", "tt.name",
+        [f"JOIN {TrustType._meta.db_table} tt ON tt.id = eo.trust_type_id"],
+    ),
+    'shelford': (
+        "eo.in_shelford_group::text",
+        "CASE WHEN eo.in_shelford_group THEN 'Shelford Group' ELSE 'Not in Shelford Group' END",
+        [],
+    ),
+    'product': (
+        "v.code", "v.name",
+        [f"JOIN {VMP._meta.db_table} v ON v.id = q.vmp_id"],
+    ),
+    # A VMP's quantity is split evenly between its ingredients
+    'ingredient': (
+        "ing.code", "ing.name",
+        [
+            f"""JOIN (
+                SELECT vmp_id, ingredient_id,
+                    1.0 / count(*) OVER (PARTITION BY vmp_id) AS weight
+                FROM {VMP.ingredients.through._meta.db_table}
+            ) vi ON vi.vmp_id = q.vmp_id""",
+            f"JOIN {Ingredient._meta.db_table} ing ON ing.id = vi.ingredient_id",
+        ],
+    ),
+    # The unit column depends on the quantity model; see _rollup_sql
+    'unit': (None, None, []),
+}
+
+
+def _org_metadata(ods_code, ods_name, region, icb):
+    return {
+        'ods_code': ods_code,
+        'ods_name': ods_name,
+        'region': region,
+        'icb': icb,
+    }
+
+
+def _unit_table(model):
+    """Return the db table holding the unit for a quantity model, or None (DDD)."""
+    try:
+        field = model._meta.get_field('quantity_unit')
+    except FieldDoesNotExist:
+        return None
+    return field.related_model._meta.db_table
+
+
+def _aggregate_sql(model, vmp_ids, national, ods_codes, packed=False):
+    """
+    SQL and params summing the dense arrays of model per VMP or (VMP, effective org).
+
+    With packed, each group's data is returned as a bytea of big-endian
+    float8 values (float8send per month) instead of a double precision array.
+    """
+    table = model._meta.db_table
+    org_table = Organisation._meta.db_table
+    unit_table = _unit_table(model)
+
+    filter_by_org = not national and bool(ods_codes)
+    params = [vmp_ids]
+
+    joins = []
+    if not national or filter_by_org:
+        joins.append(f"JOIN {org_table} o ON o.id = q.organisation_id")
+    if filter_by_org:
+        joins.append(f"LEFT JOIN {org_table} s ON s.id = o.successor_id")
+    if unit_table:
+        joins.append(f"JOIN {unit_table} qu ON qu.id = q.quantity_unit_id")
+
+    where = "q.vmp_id = ANY(%s)"
+    if filter_by_org:
+        where += " AND (o.ods_code = ANY(%s) OR s.ods_code = ANY(%s))"
+        params.extend([list(ods_codes), list(ods_codes)])
+
+    org_key = "NULL::integer" if national else "COALESCE(o.successor_id, o.id)"
+    unit_expr = "qu.unit" if unit_table else "NULL::text"
+    if packed:
+        data_agg = "string_agg(float8send(total::float8), ''::bytea ORDER BY idx)"
+        empty_data = "''::bytea"
+    else:
+        data_agg = "array_agg(total ORDER BY idx)"
+        empty_data = "'{}'::double precision[]"
+
+    sql = f"""
+        WITH month_totals AS (
+            SELECT
+                q.vmp_id,
+                {org_key} AS org_id,
+                u.idx,
+                SUM(COALESCE(u.val, 0)) AS total,
+                MIN({unit_expr}) AS unit
+            FROM {table} q
+            {' '.join(joins)}
+            LEFT JOIN LATERAL unnest(q.data) WITH ORDINALITY AS u(val, idx) ON TRUE
+            WHERE {where}
+            GROUP BY 1, 2, 3
+        ),
+        grouped AS (
+            SELECT
+                vmp_id,
+                org_id,
+                COALESCE(
+                    {data_agg} FILTER (WHERE idx IS NOT NULL),
+                    {empty_data}
+                ) AS data,
+                MIN(unit) AS unit
+            FROM month_totals
+            GROUP BY vmp_id, org_id
+        )
+        SELECT
+            g.vmp_id,
+            g.org_id,
+            g.data,
+            g.unit,
+            eo.ods_code,
+            eo.ods_name,
+            r.name,
+            i.name
+        FROM grouped g
+        LEFT JOIN {org_table} eo ON eo.id = g.org_id
+        LEFT JOIN {Region._meta.db_table} r ON r.id = eo.region_id
+        LEFT JOIN {ICB._meta.db_table} i ON i.id = eo.icb_id
+        ORDER BY g.vmp_id, g.org_id
+    """
+
+    return sql, params
+
+
+def iter_aggregated_quantities(
+    model, vmp_ids, *, national, ods_codes=None, packed=False, chunk_size=2000
+):
+    """
+    Yield the (key, group) pairs of aggregate_quantities in key order.
+
+    Rows are read through a server-side cursor chunk_size at a time, so a
+    streaming response never holds every group in memory. With packed, each
+    group's data is bytes of big-endian float64 values rather than a list.
+    """
+    vmp_ids = list(vmp_ids)
+    if not vmp_ids:
+        return
+
+    sql, params = _aggregate_sql(model, vmp_ids, national, ods_codes, packed)
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(sql, params)
+        while rows := cursor.fetchmany(chunk_size):
+            for vmp_id, org_id, data, unit, ods_code, ods_name, region, icb in rows:
+                key = vmp_id if national else (vmp_id, org_id)
+                yield key, {
+                    'data': bytes(data) if packed else list(data),
+                    'unit': unit,
+                    'organisation': (
+                        None if national else _org_metadata(ods_code, ods_name, region, icb)
+                    ),
+                }
+
+
+def aggregate_quantities(model, vmp_ids, *, national, ods_codes=None, packed=False):
+    """
+    Sum dense quantity arrays in PostgreSQL.
+
+    Rows are grouped by VMP (national) or by (VMP, effective org), where the
+    effective org is the successor if the organisation has one. Arrays are
+    unnested, summed per month index and re-aggregated, so only one array per
+    group crosses the wire.
+
+    Returns {key: {'data': [...], 'unit': str | None, 'organisation': dict | None}}
+    keyed the same way as group_quantity_rows.
+    """
+    return dict(
+        iter_aggregated_quantities(
+            model, vmp_ids, national=national, ods_codes=ods_codes, packed=packed
+        )
+    )
+
+
+def _rollup_sql(model, vmp_ids, group_by, ods_codes, ddd_units):
+    """SQL and params summing the dense arrays of model per group_by group."""
+    table = model._meta.db_table
+    org_table = Organisation._meta.db_table
+    key_expr, name_expr, group_joins = ROLLUP_GROUPS[group_by]
+
+    joins = [
+        f"JOIN {org_table} o ON o.id = q.organisation_id",
+        f"JOIN {org_table} eo ON eo.id = COALESCE(o.successor_id, o.id)",
+        *group_joins,
+    ]
+    params = []
+    if group_by == 'unit':
+        unit_table = _unit_table(model)
+        if unit_table:
+            joins.append(f"JOIN {unit_table} qu ON qu.id = q.quantity_unit_id")
+            unit_expr = "qu.unit"
+        else:
+            joins.append(
+                "LEFT JOIN unnest(%s::integer[], %s::text[]) AS du(vmp_id, unit) "
+                "ON du.vmp_id = q.vmp_id"
+            )
+            params.extend([list(ddd_units), list(ddd_units.values())])
+            unit_expr = f"COALESCE(du.unit, '{DEFAULT_DDD_UNIT}')"
+        key_expr = name_expr = unit_expr
+    weight = "vi.weight" if group_by == 'ingredient' else "1"
+
+    where = "q.vmp_id = ANY(%s)"
+    params.append(list(vmp_ids))
+    if ods_codes:
+        where += " AND (o.ods_code = ANY(%s) OR eo.ods_code = ANY(%s))"
+        params.extend([list(ods_codes), list(ods_codes)])
+
+    sql = f"""
+        WITH month_totals AS (
+            SELECT
+                {key_expr} AS group_key,
+                {name_expr} AS group_name,
+                u.idx,
+                SUM(COALESCE(u.val, 0) * {weight}) AS total
+            FROM {table} q
+            {' '.join(joins)}
+            LEFT JOIN LATERAL unnest(q.data) WITH ORDINALITY AS u(val, idx) ON TRUE
+            WHERE {where}
+            GROUP BY 1, 2, 3
+        )
+        SELECT
+            group_key,
+            group_name,
+            COALESCE(
+                array_agg(total::float8 ORDER BY idx) FILTER (WHERE idx IS NOT NULL),
+                '{{}}'::double precision[]
+            ) AS data
+        FROM month_totals
+        GROUP BY group_key, group_name
+        ORDER BY group_name, group_key
+    """
+    return sql, params
+
+
+def rollup_quantities(model, vmp_ids, group_by, *, ods_codes=None, ddd_units=None):
+    """
+    Sum dense quantity arrays into one series per group_by group in PostgreSQL.
+
+    Organisations are replaced by their successor before grouping, as in
+    aggregate_quantities, and ods_codes limits the rows to those organisations
+    or their predecessors. Rows without a group (e.g. a trust with no
+    cancer alliance) are left out. ddd_units maps VMP id to the DDD unit
+    label and is only needed to group DDD quantities by unit.
+
+    Returns [{'key': str, 'name': str, 'data': [...]}] ordered by name.
+    """
+    if group_by not in ROLLUP_GROUPS:
+        raise ValueError(f"Invalid group_by: {group_by}")
+    vmp_ids = list(vmp_ids)
+    if not vmp_ids:
+        return []
+
+    sql, params = _rollup_sql(model, vmp_ids, group_by, ods_codes, ddd_units or {})
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [
+            {'key': key, 'name': name, 'data': list(data)}
+            for key, name, data in cursor.fetchall()
+        ]
+
+
+def add_quantity_data(existing, new_data):
+    """Element-wise sum of new_data into existing, padding with zeros."""
+    new_data = new_data or []
+    for i in range(max(len(existing), len(new_data))):
+        while len(existing) <= i:
+            existing.append(0)
+        add_val = float(new_data[i] or 0) if i < len(new_data) else 0
+        existing[i] = existing[i] + add_val
+
+
+def group_quantity_rows(quantity_data, *, national):
+    """Group quantity rows by VMP (national) or (VMP, effective org)."""
+    grouped = {}
+    for item in quantity_data:
+        if national:
+            key = item.vmp_id
+            effective_org = None
+        else:
+            org = item.organisation
+            effective_org = org.successor if org.successor_id else org
+            key = (item.vmp_id, effective_org.id)
+
+        if key not in grouped:
+            grouped[key] = {
+                'item': item,
+                'effective_org': effective_org,
+                'data': list(item.data or []),
+            }
+        else:
+            add_quantity_data(grouped[key]['data'], item.data)
+    return grouped
+
+
+def aggregate_quantities_python(model, vmp_ids, *, national, ods_codes=None):
+    """
+    Reference implementation of aggregate_quantities that loads ORM rows and
+    sums the arrays in Python. Kept for benchmarking and equivalence tests.
+    """
+    queryset = model.objects.filter(vmp_id__in=vmp_ids)
+    if not national and ods_codes:
+        queryset = queryset.filter(
+            Q(organisation__ods_code__in=ods_codes)
+            | Q(organisation__successor__ods_code__in=ods_codes)
+        )
+    select_related_fields = []
+    if not national:
+        select_related_fields.extend([
+            'organisation',
+            'organisation__region',
+            'organisation__icb',
+            'organisation__successor',
+            'organisation__successor__region',
+            'organisation__successor__icb',
+        ])
+    if _unit_table(model):
+        select_related_fields.append('quantity_unit')
+    queryset = queryset.select_related(*select_related_fields)
+
+    grouped = {}
+    for key, group in group_quantity_rows(list(queryset), national=national).items():
+        org = group['effective_org']
+        grouped[key] = {
+            'data': [float(v or 0) for v in group['data']],
+            'unit': getattr(group['item'], 'unit', None),
+            'organisation': (
+                _org_metadata(
+                    org.ods_code,
+                    org.ods_name,
+                    org.region.name if org.region else None,
+                    org.icb.name if org.icb else None,
+                )
+                if org
+                else None
+            ),
+        }
+    return grouped
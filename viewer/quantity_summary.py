@@ -0,0 +1,126 @@
+"""
+Per-VMP quantity availability, read from VMPQuantitySummary.
+
+The summary holds one row per VMP and quantity type (scmd, dose, ingredient,
+ddd) that has at least one non-zero value: the units the data is in, the
+first and last non-zero DataStatus month, the number of organisations with
+data and the total quantity. It is rebuilt from the dense quantity tables by
+update_vmp_quantity_summary once the load flows have run. Until it has been
+built, reads fall back to computing the same rows from the quantity tables.
+"""
+from collections import defaultdict
+
+from django.db import connection, transaction
+
+from .models import (
+    DataStatus,
+    DDDQuantity,
+    Dose,
+    IngredientQuantity,
+    IngredientQuantityUnit,
+    SCMDQuantity,
+    VMPQuantitySummary,
+    VMPQuantityUnit,
+)
+from .utils import get_ddd_unit_map
+
+
+QUANTITY_SOURCES = [
+    ('scmd', SCMDQuantity, VMPQuantityUnit),
+    ('dose', Dose, VMPQuantityUnit),
+    ('ingredient', IngredientQuantity, IngredientQuantityUnit),
+    ('ddd', DDDQuantity, None),
+]
+
+DEFAULT_DDD_UNIT = "DDD"
+
+SUMMARY_COLUMNS = [
+    'vmp_id', 'quantity_type', 'units', 'first_month', 'last_month', 'org_count', 'total_quantity'
+]
+
+
+def _summary_sql(vmp_filter):
+    sources = []
+    for quantity_type, model, unit_model in QUANTITY_SOURCES:
+        table = model._meta.db_table
+        if unit_model:
+            unit = "u.unit"
+            join = f"JOIN {unit_model._meta.db_table} u ON u.id = q.quantity_unit_id"
+        else:
+            unit, join = "NULL::varchar", ""
+        sources.append(
+            f"SELECT '{quantity_type}' AS quantity_type, q.vmp_id, q.organisation_id, "
+            f"{unit} AS unit, q.data FROM {table} q {join} {vmp_filter}"
+        )
+    union = "\n        UNION ALL\n        ".join(sources)
+    return f"""
+    WITH months AS (
+        SELECT year_month, row_number() OVER (ORDER BY year_month) AS idx
+        FROM {DataStatus._meta.db_table}
+    ),
+    quantities AS (
+        {union}
+    )
+    SELECT
+        q.vmp_id,
+        q.quantity_type,
+        array_remove(array_agg(DISTINCT q.unit ORDER BY q.unit), NULL) AS units,
+        min(m.year_month) AS first_month,
+        max(m.year_month) AS last_month,
+        count(DISTINCT q.organisation_id) AS org_count,
+        sum(v.value) AS total_quantity
+    FROM quantities q
+    CROSS JOIN LATERAL unnest(q.data) WITH ORDINALITY AS v(value, idx)
+    LEFT JOIN months m ON m.idx = v.idx
+    WHERE v.value <> 0
+    GROUP BY q.vmp_id, q.quantity_type
+    """
+
+
+def _with_ddd_units(rows):
+    """Fill in the DDD unit label, which is formatted from the DDD table."""
+    ddd_vmp_ids = {row['vmp_id'] for row in rows if row['quantity_type'] == 'ddd'}
+    ddd_unit_map = get_ddd_unit_map(ddd_vmp_ids) if ddd_vmp_ids else {}
+    for row in rows:
+        if row['quantity_type'] == 'ddd':
+            row['units'] = [ddd_unit_map.get(row['vmp_id'], DEFAULT_DDD_UNIT)]
+    return rows
+
+
+def compute_quantity_summary(vmp_ids=None):
+    """Summary rows computed directly from the quantity tables."""
+    vmp_filter, params = "", []
+    if vmp_ids is not None:
+        vmp_filter = "WHERE q.vmp_id = ANY(%s)"
+        params = [list(vmp_ids)] * len(QUANTITY_SOURCES)
+
+    with connection.cursor() as cursor:
+        cursor.execute(_summary_sql(vmp_filter), params)
+        rows = [dict(zip(SUMMARY_COLUMNS, row)) for row in cursor.fetchall()]
+    return _with_ddd_units(rows)
+
+
+def update_vmp_quantity_summary():
+    """Rebuild VMPQuantitySummary from the quantity tables; returns the number of rows written."""
+    rows = compute_quantity_summary()
+    with transaction.atomic():
+        VMPQuantitySummary.objects.all().delete()
+        VMPQuantitySummary.objects.bulk_create(
+            [VMPQuantitySummary(**row) for row in rows], batch_size=5000
+        )
+    return len(rows)
+
+
+def get_quantity_summary(vmp_ids):
+    """Summary rows for the given VMPs, by VMP id and then quantity type."""
+    vmp_ids = list(vmp_ids)
+    rows = list(
+        VMPQuantitySummary.objects.filter(vmp_id__in=vmp_ids).values(*SUMMARY_COLUMNS)
+    )
+    if not rows and not VMPQuantitySummary.objects.exists():
+        rows = compute_quantity_summary(vmp_ids)
+
+    summary = defaultdict(dict)
+    for row in rows:
+        summary[row['vmp_id']][row['quantity_type']] = row
+    return summary
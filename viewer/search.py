@@ -1,12 +1,14 @@
 import re
 import unicodedata
+from array import array
 from collections import defaultdict
 from dataclasses import dataclass
 from functools import lru_cache
 
-from django.db.models import Count, Max, Q
+from django.db import connection
+from django.db.models import Count, Max
 
-from .models import ATC, Ingredient, VMP
+from .models import ATC, Ingredient, VMP, VMPATCAncestor, VTM
 
 
 MAX_PRODUCT_RESULTS = 200
@@ -21,6 +23,10 @@ _WHITESPACE_RE = re.compile(r"\s+")
 #   len 1 -> level 1, len 3 -> 2, len 4 -> 3, len 5 -> 4, len 7 -> 5.
 _ATC_LEVEL_BY_CODE_LEN = {1: 1, 3: 2, 4: 3, 5: 4, 7: 5}
 
+# Query tokens shorter than this cannot use the trigram index and are only
+# checked against the candidate rows' search text.
+_TRIGRAM_LENGTH = 3
+
 
 def normalise_string(s):
     """Normalise for search: lowercase, strip accents/punctuation, collapse whitespace."""
@@ -115,6 +121,77 @@ def _load_vmp_rows():
     return rows
 
 
+def _trigrams(word):
+    return {
+        word[i:i + _TRIGRAM_LENGTH]
+        for i in range(len(word) - _TRIGRAM_LENGTH + 1)
+    }
+
+
+@dataclass(frozen=True)
+class _VMPSearchIndex:
+    """Trigram postings over the VMP search text.
+
+    postings maps each trigram found in a word of a row's search_blob to the
+    positions of those rows in ascending order. A query token of three or more
+    characters can only occur in rows holding every one of its trigrams, so
+    intersecting postings gives a small candidate set that is then checked with
+    the same substring test as before.
+    """
+    rows: tuple
+    blobs: tuple
+    postings: dict
+    total_counts_by_vtm: dict
+
+    @classmethod
+    def build(cls, rows):
+        blobs = tuple(row.search_blob for row in rows)
+        postings = defaultdict(lambda: array("i"))
+        total_counts_by_vtm = defaultdict(int)
+        for position, (row, blob) in enumerate(zip(rows, blobs)):
+            grams = set()
+            for word in blob.split():
+                grams |= _trigrams(word)
+            for gram in grams:
+                postings[gram].append(position)
+            if row.vtm_id is not None:
+                total_counts_by_vtm[row.vtm_id] += 1
+        return cls(
+            rows=tuple(rows),
+            blobs=blobs,
+            postings=dict(postings),
+            total_counts_by_vtm=dict(total_counts_by_vtm),
+        )
+
+    def _candidate_positions(self, tokens):
+        """Positions of rows that may match every token, or None if no token is indexable."""
+        grams = set()
+        for token in tokens:
+            grams |= _trigrams(token)
+        if not grams:
+            return None
+        postings = sorted(
+            (self.postings.get(gram, ()) for gram in grams), key=len
+        )
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(posting)
+        return sorted(candidates)
+
+    def search(self, tokens):
+        """Rows whose search text contains every token, in catalogue order."""
+        positions = self._candidate_positions(tokens)
+        if positions is None:
+            positions = range(len(self.rows))
+        return [
+            self.rows[i]
+            for i in positions
+            if _matches_all_tokens(self.blobs[i], tokens)
+        ]
+
+
 def _vmp_rows_signature():
     stats = VMP.objects.aggregate(max_id=Max("id"), count=Count("id"))
     return (stats["max_id"], stats["count"])
@@ -125,8 +202,13 @@ def _load_vmp_rows_for_signature(signature):
     return _load_vmp_rows()
 
 
-def _load_vmp_rows_cached():
-    return _load_vmp_rows_for_signature(_vmp_rows_signature())
+@lru_cache(maxsize=1)
+def _load_vmp_index_for_signature(signature):
+    return _VMPSearchIndex.build(_load_vmp_rows_for_signature(signature))
+
+
+def _load_vmp_index_cached():
+    return _load_vmp_index_for_signature(_vmp_rows_signature())
 
 
 def _prefix_match(value, query_normalised):
@@ -136,7 +218,7 @@ def _prefix_match(value, query_normalised):
     return value.startswith(query_normalised) or query_normalised.startswith(value)
 
 
-def _rank_key(row, query_normalised, display_name):
+def _rank_key(row, query_normalised, display_norm):
     """Deterministic ranking: exact/prefix on code, then on top-label, then on
     the display label, then name.
 
@@ -144,12 +226,12 @@ def _rank_key(row, query_normalised, display_name):
     user sees (e.g. "Morphine sulfate 100mg/100ml infusion bags" for the query
     "morphine sulfate") from an infix-only or ingredient-only match on a row
     whose display label does not start with the query (e.g. "Morphine 60mg
-    modified-release tablets" matching via its ingredient blob). 
+    modified-release tablets" matching via its ingredient blob). display_norm
+    is the normalised display label, which is precomputed on the row.
     """
     code = row.code_norm
     vtm_code = row.vtm_code_norm
     top_label = row.top_label_norm
-    display_norm = normalise_string(display_name)
 
     exact_code = int(code == query_normalised or vtm_code == query_normalised)
     exact_top = int(top_label == query_normalised)
@@ -182,17 +264,12 @@ def search_product_results(raw_term):
     if len(normalised) < 3:
         return []
 
-    all_rows = _load_vmp_rows_cached()
-    matched_rows = [
-        row for row in all_rows if _matches_all_tokens(row.search_blob, tokens)
-    ]
+    index = _load_vmp_index_cached()
+    matched_rows = index.search(tokens)
     if not matched_rows:
         return []
 
-    total_counts_by_vtm = defaultdict(int)
-    for row in all_rows:
-        if row.vtm_id is not None:
-            total_counts_by_vtm[row.vtm_id] += 1
+    total_counts_by_vtm = index.total_counts_by_vtm
 
     matched_by_vtm = defaultdict(list)
     ranked_results = []
@@ -202,7 +279,7 @@ def search_product_results(raw_term):
         else:
             ranked_results.append(
                 (
-                    _rank_key(row, normalised, row.name),
+                    _rank_key(row, normalised, row.name_norm),
                     {"code": row.code, "name": row.name, "type": "vmp"},
                 )
             )
@@ -210,13 +287,13 @@ def search_product_results(raw_term):
     for vtm_id, rows in matched_by_vtm.items():
         ordered_rows = sorted(
             rows,
-            key=lambda r: _rank_key(r, normalised, r.name),
+            key=lambda r: _rank_key(r, normalised, r.name_norm),
         )
         best = ordered_rows[0]
         if len(rows) == total_counts_by_vtm[vtm_id]:
             ranked_results.append(
                 (
-                    _rank_key(best, normalised, best.vtm_name or ""),
+                    _rank_key(best, normalised, best.vtm_name_norm),
                     {
                         "code": best.vtm_code,
                         "name": best.vtm_name,
@@ -232,7 +309,7 @@ def search_product_results(raw_term):
             for row in ordered_rows:
                 ranked_results.append(
                     (
-                        _rank_key(row, normalised, row.name),
+                        _rank_key(row, normalised, row.name_norm),
                         {"code": row.code, "name": row.name, "type": "vmp"},
                     )
                 )
@@ -241,51 +318,39 @@ def search_product_results(raw_term):
     return [item for _, item in ranked_results[:MAX_PRODUCT_RESULTS]]
 
 
-def search_ingredient_results(raw_term):
-    """Search for VMPs matching the given term based on ingredient name and code."""
-    normalised, tokens = prepare_search_query(raw_term)
-    if len(normalised) < 3:
-        return []
+@dataclass(frozen=True)
+class _IngredientRow:
+    id: int
+    code: str
+    name: str
+    name_norm: str
+    search_blob: str
 
-    ingredients = list(Ingredient.objects.only("id", "code", "name"))
-    matched = [
-        ing
-        for ing in ingredients
-        if _matches_all_tokens(
-            f"{normalise_string(ing.name)} {normalise_string(ing.code)}",
-            tokens,
-        )
-    ]
-    matched.sort(key=lambda ing: normalise_string(ing.name))
-    matched = matched[:MAX_INGREDIENT_RESULTS]
-    if not matched:
-        return []
 
-    ingredient_ids = [ing.id for ing in matched]
-    vmps_by_ingredient = defaultdict(list)
-    seen = defaultdict(set)
-    vmp_rows = (
-        VMP.objects.filter(ingredients__in=ingredient_ids)
-        .values("code", "name", "ingredients__id")
-        .order_by("name")
-    )
-    for row in vmp_rows:
-        ing_id = row["ingredients__id"]
-        if row["code"] in seen[ing_id]:
-            continue
-        seen[ing_id].add(row["code"])
-        vmps_by_ingredient[ing_id].append({"code": row["code"], "name": row["name"]})
+@dataclass(frozen=True)
+class _ATCRow:
+    code: str
+    name: str | None
+    level: int | None
+    level_name: str | None
+    hierarchy_path: tuple
+    search_blob: str
 
-    return [
-        {
-            "code": ingredient.code,
-            "name": ingredient.name,
-            "type": "ingredient",
-            "vmp_count": len(vmps_by_ingredient.get(ingredient.id, [])),
-            "vmps": vmps_by_ingredient.get(ingredient.id, []),
-        }
-        for ingredient in matched
-    ]
+
+@dataclass(frozen=True)
+class _SearchCorpora:
+    """Ingredient and ATC search rows with the VMPs linked to them.
+
+    ingredients are ordered by normalised name and atcs by code, the order
+    results are returned in. vmps_by_atc maps each ATC code to its VMPs from
+    the VMPATCAncestor closure, so an ATC's VMPs include those tagged with any
+    more specific descendant. VMP lists are ordered by name and hold
+    {"code", "name"} dicts.
+    """
+    ingredients: tuple
+    atcs: tuple
+    vmps_by_ingredient: dict
+    vmps_by_atc: dict
 
 
 def _build_hierarchy_path(atc):
@@ -313,6 +378,116 @@ def _atc_search_blob(atc):
     )
 
 
+def _group_vmps(links):
+    """Group (key, code, name) links into name-ordered, de-duplicated VMP lists."""
+    grouped = defaultdict(dict)
+    for key, code, name in links:
+        grouped[key].setdefault(code, {"code": code, "name": name})
+    return {
+        key: sorted(vmps.values(), key=lambda vmp: (vmp["name"], vmp["code"]))
+        for key, vmps in grouped.items()
+    }
+
+
+def _load_search_corpora():
+    ingredients = sorted(
+        (
+            _IngredientRow(
+                id=ing.id,
+                code=ing.code,
+                name=ing.name,
+                name_norm=normalise_string(ing.name),
+                search_blob=f"{normalise_string(ing.name)} {normalise_string(ing.code)}",
+            )
+            for ing in Ingredient.objects.only("id", "code", "name")
+        ),
+        key=lambda ing: (ing.name_norm, ing.id),
+    )
+
+    atcs = []
+    for atc in ATC.objects.order_by("code"):
+        level = _ATC_LEVEL_BY_CODE_LEN.get(len(atc.code))
+        atcs.append(
+            _ATCRow(
+                code=atc.code,
+                name=atc.name,
+                level=level,
+                level_name=getattr(atc, f"level_{level}") if level else None,
+                hierarchy_path=tuple(_build_hierarchy_path(atc)),
+                search_blob=_atc_search_blob(atc),
+            )
+        )
+
+    vmps_by_ingredient = _group_vmps(
+        VMP.ingredients.through.objects.values_list(
+            "ingredient_id", "vmp__code", "vmp__name"
+        )
+    )
+    vmps_by_atc = _group_vmps(
+        VMPATCAncestor.objects.values_list("atc__code", "vmp__code", "vmp__name")
+    )
+
+    return _SearchCorpora(
+        ingredients=tuple(ingredients),
+        atcs=tuple(atcs),
+        vmps_by_ingredient=vmps_by_ingredient,
+        vmps_by_atc=vmps_by_atc,
+    )
+
+
+def _search_corpora_signature():
+    """Max id and row count of every table the corpora are built from, in one query."""
+    tables = (
+        VMP._meta.db_table,
+        Ingredient._meta.db_table,
+        ATC._meta.db_table,
+        VMP.ingredients.through._meta.db_table,
+        VMPATCAncestor._meta.db_table,
+    )
+    columns = ", ".join(
+        f"(SELECT MAX(id) FROM {table}), (SELECT COUNT(*) FROM {table})"
+        for table in tables
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {columns}")
+        return cursor.fetchone()
+
+
+@lru_cache(maxsize=1)
+def _load_search_corpora_for_signature(signature):
+    return _load_search_corpora()
+
+
+def _load_search_corpora_cached():
+    return _load_search_corpora_for_signature(_search_corpora_signature())
+
+
+def search_ingredient_results(raw_term):
+    """Search for VMPs matching the given term based on ingredient name and code."""
+    normalised, tokens = prepare_search_query(raw_term)
+    if len(normalised) < 3:
+        return []
+
+    corpora = _load_search_corpora_cached()
+    matched = [
+        ing for ing in corpora.ingredients if _matches_all_tokens(ing.search_blob, tokens)
+    ][:MAX_INGREDIENT_RESULTS]
+
+    results = []
+    for ingredient in matched:
+        vmps = list(corpora.vmps_by_ingredient.get(ingredient.id, []))
+        results.append(
+            {
+                "code": ingredient.code,
+                "name": ingredient.name,
+                "type": "ingredient",
+                "vmp_count": len(vmps),
+                "vmps": vmps,
+            }
+        )
+    return results
+
+
 def search_atc_results(raw_term):
     """ATC search: all query tokens must match on each row's name, code, and hierarchy level text.
 
@@ -323,48 +498,97 @@ def search_atc_results(raw_term):
     if len(normalised) < 3:
         return []
 
-    atcs = list(ATC.objects.all())
-    matched = [atc for atc in atcs if _matches_all_tokens(_atc_search_blob(atc), tokens)]
-    matched.sort(key=lambda atc: atc.code)
-    matched = matched[:MAX_ATC_RESULTS]
-    if not matched:
-        return []
-
-    atc_codes = [atc.code for atc in matched]
-    startswith_q = Q()
-    for ac in atc_codes:
-        startswith_q |= Q(atcs__code__startswith=ac)
-    vmp_rows = (
-        VMP.objects.filter(startswith_q)
-        .values("code", "name", "atcs__code")
-        .order_by("name")
-    )
-    vmps_by_atc = defaultdict(list)
-    seen_by_atc = defaultdict(set)
-    for row in vmp_rows:
-        matched_atc_code = row["atcs__code"]
-        for ac in atc_codes:
-            if matched_atc_code.startswith(ac) and row["code"] not in seen_by_atc[ac]:
-                seen_by_atc[ac].add(row["code"])
-                vmps_by_atc[ac].append({"code": row["code"], "name": row["name"]})
+    corpora = _load_search_corpora_cached()
+    matched = [
+        atc for atc in corpora.atcs if _matches_all_tokens(atc.search_blob, tokens)
+    ][:MAX_ATC_RESULTS]
 
     results = []
     for atc in matched:
-        level = _ATC_LEVEL_BY_CODE_LEN.get(len(atc.code))
-        if level is None:
+        if atc.level is None:
             continue
-        level_name = getattr(atc, f"level_{level}")
-        vmp_list = vmps_by_atc.get(atc.code, [])
+        vmp_list = list(corpora.vmps_by_atc.get(atc.code, []))
         results.append(
             {
                 "code": atc.code,
-                "name": level_name or atc.name,
+                "name": atc.level_name or atc.name,
                 "type": "atc",
-                "level": level,
+                "level": atc.level,
                 "vmp_count": len(vmp_list),
                 "vmps": vmp_list,
-                "hierarchy_path": _build_hierarchy_path(atc),
+                "hierarchy_path": list(atc.hierarchy_path),
             }
         )
 
     return results
+
+
+PRODUCT_TYPES = ("vmp", "vtm", "ingredient", "atc")
+
+
+def _product_resolution_sql():
+    vmp = VMP._meta.db_table
+    vtm = VTM._meta.db_table
+    ingredient = Ingredient._meta.db_table
+    atc = ATC._meta.db_table
+    vmp_ingredients = VMP.ingredients.through._meta.db_table
+    atc_closure = VMPATCAncestor._meta.db_table
+    return f"""
+    SELECT 'vmp', v.code, v.name, v.id, v.code, v.name
+    FROM {vmp} v
+    WHERE v.code = ANY(%(vmp)s::text[])
+    UNION ALL
+    SELECT 'vtm', t.vtm, t.name, v.id, v.code, v.name
+    FROM {vtm} t
+    LEFT JOIN {vmp} v ON v.vtm_id = t.id
+    WHERE t.vtm = ANY(%(vtm)s::text[])
+    UNION ALL
+    SELECT 'ingredient', i.code, i.name, v.id, v.code, v.name
+    FROM {ingredient} i
+    LEFT JOIN {vmp_ingredients} vi ON vi.ingredient_id = i.id
+    LEFT JOIN {vmp} v ON v.id = vi.vmp_id
+    WHERE i.code = ANY(%(ingredient)s::text[])
+    UNION ALL
+    SELECT 'atc', a.code, a.name, v.id, v.code, v.name
+    FROM {atc} a
+    LEFT JOIN {atc_closure} c ON c.atc_id = a.id
+    LEFT JOIN {vmp} v ON v.id = c.vmp_id
+    WHERE a.code = ANY(%(atc)s::text[])
+    """
+
+
+def resolve_product_codes(codes_by_type):
+    """Expand VMP, VTM, ingredient and ATC codes into their VMPs in one query.
+
+    codes_by_type maps product types ("vmp", "vtm", "ingredient", "atc") to
+    codes. An ATC code covers the VMPs tagged with it or any more specific
+    descendant, found through the VMPATCAncestor closure.
+
+    Returns {(type, code): {"code", "name", "vmps"}} for the codes that exist,
+    with vmps a name-ordered list of {"id", "code", "name"} dicts. A VMP code
+    resolves to itself.
+    """
+    codes = {
+        product_type: sorted(set(codes_by_type.get(product_type) or ()))
+        for product_type in PRODUCT_TYPES
+    }
+    if not any(codes.values()):
+        return {}
+
+    with connection.cursor() as cursor:
+        cursor.execute(_product_resolution_sql(), codes)
+        rows = cursor.fetchall()
+
+    resolved = {}
+    for product_type, code, name, vmp_id, vmp_code, vmp_name in rows:
+        product = resolved.setdefault(
+            (product_type, code), {"code": code, "name": name, "vmps": {}}
+        )
+        if vmp_id is not None:
+            product["vmps"][vmp_id] = {"id": vmp_id, "code": vmp_code, "name": vmp_name}
+
+    for product in resolved.values():
+        product["vmps"] = sorted(
+            product["vmps"].values(), key=lambda vmp: (vmp["name"], vmp["code"])
+        )
+    return resolved
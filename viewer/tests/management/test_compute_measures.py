@@ -1,21 +1,52 @@
+import json
 from datetime import date
 
+import numpy as np
 import pytest
+from django.core.cache import cache
 from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
 
 from viewer.models import (
     DataStatus,
     DDDQuantity,
     ICB,
     Measure,
+    MeasureComputation,
     MeasureVMP,
     Organisation,
-    PrecomputedMeasure,
+    PrecomputedMeasureAggregatedSeries,
+    PrecomputedMeasurePayload,
+    PrecomputedMeasureSeries,
+    PrecomputedPercentileSeries,
     Region,
     TrustAdmission,
     VMP,
     VTM,
 )
+from viewer.management.commands.benchmark_measure_storage import CREATE_ROWS_SQL
+from viewer.measure_computation import (
+    ABSOLUTE_MEASURE,
+    EXTERNAL_DENOMINATOR_MEASURE,
+    PRODUCT_RATIO_MEASURE,
+    MeasureInputs,
+    compute_measure,
+)
+from viewer.measure_series import (
+    aggregated_series,
+    org_series,
+    organisation_counts,
+    percentile_series,
+    series_points,
+)
+from viewer.views.measures import (
+    MEASURE_ITEM_PRECOMPUTED_CACHE_KEY_PREFIX,
+    PERCENTILE_LEVELS,
+    build_measure_item_data,
+    build_measure_item_payload,
+    load_measure_item_payload,
+)
 
 
 @pytest.fixture
@@ -99,14 +130,601 @@ def test_compute_measures_per_1000_admissions(
 
     call_command("compute_measures", admissions_measure.slug)
 
-    included = PrecomputedMeasure.objects.filter(measure=admissions_measure)
-    assert included.count() == 2
-    assert not included.filter(organisation=trust_without_admissions).exists()
+    included = _org_values(admissions_measure)
+    assert set(included) == {(trust.ods_code, months[0]), (trust.ods_code, months[1])}
+
+    jan = included[(trust.ods_code, months[0])]
+    assert jan["numerator"] == 50.0
+    assert jan["denominator"] == 1000.0
+    assert jan["quantity"] == pytest.approx(50.0)
+
+    feb = included[(trust.ods_code, months[1])]
+    assert feb["quantity"] == pytest.approx(50.0)
+
+
+@pytest.fixture
+def successor_and_predecessor(region, icb):
+    successor = Organisation.objects.create(
+        ods_code="SUC", ods_name="Successor Trust", region=region, icb=icb
+    )
+    predecessor = Organisation.objects.create(
+        ods_code="PRE", ods_name="Predecessor Trust", region=region, icb=icb,
+        successor=successor,
+    )
+    return successor, predecessor
+
+
+@pytest.fixture
+def ratio_measure(vmp):
+    denominator_vmp = VMP.objects.create(code="87654321", name="Denominator VMP")
+    measure = Measure.objects.create(
+        name="Ratio measure",
+        slug="ratio-measure",
+        quantity_type="ddd",
+        why_it_matters="test",
+        status="in_development",
+    )
+    MeasureVMP.objects.create(measure=measure, vmp=vmp, type="numerator")
+    MeasureVMP.objects.create(measure=measure, vmp=denominator_vmp, type="denominator")
+    return measure, denominator_vmp
+
+
+@pytest.fixture
+def absolute_measure(vmp):
+    measure = Measure.objects.create(
+        name="Absolute measure",
+        slug="absolute-measure",
+        quantity_type="ddd",
+        why_it_matters="test",
+        status="in_development",
+    )
+    MeasureVMP.objects.create(measure=measure, vmp=vmp, type="numerator")
+    return measure
+
+
+@pytest.fixture
+def ratio_data(ratio_measure, trust, successor_and_predecessor, vmp, months):
+    _, denominator_vmp = ratio_measure
+    successor, predecessor = successor_and_predecessor
+    DDDQuantity.objects.create(vmp=vmp, organisation=trust, data=[10.0, 30.0])
+    DDDQuantity.objects.create(vmp=denominator_vmp, organisation=trust, data=[30.0, 10.0])
+    DDDQuantity.objects.create(vmp=vmp, organisation=successor, data=[5.0, 0.0])
+    DDDQuantity.objects.create(vmp=vmp, organisation=predecessor, data=[5.0, 10.0])
+    DDDQuantity.objects.create(vmp=denominator_vmp, organisation=predecessor, data=[10.0, 10.0])
+
+
+def _org_values(measure):
+    """Org values as read by the views, by (ods_code, month)."""
+    return {
+        (series["organisation__ods_code"], point["month"]): point
+        for series in org_series([measure.id])
+        for point in series_points(series)
+    }
+
+
+def _aggregated_values(measure):
+    return {
+        (series["category"], series["label"], point["month"]): point
+        for series in aggregated_series([measure.id])
+        for point in series_points(series)
+    }
+
+
+def _percentile_values(measure):
+    return {
+        (month, series["percentile"]): quantity
+        for series in percentile_series([measure.id])
+        for month, quantity in zip(series["months"], series["quantity"])
+        if quantity is not None
+    }
+
+
+def _snapshot(measure):
+    return {
+        "org": sorted(
+            (code, month, row["numerator"], row["denominator"], row["quantity"])
+            for (code, month), row in _org_values(measure).items()
+        ),
+        "percentiles": sorted(
+            (month, percentile, quantity)
+            for (month, percentile), quantity in _percentile_values(measure).items()
+        ),
+        "aggregated": sorted(
+            key + (row["numerator"], row["denominator"], row["quantity"])
+            for key, row in _aggregated_values(measure).items()
+        ),
+    }
+
+
+@pytest.mark.django_db
+def test_compute_ratio_measure_merges_predecessors(
+    ratio_measure, ratio_data, trust, successor_and_predecessor, months
+):
+    measure, _ = ratio_measure
+    successor, predecessor = successor_and_predecessor
+
+    call_command("compute_measures", measure.slug)
+
+    rows = _org_values(measure)
+    assert predecessor.ods_code not in {code for code, _ in rows}
+
+    merged_jan = rows[(successor.ods_code, months[0])]
+    assert merged_jan["numerator"] == 10.0
+    # Denominators include numerator products
+    assert merged_jan["denominator"] == 20.0
+    assert merged_jan["quantity"] == pytest.approx(50.0)
+
+    trust_jan = rows[(trust.ods_code, months[0])]
+    assert trust_jan["quantity"] == pytest.approx(25.0)
+
+    percentiles = _percentile_values(measure)
+    assert percentiles[(months[0], 50)] == pytest.approx(37.5)
+    assert percentiles[(months[0], 5)] == pytest.approx(25.0 * 0.95 + 50.0 * 0.05)
+
+    national_jan = _aggregated_values(measure)[("national", "National", months[0])]
+    assert national_jan["numerator"] == 20.0
+    assert national_jan["denominator"] == 60.0
+    assert national_jan["quantity"] == pytest.approx(100 / 3)
+
+
+@pytest.mark.django_db
+def test_compute_absolute_measure_has_no_org_denominator(
+    absolute_measure, ratio_data, trust, months
+):
+    call_command("compute_measures", absolute_measure.slug)
+
+    row = _org_values(absolute_measure)[(trust.ods_code, months[1])]
+    assert row["numerator"] == 30.0
+    assert row["denominator"] is None
+    assert row["quantity"] == 30.0
+
+    region_feb = _aggregated_values(absolute_measure)[("region", "Test Region", months[1])]
+    assert region_feb["quantity"] == 40.0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_compute_all_measures_matches_single_measure_runs(
+    ratio_measure, absolute_measure, admissions_measure, ratio_data, trust, months
+):
+    measure, _ = ratio_measure
+    TrustAdmission.objects.create(organisation=trust, period=months[0], count=500)
+    all_measures = [measure, absolute_measure, admissions_measure]
+
+    for m in all_measures:
+        call_command("compute_measures", m.slug)
+    expected = {m.slug: _snapshot(m) for m in all_measures}
+
+    call_command("compute_measures", all=True, workers=2)
+
+    assert {m.slug: _snapshot(m) for m in all_measures} == expected
+
+
+def _series_ids(measure):
+    return {
+        model: set(model.objects.filter(measure=measure).values_list("id", flat=True))
+        for model in (PrecomputedMeasureSeries, PrecomputedMeasureAggregatedSeries)
+    }
+
+
+def _assert_matches_full_rebuild(measure):
+    incremental = (_snapshot(measure), _series_snapshot(measure))
+    call_command("compute_measures", measure.slug)
+    assert incremental == (_snapshot(measure), _series_snapshot(measure))
+
+
+@pytest.mark.django_db
+def test_incremental_updates_only_changed_months(
+    ratio_measure, ratio_data, trust, vmp, months, capsys
+):
+    measure, _ = ratio_measure
+    call_command("compute_measures", measure.slug, incremental=True)
+    assert "no previous run with the current definition and VMPs, rebuilding" in (
+        capsys.readouterr().out
+    )
+    series_ids = _series_ids(measure)
+
+    DDDQuantity.objects.filter(vmp=vmp, organisation=trust).update(data=[10.0, 5.0])
+    call_command("compute_measures", measure.slug, incremental=True)
+
+    assert f"{measure.slug}: updated 1 changed months of series" in capsys.readouterr().out
+    # The series are updated in place rather than deleted and re-inserted
+    assert _series_ids(measure) == series_ids
+    assert _org_values(measure)[(trust.ods_code, months[1])]["numerator"] == 5.0
+    _assert_matches_full_rebuild(measure)
+
+
+@pytest.mark.django_db
+def test_incremental_only_writes_a_new_month(
+    ratio_measure, trust, successor_and_predecessor, vmp, months, capsys
+):
+    measure, denominator_vmp = ratio_measure
+    successor, _ = successor_and_predecessor
+    # Quantity arrays already hold the month the next DataStatus row adds
+    DDDQuantity.objects.create(vmp=vmp, organisation=trust, data=[10.0, 30.0, 20.0])
+    DDDQuantity.objects.create(vmp=denominator_vmp, organisation=trust, data=[30.0, 10.0, 20.0])
+    DDDQuantity.objects.create(vmp=vmp, organisation=successor, data=[5.0, 0.0, 4.0])
+    call_command("compute_measures", measure.slug, incremental=True)
+
+    DataStatus.objects.create(year_month=date(2024, 3, 1))
+    call_command("compute_measures", measure.slug, incremental=True)
+
+    assert f"{measure.slug}: updated 1 changed months of series" in capsys.readouterr().out
+    series = PrecomputedMeasureSeries.objects.get(measure=measure, organisation=trust)
+    assert series.numerator == [10.0, 30.0, 20.0]
+    _assert_matches_full_rebuild(measure)
+
+
+@pytest.mark.django_db
+def test_incremental_creates_and_deletes_series_for_changed_months(
+    admissions_measure, trust, trust_without_admissions, vmp, months, capsys
+):
+    DDDQuantity.objects.create(vmp=vmp, organisation=trust, data=[50.0, 100.0])
+    DDDQuantity.objects.create(vmp=vmp, organisation=trust_without_admissions, data=[25.0, 25.0])
+    TrustAdmission.objects.create(organisation=trust, period=months[0], count=1000)
+    call_command("compute_measures", admissions_measure.slug, incremental=True)
+    assert not PrecomputedMeasureSeries.objects.filter(
+        measure=admissions_measure, organisation=trust_without_admissions
+    ).exists()
+
+    # Both trusts first have admissions in the second month
+    TrustAdmission.objects.create(organisation=trust, period=months[1], count=2000)
+    admission = TrustAdmission.objects.create(
+        organisation=trust_without_admissions, period=months[1], count=500
+    )
+    call_command("compute_measures", admissions_measure.slug, incremental=True)
+
+    assert "updated 1 changed months of series" in capsys.readouterr().out
+    assert _org_values(admissions_measure)[
+        (trust_without_admissions.ods_code, months[1])
+    ]["quantity"] == pytest.approx(50.0)
+    _assert_matches_full_rebuild(admissions_measure)
 
-    jan = included.get(organisation=trust, month=months[0])
-    assert jan.numerator == 50.0
-    assert jan.denominator == 1000.0
-    assert jan.quantity == pytest.approx(50.0)
+    call_command("compute_measures", admissions_measure.slug, incremental=True)
+    admission.delete()
+    call_command("compute_measures", admissions_measure.slug, incremental=True)
+
+    assert "updated 1 changed months of series" in capsys.readouterr().out
+    assert not PrecomputedMeasureSeries.objects.filter(
+        measure=admissions_measure, organisation=trust_without_admissions
+    ).exists()
+    _assert_matches_full_rebuild(admissions_measure)
+
+
+@pytest.mark.django_db
+def test_incremental_updates_revised_historic_month(
+    absolute_measure, ratio_data, trust, vmp, months, capsys
+):
+    call_command("compute_measures", absolute_measure.slug, incremental=True)
+    capsys.readouterr()
+
+    # A revised historic month, with no change to DataStatus
+    DDDQuantity.objects.filter(vmp=vmp, organisation=trust).update(data=[99.0, 30.0])
+    call_command("compute_measures", absolute_measure.slug, incremental=True)
+
+    assert "updated 1 changed months of series" in capsys.readouterr().out
+    assert _org_values(absolute_measure)[(trust.ods_code, months[0])]["quantity"] == 99.0
+    national = _aggregated_values(absolute_measure)
+    assert national[("national", "National", months[0])]["quantity"] == 109.0
+    assert national[("national", "National", months[1])]["quantity"] == 40.0
+
+    call_command("compute_measures", absolute_measure.slug, incremental=True)
+    assert "unchanged, skipping" in capsys.readouterr().out
+    _assert_matches_full_rebuild(absolute_measure)
+
+
+@pytest.mark.django_db
+def test_incremental_rebuilds_when_organisations_change(
+    ratio_measure, ratio_data, region, icb, vmp, months, capsys
+):
+    measure, _ = ratio_measure
+    call_command("compute_measures", measure.slug, incremental=True)
+    capsys.readouterr()
+
+    new_trust = Organisation.objects.create(
+        ods_code="NEW", ods_name="New Trust", region=region, icb=icb
+    )
+    call_command("compute_measures", measure.slug, incremental=True)
+    assert "no previous run with the current definition and VMPs, rebuilding" in (
+        capsys.readouterr().out
+    )
+
+    DDDQuantity.objects.create(vmp=vmp, organisation=new_trust, data=[0.0, 8.0])
+    call_command("compute_measures", measure.slug, incremental=True)
+    # The new trust has a value of 0 in the first month as well
+    assert "every month changed, rebuilding" in capsys.readouterr().out
+    _assert_matches_full_rebuild(measure)
+
+
+@pytest.mark.django_db
+def test_incremental_skips_unchanged_and_rebuilds_changed_definition(
+    absolute_measure, ratio_measure, ratio_data, trust, months, capsys
+):
+    _, denominator_vmp = ratio_measure
+    call_command("compute_measures", absolute_measure.slug, incremental=True)
+    computation = MeasureComputation.objects.get(measure=absolute_measure)
+    assert computation.data_status == {m.isoformat(): "" for m in months}
+    assert set(computation.month_fingerprints) == {m.isoformat() for m in months}
+
+    call_command("compute_measures", absolute_measure.slug, incremental=True)
+    assert "unchanged, skipping" in capsys.readouterr().out
+
+    MeasureVMP.objects.create(
+        measure=absolute_measure, vmp=denominator_vmp, type="numerator"
+    )
+    call_command("compute_measures", absolute_measure.slug, incremental=True)
+
+    assert "rebuilding" in capsys.readouterr().out
+    assert (
+        MeasureComputation.objects.get(measure=absolute_measure).fingerprint
+        != computation.fingerprint
+    )
+    assert _org_values(absolute_measure)[(trust.ods_code, months[0])]["quantity"] == 40.0
+
+
+@pytest.mark.django_db
+def test_full_run_does_not_store_month_fingerprints(absolute_measure, ratio_data, capsys):
+    call_command("compute_measures", absolute_measure.slug)
+    assert MeasureComputation.objects.get(measure=absolute_measure).month_fingerprints == {}
+
+    call_command("compute_measures", absolute_measure.slug, incremental=True)
+    assert "no month fingerprints from the previous run, rebuilding" in capsys.readouterr().out
+
+
+@pytest.mark.django_db
+def test_compute_measures_stores_measure_item_payload(
+    ratio_measure, ratio_data, months, client
+):
+    measure, _ = ratio_measure
+    measure.status = "published"
+    measure.description = "test"
+    measure.how_is_it_calculated = "test"
+    measure.save()
+    call_command("compute_measures", measure.slug)
+
+    assert PrecomputedMeasurePayload.objects.filter(measure=measure).exists()
+    stored = load_measure_item_payload(measure)
+    assert stored == build_measure_item_payload(measure.id)
+    assert json.loads(stored["national_data"])["data"][0]["numerator"] == 20.0
+
+    response = client.get(f"/measures/{measure.slug}/")
+    assert response.status_code == 200
+    assert "error" not in response.context
+    assert response.context["trusts_included"] == {"included": 2, "total": 2}
+    assert response.context["percentile_data"] == stored["percentile_data"]
+    assert response.context["org_data"] == build_measure_item_data(measure.id)["org_data"]
+    # The stored payload is served as it is, without a cached copy
+    assert cache.get(f"{MEASURE_ITEM_PRECOMPUTED_CACHE_KEY_PREFIX}{measure.slug}") is None
+
+
+@pytest.mark.django_db
+def test_measure_item_page_uses_current_organisation_details(
+    ratio_measure, ratio_data, trust, region, months, client
+):
+    measure, _ = ratio_measure
+    measure.status = "published"
+    measure.description = "test"
+    measure.how_is_it_calculated = "test"
+    measure.save()
+    call_command("compute_measures", measure.slug)
+
+    # An organisations reload after the measure was computed
+    Organisation.objects.filter(pk=trust.pk).update(ods_name="Renamed Trust")
+    Region.objects.filter(pk=region.pk).update(code="TR2")
+    Organisation.objects.create(ods_code="NEW", ods_name="New Trust")
+
+    response = client.get(f"/measures/{measure.slug}/")
+
+    org_data = json.loads(response.context["org_data"])
+    assert org_data["orgs"][trust.ods_code] == "Renamed Trust"
+    renamed = next(o for o in org_data["organisations"] if o["name"] == "Renamed Trust")
+    assert renamed["available"] and renamed["data"]
+    assert response.context["trusts_included"] == {"included": 2, "total": 3}
+    assert json.loads(response.context["region_data"])[0]["code"] == "TR2"
+
+
+SERIES_MODELS = (
+    PrecomputedMeasureSeries,
+    PrecomputedMeasureAggregatedSeries,
+    PrecomputedPercentileSeries,
+)
+
+
+def _series_snapshot(measure):
+    return {
+        "org": sorted(
+            PrecomputedMeasureSeries.objects.filter(measure=measure).values_list(
+                "organisation__ods_code", "start_month", "quantity", "numerator", "denominator"
+            )
+        ),
+        "aggregated": sorted(
+            PrecomputedMeasureAggregatedSeries.objects.filter(measure=measure).values_list(
+                "category", "label", "start_month", "quantity", "numerator", "denominator"
+            )
+        ),
+        "percentiles": sorted(
+            PrecomputedPercentileSeries.objects.filter(measure=measure).values_list(
+                "percentile", "start_month", "quantity"
+            )
+        ),
+    }
+
+
+def _read_snapshot(measure_ids):
+    return {
+        "org": org_series(measure_ids),
+        "aggregated": aggregated_series(measure_ids),
+        "percentiles": percentile_series(measure_ids),
+        "counts": organisation_counts(measure_ids),
+    }
+
+
+@pytest.mark.django_db
+def test_compute_measures_writes_series(admissions_measure, trust, vmp, months):
+    TrustAdmission.objects.create(organisation=trust, period=months[1], count=2000)
+    DDDQuantity.objects.create(vmp=vmp, organisation=trust, data=[50.0, 100.0])
+
+    call_command("compute_measures", admissions_measure.slug)
+
+    # Months without a row are None in the series
+    series = PrecomputedMeasureSeries.objects.get(measure=admissions_measure, organisation=trust)
+    assert series.start_month == months[0]
+    assert series.numerator == [None, 100.0]
+    assert series.denominator == [None, 2000.0]
+    assert series.quantity == [None, pytest.approx(50.0)]
+
+    national = PrecomputedMeasureAggregatedSeries.objects.get(
+        measure=admissions_measure, category="national"
+    )
+    assert national.quantity == series.quantity
+    assert PrecomputedPercentileSeries.objects.filter(measure=admissions_measure).count() == len(PERCENTILE_LEVELS)
+
+
+@pytest.mark.django_db
+def test_series_reads_are_placed_by_start_month(
+    ratio_measure, absolute_measure, ratio_data, months
+):
+    measure, _ = ratio_measure
+    call_command("compute_measures", all=True)
+    measure_ids = [measure.id, absolute_measure.id]
+    expected = _read_snapshot(measure_ids)
+
+    DataStatus.objects.filter(year_month=months[0]).delete()
+    DataStatus.objects.create(year_month=date(2023, 12, 1))
+
+    assert _read_snapshot(measure_ids) == expected
+
+
+@pytest.mark.django_db
+def test_migration_backfills_series_from_per_month_rows(
+    ratio_measure, absolute_measure, ratio_data, months
+):
+    measure, _ = ratio_measure
+    call_command("compute_measures", all=True)
+    expected = {m.slug: _series_snapshot(m) for m in (measure, absolute_measure)}
+
+    executor = MigrationExecutor(connection)
+    executor.migrate([("viewer", "0051_measurecomputation_month_fingerprints")])
+    with connection.cursor() as cursor:
+        # The benchmark's copies of the per-month tables, filled from the series
+        for sql in CREATE_ROWS_SQL:
+            cursor.execute(sql)
+        for table, columns in (
+            ("precomputedmeasure", "measure_id, organisation_id, month, quantity, numerator, denominator"),
+            ("precomputedmeasureaggregated", "measure_id, category, label, month, quantity, numerator, denominator"),
+            ("precomputedpercentile", "measure_id, percentile, month, quantity"),
+        ):
+            cursor.execute(
+                f"INSERT INTO viewer_{table} ({columns}) SELECT {columns} FROM benchmark_{table}"
+            )
+    for model in SERIES_MODELS:
+        model.objects.all().delete()
+    with connection.cursor() as cursor:
+        # Tables cannot be dropped with deferred constraint checks pending
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+    executor.loader.build_graph()
+    executor.migrate([("viewer", "0052_remove_per_month_precomputed_tables")])
+
+    assert {m.slug: _series_snapshot(m) for m in (measure, absolute_measure)} == expected
+
+
+@pytest.mark.django_db
+def test_benchmark_measure_storage_command(ratio_measure, ratio_data, months, capsys):
+    measure, _ = ratio_measure
+    call_command("compute_measures", measure.slug)
+
+    call_command("benchmark_measure_storage", "--repeat", "1")
+
+    output = capsys.readouterr().out
+    assert "viewer_precomputedmeasureseries" in output
+    assert "Speed-up" in output
+    assert "Page data matches" in output
+    assert PrecomputedMeasureSeries.objects.filter(measure=measure).exists()
+
+
+def _reference_measure(kind, scale, org_ids, numerators, denominators, geography, percentiles):
+    """Per-org, per-month loops over the same inputs as compute_measure"""
+    org_rows, values_by_month, groups = [], {}, {}
+    for i, org_id in enumerate(org_ids):
+        activity = denominators[i] if kind != ABSOLUTE_MEASURE else numerators[i]
+        has_data = any(value > 0 for value in activity)
+        icb, region = geography.get(org_id, (None, None))
+        for month in range(numerators.shape[1]):
+            numerator, denominator = numerators[i, month], denominators[i, month]
+            if kind == EXTERNAL_DENOMINATOR_MEASURE and denominator <= 0:
+                continue
+            if kind == ABSOLUTE_MEASURE:
+                value = numerator
+            else:
+                value = numerator / denominator * scale if denominator > 0 else 0.0
+            org_rows.append((
+                org_id,
+                month,
+                numerator,
+                denominator if kind != ABSOLUTE_MEASURE else None,
+                value,
+            ))
+            if has_data:
+                values_by_month.setdefault(month, []).append(value)
+            for key in (("icb", icb), ("region", region), ("national", "National")):
+                if key[1]:
+                    totals = groups.setdefault(key + (month,), [0.0, 0.0])
+                    totals[0] += numerator
+                    totals[1] += denominator
+
+    percentile_rows = [
+        (month, percentile, np.percentile(values, percentile))
+        for month, values in values_by_month.items()
+        for percentile in percentiles
+    ]
+    aggregated_rows = []
+    for (category, label, month), (numerator, denominator) in groups.items():
+        if kind == ABSOLUTE_MEASURE:
+            value = numerator
+        else:
+            value = numerator / denominator * scale if denominator > 0 else 0.0
+        aggregated_rows.append((category, label, month, numerator, denominator, value))
+    return org_rows, percentile_rows, aggregated_rows
+
+
+def _approx_rows(rows):
+    return [
+        tuple(pytest.approx(value) if isinstance(value, float) else value for value in row)
+        for row in sorted(rows, key=lambda row: row[:3])
+    ]
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize(
+    "kind", [ABSOLUTE_MEASURE, PRODUCT_RATIO_MEASURE, EXTERNAL_DENOMINATOR_MEASURE]
+)
+def test_compute_measure_matches_per_month_reference(kind, seed):
+    rng = np.random.default_rng(seed)
+    org_ids = list(range(1, 13))
+    shape = (len(org_ids), 6)
+    # Zeros are common so that empty denominators and orgs without data are covered
+    numerators = np.where(rng.random(shape) < 0.3, 0.0, rng.integers(0, 50, shape).astype(float))
+    denominators = np.where(rng.random(shape) < 0.3, 0.0, rng.integers(1, 100, shape).astype(float))
+    numerators[0] = denominators[0] = 0.0
+    geography = {
+        org_id: (f"ICB {org_id % 3}" if org_id % 4 else "", f"Region {org_id % 2}")
+        for org_id in org_ids[:-1]
+    }
+    inputs = MeasureInputs(
+        measure_id=1,
+        slug="reference",
+        kind=kind,
+        scale=1000.0,
+        org_ids=org_ids,
+        numerators=numerators,
+        denominators=denominators,
+    )
+
+    results = compute_measure(inputs, geography, PERCENTILE_LEVELS)
+    org_rows, percentile_rows, aggregated_rows = _reference_measure(
+        kind, 1000.0, org_ids, numerators, denominators, geography, PERCENTILE_LEVELS
+    )
 
-    feb = included.get(organisation=trust, month=months[1])
-    assert feb.quantity == pytest.approx(50.0)
+    assert _approx_rows(results.org_rows) == _approx_rows(org_rows)
+    assert _approx_rows(results.percentile_rows) == _approx_rows(percentile_rows)
+    assert _approx_rows(results.aggregated_rows) == _approx_rows(aggregated_rows)
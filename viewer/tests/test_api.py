@@ -1,11 +1,22 @@
 import json
+import struct
+import sys
+from array import array
 import pytest
 from datetime import date
 from django.contrib.auth.models import User
+from django.db import connection
 from django.test import Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from viewer.models import (
+    ATC,
+    CalculationLogic,
+    DDD,
+    OntFormRoute,
+    VMPIngredientStrength,
+    WHORoute,
     Region,
     ICB,
     Organisation,
@@ -13,12 +24,18 @@ from viewer.models import (
     VTM,
     DDDQuantity,
     DataStatus,
+    Dose,
+    SCMDQuantity,
+    VMPQuantitySummary,
+    VMPQuantityUnit,
     Ingredient,
     Measure,
     MeasureVMP,
-    PrecomputedMeasure,
-    PrecomputedPercentile,
+    PrecomputedMeasureSeries,
+    PrecomputedPercentileSeries,
 )
+from viewer.views.api import build_product_details, stream_quantity_ndjson
+from viewer.quantity_summary import get_quantity_summary, update_vmp_quantity_summary
 from viewer.search import MAX_ANALYSIS_VMP_COUNT
 
 
@@ -101,6 +118,64 @@ def _post_quantity_data(client, payload):
     )
 
 
+def _decode_quantity_ndjson(response):
+    """Expand an NDJSON get_quantity_data response into the JSON response shape."""
+    lines = [
+        json.loads(line)
+        for line in b"".join(response.streaming_content).decode().splitlines()
+    ]
+    assert lines[-1] == {"end": True, "rows": sum("vmp" in line for line in lines)}
+    header, orgs, items = lines[0], [], []
+    for line in lines[1:-1]:
+        if "org" in line and "vmp" not in line:
+            orgs.append(line["org"])
+            continue
+        org = orgs[line["org"]] if line["org"] is not None else {}
+        item = {
+            **header["vmps"][line["vmp"]],
+            "organisation__ods_code": org.get("ods_code"),
+            "organisation__ods_name": org.get("ods_name"),
+            "organisation__region": org.get("region"),
+            "organisation__icb": org.get("icb"),
+            "data": line["data"],
+        }
+        if "unit" in line:
+            item["unit"] = line["unit"]
+        items.append(item)
+    return {"months": header["months"], "items": items}, len(lines)
+
+
+def _decode_quantity_binary(response):
+    """Expand a binary get_quantity_data response into the JSON response shape."""
+    body = response.content
+    (header_length,) = struct.unpack(">I", body[:4])
+    header = json.loads(body[4 : 4 + header_length])
+    values = array("d")
+    values.frombytes(body[4 + header_length :])
+    if sys.byteorder == "big":
+        values.byteswap()
+
+    rows, items, offset = header["rows"], [], 0
+    for i, (vmp_ref, org_ref, unit_ref, length) in enumerate(
+        zip(rows["vmp"], rows["org"], rows["unit"], rows["length"])
+    ):
+        org = header["orgs"][org_ref] if org_ref is not None else {}
+        item = {
+            **header["vmps"][vmp_ref],
+            "organisation__ods_code": org.get("ods_code"),
+            "organisation__ods_name": org.get("ods_name"),
+            "organisation__region": org.get("region"),
+            "organisation__icb": org.get("icb"),
+            "data": values[offset : offset + length].tolist(),
+        }
+        if i >= header["placeholders"]:
+            item["unit"] = header["units"][unit_ref] if unit_ref is not None else None
+        items.append(item)
+        offset += length
+    assert offset == len(values)
+    return {"months": header["months"], "items": items}, header
+
+
 def _org_items(items, ods_name):
     return [
         item
@@ -306,6 +381,122 @@ class TestGetQuantityData:
         assert items[0]["organisation__ods_name"] is None
         assert items[0]["data"] == [16.0, 22.0, 3.0]
 
+    @pytest.mark.parametrize("scope", ["all", "national"])
+    def test_ndjson_format_matches_json_response(
+        self, predecessor_successor_orgs, region, icb, vmp, data_status_months, scope
+    ):
+        predecessor, successor = predecessor_successor_orgs
+        other_vmp = VMP.objects.create(code="87654321", name="Other VMP", vtm=vmp.vtm)
+        for quantity_vmp in (vmp, other_vmp):
+            DDDQuantity.objects.create(vmp=quantity_vmp, organisation=predecessor, data=[1.0, 2.0, 3.0])
+            DDDQuantity.objects.create(vmp=quantity_vmp, organisation=successor, data=[4.0, 0, 0])
+        payload = {
+            "names": [{"code": vmp.vtm.vtm, "type": "vtm"}],
+            "quantity_type": "Defined Daily Dose Quantity",
+            "scope": scope,
+        }
+
+        json_response = _post_quantity_data(Client(), payload)
+        ndjson_response = _post_quantity_data(Client(), {**payload, "format": "ndjson"})
+
+        assert ndjson_response["Content-Type"] == "application/x-ndjson"
+        decoded, line_count = _decode_quantity_ndjson(ndjson_response)
+        assert decoded == json_response.json()
+        if scope == "all":
+            # Header, one placeholder per VMP, one org line, one row per VMP and the end line
+            assert line_count == 1 + 2 + 1 + 2 + 1
+
+    def test_ndjson_ends_with_error_line_when_reading_rows_fails(self):
+        def failing_groups():
+            yield 1, None
+            raise RuntimeError("connection lost")
+
+        body = "".join(
+            stream_quantity_ndjson(
+                ["2024-01-01"], {1: {"vmp__code": "1"}}, failing_groups(), "dose", {},
+                placeholders=False,
+            )
+        )
+        lines = [json.loads(line) for line in body.splitlines()]
+
+        assert lines[1] == {"vmp": 0, "org": None, "unit": None, "data": []}
+        assert lines[-1] == {"error": "An error occurred while processing the request"}
+        assert not any(line.get("end") for line in lines)
+
+    @pytest.mark.parametrize("scope", ["all", "national"])
+    def test_binary_format_matches_json_response(
+        self, predecessor_successor_orgs, region, icb, vmp, data_status_months, scope
+    ):
+        predecessor, successor = predecessor_successor_orgs
+        other_vmp = VMP.objects.create(code="87654321", name="Other VMP", vtm=vmp.vtm)
+        DDDQuantity.objects.create(vmp=vmp, organisation=predecessor, data=[1.5, 2.0, 3.0])
+        DDDQuantity.objects.create(vmp=vmp, organisation=successor, data=[4.0, 0, 0.1])
+        DDDQuantity.objects.create(vmp=other_vmp, organisation=successor, data=[7.0, 8.0])
+        payload = {
+            "names": [{"code": vmp.vtm.vtm, "type": "vtm"}],
+            "quantity_type": "Defined Daily Dose Quantity",
+            "scope": scope,
+        }
+
+        json_response = _post_quantity_data(Client(), payload)
+        binary_response = _post_quantity_data(Client(), {**payload, "format": "binary"})
+
+        assert binary_response["Content-Type"] == "application/octet-stream"
+        assert (4 + struct.unpack(">I", binary_response.content[:4])[0]) % 8 == 0
+        decoded, header = _decode_quantity_binary(binary_response)
+        assert decoded == json_response.json()
+        if scope == "all":
+            # One successor organisation and one DDD unit label, each sent once
+            assert len(header["orgs"]) == 1
+            assert len(header["units"]) == 1
+
+
+@pytest.mark.django_db
+class TestGetQuantityRollup:
+    def test_region_rollup_returns_summed_series(
+        self, predecessor_successor_orgs, region, icb, vmp, data_status_months
+    ):
+        predecessor, successor = predecessor_successor_orgs
+        DDDQuantity.objects.create(vmp=vmp, organisation=predecessor, data=[1.0, 2.0, 3.0])
+        DDDQuantity.objects.create(vmp=vmp, organisation=successor, data=[4.0, 0, 0])
+
+        response = Client().post(
+            reverse("viewer:get_quantity_rollup"),
+            data=json.dumps({
+                "names": [{"code": vmp.code, "type": "vmp"}],
+                "quantity_type": "Defined Daily Dose Quantity",
+                "group_by": "region",
+            }),
+            content_type="application/json",
+        )
+
+        assert response.status_code == 200
+        assert response.json() == {
+            "months": ["2024-01-01", "2024-02-01", "2024-03-01"],
+            "group_by": "region",
+            "groups": [{"key": region.code, "name": region.name, "data": [5.0, 2.0, 3.0]}],
+        }
+
+    @pytest.mark.parametrize(
+        "overrides",
+        [{"group_by": "postcode"}, {"quantity_type": "Unknown"}, {"group_by": None}],
+    )
+    def test_invalid_parameters_return_400(self, vmp, overrides):
+        payload = {
+            "names": [{"code": vmp.code, "type": "vmp"}],
+            "quantity_type": "Defined Daily Dose Quantity",
+            "group_by": "region",
+            **overrides,
+        }
+
+        response = Client().post(
+            reverse("viewer:get_quantity_rollup"),
+            data=json.dumps(payload),
+            content_type="application/json",
+        )
+
+        assert response.status_code == 400
+
 
 @pytest.mark.django_db
 class TestGetMeasuresChartData:
@@ -338,21 +529,13 @@ class TestGetMeasuresChartData:
     ):
         predecessor, successor = predecessor_successor_orgs
 
-        PrecomputedMeasure.objects.create(
+        PrecomputedMeasureSeries.objects.create(
             measure=measure,
             organisation=successor,
-            month=date(2024, 1, 1),
-            quantity=50.0,
-            numerator=50.0,
-            denominator=None,
-        )
-        PrecomputedMeasure.objects.create(
-            measure=measure,
-            organisation=successor,
-            month=date(2024, 2, 1),
-            quantity=75.0,
-            numerator=75.0,
-            denominator=None,
+            start_month=date(2024, 1, 1),
+            quantity=[50.0, 75.0],
+            numerator=[50.0, 75.0],
+            denominator=[None, None],
         )
 
         user = User.objects.create_user(
@@ -399,28 +582,20 @@ class TestGetMeasuresChartData:
         ]
         for month in months:
             DataStatus.objects.get_or_create(year_month=month)
-            PrecomputedPercentile.objects.create(
-                measure=measure,
-                month=month,
-                percentile=50,
-                quantity=10.0,
-            )
-
-        PrecomputedMeasure.objects.create(
+        PrecomputedPercentileSeries.objects.create(
             measure=measure,
-            organisation=trust,
-            month=date(2024, 1, 1),
-            quantity=5.0,
-            numerator=5.0,
-            denominator=1000.0,
+            percentile=50,
+            start_month=months[0],
+            quantity=[10.0, 10.0, 10.0],
         )
-        PrecomputedMeasure.objects.create(
+
+        PrecomputedMeasureSeries.objects.create(
             measure=measure,
             organisation=trust,
-            month=date(2024, 3, 1),
-            quantity=15.0,
-            numerator=15.0,
-            denominator=1000.0,
+            start_month=months[0],
+            quantity=[5.0, None, 15.0],
+            numerator=[5.0, None, 15.0],
+            denominator=[1000.0, None, 1000.0],
         )
 
         client = Client()
@@ -452,12 +627,12 @@ class TestGetMeasuresChartData:
         )
         for month in [date(2024, 1, 1), date(2024, 2, 1)]:
             DataStatus.objects.get_or_create(year_month=month)
-            PrecomputedPercentile.objects.create(
-                measure=measure,
-                month=month,
-                percentile=50,
-                quantity=10.0,
-            )
+        PrecomputedPercentileSeries.objects.create(
+            measure=measure,
+            percentile=50,
+            start_month=date(2024, 1, 1),
+            quantity=[10.0, 10.0],
+        )
 
         client = Client()
         response = client.get(
@@ -539,6 +714,19 @@ class TestValidateAnalysisParamsVmpCap:
         assert data["errors"] == []
         assert data["vmp_count"] == 5
 
+    def test_query_count_does_not_grow_with_code_count(self, client):
+        vtms = [VTM.objects.create(vtm=f"20{i}", name=f"VTM {i}") for i in range(5)]
+        for i, vtm in enumerate(vtms):
+            self._create_vmps(2, vtm=vtm, code_prefix=f"500{i}")
+
+        with CaptureQueriesContext(connection) as one_code:
+            self._call(vtms=vtms[0].vtm)
+        with CaptureQueriesContext(connection) as many_codes:
+            response = self._call(vtms=",".join(vtm.vtm for vtm in vtms))
+
+        assert response.json()["vmp_count"] == 10
+        assert len(many_codes) == len(one_code)
+
 
 @pytest.mark.django_db
 class TestGetProductDetails:
@@ -572,3 +760,133 @@ class TestGetProductDetails:
         products = response.json()
         assert len(products) == 1
         assert products[0]["bnf_code"] is None
+
+
+def _create_detailed_vmps(n, code_prefix="5000"):
+    """VMPs with every relation build_product_details reads."""
+    who_route = WHORoute.objects.get_or_create(code="O", name="Oral")[0]
+    route = OntFormRoute.objects.get_or_create(name="tablet.oral", who_route=who_route)[0]
+    atc = ATC.objects.get_or_create(code="N02BE01", name="Paracetamol")[0]
+    vmp_ids = []
+    for i in range(n):
+        vmp = VMP.objects.create(code=f"{code_prefix}{i:04d}", name=f"Detailed VMP {i}")
+        vmp.ont_form_routes.add(route)
+        vmp.who_routes.add(who_route)
+        vmp.atcs.add(atc)
+        for j in range(2):
+            ingredient = Ingredient.objects.get_or_create(
+                code=f"6000{j}", defaults={"name": f"Ingredient {j}"}
+            )[0]
+            vmp.ingredients.add(ingredient)
+            VMPIngredientStrength.objects.create(
+                vmp=vmp, ingredient=ingredient, strnt_nmrtr_val=500, strnt_nmrtr_uom_name="mg"
+            )
+            CalculationLogic.objects.create(
+                vmp=vmp, ingredient=ingredient, logic_type="ingredient", logic="strength x quantity"
+            )
+        CalculationLogic.objects.create(vmp=vmp, logic_type="ddd", logic="ingredient quantity / DDD")
+        DDD.objects.create(vmp=vmp, ddd=3.0, unit_type="g", who_route=who_route)
+        vmp_ids.append(vmp.id)
+    return vmp_ids
+
+
+@pytest.mark.django_db
+class TestBuildProductDetails:
+    def test_query_count_does_not_grow_with_vmp_count(self):
+        few = _create_detailed_vmps(1, code_prefix="5000")
+        many = _create_detailed_vmps(7, code_prefix="5001")
+
+        with CaptureQueriesContext(connection) as few_queries:
+            build_product_details(few)
+        with CaptureQueriesContext(connection) as many_queries:
+            products = build_product_details(many)
+
+        assert len(many_queries) == len(few_queries)
+        assert len(products) == 7
+
+    def test_product_details_resolved_from_prefetched_data(self):
+        [vmp_id] = _create_detailed_vmps(1)
+
+        [product] = build_product_details([vmp_id])
+
+        assert product["routes"] == ["tablet.oral"]
+        assert product["who_routes"] == ["Oral"]
+        assert product["atc_codes"] == ["N02BE01"]
+        assert product["ddd_info"] == "3.0 g"
+        assert product["ddd_logic"] == {"logic": "ingredient quantity / DDD", "ingredient": None}
+        assert sorted(logic["ingredient"] for logic in product["ingredient_logic"]) == [
+            "Ingredient 0", "Ingredient 1"
+        ]
+        for logic in product["ingredient_logic"]:
+            assert logic["logic"] == "strength x quantity"
+            assert logic["strength_info"]["numerator_value"] == 500
+            assert logic["strength_info"]["numerator_uom"] == "mg"
+
+
+@pytest.mark.django_db
+class TestVMPQuantitySummary:
+    @pytest.fixture
+    def quantities(self, predecessor_successor_orgs, vmp, data_status_months):
+        predecessor, successor = predecessor_successor_orgs
+        scmd_unit = VMPQuantityUnit.objects.create(vmp=vmp, quantity_type="scmd", unit="tablet")
+        dose_unit = VMPQuantityUnit.objects.create(vmp=vmp, quantity_type="dose", unit="dose")
+        SCMDQuantity.objects.create(
+            vmp=vmp, organisation=predecessor, quantity_unit=scmd_unit, data=[0.0, 5.0, 0.0]
+        )
+        SCMDQuantity.objects.create(
+            vmp=vmp, organisation=successor, quantity_unit=scmd_unit, data=[2.0, 0.0, 0.0]
+        )
+        Dose.objects.create(
+            vmp=vmp, organisation=successor, quantity_unit=dose_unit, data=[0.0, 0.0, 0.0]
+        )
+        DDDQuantity.objects.create(vmp=vmp, organisation=successor, data=[0.0, 0.0, 1.5])
+
+    def test_update_summarises_non_zero_data(self, vmp, data_status_months, quantities):
+        assert update_vmp_quantity_summary() == 2
+
+        scmd = VMPQuantitySummary.objects.get(vmp=vmp, quantity_type="scmd")
+        assert scmd.units == ["tablet"]
+        assert (scmd.first_month, scmd.last_month) == (data_status_months[0], data_status_months[1])
+        assert scmd.org_count == 2
+        assert scmd.total_quantity == 7.0
+
+        ddd = VMPQuantitySummary.objects.get(vmp=vmp, quantity_type="ddd")
+        assert ddd.units == ["DDD"]
+        assert ddd.first_month == ddd.last_month == data_status_months[2]
+
+        assert not VMPQuantitySummary.objects.filter(quantity_type="dose").exists()
+
+    def test_reads_summary_in_one_query(self, vmp, quantities, django_assert_num_queries):
+        fallback = get_quantity_summary([vmp.id])
+        update_vmp_quantity_summary()
+
+        with django_assert_num_queries(1):
+            summary = get_quantity_summary([vmp.id])
+
+        assert summary == fallback
+        assert set(summary[vmp.id]) == {"scmd", "ddd"}
+
+    def test_select_quantity_type_uses_summary(self, client, vmp, quantities):
+        update_vmp_quantity_summary()
+
+        response = client.post(
+            reverse("viewer:select_quantity_type"),
+            data=json.dumps({"names": [{"code": vmp.code, "type": "vmp"}]}),
+            content_type="application/json",
+        )
+
+        assert response.status_code == 200
+        availability = response.json()["products"][0]["quantity_availability"]
+        assert availability["scmd"] == {"available": True, "units": ["tablet"]}
+        assert availability["dose"] == {"available": False, "units": []}
+        assert availability["ddd"] == {"available": True, "units": ["DDD"]}
+
+        response = client.post(
+            reverse("viewer:get_product_details"),
+            data=json.dumps({"names": [{"code": vmp.code, "type": "vmp"}]}),
+            content_type="application/json",
+        )
+        product = response.json()[0]
+        assert product["has_scmd_quantity"] and product["scmd_units"] == ["tablet"]
+        assert product["has_ddd_quantity"]
+        assert not product["has_dose"]
@@ -0,0 +1,106 @@
+import pytest
+
+from viewer.cache import TieredCache
+
+
+def _tiered_cache(**options):
+    return TieredCache("", {"TIMEOUT": None, "OPTIONS": {"SHARED_CACHE": "shared", **options}})
+
+
+@pytest.mark.django_db
+class TestTieredCache:
+    def test_warm_reads_do_not_touch_the_database(self, django_assert_num_queries):
+        cache = _tiered_cache(SYNC_INTERVAL=60)
+        cache.set("measures_list_chart_data:x", {"national": [1, 2, 3]})
+
+        with django_assert_num_queries(0):
+            assert cache.get("measures_list_chart_data:x") == {"national": [1, 2, 3]}
+            assert cache.get("measures_list_chart_data:x") == {"national": [1, 2, 3]}
+
+        assert cache.metrics()["local_hits"] == 2
+
+    def test_falls_through_to_shared_cache(self):
+        writer = _tiered_cache()
+        reader = _tiered_cache()
+        writer.set("key", "value")
+
+        assert reader.get("key") == "value"
+        assert reader.get("missing", "default") == "default"
+        assert reader.get("key") == "value"
+
+        metrics = reader.metrics()
+        assert (metrics["shared_hits"], metrics["local_hits"], metrics["misses"]) == (1, 1, 1)
+
+    def test_invalidation_reaches_other_processes(self):
+        writer = _tiered_cache(SYNC_INTERVAL=0)
+        reader = _tiered_cache(SYNC_INTERVAL=0)
+        writer.set("measures_list_chart_version", 0)
+        writer.set("measure_item_precomputed:abc", "old")
+        assert reader.get("measures_list_chart_version") == 0
+        assert reader.get("measure_item_precomputed:abc") == "old"
+
+        writer.set("measures_list_chart_version", 1)
+        writer.delete("measure_item_precomputed:abc")
+
+        assert reader.get("measures_list_chart_version") == 1
+        assert reader.get("measure_item_precomputed:abc") is None
+
+    def test_local_tier_is_bounded_by_bytes(self):
+        cache = _tiered_cache(MAX_BYTES=2000, MAX_ENTRY_BYTES=1500, SYNC_INTERVAL=60)
+        for i in range(5):
+            cache.set(f"key-{i}", "x" * 600)
+        cache.set("too-big", "x" * 1600)
+
+        metrics = cache.metrics()
+        assert metrics["local_bytes"] <= 2000
+        assert metrics["local_entries"] == 3
+        assert metrics["evictions"] == 2
+        assert metrics["oversized"] == 1
+        # Evicted and oversized values are still served from the shared tier
+        assert cache.get("key-0") == "x" * 600
+        assert cache.get("too-big") == "x" * 1600
+
+    def test_incr_and_add(self):
+        cache = _tiered_cache(SYNC_INTERVAL=0)
+
+        assert cache.add("counter", 1)
+        assert not cache.add("counter", 5)
+        assert cache.incr("counter") == 2
+        assert cache.get("counter") == 2
+
+    def test_invalidation_only_drops_the_changed_key(self, django_assert_num_queries):
+        writer = _tiered_cache(SYNC_INTERVAL=0)
+        reader = _tiered_cache(SYNC_INTERVAL=0)
+        writer.set("measures_list_chart_version", 0)
+        writer.set("bennett_blog_data", "blog")
+        assert reader.get("measures_list_chart_version") == 0
+        assert reader.get("bennett_blog_data") == "blog"
+
+        writer.set("measures_list_chart_version", 1)
+        writer.delete("measure_item_precomputed:not-cached")
+
+        assert reader.get("measures_list_chart_version") == 1
+        assert reader.metrics()["invalidations"] == 1
+        # The unchanged key is still served locally; the only query is the token check
+        with django_assert_num_queries(1):
+            assert reader.get("bennett_blog_data") == "blog"
+
+    def test_delete_of_a_missing_key_does_not_write_a_token(self):
+        cache = _tiered_cache(SYNC_INTERVAL=0)
+
+        assert not cache.delete("missing")
+        assert cache.shared.get("tiered_cache:generation:missing") is None
+
+        cache.set("present", 1)
+        assert cache.delete("present")
+        assert cache.shared.get("tiered_cache:generation:present") is not None
+
+    def test_clear_drops_every_local_entry(self):
+        writer = _tiered_cache(SYNC_INTERVAL=0)
+        reader = _tiered_cache(SYNC_INTERVAL=0)
+        writer.set("key", "value")
+        assert reader.get("key") == "value"
+
+        writer.clear()
+
+        assert reader.get("key") is None
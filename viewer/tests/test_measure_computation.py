@@ -0,0 +1,129 @@
+import math
+import random
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from viewer.measure_computation import (
+    ABSOLUTE_MEASURE,
+    EXTERNAL_DENOMINATOR_MEASURE,
+    MeasureInputs,
+    compute_measure,
+    interpolated_percentiles,
+    month_fingerprints,
+)
+from viewer.views.measures import PERCENTILE_LEVELS
+
+
+def _reference_percentile(values, percentile):
+    values = sorted(values)
+    k = (len(values) - 1) * (percentile / 100)
+    f = math.floor(k)
+    c = math.ceil(k)
+    if f == c:
+        return values[int(k)]
+    return values[int(f)] * (c - k) + values[int(c)] * (k - f)
+
+
+def test_interpolated_percentiles_match_reference_exactly():
+    rnd = random.Random(0)
+    values = np.array(
+        [[rnd.uniform(0, 100) for _ in range(6)] for _ in range(37)]
+    )
+    values[rnd.sample(range(37), 10), 2] = np.nan
+    values[:, 5] = np.nan
+
+    counts, results = interpolated_percentiles(values, PERCENTILE_LEVELS)
+
+    assert counts.tolist() == [37, 37, 27, 37, 37, 0]
+    for month in range(5):
+        column = [v for v in values[:, month].tolist() if not math.isnan(v)]
+        for row, percentile in enumerate(PERCENTILE_LEVELS):
+            assert results[row, month] == _reference_percentile(column, percentile)
+
+
+def test_compute_measure_skips_months_without_external_denominator():
+    inputs = MeasureInputs(
+        measure_id=1,
+        slug="test",
+        kind=EXTERNAL_DENOMINATOR_MEASURE,
+        scale=1000,
+        org_ids=[10, 20],
+        numerators=np.array([[5.0, 6.0], [1.0, 2.0]]),
+        denominators=np.array([[1000.0, 0.0], [500.0, 0.0]]),
+    )
+
+    results = compute_measure(
+        inputs, {10: ("ICB A", "Region"), 20: ("ICB B", "Region")}, [50]
+    )
+
+    assert results.org_rows == [(10, 0, 5.0, 1000.0, 5.0), (20, 0, 1.0, 500.0, 2.0)]
+    assert results.percentile_rows == [(0, 50, 3.5)]
+    assert ("national", "National", 0, 6.0, 1500.0, 4.0) in results.aggregated_rows
+    assert all(row[2] == 0 for row in results.aggregated_rows)
+
+
+def test_compute_absolute_measure_excludes_orgs_without_activity_from_percentiles():
+    inputs = MeasureInputs(
+        measure_id=1,
+        slug="test",
+        kind=ABSOLUTE_MEASURE,
+        scale=100,
+        org_ids=[10, 20, 30],
+        numerators=np.array([[4.0], [0.0], [8.0]]),
+        denominators=np.zeros((3, 1)),
+    )
+
+    results = compute_measure(inputs, {}, [50])
+
+    assert results.orgs_with_data == 2
+    assert results.percentile_rows == [(0, 50, 6.0)]
+    assert [row[3] for row in results.org_rows] == [None, None, None]
+    assert results.aggregated_rows == [("national", "National", 0, 12.0, 0.0, 12.0)]
+
+
+def test_compute_measure_limits_org_and_aggregated_rows_to_months():
+    inputs = MeasureInputs(
+        measure_id=1,
+        slug="test",
+        kind=ABSOLUTE_MEASURE,
+        scale=100,
+        org_ids=[10, 20],
+        numerators=np.array([[4.0, 1.0, 2.0], [0.0, 0.0, 8.0]]),
+        denominators=np.zeros((2, 3)),
+    )
+
+    full = compute_measure(inputs, {}, [50])
+    results = compute_measure(inputs, {}, [50], months=[2])
+
+    assert results.org_rows == [row for row in full.org_rows if row[1] == 2]
+    assert results.aggregated_rows == [("national", "National", 2, 10.0, 0.0, 10.0)]
+    # Org 20 only has activity in the last month but is in every month's percentiles
+    assert results.percentile_rows == full.percentile_rows
+    assert results.percentile_rows[0] == (0, 50, 2.0)
+
+
+def test_month_fingerprints_change_only_for_changed_months():
+    inputs = MeasureInputs(
+        measure_id=1,
+        slug="test",
+        kind=ABSOLUTE_MEASURE,
+        scale=100,
+        org_ids=[10, 20],
+        numerators=np.array([[4.0, 1.0], [0.0, 3.0]]),
+        denominators=np.zeros((2, 2)),
+    )
+    fingerprints = month_fingerprints(inputs)
+
+    revised = replace(inputs, numerators=np.array([[4.0, 2.0], [0.0, 3.0]]))
+    assert month_fingerprints(revised)[0] == fingerprints[0]
+    assert month_fingerprints(revised)[1] != fingerprints[1]
+
+    new_org = replace(
+        inputs,
+        org_ids=[10, 20, 30],
+        numerators=np.array([[4.0, 1.0], [0.0, 3.0], [0.0, 0.0]]),
+        denominators=np.zeros((3, 2)),
+    )
+    assert all(a != b for a, b in zip(month_fingerprints(new_org), fingerprints))
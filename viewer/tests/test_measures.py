@@ -7,14 +7,16 @@ from viewer.models import (
     Organisation,
     Measure,
     MeasureVMP,
-    PrecomputedMeasure,
+    PrecomputedMeasureSeries,
     VMP,
     VTM,
     DataStatus,
 )
+from viewer.measure_series import org_series
 from viewer.views.measures import (
     normalise_trust_code,
     build_measure_org_data,
+    org_series_points,
     build_trust_chart_data,
     series_dict_to_chart_points,
 )
@@ -141,18 +143,18 @@ class TestBuildMeasureOrgData:
     ):
         predecessor, successor = predecessor_successor_orgs
 
-        PrecomputedMeasure.objects.create(
+        PrecomputedMeasureSeries.objects.create(
             measure=measure,
             organisation=successor,
-            month=date(2024, 1, 1),
-            quantity=100.0,
-            numerator=100.0,
-            denominator=None,
+            start_month=date(2024, 1, 1),
+            quantity=[100.0],
+            numerator=[100.0],
+            denominator=[None],
         )
 
-        org_measures = PrecomputedMeasure.objects.filter(measure=measure)
+        org_points = org_series_points(org_series([measure.id]))
         shared_org_data = {"org_codes": {successor.ods_name: successor.ods_code}}
-        result = build_measure_org_data(org_measures, shared_org_data)
+        result = build_measure_org_data(org_points, shared_org_data)
 
         org_names = [o["name"] for o in result["organisations"]]
         assert successor.ods_name in org_names
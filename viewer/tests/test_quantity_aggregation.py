@@ -0,0 +1,236 @@
+import pytest
+from django.core.management import call_command
+
+from viewer.models import (
+    ICB,
+    DDDQuantity,
+    Ingredient,
+    Organisation,
+    Region,
+    SCMDQuantity,
+    VMP,
+    VMPQuantityUnit,
+    VTM,
+)
+from viewer.quantity_aggregation import (
+    aggregate_quantities,
+    aggregate_quantities_python,
+    rollup_quantities,
+)
+
+
+@pytest.fixture
+def region():
+    return Region.objects.create(name="Test Region", code="TR")
+
+
+@pytest.fixture
+def icb(region):
+    return ICB.objects.create(code="QXX", name="Test ICB", region=region)
+
+
+@pytest.fixture
+def orgs(region, icb):
+    successor = Organisation.objects.create(
+        ods_code="SUC", ods_name="Successor Trust", region=region, icb=icb
+    )
+    predecessor = Organisation.objects.create(
+        ods_code="PRE",
+        ods_name="Predecessor Trust",
+        region=None,
+        icb=None,
+        successor=successor,
+    )
+    other = Organisation.objects.create(
+        ods_code="OTH", ods_name="Other Trust", region=region, icb=icb
+    )
+    return predecessor, successor, other
+
+
+@pytest.fixture
+def vmps():
+    vtm = VTM.objects.create(vtm="12345", name="Test VTM")
+    return [
+        VMP.objects.create(code="111", name="VMP A", vtm=vtm),
+        VMP.objects.create(code="222", name="VMP B", vtm=vtm),
+    ]
+
+
+@pytest.fixture
+def scmd_rows(orgs, vmps):
+    predecessor, successor, other = orgs
+    vmp_a, vmp_b = vmps
+    unit_a = VMPQuantityUnit.objects.create(quantity_type="scmd", vmp=vmp_a, unit="tablet")
+    unit_b = VMPQuantityUnit.objects.create(quantity_type="scmd", vmp=vmp_b, unit="ml")
+    SCMDQuantity.objects.create(
+        vmp=vmp_a, organisation=predecessor, quantity_unit=unit_a, data=[1.0, 2.0, 3.0]
+    )
+    SCMDQuantity.objects.create(
+        vmp=vmp_a, organisation=successor, quantity_unit=unit_a, data=[10.0, 0.0]
+    )
+    SCMDQuantity.objects.create(
+        vmp=vmp_a, organisation=other, quantity_unit=unit_a, data=[5.0, 5.0, 5.0]
+    )
+    SCMDQuantity.objects.create(
+        vmp=vmp_b, organisation=other, quantity_unit=unit_b, data=None
+    )
+
+
+@pytest.mark.django_db
+class TestAggregateQuantities:
+    def test_trust_scope_merges_predecessors_into_successor(self, orgs, vmps, scmd_rows):
+        predecessor, successor, other = orgs
+        vmp_a, vmp_b = vmps
+
+        grouped = aggregate_quantities(
+            SCMDQuantity, [vmp_a.id, vmp_b.id], national=False
+        )
+
+        assert set(grouped) == {
+            (vmp_a.id, successor.id),
+            (vmp_a.id, other.id),
+            (vmp_b.id, other.id),
+        }
+        merged = grouped[(vmp_a.id, successor.id)]
+        assert merged["data"] == [11.0, 2.0, 3.0]
+        assert merged["unit"] == "tablet"
+        assert merged["organisation"] == {
+            "ods_code": "SUC",
+            "ods_name": "Successor Trust",
+            "region": "Test Region",
+            "icb": "Test ICB",
+        }
+        assert grouped[(vmp_b.id, other.id)]["data"] == []
+        assert grouped[(vmp_b.id, other.id)]["unit"] == "ml"
+
+    def test_national_scope_sums_all_orgs(self, vmps, scmd_rows):
+        vmp_a, _ = vmps
+
+        grouped = aggregate_quantities(SCMDQuantity, [vmp_a.id], national=True)
+
+        assert grouped == {
+            vmp_a.id: {
+                "data": [16.0, 7.0, 8.0],
+                "unit": "tablet",
+                "organisation": None,
+            }
+        }
+
+    def test_ods_code_filter_includes_predecessors(self, orgs, vmps, scmd_rows):
+        _, successor, other = orgs
+        vmp_a, vmp_b = vmps
+
+        grouped = aggregate_quantities(
+            SCMDQuantity, [vmp_a.id, vmp_b.id], national=False, ods_codes=["SUC"]
+        )
+
+        assert list(grouped) == [(vmp_a.id, successor.id)]
+        assert grouped[(vmp_a.id, successor.id)]["data"] == [11.0, 2.0, 3.0]
+
+    @pytest.mark.parametrize("national", [True, False])
+    def test_matches_python_aggregation(self, orgs, vmps, scmd_rows, national):
+        vmp_ids = [vmp.id for vmp in vmps]
+
+        assert aggregate_quantities(
+            SCMDQuantity, vmp_ids, national=national
+        ) == aggregate_quantities_python(SCMDQuantity, vmp_ids, national=national)
+
+    def test_ddd_quantities_have_no_unit(self, orgs, vmps):
+        _, successor, _ = orgs
+        vmp_a, _ = vmps
+        DDDQuantity.objects.create(vmp=vmp_a, organisation=successor, data=[1.5, 2.5])
+
+        grouped = aggregate_quantities(DDDQuantity, [vmp_a.id], national=True)
+
+        assert grouped[vmp_a.id]["data"] == [1.5, 2.5]
+        assert grouped[vmp_a.id]["unit"] is None
+
+
+@pytest.mark.django_db
+class TestRollupQuantities:
+    def test_region_rollup_uses_successor_region(self, orgs, vmps, scmd_rows):
+        groups = rollup_quantities(SCMDQuantity, [vmp.id for vmp in vmps], "region")
+
+        # The predecessor has no region of its own but counts towards its successor's
+        assert groups == [{"key": "TR", "name": "Test Region", "data": [16.0, 7.0, 8.0]}]
+
+    def test_ods_code_filter_includes_predecessors(self, orgs, vmps, scmd_rows):
+        groups = rollup_quantities(
+            SCMDQuantity, [vmp.id for vmp in vmps], "icb", ods_codes=["SUC"]
+        )
+
+        assert groups == [{"key": "QXX", "name": "Test ICB", "data": [11.0, 2.0, 3.0]}]
+
+    def test_product_and_unit_rollups(self, orgs, vmps, scmd_rows):
+        vmp_ids = [vmp.id for vmp in vmps]
+
+        assert rollup_quantities(SCMDQuantity, vmp_ids, "product") == [
+            {"key": "111", "name": "VMP A", "data": [16.0, 7.0, 8.0]},
+            {"key": "222", "name": "VMP B", "data": []},
+        ]
+        assert rollup_quantities(SCMDQuantity, vmp_ids, "unit") == [
+            {"key": "ml", "name": "ml", "data": []},
+            {"key": "tablet", "name": "tablet", "data": [16.0, 7.0, 8.0]},
+        ]
+
+    def test_ingredient_rollup_splits_quantity_between_ingredients(
+        self, orgs, vmps, scmd_rows
+    ):
+        vmp_a, _ = vmps
+        vmp_a.ingredients.add(
+            Ingredient.objects.create(code="ING1", name="Ingredient 1"),
+            Ingredient.objects.create(code="ING2", name="Ingredient 2"),
+        )
+
+        groups = rollup_quantities(SCMDQuantity, [vmp_a.id], "ingredient")
+
+        assert groups == [
+            {"key": "ING1", "name": "Ingredient 1", "data": [8.0, 3.5, 4.0]},
+            {"key": "ING2", "name": "Ingredient 2", "data": [8.0, 3.5, 4.0]},
+        ]
+
+    def test_shelford_rollup(self, orgs, vmps, scmd_rows):
+        _, successor, _ = orgs
+        successor.in_shelford_group = True
+        successor.save()
+
+        groups = rollup_quantities(SCMDQuantity, [vmps[0].id], "shelford")
+
+        assert groups == [
+            {"key": "false", "name": "Not in Shelford Group", "data": [5.0, 5.0, 5.0]},
+            {"key": "true", "name": "Shelford Group", "data": [11.0, 2.0, 3.0]},
+        ]
+
+    def test_ddd_unit_rollup_uses_unit_labels(self, orgs, vmps):
+        _, successor, other = orgs
+        vmp_a, vmp_b = vmps
+        DDDQuantity.objects.create(vmp=vmp_a, organisation=successor, data=[1.5, 2.5])
+        DDDQuantity.objects.create(vmp=vmp_b, organisation=other, data=[1.0])
+
+        groups = rollup_quantities(
+            DDDQuantity, [vmp_a.id, vmp_b.id], "unit", ddd_units={vmp_a.id: "DDD (1 g)"}
+        )
+
+        assert groups == [
+            {"key": "DDD", "name": "DDD", "data": [1.0]},
+            {"key": "DDD (1 g)", "name": "DDD (1 g)", "data": [1.5, 2.5]},
+        ]
+
+    def test_invalid_group_by(self, vmps):
+        with pytest.raises(ValueError):
+            rollup_quantities(SCMDQuantity, [vmps[0].id], "postcode")
+
+
+@pytest.mark.django_db
+def test_benchmark_quantity_aggregation_command(vmps, scmd_rows, capsys):
+    call_command(
+        "benchmark_quantity_aggregation",
+        "--quantity-type", "scmd",
+        "--scope", "trust",
+        "--repeat", "1",
+    )
+
+    output = capsys.readouterr().out
+    assert "Python aggregation" in output
+    assert "SQL aggregation" in output
+    assert "Results match" in output
@@ -1,7 +1,17 @@
 import pytest
 
+from viewer.atc_closure import rebuild_atc_closure
 from viewer.models import ATC, Ingredient, VMP, VTM
-from viewer.search import normalise_string, tokenize
+from viewer.search import (
+    _VMPRow,
+    _VMPSearchIndex,
+    _matches_all_tokens,
+    normalise_string,
+    resolve_product_codes,
+    search_atc_results,
+    search_ingredient_results,
+    tokenize,
+)
 
 
 class TestNormaliseString:
@@ -39,6 +49,64 @@ class TestTokenize:
         assert tokenize("Paracetamol, 500mg.") == ["paracetamol", "500mg"]
 
 
+def _row(id, code, name, vtm=None, ingredients=""):
+    vtm_id, vtm_code, vtm_name = vtm or (None, None, None)
+    return _VMPRow(
+        id=id,
+        code=code,
+        name=name,
+        code_norm=normalise_string(code),
+        name_norm=normalise_string(name),
+        vtm_id=vtm_id,
+        vtm_code=vtm_code,
+        vtm_name=vtm_name,
+        vtm_code_norm=normalise_string(vtm_code),
+        vtm_name_norm=normalise_string(vtm_name),
+        ingredient_blob_norm=normalise_string(ingredients),
+    )
+
+
+class TestVMPSearchIndex:
+    @pytest.fixture
+    def rows(self):
+        coamox = (1, "VTMCO1", "Co-amoxiclav")
+        morphine = (2, "VTMMO1", "Morphine")
+        return [
+            _row(1, "COA125", "Co-amoxiclav 125mg tablets", coamox),
+            _row(2, "COA625", "Co-amoxiclav 625mg tablets", coamox),
+            _row(3, "MOR10", "Morphine 10mg/5ml oral solution", morphine, "Morphine sulfate"),
+            _row(4, "MOR60", "Morphine 60mg modified-release tablets", morphine),
+            _row(5, "ORPH1", "Orphan product 100mg", None, "Paracetamol ING001"),
+        ]
+
+    @pytest.mark.parametrize(
+        "term",
+        [
+            "co amox",
+            "coamox",
+            "tablets",
+            "morphine sulfate",
+            "60mg",
+            "mg tab",
+            "ing001",
+            "a b c",
+            "granules",
+        ],
+    )
+    def test_search_matches_full_scan(self, rows, term):
+        tokens = tokenize(term)
+        index = _VMPSearchIndex.build(rows)
+
+        expected = [row for row in rows if _matches_all_tokens(row.search_blob, tokens)]
+
+        assert index.search(tokens) == expected
+
+    def test_counts_vmps_per_vtm(self, rows):
+        index = _VMPSearchIndex.build(rows)
+
+        assert index.total_counts_by_vtm == {1: 2, 2: 2}
+
+
 def _vmp_names(data):
     names = []
     for r in data["results"]:
@@ -412,6 +480,46 @@ class TestSearchProducts:
             assert "vmp_count" in item
             assert "hierarchy_path" in item
 
+    def test_atc_search_includes_descendant_vmps(self, client, atc_paracetamol):
+        atc_group = ATC.objects.create(
+            code="N02B", name="Other analgesics", level_1="N", level_2="N02", level_3="N02B"
+        )
+        VMP.objects.create(code="VMPB", name="Paracetamol 1g tablets").atcs.add(atc_paracetamol)
+        VMP.objects.create(code="VMPA", name="Aspirin 75mg tablets").atcs.add(atc_group)
+        rebuild_atc_closure()
+
+        response = client.get(
+            "/api/search-products/", {"type": "atc", "term": "N02B"}
+        )
+
+        data = response.json()
+        group_result = _find_result(data, "N02B", "atc")
+        assert group_result["level"] == 3
+        assert group_result["vmps"] == [
+            {"code": "VMPA", "name": "Aspirin 75mg tablets"},
+            {"code": "VMPB", "name": "Paracetamol 1g tablets"},
+        ]
+        assert _find_result(data, "N02BE01", "atc")["vmp_count"] == 1
+
+    def test_ingredient_and_atc_search_use_cached_corpora(
+        self, client, ingredient_paracetamol, atc_paracetamol, django_assert_num_queries
+    ):
+        vmp = VMP.objects.create(code="VMPC1", name="Paracetamol 500mg tablets")
+        vmp.ingredients.add(ingredient_paracetamol)
+        search_ingredient_results("paracetamol")
+
+        # Only the signature query once the corpora are loaded
+        with django_assert_num_queries(1):
+            results = search_ingredient_results("paracetamol")
+        assert results[0]["vmp_count"] == 1
+        with django_assert_num_queries(1):
+            assert search_atc_results("paracetamol")[0]["vmp_count"] == 0
+
+        # New links change the signature and reload the corpora
+        vmp.atcs.add(atc_paracetamol)
+        rebuild_atc_closure()
+        assert search_atc_results("paracetamol")[0]["vmp_count"] == 1
+
     def test_default_type_is_product(self, client):
         vtm = VTM.objects.create(vtm="VTMDEF", name="Paracetamol")
         VMP.objects.create(code="VMPDEF", name="Paracetamol 500mg tablets", vtm=vtm)
@@ -426,3 +534,71 @@ class TestSearchProducts:
         )
         assert response.status_code == 200
         assert response.json()["results"] == []
+
+
+@pytest.mark.django_db
+class TestResolveProductCodes:
+    @pytest.fixture
+    def products(self, vtm_paracetamol, ingredient_paracetamol, atc_paracetamol):
+        atc_group = ATC.objects.create(
+            code="N02B", name="Other analgesics", level_1="N", level_2="N02", level_3="N02B"
+        )
+        tablets = VMP.objects.create(
+            code="VMPT", name="Paracetamol 500mg tablets", vtm=vtm_paracetamol
+        )
+        tablets.ingredients.add(ingredient_paracetamol)
+        tablets.atcs.add(atc_paracetamol)
+        aspirin = VMP.objects.create(code="VMPA", name="Aspirin 75mg tablets")
+        aspirin.atcs.add(atc_group)
+        rebuild_atc_closure()
+        return tablets, aspirin
+
+    def test_expands_every_type(self, products):
+        tablets, aspirin = products
+
+        resolved = resolve_product_codes({
+            "vmp": ["VMPA", "MISSING"],
+            "vtm": ["VTM001"],
+            "ingredient": ["ING001"],
+            "atc": ["N02B", "N02BE01"],
+        })
+
+        def codes(product_type, code):
+            return [vmp["code"] for vmp in resolved[(product_type, code)]["vmps"]]
+
+        assert codes("vmp", "VMPA") == ["VMPA"]
+        assert ("vmp", "MISSING") not in resolved
+        assert codes("vtm", "VTM001") == ["VMPT"]
+        assert codes("ingredient", "ING001") == ["VMPT"]
+        assert codes("atc", "N02B") == ["VMPA", "VMPT"]
+        assert codes("atc", "N02BE01") == ["VMPT"]
+        assert resolved[("atc", "N02B")]["name"] == "Other analgesics"
+        assert resolved[("vtm", "VTM001")]["vmps"][0] == {
+            "id": tablets.id, "code": "VMPT", "name": "Paracetamol 500mg tablets"
+        }
+
+    def test_atc_closure_includes_ancestor_levels(self, products):
+        tablets, aspirin = products
+        for code in ("N", "N02"):
+            ATC.objects.create(code=code, name=f"Level {code}")
+        rebuild_atc_closure()
+
+        assert set(ATC.objects.get(code="N").get_vmps()) == {tablets, aspirin}
+        assert set(ATC.objects.get(code="N02B").get_vmps()) == {tablets, aspirin}
+        assert list(ATC.objects.get(code="N02BE01").get_vmps()) == [tablets]
+
+    def test_existing_code_without_vmps_is_resolved(self, products):
+        ATC.objects.create(code="A01", name="Stomatological preparations", level_1="A", level_2="A01")
+
+        resolved = resolve_product_codes({"atc": ["A01"]})
+
+        assert resolved[("atc", "A01")]["vmps"] == []
+
+    def test_query_count_does_not_grow_with_code_count(self, products, django_assert_num_queries):
+        with django_assert_num_queries(1):
+            resolve_product_codes({
+                "vmp": ["VMPA", "VMPT"],
+                "vtm": ["VTM001"],
+                "ingredient": ["ING001"],
+                "atc": ["N", "N02", "N02B", "N02BE01"],
+            })
@@ -16,6 +16,7 @@ from .views import (
     MeasureTrustsView,
     select_quantity_type,
     get_quantity_data,
+    get_quantity_rollup,
     get_product_details,
     search_products,
     validate_analysis_params,
@@ -49,6 +50,7 @@ urlpatterns = [
     path('blog/', BlogListView.as_view(), name='blog_list'),
     path('research/', PapersListView.as_view(), name='papers_list'),
     path("api/get-quantity-data/", get_quantity_data, name="get_quantity_data"),
+    path("api/get-quantity-rollup/", get_quantity_rollup, name="get_quantity_rollup"),
     path("api/select-quantity-type/", select_quantity_type, name="select_quantity_type"),
     path("api/get-product-details/", get_product_details, name="get_product_details"),
     path("api/search-products/", search_products, name="search_products"),
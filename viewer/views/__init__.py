@@ -17,6 +17,7 @@ from .analyse import AnalyseView
 
 from .api import (
     get_quantity_data,
+    get_quantity_rollup,
     search_products,
     get_product_details,
     select_quantity_type,
@@ -1,21 +1,20 @@
+import json
 import re
+import struct
+from array import array
 
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from django.db.models import Q, OuterRef, Exists
+from django.db.models import Q, OuterRef, Exists, Prefetch
 from typing import List, Set
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_protect
 from django.contrib.postgres.aggregates import ArrayAgg
 from ..models import (
     VMP,
-    SCMDQuantity,
-    Dose,
-    IngredientQuantity,
+    DDD,
+    CalculationLogic,
     DDDQuantity,
-    VTM,
-    Ingredient,
-    ATC,
     Organisation,
     Measure,
     MeasureVMP,
@@ -25,8 +24,18 @@ from ..utils import (
     get_quantity_months,
     get_ddd_unit_map,
 )
+from ..quantity_aggregation import (
+    QUANTITY_MODELS,
+    ROLLUP_GROUPS,
+    aggregate_quantities,
+    iter_aggregated_quantities,
+    rollup_quantities,
+)
+from ..quantity_summary import get_quantity_summary
 from ..search import (
     MAX_ANALYSIS_VMP_COUNT,
+    PRODUCT_TYPES,
+    resolve_product_codes,
     search_atc_results,
     search_ingredient_results,
     search_product_results,
@@ -39,64 +48,52 @@ from .measures import (
     series_dict_to_chart_points,
 )
 
-
-def add_quantity_data(existing, new_data):
-    """Element-wise sum of new_data into existing, padding with zeros."""
-    new_data = new_data or []
-    for i in range(max(len(existing), len(new_data))):
-        while len(existing) <= i:
-            existing.append(0)
-        add_val = float(new_data[i] or 0) if i < len(new_data) else 0
-        existing[i] = existing[i] + add_val
-
-
-def group_quantity_rows(quantity_data, *, national):
-    """Group quantity rows by VMP (national) or (VMP, effective org)."""
-    grouped = {}
-    for item in quantity_data:
-        if national:
-            key = item.vmp_id
-            effective_org = None
-        else:
-            org = item.organisation
-            effective_org = org.successor if org.successor_id else org
-            key = (item.vmp_id, effective_org.id)
-
-        if key not in grouped:
-            grouped[key] = {
-                'item': item,
-                'effective_org': effective_org,
-                'data': list(item.data or []),
-            }
-        else:
-            add_quantity_data(grouped[key]['data'], item.data)
-    return grouped
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+BINARY_CONTENT_TYPE = "application/octet-stream"
+
+# VMPQuantitySummary quantity type -> (availability flag, units key) in the
+# get_product_info and get_quantity_data_batch dicts
+PRODUCT_INFO_QUANTITY_KEYS = {
+    'scmd': ('has_scmd_quantity', 'scmd_units'),
+    'dose': ('has_dose_quantity', 'dose_units'),
+    'ingredient': ('has_ingredient_quantity', 'ingredient_quantity_units'),
+    'ddd': ('has_ddd_quantity', 'ddd_units'),
+}
+PRODUCT_TYPE_BY_PARAM = {
+    'vmps': 'vmp',
+    'vtms': 'vtm',
+    'ingredients': 'ingredient',
+    'atcs': 'atc',
+}
+PRODUCT_DETAILS_QUANTITY_KEYS = {
+    'scmd': ('has_scmd_quantity', 'scmd_units'),
+    'dose': ('has_dose', 'dose_units'),
+    'ingredient': ('has_ingredient_quantities', 'ingredient_units'),
+    'ddd': ('has_ddd_quantity', None),
+}
 
 
 def build_quantity_response_row(
     base_metadata, vmp_id, group, quantity_type, ddd_unit_map
 ):
-    source_item = group['item'] if group else None
-    effective_org = group['effective_org'] if group else None
+    org = group['organisation'] if group else None
     return {
         **base_metadata,
-        'organisation__ods_code': effective_org.ods_code if effective_org else None,
-        'organisation__ods_name': effective_org.ods_name if effective_org else None,
-        'organisation__region': (
-            effective_org.region.name if effective_org and effective_org.region else None
-        ),
-        'organisation__icb': (
-            effective_org.icb.name if effective_org and effective_org.icb else None
-        ),
+        'organisation__ods_code': org['ods_code'] if org else None,
+        'organisation__ods_name': org['ods_name'] if org else None,
+        'organisation__region': org['region'] if org else None,
+        'organisation__icb': org['icb'] if org else None,
         'data': group['data'] if group else [],
-        'unit': (
-            ddd_unit_map.get(vmp_id, "DDD")
-            if quantity_type == "Defined Daily Dose Quantity"
-            else (source_item.unit if source_item else None)
-        ),
+        'unit': quantity_row_unit(vmp_id, group, quantity_type, ddd_unit_map),
     }
 
 
+def quantity_row_unit(vmp_id, group, quantity_type, ddd_unit_map):
+    if quantity_type == "Defined Daily Dose Quantity":
+        return ddd_unit_map.get(vmp_id, "DDD")
+    return group['unit'] if group else None
+
+
 @api_view(["GET"])
 def search_products(request):
     search_type = request.GET.get("type", "product")
@@ -268,10 +265,13 @@ def get_product_info(vmp_ids):
                 'ddd_units': []
             })
     
-    _populate_scmd_quantity_info(vmp_ids, vmp_info)
-    _populate_dose_quantity_info(vmp_ids, vmp_info)
-    _populate_ingredient_quantity_info(vmp_ids, vmp_info)
-    _populate_ddd_quantity_info(vmp_ids, vmp_info)
+    quantity_summary = get_quantity_summary(vmp_ids)
+    for vmp_id, vmp in vmp_info.items():
+        for quantity_type, (has_key, units_key) in PRODUCT_INFO_QUANTITY_KEYS.items():
+            row = quantity_summary.get(vmp_id, {}).get(quantity_type)
+            if row:
+                vmp[has_key] = True
+                vmp[units_key] = sorted(row['units'])
     
     products = []
     for vmp_id in vmp_ids:
@@ -308,83 +308,6 @@ def get_product_info(vmp_ids):
     return products
 
 
-def _populate_scmd_quantity_info(vmp_ids, vmp_info):
-    """Populate SCMD quantity information"""
-    scmd_quantities = SCMDQuantity.objects.filter(
-        vmp_id__in=vmp_ids,
-        data__0__isnull=False
-    ).values('vmp_id', 'data', 'quantity_unit__unit').distinct('vmp_id')
-    
-    for scmd in scmd_quantities:
-        vmp_id = scmd['vmp_id']
-        if vmp_id not in vmp_info or not scmd['data']:
-            continue
-
-        has_valid_data = any(v != 0 for v in scmd['data']) if scmd['data'] else False
-        
-        if has_valid_data:
-            vmp_info[vmp_id]['has_scmd_quantity'] = True
-            unit = scmd.get('quantity_unit__unit')
-            if unit:
-                vmp_info[vmp_id]['scmd_units'] = sorted(list({unit}))
-
-
-def _populate_dose_quantity_info(vmp_ids, vmp_info):
-    """Populate Dose quantity information"""
-    dose_quantities = Dose.objects.filter(
-        vmp_id__in=vmp_ids,
-        data__0__isnull=False
-    ).values('vmp_id', 'data', 'quantity_unit__unit').distinct('vmp_id')
-    
-    for dose in dose_quantities:
-        vmp_id = dose['vmp_id']
-        if vmp_id not in vmp_info:
-            continue
-        has_valid_data = any(v != 0 for v in dose['data']) if dose.get('data') else False
-        if has_valid_data:
-            vmp_info[vmp_id]['has_dose_quantity'] = True
-            unit = dose.get('quantity_unit__unit')
-            if unit:
-                vmp_info[vmp_id]['dose_units'] = sorted(list({unit}))
-
-
-def _populate_ingredient_quantity_info(vmp_ids, vmp_info):
-    """Populate Ingredient quantity information"""
-    ingredient_quantities = IngredientQuantity.objects.filter(
-        vmp_id__in=vmp_ids,
-        data__0__isnull=False
-    ).values('vmp_id', 'data', 'quantity_unit__unit').distinct('vmp_id')
-    
-    for ingredient_qty in ingredient_quantities:
-        vmp_id = ingredient_qty['vmp_id']
-        if vmp_id not in vmp_info:
-            continue
-        has_valid_data = any(v != 0 for v in ingredient_qty['data']) if ingredient_qty.get('data') else False
-        if has_valid_data:
-            vmp_info[vmp_id]['has_ingredient_quantity'] = True
-            unit = ingredient_qty.get('quantity_unit__unit')
-            if unit:
-                vmp_info[vmp_id]['ingredient_quantity_units'] = sorted(list({unit}))
-
-
-def _populate_ddd_quantity_info(vmp_ids, vmp_info):
-    """Populate DDD quantity information. Unit is always DDD (details from DDD model)."""
-    ddd_unit_map = get_ddd_unit_map(vmp_ids)
-    ddd_quantities = DDDQuantity.objects.filter(
-        vmp_id__in=vmp_ids,
-        data__0__isnull=False
-    ).values('vmp_id', 'data').distinct('vmp_id')
-    
-    for ddd_qty in ddd_quantities:
-        vmp_id = ddd_qty['vmp_id']
-        if vmp_id not in vmp_info:
-            continue
-        has_valid_data = any(v != 0 for v in ddd_qty['data']) if ddd_qty.get('data') else False
-        if has_valid_data:
-            vmp_info[vmp_id]['has_ddd_quantity'] = True
-            vmp_info[vmp_id]['ddd_units'] = [ddd_unit_map.get(vmp_id, "DDD")]
-
-
 @csrf_protect
 @api_view(["POST"])
 def get_quantity_data(request):
@@ -396,23 +319,10 @@ def get_quantity_data(request):
     if not all([search_items, quantity_type]):
         return Response({"error": "Missing required parameters"}, status=400)
 
-    query = Q()
-    for item in search_items:
-        try:
-            code = item["code"]
-            item_type = item["type"]
-            if item_type == 'vmp':
-                query |= Q(code=code)
-            elif item_type == 'vtm':
-                query |= Q(vtm__vtm=code)
-            elif item_type == 'ingredient':
-                query |= Q(ingredients__code=code)
-            elif item_type == 'atc':
-                query |= Q(atcs__code__startswith=code)
-        except (KeyError, TypeError):
-            return Response({"error": f"Invalid search item format: {item}"}, status=400)
-
-    vmp_ids = set(VMP.objects.filter(query).values_list('id', flat=True))
+    try:
+        vmp_ids = get_vmp_ids_from_search_items(search_items)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
 
     if not vmp_ids:
         return Response({"error": "No valid VMPs found"}, status=400)
@@ -421,31 +331,48 @@ def get_quantity_data(request):
         scope_value = scope.strip().lower() if isinstance(scope, str) else "all"
         is_national_scope = scope_value == "national"
 
-        base_vmps = list(VMP.objects.filter(
-            id__in=vmp_ids
-        ).select_related('vtm').annotate(
-            ingredient_names=ArrayAgg('ingredients__name', distinct=True),
-            ingredient_codes=ArrayAgg('ingredients__code', distinct=True)
-        ).values(
-            'id', 'code', 'name', 'vtm__name', 'vtm__vtm',
-            'ingredient_names', 'ingredient_codes'
-        ))
-
-        base_vmp_metadata = {}
+        base_vmp_metadata = get_base_vmp_metadata(vmp_ids)
+        quantity_model = QUANTITY_MODELS.get(quantity_type)
+        ddd_unit_map = get_ddd_unit_map(vmp_ids) if quantity_model is DDDQuantity else {}
+        response_format = request.data.get("format")
+        groups = iter_quantity_groups(
+            quantity_model,
+            base_vmp_metadata,
+            national=is_national_scope,
+            ods_codes=ods_codes if isinstance(ods_codes, list) else None,
+            packed=response_format == "binary",
+        )
+        months = get_quantity_months()
+
+        if response_format == "binary":
+            return HttpResponse(
+                build_quantity_binary(
+                    months,
+                    base_vmp_metadata,
+                    groups,
+                    quantity_type,
+                    ddd_unit_map,
+                    placeholders=not is_national_scope,
+                ),
+                content_type=BINARY_CONTENT_TYPE,
+            )
+
+        if response_format == "ndjson":
+            return StreamingHttpResponse(
+                stream_quantity_ndjson(
+                    months,
+                    base_vmp_metadata,
+                    groups,
+                    quantity_type,
+                    ddd_unit_map,
+                    placeholders=not is_national_scope,
+                ),
+                content_type=NDJSON_CONTENT_TYPE,
+            )
+
         response_data = []
-        for vmp in base_vmps:
-            ingredient_names = vmp['ingredient_names'] or []
-            ingredient_codes = vmp['ingredient_codes'] or []
-            base_metadata = {
-                'vmp__code': vmp['code'],
-                'vmp__name': vmp['name'],
-                'vmp__vtm__vtm': vmp['vtm__vtm'],
-                'vmp__vtm__name': vmp['vtm__name'],
-                'ingredient_names': ingredient_names,
-                'ingredient_codes': ingredient_codes
-            }
-            base_vmp_metadata[vmp['id']] = base_metadata
-            if not is_national_scope:
+        if not is_national_scope:
+            for base_metadata in base_vmp_metadata.values():
                 response_data.append({
                     **base_metadata,
                     'organisation__ods_code': None,
@@ -454,65 +381,256 @@ def get_quantity_data(request):
                     'organisation__icb': None,
                     'data': []
                 })
-
-        quantity_model = {
-            "SCMD Quantity": SCMDQuantity,
-            "Unit Dose Quantity": Dose,
-            "Ingredient Quantity": IngredientQuantity,
-            "Defined Daily Dose Quantity": DDDQuantity
-        }.get(quantity_type)
-
-        if quantity_model:
-            ddd_unit_map = get_ddd_unit_map(vmp_ids) if quantity_model is DDDQuantity else {}
-            quantity_queryset = quantity_model.objects.filter(
-                vmp_id__in=vmp_ids
-            )
-            if not is_national_scope and isinstance(ods_codes, list) and len(ods_codes) > 0:
-                quantity_queryset = quantity_queryset.filter(
-                    Q(organisation__ods_code__in=ods_codes)
-                    | Q(organisation__successor__ods_code__in=ods_codes)
-                )
-            select_related_fields = [
-                'vmp',
-                'vmp__vtm',
-            ]
-            if not is_national_scope:
-                select_related_fields.extend([
-                    'organisation',
-                    'organisation__region',
-                    'organisation__icb',
-                    'organisation__successor',
-                ])
-            if quantity_model is not DDDQuantity:
-                select_related_fields.append('quantity_unit')
-            quantity_queryset = quantity_queryset.select_related(*select_related_fields)
-            quantity_data = list(quantity_queryset)
-
-            grouped = group_quantity_rows(quantity_data, national=is_national_scope)
-            if is_national_scope:
-                emit_items = (
-                    (vmp_id, base_vmp_metadata[vmp_id], grouped.get(vmp_id))
-                    for vmp_id in base_vmp_metadata
-                )
-            else:
-                emit_items = (
-                    (vmp_id, base_vmp_metadata[vmp_id], group)
-                    for (vmp_id, _), group in grouped.items()
-                )
-            for vmp_id, base_metadata, group in emit_items:
-                response_data.append(
-                    build_quantity_response_row(
-                        base_metadata, vmp_id, group, quantity_type, ddd_unit_map
-                    )
+        for vmp_id, group in groups:
+            response_data.append(
+                build_quantity_response_row(
+                    base_vmp_metadata[vmp_id], vmp_id, group, quantity_type, ddd_unit_map
                 )
+            )
 
-        months = get_quantity_months()
         return Response({"months": months, "items": response_data})
 
     except Exception:
         return Response({"error": "An error occurred while processing the request"}, status=500)
 
 
+@csrf_protect
+@api_view(["POST"])
+def get_quantity_rollup(request):
+    """
+    Quantity series summed server-side by region, ICB, cancer alliance,
+    trust type, Shelford Group membership, product, ingredient or unit.
+
+    Takes the names, quantity_type and ods_codes of get_quantity_data plus
+    group_by, and returns {"months": [...], "group_by": ..., "groups":
+    [{"key", "name", "data"}]} instead of one row per trust.
+    """
+    search_items = request.data.get("names", None)
+    ods_codes = request.data.get("ods_codes", None)
+    quantity_type = request.data.get("quantity_type", None)
+    group_by = request.data.get("group_by", None)
+
+    if not all([search_items, quantity_type, group_by]):
+        return Response({"error": "Missing required parameters"}, status=400)
+    if group_by not in ROLLUP_GROUPS:
+        return Response({"error": f"Invalid group_by: {group_by}"}, status=400)
+    quantity_model = QUANTITY_MODELS.get(quantity_type)
+    if not quantity_model:
+        return Response({"error": f"Invalid quantity_type: {quantity_type}"}, status=400)
+
+    try:
+        vmp_ids = get_vmp_ids_from_search_items(search_items)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    if not vmp_ids:
+        return Response({"error": "No valid VMPs found"}, status=400)
+
+    try:
+        ddd_units = (
+            get_ddd_unit_map(vmp_ids)
+            if group_by == "unit" and quantity_model is DDDQuantity
+            else None
+        )
+        groups = rollup_quantities(
+            quantity_model,
+            vmp_ids,
+            group_by,
+            ods_codes=ods_codes if isinstance(ods_codes, list) else None,
+            ddd_units=ddd_units,
+        )
+        return Response({
+            "months": get_quantity_months(),
+            "group_by": group_by,
+            "groups": groups,
+        })
+
+    except Exception:
+        return Response({"error": "An error occurred while processing the request"}, status=500)
+
+
+def get_base_vmp_metadata(vmp_ids):
+    """VMP id -> the VMP fields repeated on each get_quantity_data row."""
+    base_vmps = VMP.objects.filter(
+        id__in=vmp_ids
+    ).select_related('vtm').annotate(
+        ingredient_names=ArrayAgg('ingredients__name', distinct=True),
+        ingredient_codes=ArrayAgg('ingredients__code', distinct=True)
+    ).values(
+        'id', 'code', 'name', 'vtm__name', 'vtm__vtm',
+        'ingredient_names', 'ingredient_codes'
+    )
+
+    return {
+        vmp['id']: {
+            'vmp__code': vmp['code'],
+            'vmp__name': vmp['name'],
+            'vmp__vtm__vtm': vmp['vtm__vtm'],
+            'vmp__vtm__name': vmp['vtm__name'],
+            'ingredient_names': vmp['ingredient_names'] or [],
+            'ingredient_codes': vmp['ingredient_codes'] or []
+        }
+        for vmp in base_vmps
+    }
+
+
+def iter_quantity_groups(
+    quantity_model, base_vmp_metadata, *, national, ods_codes=None, packed=False
+):
+    """
+    (vmp_id, group) pairs in get_quantity_data row order.
+
+    National rows are one per VMP, with None for VMPs without data; otherwise
+    the (VMP, organisation) groups are streamed from the database as they are
+    read. With packed, group data is bytes of big-endian float64 values.
+    """
+    if not quantity_model:
+        return
+    if national:
+        grouped = aggregate_quantities(
+            quantity_model, base_vmp_metadata, national=True, packed=packed
+        )
+        for vmp_id in base_vmp_metadata:
+            yield vmp_id, grouped.get(vmp_id)
+        return
+    for (vmp_id, _), group in iter_aggregated_quantities(
+        quantity_model, base_vmp_metadata, national=False, ods_codes=ods_codes, packed=packed
+    ):
+        yield vmp_id, group
+
+
+def stream_quantity_ndjson(
+    months, base_vmp_metadata, groups, quantity_type, ddd_unit_map, *, placeholders, lines_per_chunk=500
+):
+    """
+    Yield the get_quantity_data response as newline-delimited JSON.
+
+    The first line is {"months": [...], "vmps": [...]} with the metadata of
+    each VMP sent once. Each organisation is sent once as an {"org": {...}}
+    line before the first row that refers to it. Rows are
+    {"vmp": i, "org": j, "unit": ..., "data": [...]}, where i and j index the
+    VMP and organisation lists and org is null for VMP-level rows. VMP
+    placeholder rows carry no unit, as in the JSON response.
+
+    The status code is sent before the rows are read, so the last line is
+    {"end": true, "rows": n} once every row has been sent, or {"error": ...}
+    if reading them failed. A body without the end line is incomplete.
+    """
+    vmp_index = {vmp_id: i for i, vmp_id in enumerate(base_vmp_metadata)}
+    org_index = {}
+    lines = [_ndjson_line({"months": months, "vmps": list(base_vmp_metadata.values())})]
+    rows = 0
+
+    if placeholders:
+        lines.extend(_ndjson_line({"vmp": i, "org": None, "data": []}) for i in vmp_index.values())
+        rows += len(vmp_index)
+
+    try:
+        for vmp_id, group in groups:
+            org = group['organisation'] if group else None
+            org_ref = None
+            if org:
+                org_ref = org_index.get(org['ods_code'])
+                if org_ref is None:
+                    org_ref = org_index[org['ods_code']] = len(org_index)
+                    lines.append(_ndjson_line({"org": org}))
+            lines.append(_ndjson_line({
+                "vmp": vmp_index[vmp_id],
+                "org": org_ref,
+                "unit": quantity_row_unit(vmp_id, group, quantity_type, ddd_unit_map),
+                "data": group['data'] if group else [],
+            }))
+            rows += 1
+            if len(lines) >= lines_per_chunk:
+                yield "".join(lines)
+                lines = []
+    except Exception:
+        lines.append(_ndjson_line({"error": "An error occurred while processing the request"}))
+        yield "".join(lines)
+        return
+
+    lines.append(_ndjson_line({"end": True, "rows": rows}))
+    yield "".join(lines)
+
+
+def _ndjson_line(obj):
+    return json.dumps(obj, separators=(",", ":")) + "\n"
+
+
+def build_quantity_binary(
+    months, base_vmp_metadata, packed_groups, quantity_type, ddd_unit_map, *, placeholders
+):
+    """
+    The get_quantity_data response as a JSON header and one packed value matrix.
+
+    The body is the header length as a big-endian uint32, the UTF-8 JSON
+    header padded with spaces so the values start on an 8-byte boundary, then
+    the data of every row as little-endian float64, concatenated in row
+    order. The header is {"months", "vmps", "orgs", "units", "placeholders",
+    "rows"}, where rows holds parallel "vmp", "org", "unit" and "length"
+    lists: indexes into vmps, orgs (null for VMP-level rows) and units (null
+    for no unit), and the number of values in each row. The first
+    "placeholders" rows are the VMP placeholder rows, which carry no unit.
+
+    packed_groups are iter_quantity_groups(..., packed=True) pairs, whose data
+    is already float64 bytes from the database, so values are never converted
+    one by one in Python.
+    """
+    vmp_index = {vmp_id: i for i, vmp_id in enumerate(base_vmp_metadata)}
+    org_index, unit_index = {}, {}
+    orgs, units = [], []
+    rows = {"vmp": [], "org": [], "unit": [], "length": []}
+    chunks = []
+
+    if placeholders:
+        rows["vmp"].extend(vmp_index.values())
+        for key in ("org", "unit"):
+            rows[key].extend([None] * len(vmp_index))
+        rows["length"].extend([0] * len(vmp_index))
+
+    for vmp_id, group in packed_groups:
+        org = group['organisation'] if group else None
+        org_ref = None
+        if org:
+            org_ref = org_index.get(org['ods_code'])
+            if org_ref is None:
+                org_ref = org_index[org['ods_code']] = len(orgs)
+                orgs.append(org)
+        unit = quantity_row_unit(vmp_id, group, quantity_type, ddd_unit_map)
+        unit_ref = None
+        if unit is not None:
+            unit_ref = unit_index.get(unit)
+            if unit_ref is None:
+                unit_ref = unit_index[unit] = len(units)
+                units.append(unit)
+        data = group['data'] if group else b""
+        chunks.append(data)
+        rows["vmp"].append(vmp_index[vmp_id])
+        rows["org"].append(org_ref)
+        rows["unit"].append(unit_ref)
+        rows["length"].append(len(data) // 8)
+
+    header = json.dumps(
+        {
+            "months": months,
+            "vmps": list(base_vmp_metadata.values()),
+            "orgs": orgs,
+            "units": units,
+            "placeholders": len(vmp_index) if placeholders else 0,
+            "rows": rows,
+        },
+        separators=(",", ":"),
+    ).encode()
+    header += b" " * (-(4 + len(header)) % 8)
+
+    # The database sends big-endian float8; one byteswap of the whole matrix
+    # makes it little-endian, which browsers read as a Float64Array directly
+    values = array('d')
+    values.frombytes(b"".join(chunks))
+    values.byteswap()
+    return struct.pack(">I", len(header)) + header + values.tobytes()
+
+
 @csrf_protect
 @api_view(["POST"])
 def get_product_details(request):
@@ -546,35 +664,41 @@ def get_vmp_ids_from_search_items(search_items: List[dict]) -> Set[int]:
     Raises:
         ValueError: If search item format is invalid
     """
-    query = Q()
+    codes_by_type = {product_type: [] for product_type in PRODUCT_TYPES}
     
     for item in search_items:
         try:
             code = item["code"]
             item_type = item["type"]
-            if item_type == 'vmp':
-                query |= Q(code=code)
-            elif item_type == 'vtm':
-                query |= Q(vtm__vtm=code)
-            elif item_type == 'ingredient':
-                query |= Q(ingredients__code=code)
-            elif item_type == 'atc':
-                query |= Q(atcs__code__startswith=code)
         except (KeyError, TypeError):
             raise ValueError(f"Invalid search item format: {item}")
+        if item_type in codes_by_type:
+            codes_by_type[item_type].append(code)
     
-    return set(VMP.objects.filter(query).values_list('id', flat=True))
+    return {
+        vmp['id']
+        for product in resolve_product_codes(codes_by_type).values()
+        for vmp in product['vmps']
+    }
 
 def build_product_details(vmp_ids):
-    """Build detailed product information for given VMP IDs."""
+    """
+    Build detailed product information for given VMP IDs.
+
+    Everything build_single_product_data reads is prefetched here, so the
+    number of queries does not grow with the number of VMPs or ingredients.
+    """
     vmps = VMP.objects.filter(id__in=vmp_ids).select_related('vtm').prefetch_related(
         'ingredients',
-        'ddds__who_route', 
+        Prefetch('ddds', queryset=DDD.objects.select_related('who_route')),
         'ont_form_routes',
         'who_routes',
         'atcs',
-        'ingredient_strengths__ingredient',
-        'calculation_logic__ingredient'
+        'ingredient_strengths',
+        Prefetch(
+            'calculation_logic',
+            queryset=CalculationLogic.objects.select_related('ingredient').order_by('id'),
+        ),
     )
     
     quantity_data = get_quantity_data_batch(vmp_ids)
@@ -601,79 +725,55 @@ def get_quantity_data_batch(vmp_ids):
             'has_ddd_quantity': False
         }
     
-    scmd_quantities = SCMDQuantity.objects.filter(
-        vmp_id__in=vmp_ids,
-        data__0__isnull=False
-    ).values('vmp_id', 'data', 'quantity_unit__unit')
-    
-    for scmd in scmd_quantities:
-        vmp_id = scmd['vmp_id']
-        if scmd.get('data') and any(v != 0 for v in scmd['data']):
-            quantity_data[vmp_id]['has_scmd_quantity'] = True
-            unit = scmd.get('quantity_unit__unit')
-            if unit:
-                quantity_data[vmp_id]['scmd_units'] = sorted(list({unit}))
-    
-    dose_quantities = Dose.objects.filter(
-        vmp_id__in=vmp_ids,
-        data__0__isnull=False
-    ).values('vmp_id', 'data', 'quantity_unit__unit')
-    
-    for dose in dose_quantities:
-        vmp_id = dose['vmp_id']
-        if dose.get('data') and any(v != 0 for v in dose['data']):
-            quantity_data[vmp_id]['has_dose'] = True
-            unit = dose.get('quantity_unit__unit')
-            if unit:
-                quantity_data[vmp_id]['dose_units'] = sorted(list({unit}))
-    
-    ingredient_quantities = IngredientQuantity.objects.filter(
-        vmp_id__in=vmp_ids,
-        data__0__isnull=False
-    ).values('vmp_id', 'data', 'quantity_unit__unit')
-    
-    for ingredient_qty in ingredient_quantities:
-        vmp_id = ingredient_qty['vmp_id']
-        if ingredient_qty.get('data') and any(v != 0 for v in ingredient_qty['data']):
-            quantity_data[vmp_id]['has_ingredient_quantities'] = True
-            unit = ingredient_qty.get('quantity_unit__unit')
-            if unit:
-                quantity_data[vmp_id]['ingredient_units'] = sorted(list({unit}))
-    
-    ddd_quantities = DDDQuantity.objects.filter(
-        vmp_id__in=vmp_ids,
-        data__0__isnull=False
-    ).values('vmp_id', 'data')
-    
-    for ddd_qty in ddd_quantities:
-        vmp_id = ddd_qty['vmp_id']
-        if ddd_qty.get('data') and any(v != 0 for v in ddd_qty['data']):
-            quantity_data[vmp_id]['has_ddd_quantity'] = True
+    quantity_summary = get_quantity_summary(vmp_ids)
+    for vmp_id, quantity_types in quantity_summary.items():
+        if vmp_id not in quantity_data:
+            continue
+        for quantity_type, (has_key, units_key) in PRODUCT_DETAILS_QUANTITY_KEYS.items():
+            row = quantity_types.get(quantity_type)
+            if row:
+                quantity_data[vmp_id][has_key] = True
+                if units_key:
+                    quantity_data[vmp_id][units_key] = sorted(row['units'])
     
     return quantity_data
 
+def build_strength_info(strength):
+    """Strength details for an ingredient of a VMP, or None if there is no strength."""
+    if not strength:
+        return None
+    return {
+        'numerator_value': safe_float(strength.strnt_nmrtr_val),
+        'numerator_uom': strength.strnt_nmrtr_uom_name,
+        'denominator_value': safe_float(strength.strnt_dnmtr_val),
+        'denominator_uom': strength.strnt_dnmtr_uom_name,
+        'basis_of_strength_type': strength.basis_of_strength_type,
+        'basis_of_strength_name': strength.basis_of_strength_name
+    }
+
 def build_single_product_data(vmp, quantity_data):
-    """Build detailed data for a single VMP."""
+    """
+    Build detailed data for a single VMP.
+
+    Reads only the relations prefetched by build_product_details.
+    """
+    strengths_by_ingredient = {
+        strength.ingredient_id: strength for strength in vmp.ingredient_strengths.all()
+    }
+    calculation_logic = list(vmp.calculation_logic.all())
+
     ingredient_logic_map = {}
 
-    for calc_logic in vmp.calculation_logic.filter(logic_type='ingredient'):
+    for calc_logic in calculation_logic:
+        if calc_logic.logic_type != 'ingredient':
+            continue
         if calc_logic.ingredient:
-            strength_info = None
-            strength = vmp.ingredient_strengths.filter(ingredient=calc_logic.ingredient).first()
-            if strength:
-                strength_info = {
-                    'numerator_value': safe_float(strength.strnt_nmrtr_val),
-                    'numerator_uom': strength.strnt_nmrtr_uom_name,
-                    'denominator_value': safe_float(strength.strnt_dnmtr_val),
-                    'denominator_uom': strength.strnt_dnmtr_uom_name,
-                    'basis_of_strength_type': strength.basis_of_strength_type,
-                    'basis_of_strength_name': strength.basis_of_strength_name
-                }
-            
             ingredient_logic_map[calc_logic.ingredient.id] = {
                 'ingredient': calc_logic.ingredient.name,
                 'logic': calc_logic.logic,
-                'strength_info': strength_info
+                'strength_info': build_strength_info(
+                    strengths_by_ingredient.get(calc_logic.ingredient_id)
+                )
             }
         else:
             ingredient_logic_map['no_ingredients'] = {
@@ -684,30 +784,19 @@ def build_single_product_data(vmp, quantity_data):
 
     ingredient_logic = []
     ingredient_names_list = []
+    ingredients = list(vmp.ingredients.all())
     
-    if vmp.ingredients.exists():
-        for ingredient in vmp.ingredients.all():
+    if ingredients:
+        for ingredient in ingredients:
             ingredient_names_list.append(ingredient.name)
             
             if ingredient.id in ingredient_logic_map:
                 ingredient_logic.append(ingredient_logic_map[ingredient.id])
             else:
-                strength_info = None
-                strength = vmp.ingredient_strengths.filter(ingredient=ingredient).first()
-                if strength:
-                    strength_info = {
-                        'numerator_value': safe_float(strength.strnt_nmrtr_val),
-                        'numerator_uom': strength.strnt_nmrtr_uom_name,
-                        'denominator_value': safe_float(strength.strnt_dnmtr_val),
-                        'denominator_uom': strength.strnt_dnmtr_uom_name,
-                        'basis_of_strength_type': strength.basis_of_strength_type,
-                        'basis_of_strength_name': strength.basis_of_strength_name
-                    }
-                
                 ingredient_logic.append({
                     'ingredient': ingredient.name,
                     'logic': None,
-                    'strength_info': strength_info
+                    'strength_info': build_strength_info(strengths_by_ingredient.get(ingredient.id))
                 })
     else:
         if 'no_ingredients' in ingredient_logic_map:
@@ -716,7 +805,7 @@ def build_single_product_data(vmp, quantity_data):
     dose_logic = None
     ddd_logic = None
     
-    for calc_logic in vmp.calculation_logic.all():
+    for calc_logic in calculation_logic:
         if calc_logic.logic_type == 'dose':
             dose_logic = {
                 'logic': calc_logic.logic,
@@ -872,91 +961,36 @@ def validate_analysis_params(request):
     if product_codes:
         vmp_ids = set()
         invalid_codes_by_type = {}
+        resolved = resolve_product_codes({
+            PRODUCT_TYPE_BY_PARAM[param]: codes for param, codes in product_codes.items()
+        })
 
         for param, codes in product_codes.items():
-            if param == 'vmps':
-                vmps_qs = VMP.objects.filter(code__in=codes).values('id', 'code', 'name')
-                vmps = list(vmps_qs)
-                found_codes = {vmp['code'] for vmp in vmps}
-                invalid_codes = set(codes) - found_codes
-                if invalid_codes:
-                    invalid_codes_by_type['vmps'] = list(invalid_codes)
-
-                for vmp in vmps:
+            product_type = PRODUCT_TYPE_BY_PARAM[param]
+            invalid_codes = []
+            for code in dict.fromkeys(codes):
+                product = resolved.get((product_type, code))
+                if product is None:
+                    invalid_codes.append(code)
+                    continue
+
+                for vmp in product['vmps']:
                     vmp_ids.add(vmp['id'])
                     available_vmp_codes.add(str(vmp['code']))
-                    valid_products.append({
-                        'code': vmp['code'],
-                        'name': vmp['name'],
-                        'type': 'vmp',
-                        'label': vmp['name']
-                    })
-            elif param == 'vtms':
-                vtms_qs = VTM.objects.filter(vtm__in=codes).values('vtm', 'name')
-                vtms = list(vtms_qs)
-                found_codes = {vtm['vtm'] for vtm in vtms}
-                invalid_codes = set(codes) - found_codes
-                if invalid_codes:
-                    invalid_codes_by_type['vtms'] = list(invalid_codes)
-
-                for vtm in vtms:
-                    vtm_vmps_qs = VMP.objects.filter(vtm__vtm=vtm['vtm']).values('id', 'code', 'name')
-                    vtm_vmps_list = list(vtm_vmps_qs)
-                    for vmp in vtm_vmps_list:
-                        vmp_ids.add(vmp['id'])
-                        available_vmp_codes.add(str(vmp['code']))
-                    vtm_vmps = [{'code': v['code'], 'name': v['name']} for v in vtm_vmps_list]
-                    valid_products.append({
-                        'code': vtm['vtm'],
-                        'name': vtm['name'],
-                        'type': 'vtm',
-                        'label': vtm['name'],
-                        'vmps': vtm_vmps
-                    })
-            elif param == 'ingredients':
-                ingredients_qs = Ingredient.objects.filter(code__in=codes).values('code', 'name')
-                ingredients = list(ingredients_qs)
-                found_codes = {ingredient['code'] for ingredient in ingredients}
-                invalid_codes = set(codes) - found_codes
-                if invalid_codes:
-                    invalid_codes_by_type['ingredients'] = list(invalid_codes)
-
-                for ingredient in ingredients:
-                    ingredient_vmps_qs = VMP.objects.filter(ingredients__code=ingredient['code']).values('id', 'code', 'name')
-                    ingredient_vmps_list = list(ingredient_vmps_qs)
-                    for vmp in ingredient_vmps_list:
-                        vmp_ids.add(vmp['id'])
-                        available_vmp_codes.add(str(vmp['code']))
-                    ingredient_vmps = [{'code': v['code'], 'name': v['name']} for v in ingredient_vmps_list]
-                    valid_products.append({
-                        'code': ingredient['code'],
-                        'name': ingredient['name'],
-                        'type': 'ingredient',
-                        'label': ingredient['name'],
-                        'vmps': ingredient_vmps
-                    })
-            elif param == 'atcs':
-                atcs_qs = ATC.objects.filter(code__in=codes).values('code', 'name')
-                atcs = list(atcs_qs)
-                found_codes = {atc['code'] for atc in atcs}
-                invalid_codes = set(codes) - found_codes
-                if invalid_codes:
-                    invalid_codes_by_type['atcs'] = list(invalid_codes)
-
-                for atc in atcs:
-                    atc_vmps_qs = VMP.objects.filter(atcs__code__startswith=atc['code']).values('id', 'code', 'name')
-                    atc_vmps_list = list(atc_vmps_qs)
-                    for vmp in atc_vmps_list:
-                        vmp_ids.add(vmp['id'])
-                        available_vmp_codes.add(str(vmp['code']))
-                    atc_vmps = [{'code': v['code'], 'name': v['name']} for v in atc_vmps_list]
-                    valid_products.append({
-                        'code': atc['code'],
-                        'name': atc['name'],
-                        'type': 'atc',
-                        'label': atc['name'],
-                        'vmps': atc_vmps
-                    })
+                valid_product = {
+                    'code': product['code'],
+                    'name': product['name'],
+                    'type': product_type,
+                    'label': product['name'],
+                }
+                if product_type != 'vmp':
+                    valid_product['vmps'] = [
+                        {'code': v['code'], 'name': v['name']} for v in product['vmps']
+                    ]
+                valid_products.append(valid_product)
+
+            if invalid_codes:
+                invalid_codes_by_type[param] = invalid_codes
 
         for param, invalid_codes in invalid_codes_by_type.items():
             code_type = {'vmps': 'VMP', 'vtms': 'VTM', 'ingredients': 'Ingredient', 'atcs': 'ATC'}[param]
@@ -1,5 +1,6 @@
 import hashlib
 import json
+import zlib
 from collections import defaultdict
 from datetime import date, datetime, timedelta
 from markdown2 import Markdown
@@ -9,22 +10,27 @@ from django.core.serializers.json import DjangoJSONEncoder
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.utils.text import slugify
-from django.db.models import Count, Exists, OuterRef, Q
+from django.db.models import Exists, OuterRef, Q
 
 from ..mixins import MaintenanceModeMixin
 from ..models import (
     Measure,
     MeasureVMP,
     MeasureTag,
-    PrecomputedMeasure,
-    PrecomputedMeasureAggregated,
-    PrecomputedPercentile,
+    PrecomputedMeasurePayload,
     Organisation,
     MeasureAnnotation,
     Region,
     ICB,
 )
 from ..utils import get_organisation_data
+from ..measure_series import (
+    aggregated_series,
+    org_series,
+    organisation_counts,
+    percentile_series,
+    series_points,
+)
 from ..measure_denominators import (
     compute_rate_from_totals,
     get_measure_chart_kind,
@@ -62,14 +68,13 @@ def _is_measure_new(measure):
 def get_bulk_percentiles_for_measures(measures):
     """Fetch all percentiles for a set of measures."""
     measure_ids = [m.id for m in measures]
-    percentiles = PrecomputedPercentile.objects.filter(
-        measure_id__in=measure_ids,
-        percentile__in=PERCENTILE_LEVELS
-    ).values('measure_id', 'month', 'percentile', 'quantity').order_by('measure_id', 'month', 'percentile')
 
     grouped_data = defaultdict(lambda: defaultdict(dict))
-    for p in percentiles:
-        grouped_data[p['measure_id']][p['month']][p['percentile']] = p['quantity']
+    for series in percentile_series(measure_ids, PERCENTILE_LEVELS):
+        measure_data = grouped_data[series['measure_id']]
+        for month, quantity in zip(series['months'], series['quantity']):
+            if quantity is not None:
+                measure_data[month][series['percentile']] = quantity
 
     return grouped_data
 
@@ -89,16 +94,17 @@ def normalise_trust_code(trust_code):
         return None
 
 
-def _compute_measure_value_from_rows(measure, rows):
-    """Compute chart value from PrecomputedMeasure rows. Reused by get_bulk_trust_series_for_measures."""
-    if measure_has_rate_denominator(measure):
-        total_numerator = sum(row['numerator'] or 0 for row in rows)
-        total_denominator = sum(row['denominator'] or 0 for row in rows)
-        value = compute_rate_from_totals(total_numerator, total_denominator, measure)
+def _compute_measure_value(measure, is_rate, numerator, denominator, quantity):
+    """
+    Compute chart value for a month from an org's precomputed values, or the
+    totals of several orgs'. Reused by get_bulk_trust_series_for_measures.
+    """
+    if is_rate:
+        value = compute_rate_from_totals(numerator, denominator, measure)
         if measure_uses_external_denominator(measure):
             return max(0, value)
         return max(0, min(100, value))
-    return max(0, sum(row['quantity'] or 0 for row in rows))
+    return max(0, quantity)
 
 
 def get_bulk_trust_series_for_measures(measures, trust_codes=None, per_org=False):
@@ -115,46 +121,53 @@ def get_bulk_trust_series_for_measures(measures, trust_codes=None, per_org=False
     if not per_org and not trust_codes:
         return {}
 
-    measure_ids = [m.id for m in measures]
     measure_by_id = {m.id: m for m in measures}
+    is_rate = {m.id: measure_has_rate_denominator(m) for m in measures}
 
-    qs = PrecomputedMeasure.objects.filter(measure_id__in=measure_ids)
-    if trust_codes:
-        qs = qs.filter(organisation__ods_code__in=trust_codes)
-    qs = qs.values(
-        'measure_id', 'organisation__ods_name', 'month', 'quantity', 'numerator', 'denominator'
-    ).order_by('measure_id', 'organisation__ods_name', 'month')
+    org_values = org_series(list(measure_by_id), trust_codes)
 
     if per_org:
-        grouped = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
-        for row in qs:
-            org_name = row['organisation__ods_name']
-            if org_name:
-                grouped[row['measure_id']][org_name][row['month']].append(row)
         result = defaultdict(dict)
-        for measure_id, orgs_data in grouped.items():
-            measure = measure_by_id.get(measure_id)
-            if not measure:
+        for series in org_values:
+            measure = measure_by_id[series['measure_id']]
+            org_name = series['organisation__ods_name']
+            if not org_name:
                 continue
-            for org_name, months_data in orgs_data.items():
-                series = [
-                    [month.isoformat(), _compute_measure_value_from_rows(measure, rows)]
-                    for month, rows in sorted(months_data.items())
+            points = [
+                [
+                    month.isoformat(),
+                    _compute_measure_value(
+                        measure, is_rate[measure.id], numerator or 0, denominator or 0, quantity
+                    ),
                 ]
-                if series:
-                    result[measure_id][org_name] = series
+                for month, quantity, numerator, denominator in zip(
+                    series['months'], series['quantity'], series['numerator'], series['denominator']
+                )
+                if quantity is not None
+            ]
+            if points:
+                result[measure.id][org_name] = points
         return dict(result)
     else:
-        grouped_data = defaultdict(lambda: defaultdict(list))
-        for row in qs:
-            grouped_data[row['measure_id']][row['month']].append(row)
+        # month -> [numerator, denominator, quantity] summed over the selected trusts
+        totals = defaultdict(lambda: defaultdict(lambda: [0, 0, 0]))
+        for series in org_values:
+            measure_totals = totals[series['measure_id']]
+            for month, quantity, numerator, denominator in zip(
+                series['months'], series['quantity'], series['numerator'], series['denominator']
+            ):
+                if quantity is not None:
+                    month_totals = measure_totals[month]
+                    month_totals[0] += numerator or 0
+                    month_totals[1] += denominator or 0
+                    month_totals[2] += quantity
         aggregated_data = defaultdict(dict)
-        for measure_id, months_data in grouped_data.items():
-            measure = measure_by_id.get(measure_id)
-            if not measure:
-                continue
-            for month, rows in months_data.items():
-                aggregated_data[measure_id][month] = _compute_measure_value_from_rows(measure, rows)
+        for measure_id, measure_totals in totals.items():
+            measure = measure_by_id[measure_id]
+            for month, (numerator, denominator, quantity) in measure_totals.items():
+                aggregated_data[measure_id][month] = _compute_measure_value(
+                    measure, is_rate[measure_id], numerator, denominator, quantity
+                )
         return aggregated_data
 
 
@@ -163,18 +176,19 @@ def get_bulk_regions_and_national_series_for_measures(measures):
     Fetch region and national series data for a set of measures.
     """
     measure_ids = [m.id for m in measures]
-    rows = PrecomputedMeasureAggregated.objects.filter(
-        measure_id__in=measure_ids,
-        category__in=['region', 'national']
-    ).values('measure_id', 'category', 'label', 'month', 'quantity').order_by('measure_id', 'category', 'label', 'month')
 
     regions_data = defaultdict(lambda: defaultdict(dict))
     national_data = defaultdict(dict)
-    for row in rows:
-        if row['category'] == 'region':
-            regions_data[row['measure_id']][row['label']][row['month']] = row['quantity']
+    for series in aggregated_series(measure_ids, ['region', 'national']):
+        values = {
+            month: quantity
+            for month, quantity in zip(series['months'], series['quantity'])
+            if quantity is not None
+        }
+        if series['category'] == 'region':
+            regions_data[series['measure_id']][series['label']] = values
         else:
-            national_data[row['measure_id']][row['month']] = row['quantity']
+            national_data[series['measure_id']] = values
     return regions_data, national_data
 
 
@@ -244,15 +258,19 @@ def build_trust_chart_data(measure, bulk_percentiles, overlay_series=None):
     return chart_data
 
 
-def build_measure_org_data(org_measures, shared_org_data, include_region_icb=False):
+def org_series_points(series_list):
+    """Org series as {ods_code: [{month, quantity, numerator, denominator}, ...]}."""
+    return {series['organisation__ods_code']: series_points(series) for series in series_list}
+
+
+def build_measure_org_data(org_points, shared_org_data, include_region_icb=False):
     """
     Build org data for measure views.
 
-    When include_region_icb=True, adds region/icb per org and regions_hierarchy for RegionIcbFilter.
+    org_points maps ODS code to the org's values, as from org_series_points.
+    When include_region_icb=True, adds region/icb per org and
+    regions_hierarchy for RegionIcbFilter.
     """
-    measure_orgs = set(
-        org_measures.values_list('organisation__ods_code', flat=True).distinct()
-    )
     if include_region_icb:
         current_orgs = Organisation.objects.filter(
             successor__isnull=True
@@ -272,8 +290,8 @@ def build_measure_org_data(org_measures, shared_org_data, include_region_icb=Fal
 
     for org in current_orgs:
         org_name = org['ods_name']
-        is_available = org['ods_code'] in measure_orgs
-        entry = {'available': is_available, 'data': []}
+        is_available = org['ods_code'] in org_points
+        entry = {'available': is_available, 'data': list(org_points.get(org['ods_code'], []))}
         if include_region_icb:
             region = org.get('region__name')
             region_code = org.get('region__code')
@@ -286,19 +304,6 @@ def build_measure_org_data(org_measures, shared_org_data, include_region_icb=Fal
                 regions_with_icbs[region]['icbs'].add((icb, icb_code or ''))
         flat_data[org_name] = entry
 
-    for row in org_measures.values(
-        'organisation__ods_code', 'organisation__ods_name',
-        'month', 'quantity', 'numerator', 'denominator',
-    ):
-        org_name = row['organisation__ods_name']
-        if org_name in flat_data:
-            flat_data[org_name]['data'].append({
-                'month': row['month'],
-                'quantity': row['quantity'],
-                'numerator': row['numerator'],
-                'denominator': row['denominator'],
-            })
-
     orgs_with_data = {
         name for name, info in flat_data.items()
         if info.get('available') and info.get('data')
@@ -517,12 +522,7 @@ class MeasuresListView(MaintenanceModeMixin, TemplateView):
             else:
                 bulk_all_regions, bulk_national = get_bulk_regions_and_national_series_for_measures(measures_for_charts)
                 bulk_percentiles = get_bulk_percentiles_for_measures(measures_for_charts)
-                trust_counts = dict(
-                    PrecomputedMeasure.objects.filter(measure_id__in=[m.id for m in measures_for_charts])
-                    .values('measure_id')
-                    .annotate(count=Count('organisation_id', distinct=True))
-                    .values_list('measure_id', 'count')
-                )
+                trust_counts = organisation_counts([m.id for m in measures_for_charts])
                 national_data = {}
                 region_data = {}
                 trust_percentiles_data = {}
@@ -596,6 +596,143 @@ class MeasuresListView(MaintenanceModeMixin, TemplateView):
         return context
 
 
+def build_measure_item_payload(measure_id):
+    """
+    The measure's own data for the measure item page, serialised to JSON
+    strings: org values by ODS code, region, ICB and national series and
+    percentiles. Organisation details are merged in when the page is served,
+    by measure_item_context, so they are never older than the organisations.
+    """
+    payload = {
+        'org_data': json.dumps(org_series_points(org_series([measure_id])), cls=DjangoJSONEncoder),
+    }
+    payload.update(_measure_item_aggregated_data(aggregated_series([measure_id])))
+    payload.update(_measure_item_percentile_data(percentile_series([measure_id])))
+    return payload
+
+
+def measure_item_context(payload):
+    """
+    Measure item page data from a measure item payload: the org data with the
+    current organisations, ICB and region codes and trusts_included added.
+    """
+    context = dict(payload)
+    context.update(_measure_item_org_data(json.loads(payload['org_data'])))
+    context['region_data'] = _with_codes(
+        payload['region_data'], dict(Region.objects.values_list('name', 'code'))
+    )
+    context['icb_data'] = _with_codes(
+        payload['icb_data'], dict(ICB.objects.values_list('name', 'code'))
+    )
+    return context
+
+
+def build_measure_item_data(measure_id):
+    """Measure item page data for a measure, built from its precomputed values."""
+    return measure_item_context(build_measure_item_payload(measure_id))
+
+
+def save_measure_item_payload(measure_id):
+    """Store the measure item payload for a measure. Called by compute_measures."""
+    payload = build_measure_item_payload(measure_id)
+    PrecomputedMeasurePayload.objects.update_or_create(
+        measure_id=measure_id,
+        defaults={
+            field: zlib.compress(payload[field].encode())
+            for field in PrecomputedMeasurePayload.JSON_FIELDS
+        },
+    )
+
+
+def load_measure_item_payload(measure):
+    """The stored measure item payload for a measure, or None if it has not been computed."""
+    payload = PrecomputedMeasurePayload.objects.filter(measure=measure).first()
+    if payload is None:
+        return None
+    return {
+        field: zlib.decompress(getattr(payload, field)).decode()
+        for field in PrecomputedMeasurePayload.JSON_FIELDS
+    }
+
+
+def _measure_item_org_data(org_points):
+    # Exclude predecessors from total (they are merged into successors)
+    total_orgs = Organisation.objects.filter(successor__isnull=True).count()
+    shared_org_data = get_organisation_data()
+    org_data = build_measure_org_data(org_points, shared_org_data, include_region_icb=False)
+    org_data_for_json = {k: v for k, v in org_data.items() if k != 'available_count'}
+    org_data_for_json.update({
+        'trust_types': shared_org_data.get('trust_types', {}),
+        'org_regions': shared_org_data.get('org_regions', {}),
+        'org_icbs': shared_org_data.get('org_icbs', {}),
+        'org_cancer_alliances': shared_org_data.get('org_cancer_alliances', {}),
+        'org_shelford_group': shared_org_data.get('org_shelford_group', {}),
+        'regions_hierarchy': shared_org_data.get('regions_hierarchy', []),
+        'cancer_alliances': shared_org_data.get('cancer_alliances', []),
+    })
+    return {
+        "trusts_included": {"included": org_data['available_count'], "total": total_orgs},
+        "org_data": json.dumps(org_data_for_json, cls=DjangoJSONEncoder),
+    }
+
+
+def _with_codes(series_json, codes):
+    """Region or ICB series JSON with each series' code added from codes (name -> code)."""
+    return json.dumps(
+        [
+            {'name': series['name'], 'code': codes.get(series['name'], ''), 'data': series['data']}
+            for series in json.loads(series_json)
+        ],
+        cls=DjangoJSONEncoder,
+    )
+
+
+def _measure_item_aggregated_data(series_list):
+    region_list = []
+    icb_list = []
+    national_data = {'name': 'National', 'data': []}
+
+    for series in series_list:
+        if series['category'] == 'region':
+            region_list.append({'name': series['label'], 'data': series_points(series)})
+        elif series['category'] == 'icb':
+            icb_list.append({'name': series['label'], 'data': series_points(series)})
+        elif series['category'] == 'national':
+            national_data['data'] = series_points(series)
+
+    return {
+        "region_data": json.dumps(region_list, cls=DjangoJSONEncoder),
+        "icb_data": json.dumps(icb_list, cls=DjangoJSONEncoder),
+        "national_data": json.dumps(national_data, cls=DjangoJSONEncoder),
+    }
+
+
+def percentile_points(series_list):
+    """Percentile series as [{measure_id, month, percentile, quantity}, ...] ordered by month."""
+    points = [
+        {
+            'measure_id': series['measure_id'],
+            'month': month,
+            'percentile': series['percentile'],
+            'quantity': quantity,
+        }
+        for series in series_list
+        for month, quantity in zip(series['months'], series['quantity'])
+        if quantity is not None
+    ]
+    # Stable, so percentiles stay in order within each month
+    points.sort(key=lambda point: point['month'])
+    return points
+
+
+def _measure_item_percentile_data(series_list):
+    return {
+        "percentile_data": json.dumps(
+            percentile_points(series_list), cls=DjangoJSONEncoder
+        ),
+    }
+
+
 class BaseMeasureItemView(TemplateView):
     template_name = "measure_item.html"
 
@@ -697,101 +834,23 @@ class BaseMeasureItemView(TemplateView):
         }
 
     def get_precomputed_data(self, measure):
-        cache_key = f'{MEASURE_ITEM_PRECOMPUTED_CACHE_KEY_PREFIX}{measure.slug}'
-        cached = cache.get(cache_key)
-        if cached is not None:
-            return cached, True
-
-        org_measures = PrecomputedMeasure.objects.filter(
-            measure=measure
-        ).select_related('organisation')
-        
-        aggregated_measures = PrecomputedMeasureAggregated.objects.filter(
-            measure=measure
-        )
-        
-        percentiles = PrecomputedPercentile.objects.filter(
-            measure=measure
-        )
+        """
+        The measure item page data and whether it was precomputed. The payload
+        stored by compute_measures is used as it is; only measures without one
+        have it built from the precomputed values, and that is cached. Current
+        organisation details are merged into either when the page is served.
+        """
+        payload = load_measure_item_payload(measure)
+        if payload is not None:
+            return measure_item_context(payload), True
 
-        context = {}
-        context.update(self.get_org_data(org_measures))
-        context.update(self.get_aggregated_data(aggregated_measures))
-        context.update(self.get_percentile_data(percentiles))
-
-        cache.set(cache_key, context, timeout=MEASURE_ITEM_PRECOMPUTED_CACHE_TIMEOUT)
-        return context, False
-
-    def get_org_data(self, org_measures):
-        # Exclude predecessors from total (they are merged into successors)
-        total_orgs = Organisation.objects.filter(successor__isnull=True).count()
-        shared_org_data = get_organisation_data()
-        org_data = build_measure_org_data(org_measures, shared_org_data, include_region_icb=False)
-        org_data_for_json = {k: v for k, v in org_data.items() if k != 'available_count'}
-        org_data_for_json.update({
-            'trust_types': shared_org_data.get('trust_types', {}),
-            'org_regions': shared_org_data.get('org_regions', {}),
-            'org_icbs': shared_org_data.get('org_icbs', {}),
-            'org_cancer_alliances': shared_org_data.get('org_cancer_alliances', {}),
-            'org_shelford_group': shared_org_data.get('org_shelford_group', {}),
-            'regions_hierarchy': shared_org_data.get('regions_hierarchy', []),
-            'cancer_alliances': shared_org_data.get('cancer_alliances', []),
-        })
-        return {
-            "trusts_included": {"included": org_data['available_count'], "total": total_orgs},
-            "org_data": json.dumps(org_data_for_json, cls=DjangoJSONEncoder),
-        }
-
-    def get_aggregated_data(self, aggregated_measures):
-        region_data = defaultdict(lambda: {'name': '', 'code': '', 'data': []})
-        icb_data = defaultdict(lambda: {'name': '', 'code': '', 'data': []})
-        national_data = {'name': 'National', 'data': []}
-        region_codes = {region.name: region.code for region in Region.objects.all()}
-        icb_codes = {icb.name: icb.code for icb in ICB.objects.all()}
-
-        for measure in aggregated_measures:
-            if measure.category == 'region':
-                region_data[measure.label]['name'] = measure.label
-                region_data[measure.label]['code'] = region_codes.get(measure.label, '')
-                region_data[measure.label]['data'].append({
-                    'month': measure.month,
-                    'quantity': measure.quantity,
-                    'numerator': measure.numerator,
-                    'denominator': measure.denominator
-                })
-            elif measure.category == 'icb':
-                icb_data[measure.label]['name'] = measure.label
-                icb_data[measure.label]['code'] = icb_codes.get(measure.label, '')
-                icb_data[measure.label]['data'].append({
-                    'month': measure.month,
-                    'quantity': measure.quantity,
-                    'numerator': measure.numerator,
-                    'denominator': measure.denominator
-                })
-            elif measure.category == 'national':
-                national_data['data'].append({
-                    'month': measure.month,
-                    'quantity': measure.quantity,
-                    'numerator': measure.numerator,
-                    'denominator': measure.denominator
-                })
-
-        region_list = list(region_data.values())
-        icb_list = list(icb_data.values())
-
-        return {
-            "region_data": json.dumps(region_list, cls=DjangoJSONEncoder),
-            "icb_data": json.dumps(icb_list, cls=DjangoJSONEncoder),
-            "national_data": json.dumps(national_data, cls=DjangoJSONEncoder),
-        }
-
-    def get_percentile_data(self, percentiles):
-        percentiles_list = list(percentiles.values())
-        return {
-            "percentile_data": json.dumps(
-                percentiles_list, cls=DjangoJSONEncoder
-            ),
-        }
+        cache_key = f'{MEASURE_ITEM_PRECOMPUTED_CACHE_KEY_PREFIX}{measure.slug}'
+        payload = cache.get(cache_key)
+        precomputed = payload is not None
+        if payload is None:
+            payload = build_measure_item_payload(measure.id)
+            cache.set(cache_key, payload, timeout=MEASURE_ITEM_PRECOMPUTED_CACHE_TIMEOUT)
+        return measure_item_context(payload), precomputed
 
 
 class MeasureTrustsView(MaintenanceModeMixin, TemplateView):
@@ -815,13 +874,11 @@ class MeasureTrustsView(MaintenanceModeMixin, TemplateView):
 
         try:
             measure = Measure.objects.prefetch_related('tags').get(slug=slug)
-            org_measures = PrecomputedMeasure.objects.filter(
-                measure=measure
-            ).select_related('organisation')
-            percentiles = PrecomputedPercentile.objects.filter(measure=measure)
             shared_org_data = get_organisation_data()
 
-            org_data = build_measure_org_data(org_measures, shared_org_data, include_region_icb=True)
+            org_data = build_measure_org_data(
+                org_series_points(org_series([measure.id])), shared_org_data, include_region_icb=True
+            )
 
             org_data_for_json = {
                 k: v for k, v in org_data.items()
@@ -836,11 +893,14 @@ class MeasureTrustsView(MaintenanceModeMixin, TemplateView):
                 'regions_hierarchy': shared_org_data.get('regions_hierarchy', []),
                 'cancer_alliances': shared_org_data.get('cancer_alliances', []),
             })
-            percentile_data = list(
-                percentiles.values('month', 'percentile', 'quantity')
-            )
-            for p in percentile_data:
-                p['month'] = p['month'].isoformat()
+            percentile_data = [
+                {
+                    'month': p['month'].isoformat(),
+                    'percentile': p['percentile'],
+                    'quantity': p['quantity'],
+                }
+                for p in percentile_points(percentile_series([measure.id]))
+            ]
 
             markdowner = Markdown()
             tags_data = [